@@ -0,0 +1,348 @@
+"""
+카메라 소스 / GPIO 백엔드 추상화
+
+- Picamera2Source: 라즈베리 카메라 (기존 동작)
+- SyntheticCameraSource: 하드웨어 없이 지정 해상도/fps로 프레임 생성 (패턴, 움직이는 물체, QR 삽입, 파일 재생)
+- NullLED / NullButton: GPIO가 없는 환경용 더미 백엔드
+- FrameScheduler: 고정 fps 캡처 루프 페이싱 + 단조 증가 캡처 타임스탬프
+
+환경 변수
+  CAMERA_SOURCE: 'picamera2'(기본) | 'synthetic' | 'synthetic:<pattern>' | 'file:<경로>'
+  CAMERA_GPIO: 'gpiozero'(기본) | 'null'
+  SYNTHETIC_OBJECTS: 움직이는 물체 개수 (기본 2)
+  SYNTHETIC_QR: 주기적으로 삽입할 QR 문자열 (예: '{"endpoint":"http://127.0.0.1:3000/devices/pairing"}')
+  SYNTHETIC_QR_INTERVAL: QR 삽입 주기(초, 기본 10), 매 주기의 앞 2초 동안 표시
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from picamera2 import Picamera2  # type: ignore
+except Exception:
+    Picamera2 = None
+
+
+# --- GPIO ---
+class NullLED:
+    """gpiozero.LED 호환 더미 (상태만 보관)."""
+
+    def __init__(self, pin=None):
+        self.pin = pin
+        self.is_lit = False
+
+    def on(self):
+        self.is_lit = True
+
+    def off(self):
+        self.is_lit = False
+
+    @property
+    def value(self):
+        return 1 if self.is_lit else 0
+
+    def close(self):
+        pass
+
+
+class NullButton:
+    """gpiozero.Button 호환 더미 (항상 눌리지 않은 상태)."""
+
+    def __init__(self, pin=None, **kwargs):
+        self.pin = pin
+        self.is_pressed = False
+
+    def close(self):
+        pass
+
+
+def _gpio_backend() -> str:
+    return os.getenv('CAMERA_GPIO', 'gpiozero').strip().lower()
+
+
+def create_led(pin: int):
+    """GPIO LED 생성. gpiozero를 쓸 수 없거나 CAMERA_GPIO=null이면 NullLED."""
+    if _gpio_backend() != 'null':
+        try:
+            from gpiozero import LED  # type: ignore
+            return LED(pin)
+        except Exception as e:
+            print(f"[GPIO] LED({pin}) 초기화 실패 → null 백엔드 사용: {e}")
+    return NullLED(pin)
+
+
+def create_button(pin: int, **kwargs):
+    """GPIO Button 생성. gpiozero를 쓸 수 없거나 CAMERA_GPIO=null이면 NullButton."""
+    if _gpio_backend() != 'null':
+        try:
+            from gpiozero import Button  # type: ignore
+            return Button(pin, **kwargs)
+        except Exception as e:
+            print(f"[GPIO] Button({pin}) 초기화 실패 → null 백엔드 사용: {e}")
+    return NullButton(pin, **kwargs)
+
+
+# --- Camera sources ---
+class Picamera2Source:
+    """Picamera2를 camera_on에서 쓰던 설정(RGB888, FrameRate, 연속 AF)으로 감싼 소스."""
+
+    name = 'picamera2'
+
+    def __init__(self, width: int, height: int, fps: int):
+        if Picamera2 is None:
+            raise RuntimeError('picamera2 모듈을 사용할 수 없습니다')
+        self.width, self.height, self.fps = int(width), int(height), int(fps)
+        self.picam2 = Picamera2()
+        cfg = self.picam2.create_video_configuration(
+            main={'size': (self.width, self.height), 'format': 'RGB888'}
+        )
+        self.picam2.configure(cfg)
+        self.picam2.set_controls({"FrameRate": self.fps})
+        self.picam2.set_controls({"AfMode": 2})   # 0=Manual, 1=Auto, 2=Continuous
+
+    def start(self):
+        self.picam2.start()
+
+    def capture_array(self):
+        return self.picam2.capture_array()
+
+    def stop(self):
+        self.picam2.stop()
+
+    def close(self):
+        self.picam2.close()
+
+
+def make_qr_image(payload: str, size: int):
+    """QR 코드 이미지(BGR, size x size) 생성. qrcode 모듈이 없으면 None."""
+    try:
+        import qrcode  # type: ignore
+    except Exception:
+        print("[SYNTH] qrcode 모듈이 없어 QR 삽입을 건너뜁니다")
+        return None
+    qr = qrcode.QRCode(border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    matrix = np.array(qr.get_matrix(), dtype=np.uint8)
+    img = np.where(matrix, 0, 255).astype(np.uint8)
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_NEAREST)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+class SyntheticCameraSource:
+    """하드웨어 없이 프레임을 생성하는 카메라 소스 (Picamera2와 같은 BGR 메모리 배치).
+
+    pattern: 'bars' | 'gradient' | 'noise' | 'static' | 'file'
+    objects: 배경 위를 움직이는 사각형 개수 (모션 감지 부하/판정용)
+    qr_payload: 주기적으로 프레임에 삽입할 QR 문자열
+    file_path: 파일 재생 소스 (끝나면 처음부터 반복)
+    realtime: True면 fps에 맞춰 capture_array가 대기 (카메라와 동일한 페이싱)
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, width: int, height: int, fps: int, pattern: str = 'bars', objects: int = 2,
+                 qr_payload: str = None, qr_interval_sec: float = 10.0, qr_visible_sec: float = 2.0,
+                 file_path: str = None, realtime: bool = True, seed: int = 1):
+        self.width, self.height, self.fps = int(width), int(height), max(1, int(fps))
+        self.pattern = 'file' if file_path else (pattern or 'bars')
+        self.file_path = file_path
+        self.realtime = bool(realtime)
+        self.qr_interval_sec = float(qr_interval_sec)
+        self.qr_visible_sec = float(qr_visible_sec)
+        self._rng = np.random.default_rng(seed)
+        self._frame_idx = 0
+        self._next_deadline = None
+        self._cap = None
+        self._background = None
+        self._noise_frames = None
+        self._qr_img = make_qr_image(qr_payload, max(64, min(self.width, self.height) // 3)) if qr_payload else None
+        self._objects = []
+        for i in range(max(0, int(objects))):
+            size = max(8, min(self.width, self.height) // (8 + 2 * i))
+            self._objects.append({
+                "pos": np.array([self._rng.uniform(0, self.width - size), self._rng.uniform(0, self.height - size)]),
+                "vel": np.array([self._rng.uniform(-6, 6), self._rng.uniform(-4, 4)]) * (self.width / 640.0),
+                "size": size,
+                "color": tuple(int(c) for c in self._rng.integers(0, 255, 3)),
+            })
+        self._prepare_background()
+
+    def _prepare_background(self) -> None:
+        w, h = self.width, self.height
+        if self.pattern == 'gradient':
+            xs = np.linspace(0, 255, w, dtype=np.float32)
+            ys = np.linspace(0, 255, h, dtype=np.float32)
+            bg = np.empty((h, w, 3), dtype=np.uint8)
+            bg[:, :, 0] = xs[None, :].astype(np.uint8)
+            bg[:, :, 1] = ys[:, None].astype(np.uint8)
+            bg[:, :, 2] = 128
+            self._background = bg
+        elif self.pattern == 'noise':
+            # 매 프레임 난수 생성은 비싸므로 몇 장을 미리 만들어 순환
+            self._noise_frames = [self._rng.integers(0, 255, (h, w, 3), dtype=np.uint8) for _ in range(8)]
+            self._background = self._noise_frames[0]
+        elif self.pattern == 'static':
+            self._background = np.full((h, w, 3), 96, dtype=np.uint8)
+        elif self.pattern == 'file':
+            self._background = np.zeros((h, w, 3), dtype=np.uint8)
+        else:
+            # SMPTE 유사 컬러바
+            colors = [(192, 192, 192), (0, 192, 192), (192, 192, 0), (0, 192, 0),
+                      (192, 0, 192), (0, 0, 192), (192, 0, 0), (16, 16, 16)]
+            bg = np.zeros((h, w, 3), dtype=np.uint8)
+            bar_w = max(1, w // len(colors))
+            for i, c in enumerate(colors):
+                bg[:, i * bar_w:(i + 1) * bar_w] = c
+            self._background = bg
+
+    def start(self):
+        if self.pattern == 'file':
+            self._cap = cv2.VideoCapture(self.file_path)
+            if not self._cap.isOpened():
+                raise RuntimeError(f'재생 파일을 열 수 없습니다: {self.file_path}')
+        self._next_deadline = time.monotonic()
+        print(f"[SYNTH] 합성 카메라 시작: {self.width}x{self.height}@{self.fps} pattern={self.pattern} objects={len(self._objects)}")
+
+    def _read_file_frame(self):
+        ok, frame = self._cap.read()
+        if not ok or frame is None:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._cap.read()
+            if not ok or frame is None:
+                return self._background.copy()
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def capture_array(self):
+        if self.realtime and self._next_deadline is not None:
+            delay = self._next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # 지연이 누적되면 기준 시각을 현재로 당김 (카메라처럼 프레임을 건너뜀)
+            self._next_deadline = max(self._next_deadline, time.monotonic() - 1.0 / self.fps) + 1.0 / self.fps
+        if self.pattern == 'file':
+            frame = self._read_file_frame()
+        elif self._noise_frames is not None:
+            frame = self._noise_frames[self._frame_idx % len(self._noise_frames)].copy()
+        else:
+            frame = self._background.copy()
+        for obj in self._objects:
+            pos, vel, size = obj["pos"], obj["vel"], obj["size"]
+            pos += vel
+            for axis, limit in ((0, self.width - size), (1, self.height - size)):
+                if pos[axis] < 0 or pos[axis] > limit:
+                    vel[axis] = -vel[axis]
+                    pos[axis] = min(max(pos[axis], 0), limit)
+            x, y = int(pos[0]), int(pos[1])
+            cv2.rectangle(frame, (x, y), (x + size, y + size), obj["color"], -1)
+        if self._qr_img is not None:
+            t = self._frame_idx / float(self.fps)
+            if (t % self.qr_interval_sec) < self.qr_visible_sec:
+                qh, qw = self._qr_img.shape[:2]
+                y0 = (self.height - qh) // 2
+                x0 = (self.width - qw) // 2
+                frame[y0:y0 + qh, x0:x0 + qw] = self._qr_img
+        cv2.putText(frame, f"SYNTH {self._frame_idx}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        self._frame_idx += 1
+        return frame
+
+    def stop(self):
+        if self._cap is not None:
+            try:
+                self._cap.release()
+            except Exception:
+                pass
+            self._cap = None
+
+    def close(self):
+        self.stop()
+
+
+class FrameScheduler:
+    """캡처 루프를 fps에 고정하는 스케줄러.
+
+    wait()는 다음 프레임 시각(monotonic 기준 절대 시각)까지 대기하므로 처리 시간이 달라도 주기가 흔들리지 않습니다.
+    한 프레임 이상 밀리면 놓친 슬롯은 건너뛰고(late_frames) 현재 시각으로 다시 맞춥니다.
+    stamp()는 캡처 직후 시각을 첫 stamp 기준 ns로 돌려주며 항상 이전 값보다 큽니다 (PTS용).
+    """
+
+    def __init__(self, fps: int):
+        self.fps = 1
+        self.period_ns = int(1e9)
+        self.late_frames = 0
+        self._next_ns = None
+        self._t0_ns = None
+        self._last_pts = None
+        self.set_fps(fps)
+
+    def set_fps(self, fps: int) -> None:
+        self.fps = max(1, int(fps))
+        self.period_ns = int(1e9 / self.fps)
+        self._next_ns = None
+
+    def reset_timebase(self) -> None:
+        """다음 stamp()를 0으로 (출력 파이프라인을 새로 시작할 때)."""
+        self._t0_ns = None
+        self._last_pts = None
+
+    def wait(self) -> None:
+        now = time.monotonic_ns()
+        if self._next_ns is None:
+            self._next_ns = now
+        delay = self._next_ns - now
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        elif -delay >= self.period_ns:
+            self.late_frames += int(-delay // self.period_ns)
+            self._next_ns = now
+        self._next_ns += self.period_ns
+
+    def stamp(self, capture_ns: int = None) -> int:
+        now = time.monotonic_ns() if capture_ns is None else int(capture_ns)
+        if self._t0_ns is None:
+            self._t0_ns = now
+        pts = now - self._t0_ns
+        if self._last_pts is not None and pts <= self._last_pts:
+            pts = self._last_pts + 1
+        self._last_pts = pts
+        return pts
+
+
+def camera_source_spec() -> str:
+    return os.getenv('CAMERA_SOURCE', 'picamera2').strip()
+
+
+def create_camera_source(width: int, height: int, fps: int, spec: str = None):
+    """CAMERA_SOURCE(또는 spec)에 따라 카메라 소스 생성.
+
+    picamera2 모듈 자체가 없는 환경(x86 CI 등)에서는 합성 소스로 대체합니다.
+    """
+    spec = (spec or camera_source_spec()).strip()
+    kind, _, arg = spec.partition(':')
+    kind = kind.lower()
+    qr_payload = os.getenv('SYNTHETIC_QR') or None
+    try:
+        objects = int(os.getenv('SYNTHETIC_OBJECTS', '2'))
+    except ValueError:
+        objects = 2
+    try:
+        qr_interval = float(os.getenv('SYNTHETIC_QR_INTERVAL', '10'))
+    except ValueError:
+        qr_interval = 10.0
+    if kind == 'picamera2':
+        if Picamera2 is not None:
+            return Picamera2Source(width, height, fps)
+        print("[CAMERA] picamera2 모듈 없음 → 합성 카메라 소스 사용")
+        kind = 'synthetic'
+    if kind == 'file':
+        return SyntheticCameraSource(width, height, fps, file_path=arg, objects=0, qr_payload=qr_payload,
+                                     qr_interval_sec=qr_interval)
+    if kind == 'synthetic':
+        return SyntheticCameraSource(width, height, fps, pattern=arg or 'bars', objects=objects,
+                                     qr_payload=qr_payload, qr_interval_sec=qr_interval)
+    raise ValueError(f'알 수 없는 CAMERA_SOURCE: {spec}')
@@ -0,0 +1,638 @@
+"""
+공유 H.264 인코더 (encode-once)
+
+카메라 프레임을 한 번만 변환(gamma/videobalance/videoconvert)하고 렌디션(해상도/비트레이트)별로
+x264enc를 하나씩만 실행합니다. 인코딩된 버퍼는 appsink에서 구독자(mp4 세그먼트, HLS, RTSP)의
+appsrc로 나눠 보냅니다. 출력마다 인코더를 따로 두지 않고, 다른 파라미터가 필요한 출력만
+별도 렌디션을 추가합니다.
+
+  appsrc(BGR) → gamma → videoconvert(I420) → videobalance → tee ┬ queue → valve → x264enc → h264parse → appsink(main)
+                                                                 └ queue → valve → videoscale → x264enc → ... (추가 렌디션)
+
+구독자가 없는 렌디션은 valve로 막아 인코딩하지 않습니다.
+
+입력과 크기가 다른 렌디션은 크기별 스케일러(queue → valve → videoscale → tee) 하나를 함께 씁니다.
+같은 크기에 fps/비트레이트/코덱만 다른 렌디션이 여럿이어도 축소는 한 번만 합니다.
+렌디션마다 fps(videorate로 줄이기만 함)와 코덱(h264 | jpeg, MJPEG 호환 출력용)을 따로 지정할 수 있습니다.
+
+키프레임 정렬(align_keyframes, HLS ABR용): 렌디션마다 x264가 따로 GOP를 세지 않고, 소스(appsrc)에서
+keyint 프레임마다 다운스트림 GstForceKeyUnit 이벤트를 보내 tee 뒤 모든 렌디션이 같은 입력 프레임에서
+키프레임을 만듭니다 (scenecut 비활성). 구독자 키프레임 요청도 모든 렌디션에 함께 적용됩니다.
+"""
+
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+import metrics
+
+# 구독자 appsrc caps (h264parse가 avc/mp4, mpegts, rtp 쪽 형식으로 변환)
+H264_CAPS = "video/x-h264,stream-format=byte-stream,alignment=au"
+# 구독자 appsrc에 쌓일 수 있는 최대 바이트 (초과 시 드롭 후 다음 키프레임부터 재개)
+SUBSCRIBER_MAX_BYTES = 8 * 1024 * 1024
+# 키프레임 요청 최소 간격(초): 여러 구독자가 동시에 요청해도 IDR이 폭주하지 않도록
+KEYFRAME_REQUEST_MIN_INTERVAL_SEC = 0.5
+# 렌디션별 CPU 사용률 측정 주기(초)
+CPU_SAMPLE_SEC = 5.0
+# jpeg 렌디션 품질
+JPEG_QUALITY = 85
+JPEG_CAPS = "image/jpeg"
+
+
+def force_key_unit_event(downstream: bool = False):
+    """GstForceKeyUnit 이벤트 (GstVideo 헬퍼와 동일한 구조). downstream=True면 소스에서 인코더로 보내는 이벤트."""
+    st = Gst.Structure.new_from_string("GstForceKeyUnit, all-headers=(boolean)true")
+    kind = Gst.EventType.CUSTOM_DOWNSTREAM if downstream else Gst.EventType.CUSTOM_UPSTREAM
+    return Gst.Event.new_custom(kind, st)
+
+
+def build_h264_appsrc_pipeline(sink_desc: str, name: str = 'h264_src'):
+    """인코딩된 H.264를 받는 파이프라인 생성 → (pipeline, appsrc)."""
+    launch = (
+        f"appsrc name={name} is-live=true format=time do-timestamp=false block=false caps={H264_CAPS} ! "
+        f"h264parse ! {sink_desc}"
+    )
+    pipeline = Gst.parse_launch(launch)
+    return pipeline, pipeline.get_by_name(name)
+
+
+def build_mp4_writer_pipeline(location: str, fragment_sec: float = 0.0):
+    """세그먼트 mp4 기록 파이프라인 → (pipeline, appsrc). 종료는 EOS(finalizer)로 처리.
+
+    fragment_sec > 0: 조각 MP4 (moov를 먼저 쓰고 fragment_sec마다 moof+mdat 추가, streamable이라 되감아 쓰지 않음).
+    전원이 끊겨도 마지막 완료 조각까지 재생 가능하고 EOS 시 파일을 다시 쓰지 않는다.
+    0이면 기존 faststart mp4 (moov를 EOS에 기록하며 파일 앞쪽으로 옮겨 씀).
+    """
+    if fragment_sec and fragment_sec > 0:
+        mux = f"mp4mux fragment-duration={int(fragment_sec * 1000)} streamable=true"
+    else:
+        mux = "mp4mux faststart=true"
+    return build_h264_appsrc_pipeline(
+        f"{mux} ! filesink name=file_sink location={location} sync=false", name='file_src')
+
+
+class EncodedSubscriber:
+    """인코딩된 스트림을 appsrc로 받는 구독자.
+
+    - 구독 직후/드롭 직후에는 키프레임부터 전달
+    - live_timestamps=False: 첫 버퍼를 0으로 하는 자체 시간축 (파일, HLS)
+    - live_timestamps=True: 타임스탬프를 비워 appsrc(do-timestamp=true)가 실행 시간을 찍도록 함 (RTSP)
+    - appsrc 쪽에서 올라오는 GstForceKeyUnit 요청은 공유 인코더로 전달
+    - timebase: 여러 구독자가 공유하는 [base_pts] 리스트 (HLS ABR 렌디션끼리 같은 시간축을 쓰도록)
+    """
+
+    def __init__(self, name: str, appsrc, max_bytes: int = SUBSCRIBER_MAX_BYTES, live_timestamps: bool = False,
+                 timebase: list = None):
+        self.name = name
+        self.appsrc = appsrc
+        self.max_bytes = int(max_bytes)
+        self.live_timestamps = bool(live_timestamps)
+        self.hub = None
+        self.rendition = None
+        self.waiting_keyframe = True
+        self.pushed = 0
+        self.dropped = 0
+        self.closed = False
+        self._base_pts = None
+        self._last_out = None
+        self.timebase = timebase
+        try:
+            pad = appsrc.get_static_pad('src')
+            pad.add_probe(Gst.PadProbeType.EVENT_UPSTREAM, self._on_upstream_event)
+        except Exception:
+            pass
+
+    def _on_upstream_event(self, pad, info):
+        try:
+            event = info.get_event()
+            if event is not None and event.type == Gst.EventType.CUSTOM_UPSTREAM:
+                st = event.get_structure()
+                if st is not None and st.get_name() == 'GstForceKeyUnit':
+                    self.request_keyframe()
+        except Exception:
+            pass
+        return Gst.PadProbeReturn.OK
+
+    def request_keyframe(self) -> None:
+        hub = self.hub
+        if hub is not None and self.rendition is not None:
+            hub.request_keyframe(self.rendition)
+
+    def _drop(self) -> None:
+        self.dropped += 1
+        metrics.FRAMES_DROPPED.inc(consumer=self.name)
+        if not self.waiting_keyframe:
+            self.waiting_keyframe = True
+            self.request_keyframe()
+
+    def push(self, buf) -> bool:
+        if self.closed:
+            return False
+        is_key = not buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        if self.waiting_keyframe:
+            if not is_key:
+                return False
+            self.waiting_keyframe = False
+        try:
+            if self.max_bytes and self.appsrc.get_property('current-level-bytes') > self.max_bytes:
+                self._drop()
+                return False
+        except Exception:
+            pass
+        out = buf.copy()
+        if self.live_timestamps:
+            out.pts = Gst.CLOCK_TIME_NONE
+            out.dts = Gst.CLOCK_TIME_NONE
+        else:
+            pts = int(buf.pts)
+            dur = int(buf.duration) if buf.duration != Gst.CLOCK_TIME_NONE else 0
+            if self._base_pts is None and self.timebase is not None and self.timebase[0] is not None:
+                self._base_pts = self.timebase[0]
+            if self._base_pts is None or (self._last_out is not None and pts - self._base_pts <= self._last_out):
+                # 첫 버퍼, 또는 인코더 재구성으로 시간축이 역행하면 직전 출력 바로 뒤로 맞춤
+                next_pts = 0 if self._last_out is None else self._last_out + max(1, dur)
+                self._base_pts = pts - next_pts
+                if self.timebase is not None and self.timebase[0] is None:
+                    self.timebase[0] = self._base_pts
+            out.pts = pts - self._base_pts
+            out.dts = out.pts
+            self._last_out = out.pts
+        ret = self.appsrc.emit('push-buffer', out)
+        if ret != Gst.FlowReturn.OK:
+            if ret in (Gst.FlowReturn.FLUSHING, Gst.FlowReturn.EOS):
+                self.closed = True
+            self._drop()
+            return False
+        self.pushed += 1
+        return True
+
+
+class _Rendition:
+    def __init__(self, name: str, width: int, height: int, bitrate_kbps: int, fps: int = None, codec: str = 'h264'):
+        self.name = name
+        self.width = int(width)
+        self.height = int(height)
+        self.bitrate_kbps = int(bitrate_kbps)
+        self.fps = int(fps) if fps else None   # None이면 입력 fps
+        self.codec = codec
+        self.bin = None
+        self.tee_pad = None
+        self.encoder = None
+        self.valve = None
+        self.subscribers = []
+        self.last_keyframe_request = 0.0
+
+
+class _Scaler:
+    """크기별 공유 스케일러 (렌디션 bin들이 tee에 연결)."""
+
+    def __init__(self, width: int, height: int):
+        self.name = f"s{int(width)}x{int(height)}"
+        self.width = int(width)
+        self.height = int(height)
+        self.bin = None
+        self.tee = None
+        self.tee_pad = None
+        self.valve = None
+
+
+class SharedEncoder:
+    """카메라 프레임을 렌디션별로 한 번씩만 인코딩하여 구독자에게 나눠주는 공유 인코더."""
+
+    def __init__(self, width: int, height: int, fps: int, bitrate_kbps: int,
+                 gamma: float = 1.0, saturation: float = 1.0, speed_preset: str = 'ultrafast',
+                 align_keyframes: bool = False):
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = max(1, int(fps))
+        self.bitrate_kbps = max(1, int(bitrate_kbps))
+        self.gamma = float(gamma)
+        self.saturation = float(saturation)
+        self.speed_preset = speed_preset
+        # GOP = 2초 (HLS target-duration과 일치)
+        self.keyint = self.fps * 2
+        self.pipeline = None
+        self.appsrc = None
+        self.tee = None
+        self.gamma_element = None
+        self.vb_element = None
+        self._renditions = {}
+        self._scalers = {}
+        self._lock = threading.RLock()
+        self._t0_ns = None
+        self._frame_bytes = self.width * self.height * 3
+        self._frame_duration_ns = int(1e9 / self.fps)
+        self.align_keyframes = bool(align_keyframes)
+        self._frames_pushed = 0
+        self._force_keyframe = False
+        self._last_aligned_request = 0.0
+        self._cpu_thread = None
+
+    # --- lifecycle ---
+    def start(self) -> None:
+        Gst.init(None)
+        launch = (
+            f"appsrc name=enc_src is-live=true format=time do-timestamp=false block=false "
+            f"max-bytes={self._frame_bytes * 3} "
+            f"caps=video/x-raw,format=BGR,width={self.width},height={self.height},framerate={self.fps}/1 ! "
+            f"gamma name=enc_gamma gamma={self.gamma} ! "
+            f"videoconvert ! video/x-raw,format=I420 ! "
+            f"videobalance name=enc_vb saturation={self.saturation} ! "
+            f"tee name=raw_tee allow-not-linked=true"
+        )
+        self.pipeline = Gst.parse_launch(launch)
+        self.appsrc = self.pipeline.get_by_name('enc_src')
+        self.tee = self.pipeline.get_by_name('raw_tee')
+        self.gamma_element = self.pipeline.get_by_name('enc_gamma')
+        self.vb_element = self.pipeline.get_by_name('enc_vb')
+        self.pipeline.set_state(Gst.State.PLAYING)
+        self._t0_ns = time.monotonic_ns()
+        with self._lock:
+            renditions = list(self._renditions.values())
+        if not renditions:
+            self.add_rendition('main', self.width, self.height, self.bitrate_kbps)
+        else:
+            for r in renditions:
+                self._build_rendition(r)
+        self._frames_pushed = 0
+        if self._cpu_thread is None:
+            self._cpu_thread = threading.Thread(target=self._cpu_loop, name='enc-cpu', daemon=True)
+            self._cpu_thread.start()
+        aligned = ' (키프레임 정렬)' if self.align_keyframes else ''
+        print(f"[ENC] 공유 인코더 시작: {self.width}x{self.height}@{self.fps} {self.bitrate_kbps}kbps{aligned}")
+
+    def stop(self) -> None:
+        """파이프라인만 정리하고 렌디션/구독자 목록은 유지 (reconfigure에서 재사용)."""
+        pipeline = self.pipeline
+        self.pipeline = None
+        self.appsrc = None
+        self.tee = None
+        self.gamma_element = None
+        self.vb_element = None
+        with self._lock:
+            for r in self._renditions.values():
+                r.bin = r.tee_pad = r.encoder = r.valve = None
+            for sc in self._scalers.values():
+                sc.bin = sc.tee = sc.tee_pad = sc.valve = None
+        if pipeline is not None:
+            try:
+                pipeline.set_state(Gst.State.NULL)
+            except Exception:
+                pass
+
+    def set_keyframe_alignment(self, enabled: bool) -> None:
+        """렌디션 간 키프레임 정렬 on/off. x264 설정(scenecut/key-int-max)이 바뀌므로 파이프라인을 재구성."""
+        enabled = bool(enabled)
+        if enabled == self.align_keyframes:
+            return
+        self.align_keyframes = enabled
+        if self.pipeline is None:
+            return
+        self.stop()
+        with self._lock:
+            for r in self._renditions.values():
+                for s in r.subscribers:
+                    s.waiting_keyframe = True
+        self.start()
+
+    def matches(self, width: int, height: int, fps: int) -> bool:
+        return (int(width), int(height), max(1, int(fps))) == (self.width, self.height, self.fps)
+
+    def reconfigure(self, width: int, height: int, fps: int, bitrate_kbps: int = None) -> None:
+        """입력 해상도/fps가 바뀌면 파이프라인을 재구성. 구독자는 다음 키프레임부터 이어받는다."""
+        if self.matches(width, height, fps) and (bitrate_kbps is None or int(bitrate_kbps) == self.bitrate_kbps):
+            return
+        self.stop()
+        old_w, old_h = self.width, self.height
+        self.width, self.height, self.fps = int(width), int(height), max(1, int(fps))
+        self.keyint = self.fps * 2
+        self._frame_bytes = self.width * self.height * 3
+        self._frame_duration_ns = int(1e9 / self.fps)
+        with self._lock:
+            main = self._renditions.get('main')
+            if main is not None:
+                main.width, main.height = self.width, self.height
+                if bitrate_kbps is not None:
+                    main.bitrate_kbps = max(1, int(bitrate_kbps))
+            for r in self._renditions.values():
+                # 입력보다 큰 렌디션은 만들지 않음
+                if r.name != 'main' and (r.width > self.width or r.height > self.height):
+                    r.width, r.height = min(r.width, self.width), min(r.height, self.height)
+                for s in r.subscribers:
+                    s.waiting_keyframe = True
+        if bitrate_kbps is not None:
+            self.bitrate_kbps = max(1, int(bitrate_kbps))
+        print(f"[ENC] 재구성: {old_w}x{old_h} → {self.width}x{self.height}@{self.fps}")
+        self.start()
+
+    # --- renditions ---
+    def _rendition_fps(self, r: _Rendition) -> int:
+        return min(r.fps, self.fps) if r.fps else self.fps
+
+    def _rendition_desc(self, r: _Rendition) -> str:
+        fps = self._rendition_fps(r)
+        rate = ""
+        if fps < self.fps:
+            rate = f"videorate drop-only=true ! video/x-raw,framerate={fps}/1 ! "
+        if r.codec == 'jpeg':
+            encode = f"jpegenc name=enc_{r.name} quality={JPEG_QUALITY} ! "
+        else:
+            keyint = fps * 2
+            if self.align_keyframes:
+                # GOP는 소스의 강제 키프레임으로 맞추고, x264 자체 키프레임은 안전망으로만 둠
+                gop = f"key-int-max={keyint * 2} option-string=scenecut=0"
+            else:
+                gop = f"key-int-max={keyint}"
+            encode = (
+                f"x264enc name=enc_{r.name} tune=zerolatency speed-preset={self.speed_preset} "
+                f"bitrate={r.bitrate_kbps} {gop} b-adapt=false ! "
+                f"h264parse config-interval=-1 ! "
+            )
+        return (
+            f"queue name=q_{r.name} max-size-buffers=2 max-size-bytes=0 max-size-time=0 leaky=downstream ! "
+            f"valve name=valve_{r.name} drop={'false' if r.subscribers else 'true'} ! {rate}{encode}"
+            f"appsink name=sink_{r.name} emit-signals=true sync=false max-buffers=8 drop=false"
+        )
+
+    @staticmethod
+    def _request_pad(tee):
+        try:
+            return tee.request_pad_simple('src_%u')
+        except AttributeError:
+            return tee.get_request_pad('src_%u')
+
+    def _scaler_active(self, sc: _Scaler) -> bool:
+        return any(r.subscribers for r in self._renditions.values() if (r.width, r.height) == (sc.width, sc.height))
+
+    def _source_tee(self, r: _Rendition):
+        """렌디션이 연결될 tee: 입력 크기면 raw_tee, 아니면 같은 크기 렌디션이 공유하는 스케일러의 tee."""
+        if (r.width, r.height) == (self.width, self.height):
+            return self.tee
+        key = (r.width, r.height)
+        with self._lock:
+            sc = self._scalers.get(key)
+            if sc is None:
+                sc = self._scalers[key] = _Scaler(r.width, r.height)
+            if sc.tee is not None:
+                return sc.tee
+            drop = 'false' if self._scaler_active(sc) else 'true'
+        bin_ = Gst.parse_bin_from_description(
+            f"queue name=q_{sc.name} max-size-buffers=2 max-size-bytes=0 max-size-time=0 leaky=downstream ! "
+            f"valve name=valve_{sc.name} drop={drop} ! "
+            f"videoscale ! video/x-raw,width={sc.width},height={sc.height}", True)
+        bin_.set_name(f"scaler_{sc.name}")
+        tee = Gst.ElementFactory.make('tee', f"tee_{sc.name}")
+        tee.set_property('allow-not-linked', True)
+        self.pipeline.add(bin_)
+        self.pipeline.add(tee)
+        bin_.get_static_pad('src').link(tee.get_static_pad('sink'))
+        tee_pad = self._request_pad(self.tee)
+        tee_pad.link(bin_.get_static_pad('sink'))
+        sc.bin, sc.tee, sc.tee_pad = bin_, tee, tee_pad
+        sc.valve = bin_.get_by_name(f"valve_{sc.name}")
+        tee.sync_state_with_parent()
+        bin_.sync_state_with_parent()
+        print(f"[ENC] 스케일러 추가: {sc.width}x{sc.height}")
+        return tee
+
+    def _build_rendition(self, r: _Rendition) -> None:
+        if self.pipeline is None:
+            return
+        bin_ = Gst.parse_bin_from_description(self._rendition_desc(r), True)
+        bin_.set_name(f"rendition_{r.name}")
+        self.pipeline.add(bin_)
+        tee_pad = self._request_pad(self._source_tee(r))
+        tee_pad.link(bin_.get_static_pad('sink'))
+        sink = bin_.get_by_name(f"sink_{r.name}")
+        sink.connect('new-sample', self._on_sample, r.name)
+        r.bin = bin_
+        r.tee_pad = tee_pad
+        r.encoder = bin_.get_by_name(f"enc_{r.name}")
+        r.valve = bin_.get_by_name(f"valve_{r.name}")
+        bin_.sync_state_with_parent()
+
+    def add_rendition(self, name: str, width: int, height: int, bitrate_kbps: int,
+                      fps: int = None, codec: str = 'h264') -> str:
+        """렌디션 추가 (이미 있으면 그대로 사용). 입력보다 큰 크기는 입력 크기로 제한."""
+        with self._lock:
+            if name in self._renditions:
+                return name
+            r = _Rendition(name, min(int(width), self.width), min(int(height), self.height), bitrate_kbps,
+                           fps=fps, codec=codec)
+            self._renditions[name] = r
+        self._build_rendition(r)
+        rate = f"@{r.fps}" if r.fps else ""
+        print(f"[ENC] 렌디션 추가: {name} {r.width}x{r.height}{rate} {r.codec} {r.bitrate_kbps}kbps")
+        return name
+
+    def ensure_rendition(self, width: int, height: int, bitrate_kbps: int = None,
+                         fps: int = None, codec: str = 'h264') -> str:
+        """요청한 크기/fps/비트레이트/코덱의 렌디션 이름 반환. 입력과 같은 설정이면 main을 공유한다.
+
+        bitrate_kbps/fps가 None이면 크기만 맞는 렌디션을 재사용한다.
+        """
+        width, height = min(int(width), self.width), min(int(height), self.height)
+        fps = max(1, int(fps)) if fps and int(fps) < self.fps else None
+        if codec == 'jpeg':
+            bitrate_kbps = None
+        if (codec == 'h264' and fps is None and (width, height) == (self.width, self.height)
+                and (bitrate_kbps is None or int(bitrate_kbps) == self.bitrate_kbps)):
+            return 'main'
+        with self._lock:
+            for r in self._renditions.values():
+                if r.name == 'main' or (r.width, r.height, r.fps, r.codec) != (width, height, fps, codec):
+                    continue
+                if bitrate_kbps is None or r.bitrate_kbps == int(bitrate_kbps):
+                    return r.name
+            kbps = bitrate_kbps or max(1, int(self.bitrate_kbps * (width * height) / float(self.width * self.height)))
+            name = f"{'j' if codec == 'jpeg' else 'r'}{width}x{height}" + (f"_{fps}fps" if fps else "")
+            if name in self._renditions:
+                name += f"_{int(kbps)}k"
+        return self.add_rendition(name, width, height, kbps, fps=fps, codec=codec)
+
+    def renditions(self) -> list:
+        with self._lock:
+            return [{"name": r.name, "width": r.width, "height": r.height, "bitrate_kbps": r.bitrate_kbps,
+                     "fps": self._rendition_fps(r), "codec": r.codec,
+                     "subscribers": [s.name for s in r.subscribers]} for r in self._renditions.values()]
+
+    def _update_valve(self, r: _Rendition) -> None:
+        sc = self._scalers.get((r.width, r.height))
+        if sc is not None and sc.valve is not None:
+            # 같은 크기 렌디션이 모두 멈추면 스케일러도 멈춤
+            try:
+                drop = not self._scaler_active(sc)
+                if bool(sc.valve.get_property('drop')) != drop:
+                    sc.valve.set_property('drop', drop)
+            except Exception:
+                pass
+        if r.valve is None:
+            return
+        try:
+            drop = not r.subscribers
+            if bool(r.valve.get_property('drop')) != drop:
+                r.valve.set_property('drop', drop)
+                print(f"[ENC] 렌디션 {r.name}: {'정지' if drop else '인코딩 시작'}")
+        except Exception:
+            pass
+
+    # --- subscribers ---
+    def subscribe(self, rendition: str, subscriber: EncodedSubscriber) -> None:
+        with self._lock:
+            r = self._renditions.get(rendition)
+            if r is None:
+                raise KeyError(f'렌디션 없음: {rendition}')
+            if subscriber not in r.subscribers:
+                r.subscribers.append(subscriber)
+            subscriber.hub = self
+            subscriber.rendition = rendition
+            subscriber.waiting_keyframe = True
+            self._update_valve(r)
+        self.request_keyframe(rendition, force=True)
+
+    def unsubscribe(self, subscriber: EncodedSubscriber) -> None:
+        with self._lock:
+            for r in self._renditions.values():
+                if subscriber in r.subscribers:
+                    r.subscribers.remove(subscriber)
+                    self._update_valve(r)
+        subscriber.hub = None
+
+    def move_subscriber(self, subscriber: EncodedSubscriber, rendition: str) -> None:
+        if subscriber.rendition == rendition and subscriber.hub is self:
+            return
+        self.unsubscribe(subscriber)
+        self.subscribe(rendition, subscriber)
+
+    def _on_sample(self, sink, name):
+        sample = sink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        with self._lock:
+            r = self._renditions.get(name)
+            subs = list(r.subscribers) if r is not None else []
+        for s in subs:
+            try:
+                s.push(buf)
+            except Exception as e:
+                print(f"[ENC] 구독자 {s.name} 전달 실패: {e}")
+        return Gst.FlowReturn.OK
+
+    def request_keyframe(self, rendition: str = 'main', force: bool = False) -> None:
+        if self.align_keyframes:
+            # 정렬 모드: 모든 렌디션이 같은 프레임에서 키프레임을 만들도록 소스에서 요청
+            now = time.monotonic()
+            if force or now - self._last_aligned_request >= KEYFRAME_REQUEST_MIN_INTERVAL_SEC:
+                self._last_aligned_request = now
+                self._force_keyframe = True
+            return
+        with self._lock:
+            r = self._renditions.get(rendition)
+        if r is None or r.bin is None:
+            return
+        now = time.monotonic()
+        if not force and now - r.last_keyframe_request < KEYFRAME_REQUEST_MIN_INTERVAL_SEC:
+            return
+        r.last_keyframe_request = now
+        try:
+            sink = r.bin.get_by_name(f"sink_{r.name}")
+            sink.get_static_pad('sink').send_event(force_key_unit_event())
+        except Exception:
+            pass
+
+    # --- input ---
+    def push_frame(self, frame, capture_ns: int = None) -> bool:
+        """BGR 프레임(입력 해상도) 하나를 인코더에 넣는다. 인코더가 밀려 있으면 드롭 후 False.
+
+        capture_ns: time.monotonic_ns() 기준 캡처 시각 (없으면 호출 시각)
+        """
+        appsrc = self.appsrc
+        if appsrc is None:
+            return False
+        try:
+            if appsrc.get_property('current-level-bytes') >= self._frame_bytes * 2:
+                metrics.FRAMES_DROPPED.inc(consumer='encoder')
+                return False
+        except Exception:
+            pass
+        if self.align_keyframes and (self._force_keyframe or self._frames_pushed % self.keyint == 0):
+            # 직렬화된 다운스트림 이벤트: 다음 버퍼와 함께 tee의 모든 렌디션에 전달
+            self._force_keyframe = False
+            self._frames_pushed = 0
+            try:
+                appsrc.send_event(force_key_unit_event(downstream=True))
+            except Exception:
+                pass
+        now_ns = time.monotonic_ns() if capture_ns is None else int(capture_ns)
+        buf = Gst.Buffer.new_wrapped(frame.tobytes())
+        buf.pts = max(0, now_ns - self._t0_ns)
+        buf.dts = buf.pts
+        buf.duration = self._frame_duration_ns
+        ret = appsrc.emit('push-buffer', buf)
+        if ret != Gst.FlowReturn.OK:
+            metrics.FRAMES_DROPPED.inc(consumer='encoder')
+            return False
+        self._frames_pushed += 1
+        return True
+
+    # --- metrics ---
+    def _thread_names(self) -> dict:
+        """스레드 이름 → 렌디션. 렌디션 queue의 스트리밍 스레드(q_<이름>:src)에서 x264가 인코딩하고,
+        x264 작업 스레드도 이 스레드에서 만들어져 이름을 물려받는다 (리눅스 스레드 이름은 15자에서 잘림)."""
+        with self._lock:
+            names = {f"q_{r.name}:src"[:15]: r.name for r in self._renditions.values()}
+            for sc in self._scalers.values():
+                names[f"q_{sc.name}:src"[:15]] = f"scale_{sc.width}x{sc.height}"
+        names["enc_src:src"] = 'shared'
+        return names
+
+    def _cpu_loop(self) -> None:
+        prev = None
+        prev_t = None
+        while True:
+            time.sleep(CPU_SAMPLE_SEC)
+            if self.pipeline is None:
+                prev = None
+                continue
+            try:
+                now = time.monotonic()
+                cur = metrics.read_thread_cpu()
+                if prev is not None:
+                    names = self._thread_names()
+                    usage = {name: 0.0 for name in names.values()}
+                    for tid, info in cur.items():
+                        name = names.get(info["name"])
+                        if name is not None:
+                            before = prev.get(tid, {}).get("cpu_s", 0.0)
+                            usage[name] += max(0.0, info["cpu_s"] - before)
+                    for name, cpu_s in usage.items():
+                        metrics.ENCODER_CPU_PERCENT.set(round(cpu_s / (now - prev_t) * 100.0, 1), rendition=name)
+                prev, prev_t = cur, now
+            except Exception:
+                pass
+
+    # --- runtime parameters ---
+    def set_gamma(self, gamma: float) -> None:
+        self.gamma = float(gamma)
+        if self.gamma_element is not None:
+            self.gamma_element.set_property('gamma', self.gamma)
+
+    def set_saturation(self, saturation: float) -> None:
+        self.saturation = float(saturation)
+        if self.vb_element is not None:
+            self.vb_element.set_property('saturation', self.saturation)
+
+    def set_bitrate(self, bitrate_kbps: int, rendition: str = 'main') -> None:
+        with self._lock:
+            r = self._renditions.get(rendition)
+        if r is None:
+            return
+        r.bitrate_kbps = max(1, int(bitrate_kbps))
+        if rendition == 'main':
+            self.bitrate_kbps = r.bitrate_kbps
+        if r.encoder is not None:
+            r.encoder.set_property('bitrate', r.bitrate_kbps)
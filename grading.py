@@ -0,0 +1,193 @@
+"""
+후처리 색 보정: 세션 파라미터 타임라인(gamma / WB / gray)을 병합된 원본 영상에 적용
+
+후처리 모드(POSTPROCESS_AFTER_CAPTURE=1)에서는 실시간 인코더가 보정 없이(중립) 기록하고,
+세션 중 바뀐 파라미터는 타임라인 이벤트로만 남깁니다. 병합 후 이 모듈이 한 번 디코드하여
+이벤트 구간마다 미리 계산한 LUT를 cv2.LUT로 프레임 전체에 적용한 뒤 다시 인코딩합니다.
+
+- LUT는 이벤트(구간)마다 한 번만 계산: WB 이득 × gamma를 채널별 256 엔트리 표 하나로 합침
+- gamma는 GStreamer gamma 요소와 같은 정의: out = 255 * (in / 255) ^ (1 / gamma)
+- WB auto(gray-world)는 구간 첫 프레임에서 이득을 구해 구간 내내 고정
+- gray는 LUT 적용 후 휘도 변환 (videobalance saturation=0과 같은 결과)
+- 중립 원본과 <원본>.timeline.json은 남겨 두므로 언제든 다시 보정할 수 있음
+
+타임라인 파일: {"placements": [{"segment", "start_s", "duration_s", "start_ns", "events": [...]}, ...]}
+  start_s/duration_s: 병합 출력 안의 위치, start_ns: 세션 시작 기준 세그먼트 시작, events: session_param_events
+
+예)
+  python3 grading.py video_..._merge_file.mp4 graded.mp4                 # <입력>.timeline.json 사용
+  python3 grading.py merged.mp4 graded.mp4 --gamma 1.4 --mode gray       # 타임라인 대신 고정 파라미터
+"""
+
+import argparse
+import bisect
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from recording_writer import open_h264_writer
+
+NEUTRAL = {"gamma": 1.0, "wb": 'none', "mode": 'rgb'}
+TIMELINE_SUFFIX = '.timeline.json'
+# gray-world 이득 계산용 축소 크기 (구간당 한 번)
+WB_SAMPLE_WIDTH = 320
+
+
+def _params(event) -> dict:
+    return {
+        "gamma": float((event or {}).get("gamma", 1.0) or 1.0),
+        "wb": str((event or {}).get("wb", 'none')).lower(),
+        "mode": str((event or {}).get("mode", 'rgb')).lower(),
+    }
+
+
+def is_neutral(params: dict) -> bool:
+    return params["gamma"] == 1.0 and params["wb"] != 'auto' and params["mode"] != 'gray'
+
+
+def gamma_lut(gamma: float) -> np.ndarray:
+    x = np.arange(256, dtype=np.float64) / 255.0
+    return np.clip(np.round(255.0 * np.power(x, 1.0 / max(gamma, 1e-3))), 0, 255).astype(np.uint8)
+
+
+def grayworld_gains(frame: np.ndarray) -> np.ndarray:
+    """채널별 gray-world 이득 (apply_simple_wb_rgb와 같은 식, 축소한 프레임에서 계산)."""
+    h, w = frame.shape[:2]
+    if w > WB_SAMPLE_WIDTH:
+        frame = cv2.resize(frame, (WB_SAMPLE_WIDTH, max(1, h * WB_SAMPLE_WIDTH // w)), interpolation=cv2.INTER_AREA)
+    avg = frame.reshape(-1, 3).mean(axis=0)
+    if np.any(avg <= 1e-6):
+        return np.ones(3)
+    return avg.mean() / avg
+
+
+def build_lut(params: dict, frame: np.ndarray = None) -> np.ndarray:
+    """WB 이득과 gamma를 합친 (256, 1, 3) uint8 LUT — cv2.LUT 한 번으로 세 채널에 적용."""
+    gains = grayworld_gains(frame) if params["wb"] == 'auto' and frame is not None else np.ones(3)
+    g = gamma_lut(params["gamma"])
+    x = np.arange(256, dtype=np.float64)
+    lut = np.empty((256, 1, 3), dtype=np.uint8)
+    for c in range(3):
+        lut[:, 0, c] = g[np.clip(np.round(x * gains[c]), 0, 255).astype(np.int64)]
+    return lut
+
+
+def switches_from_placements(placements) -> list:
+    """placements → 출력 시간 기준 [(시작 초, params)] (시간순). 이벤트가 없는 세그먼트는 중립."""
+    out = []
+    for p in placements:
+        start_s = float(p.get("start_s", 0.0))
+        dur_s = float(p.get("duration_s", 0.0))
+        seg_ns = int(p.get("start_ns", 0))
+        events = sorted(p.get("events") or [], key=lambda e: int(e.get("t_ns", 0)))
+        active = None
+        later = []
+        for ev in events:
+            if int(ev.get("t_ns", 0)) <= seg_ns:
+                active = ev
+            else:
+                later.append(ev)
+        out.append((start_s, _params(active) if events else dict(NEUTRAL)))
+        for ev in later:
+            t = start_s + (int(ev["t_ns"]) - seg_ns) / 1e9
+            if t < start_s + dur_s:
+                out.append((t, _params(ev)))
+    out.sort(key=lambda x: x[0])
+    return out
+
+
+def needs_grading(switches) -> bool:
+    return any(not is_neutral(p) for _t, p in switches)
+
+
+def load_timeline(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("placements", [])
+
+
+def save_timeline(path: str, placements) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"placements": placements}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def grade_video(src: str, dst: str, switches, bitrate_kbps: int = 4000) -> dict:
+    """src를 디코드하여 구간별 LUT를 적용하고 dst(H.264 mp4)로 기록. 실패 시 RuntimeError."""
+    t0 = time.time()
+    cap = cv2.VideoCapture(src)
+    if not cap.isOpened():
+        raise RuntimeError(f'영상 열기 실패: {src}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    if fps <= 0 or fps > 240:
+        fps = 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    tmp = dst[:-len('.mp4')] + '.part.mp4' if dst.endswith('.mp4') else dst + '.part.mp4'
+    writer, codec = open_h264_writer(tmp, fps, (width, height), bitrate_kbps)
+    if writer is None:
+        cap.release()
+        raise RuntimeError('H.264 writer를 열 수 없습니다')
+    starts = [t for t, _p in switches]
+    current = -1
+    lut = None
+    gray = False
+    frames = 0
+    luts = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            t = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if cap.get(cv2.CAP_PROP_POS_MSEC) > 0 else frames / fps
+            idx = bisect.bisect_right(starts, t + 1e-6) - 1
+            if idx != current:
+                # 구간이 바뀔 때만 LUT 계산 (gray-world 이득은 구간 첫 프레임 기준)
+                current = idx
+                params = switches[idx][1] if idx >= 0 else dict(NEUTRAL)
+                lut = None if params["gamma"] == 1.0 and params["wb"] != 'auto' else build_lut(params, frame)
+                gray = params["mode"] == 'gray'
+                luts += 1
+            if lut is not None:
+                frame = cv2.LUT(frame, lut)
+            if gray:
+                frame = cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+            writer.write(frame)
+            frames += 1
+    finally:
+        cap.release()
+        writer.release()
+    if frames == 0:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+        raise RuntimeError(f'디코드된 프레임이 없습니다: {src}')
+    os.replace(tmp, dst)
+    elapsed = time.time() - t0
+    print(f"[보정] 완료: {dst} ({frames}프레임, 구간 {luts}개, {codec}, {elapsed:.1f}s)")
+    return {"path": dst, "frames": frames, "segments": luts, "codec": codec, "elapsed_s": round(elapsed, 3)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='병합 원본에 파라미터 타임라인(gamma/WB/gray) 적용')
+    ap.add_argument('src')
+    ap.add_argument('dst')
+    ap.add_argument('--timeline', help=f'타임라인 파일 (기본: <src>{TIMELINE_SUFFIX})')
+    ap.add_argument('--gamma', type=float, help='타임라인 대신 고정 gamma')
+    ap.add_argument('--wb', choices=('auto', 'none'))
+    ap.add_argument('--mode', choices=('rgb', 'gray'))
+    ap.add_argument('--bitrate', type=int, default=4000, help='출력 비트레이트(kbps)')
+    args = ap.parse_args()
+    if args.gamma is not None or args.wb or args.mode:
+        switches = [(0.0, _params({"gamma": args.gamma or 1.0, "wb": args.wb or 'none', "mode": args.mode or 'rgb'}))]
+    else:
+        switches = switches_from_placements(load_timeline(args.timeline or args.src + TIMELINE_SUFFIX))
+    print(json.dumps(grade_video(args.src, args.dst, switches, args.bitrate), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
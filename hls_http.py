@@ -0,0 +1,269 @@
+"""
+HLS 전용 HTTP/1.1 서버
+
+SimpleHTTPRequestHandler 대신 HLS 응답에 맞춘 핸들러입니다.
+- 캐시: 세그먼트/부분 세그먼트는 이름이 다시 쓰이지 않으므로 immutable, 플레이리스트는 no-cache(매번 재검증)
+- 조건부 GET: ETag(If-None-Match) / Last-Modified(If-Modified-Since) → 304
+- 바이트 범위: 단일 Range 요청 → 206 (범위가 잘못되면 416, 여러 범위는 전체 200)
+- 파일(tmpfs/disk 모드) 응답은 os.sendfile로 커널에서 바로 전송, 메모리 저장소 응답은 복사 없이 memoryview로 전송
+- HTTP/1.1 keep-alive (유휴 KEEPALIVE_TIMEOUT_SEC 후 종료), 동시 연결 수 상한(초과 시 즉시 503)
+- 요청마다 접근 로그를 남기지 않음 (시청자 10명이면 초당 수십 건)
+
+하위 클래스에서 route / before_media / get_store(store_for) / get_directory를 지정해 사용합니다.
+"""
+
+import email.utils
+import os
+import posixpath
+import re
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from hls_store import PLAYLIST_CONTENT_TYPE, SEGMENT_CONTENT_TYPE
+
+MAX_CONNECTIONS = int(os.getenv('HLS_HTTP_MAX_CONNECTIONS', '32'))
+KEEPALIVE_TIMEOUT_SEC = 15
+SEGMENT_MAX_AGE_SEC = 3600
+CACHE_PLAYLIST = 'no-cache'
+CACHE_SEGMENT = f'public, max-age={SEGMENT_MAX_AGE_SEC}, immutable'
+CACHE_DEFAULT = 'no-cache'
+
+CONTENT_TYPES = {
+    '.m3u8': PLAYLIST_CONTENT_TYPE,
+    '.ts': SEGMENT_CONTENT_TYPE,
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'application/javascript',
+    '.css': 'text/css',
+    '.json': 'application/json',
+    '.jpg': 'image/jpeg',
+}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def cache_control_for(path: str) -> str:
+    if path.endswith('.ts'):
+        return CACHE_SEGMENT
+    if path.endswith('.m3u8'):
+        return CACHE_PLAYLIST
+    return CACHE_DEFAULT
+
+
+def parse_range(header, size: int):
+    """Range 헤더 → (start, end) 포함 범위. 헤더가 없거나 지원하지 않는 형식이면 None, 만족할 수 없으면 ValueError."""
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if m is None:
+        return None  # 여러 범위 등: 전체 응답
+    first, last = m.group(1), m.group(2)
+    if not first and not last:
+        return None
+    if not first:
+        # 접미 범위: 마지막 N바이트
+        n = int(last)
+        if n == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - n), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+
+class BoundedHTTPServer(ThreadingHTTPServer):
+    """동시 연결 수를 제한하는 ThreadingHTTPServer (초과 연결은 스레드를 만들지 않고 503)."""
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_connections: int = MAX_CONNECTIONS):
+        self._slots = threading.BoundedSemaphore(max(1, int(max_connections)))
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n'
+                                b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
+class HlsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'openiot-hls/1.0'
+    # keep-alive 연결의 소켓 타임아웃 (유휴 연결이 스레드를 붙잡지 않도록)
+    timeout = KEEPALIVE_TIMEOUT_SEC
+
+    # --- 하위 클래스에서 지정 ---
+    def route(self, path: str):
+        """HLS 외 경로 → (content-type, 본문 bytes). 해당 없으면 None."""
+        return None
+
+    def before_media(self, path: str) -> None:
+        """플레이리스트/세그먼트 요청 직전 호출 (시청자 기록, 온디맨드 시작)."""
+
+    def get_store(self):
+        """메모리 저장소(HlsSegmentStore). 파일에서 응답할 때는 None."""
+        return None
+
+    def get_directory(self):
+        """파일 응답 디렉터리 (tmpfs/disk 모드)."""
+        return None
+
+    def store_for(self, path: str):
+        """요청 경로 → (저장소, 저장소 기준 경로+쿼리). 기본은 get_store()와 요청 경로 그대로."""
+        store = self.get_store()
+        return (store, self.path) if store is not None else (None, None)
+
+    # --- HTTP ---
+    def log_message(self, format, *args):
+        pass
+
+    def log_error(self, format, *args):
+        print(f"[HLS] HTTP 오류 {self.address_string()}: {format % args}")
+
+    def _cors(self) -> None:
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Range, Content-Type, Origin, Accept, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'Content-Length, Content-Range, ETag')
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors()
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._handle(head=False)
+
+    def do_HEAD(self):
+        self._handle(head=True)
+
+    def _handle(self, head: bool) -> None:
+        path = unquote(self.path.split('?', 1)[0])
+        if path.endswith('.m3u8') or path.endswith('.ts'):
+            # route가 만드는 플레이리스트(ABR 마스터 등)도 온디맨드 시작 대상
+            self.before_media(path)
+        extra = self.route(path)
+        if extra is not None:
+            content_type, body = extra
+            self._send_bytes(content_type, body, CACHE_DEFAULT, head)
+            return
+        store, store_path = self.store_for(path)
+        if store is not None:
+            res = store.respond(store_path)
+            if res is None:
+                self._send_empty(404)
+                return
+            content_type, body = res
+            cache = CACHE_PLAYLIST if content_type == PLAYLIST_CONTENT_TYPE else CACHE_SEGMENT
+            self._send_bytes(content_type, body, cache, head)
+            return
+        directory = self.get_directory()
+        if directory:
+            self._send_file(directory, path, head)
+            return
+        self._send_empty(404)
+
+    def _send_empty(self, status: int, headers=None) -> None:
+        self.send_response(status)
+        self._cors()
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _not_modified(self, etag: str, mtime=None) -> bool:
+        inm = self.headers.get('If-None-Match')
+        if inm is not None:
+            return inm.strip() == '*' or etag in [t.strip() for t in inm.split(',')]
+        ims = self.headers.get('If-Modified-Since')
+        if ims is not None and mtime is not None:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(ims).timestamp()
+            except Exception:
+                return False
+        return False
+
+    def _begin(self, content_type: str, size: int, etag: str, cache: str, mtime=None):
+        """조건부/범위 요청을 처리하고 헤더를 보냄 → 보낼 (start, end) 또는 None(본문 없음)."""
+        common = {'ETag': etag, 'Cache-Control': cache}
+        if mtime is not None:
+            common['Last-Modified'] = email.utils.formatdate(mtime, usegmt=True)
+        if self._not_modified(etag, mtime):
+            self._send_empty(304, common)
+            return None
+        try:
+            rng = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self._send_empty(416, {'Content-Range': f'bytes */{size}'})
+            return None
+        if rng is not None and self.headers.get('If-Range') not in (None, etag):
+            rng = None
+        start, end = rng if rng is not None else (0, size - 1)
+        self.send_response(206 if rng is not None else 200)
+        self._cors()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(max(0, end - start + 1)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if rng is not None:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        for k, v in common.items():
+            self.send_header(k, v)
+        self.end_headers()
+        return start, end
+
+    def _send_bytes(self, content_type: str, body: bytes, cache: str, head: bool) -> None:
+        etag = f'"{zlib.crc32(body):08x}-{len(body):x}"'
+        rng = self._begin(content_type, len(body), etag, cache)
+        if rng is None or head:
+            return
+        start, end = rng
+        self.wfile.write(memoryview(body)[start:end + 1])
+
+    def _send_file(self, directory: str, path: str, head: bool) -> None:
+        rel = posixpath.normpath(path).lstrip('/')
+        if rel in ('', '.'):
+            rel = 'index.html'
+        if rel.startswith('..') or '/../' in f'/{rel}/':
+            self._send_empty(404)
+            return
+        full = os.path.join(directory, *rel.split('/'))
+        if not os.path.isfile(full):
+            self._send_empty(404)
+            return
+        try:
+            f = open(full, 'rb')
+        except OSError:
+            self._send_empty(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            ext = os.path.splitext(rel)[1].lower()
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            rng = self._begin(CONTENT_TYPES.get(ext, 'application/octet-stream'), st.st_size, etag,
+                              cache_control_for(rel), mtime=st.st_mtime)
+            if rng is None or head:
+                return
+            start, end = rng
+            self.wfile.flush()
+            # socket.sendfile: os.sendfile(zero-copy)로 전송하고 소켓 타임아웃도 처리 (불가하면 send로 대체)
+            self.connection.sendfile(f, start, end - start + 1)
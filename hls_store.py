@@ -0,0 +1,501 @@
+"""
+메모리 HLS 세그먼트 저장소 (SD 카드에 쓰지 않는 HLS)
+
+hlssink가 2초마다 SD 카드에 segment_%05d.ts / index.m3u8을 쓰고 HTTP 서버가 다시 읽어 가던 구조 대신,
+mpegtsmux 출력을 appsink로 받아 키프레임 경계에서 세그먼트로 잘라 메모리 링에 보관하고
+HTTP 핸들러가 플레이리스트와 세그먼트를 메모리에서 바로 응답합니다.
+
+- 링 크기: max_segments개(재생 목록에는 최근 window개). 오래된 세그먼트는 자동 폐기
+- 세그먼트 경계: 키프레임 버퍼(DELTA_UNIT 아님)이면서 현재 세그먼트가 target_duration 이상일 때
+- 모든 세그먼트는 PAT/PMT로 시작 (mpegtsmux가 키프레임 앞에 다시 쓰지 않았으면 마지막 PAT/PMT를 붙임)
+- 파이프라인 재시작 시 다음 세그먼트에 EXT-X-DISCONTINUITY 표시, 시퀀스 번호는 계속 증가
+
+저지연 HLS (HLS_LOW_LATENCY=1, memory 모드 전용):
+- 세그먼트를 HLS_PART_MS(기본 333ms) 단위 부분 세그먼트(part_NNNNN_M.ts)로도 공개 (EXT-X-PART)
+- 아직 만들어지지 않은 다음 부분은 EXT-X-PRELOAD-HINT로 알리고, 요청이 오면 준비될 때까지 대기 후 응답
+- 플레이리스트 블로킹 리로드: ?_HLS_msn=N&_HLS_part=M 요청은 해당 부분이 생길 때까지 대기 후 응답
+- PART-HOLD-BACK = 부분 길이 × 3 → 재생 지연 약 1초 + 인코더 지연
+
+HLS_STORE 환경 변수: memory(기본) | tmpfs | disk
+  tmpfs: hlssink2가 HLS_TMPFS_DIR(기본 /dev/shm/openiot-hls)에 기록, 쓸 수 없으면 disk로 대체
+  memory 파이프라인을 만들 수 없으면(appsink 없음 등) tmpfs로 자동 대체
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+HLS_STORE_MODE = os.getenv('HLS_STORE', 'memory').strip().lower()
+HLS_TMPFS_DIR = os.getenv('HLS_TMPFS_DIR', '/dev/shm/openiot-hls')
+DEFAULT_TARGET_DURATION = 2.0
+DEFAULT_WINDOW = 6
+DEFAULT_MAX_SEGMENTS = 10
+HLS_LOW_LATENCY = os.getenv('HLS_LOW_LATENCY', '0') == '1'
+HLS_PART_SEC = max(0.1, float(os.getenv('HLS_PART_MS', '333')) / 1000.0)
+# 부분 세그먼트 목록을 유지할 최근 완료 세그먼트 수 (그 이전은 EXTINF만)
+PART_SEGMENTS = 2
+# 블로킹 요청 최대 대기 (세그먼트 길이의 배수)
+BLOCK_TIMEOUT_FACTOR = 3.0
+# 링 전체 최대 바이트 (비트레이트가 높아도 메모리 사용량 제한)
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+SEGMENT_NAME = 'segment_{:05d}.ts'
+PART_NAME = 'part_{:05d}_{}.ts'
+PLAYLIST_NAME = 'index.m3u8'
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_CONTENT_TYPE = 'video/mp2t'
+
+_SEGMENT_RE = re.compile(r'^/segment_(\d+)\.ts$')
+_PART_RE = re.compile(r'^/part_(\d+)_(\d+)\.ts$')
+
+
+def tmpfs_dir(fallback_dir: str) -> str:
+    """tmpfs 모드 디렉터리. 만들 수 없으면 fallback_dir(디스크)."""
+    try:
+        os.makedirs(HLS_TMPFS_DIR, exist_ok=True)
+        if os.access(HLS_TMPFS_DIR, os.W_OK):
+            return HLS_TMPFS_DIR
+    except Exception:
+        pass
+    print(f"[HLS] tmpfs 디렉터리를 사용할 수 없어 디스크에 기록합니다: {fallback_dir}")
+    return fallback_dir
+
+
+def prepare_file_output(out_dir: str):
+    """tmpfs/disk 모드 출력 준비 → (playlist 경로, 세그먼트 location 패턴).
+    이전 실행의 세그먼트를 지우고 실행마다 다른 이름을 써서 HTTP 캐시(immutable)가 섞이지 않게 한다."""
+    for name in os.listdir(out_dir):
+        if (name.startswith('segment_') and name.endswith('.ts')) or name == PLAYLIST_NAME:
+            try:
+                os.remove(os.path.join(out_dir, name))
+            except Exception:
+                pass
+    run = int(time.time())
+    return os.path.join(out_dir, PLAYLIST_NAME), os.path.join(out_dir, f'segment_{run}_%05d.ts')
+
+
+def _ts_pid(packet: bytes) -> int:
+    return ((packet[1] & 0x1f) << 8) | packet[2]
+
+
+def _ts_payload(packet: bytes) -> bytes:
+    """TS 패킷 페이로드 (adaptation field 제외)."""
+    p = 4
+    if packet[3] & 0x20:
+        p += 1 + packet[4]
+    return packet[p:]
+
+
+def _pat_pmt_pid(packet: bytes):
+    """PAT 패킷에서 첫 프로그램의 PMT PID (없으면 None)."""
+    payload = _ts_payload(packet)
+    if not payload:
+        return None
+    s = 1 + payload[0]  # pointer_field
+    if s + 8 > len(payload):
+        return None
+    section_length = ((payload[s + 1] & 0x0f) << 8) | payload[s + 2]
+    end = min(len(payload), s + 3 + section_length - 4)  # CRC 제외
+    p = s + 8
+    while p + 4 <= end:
+        program = (payload[p] << 8) | payload[p + 1]
+        pid = ((payload[p + 2] & 0x1f) << 8) | payload[p + 3]
+        if program != 0:
+            return pid
+        p += 4
+    return None
+
+
+class HlsSegmentStore:
+    """완성된 TS 세그먼트 링 + 플레이리스트 (스레드 안전).
+
+    part_target > 0이면 저지연 모드: 작성 중인 세그먼트의 부분들을 공개하고 블로킹 요청을 지원.
+    """
+
+    def __init__(self, target_duration: float = DEFAULT_TARGET_DURATION, window: int = DEFAULT_WINDOW,
+                 max_segments: int = DEFAULT_MAX_SEGMENTS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 part_target: float = 0.0):
+        self.target_duration = float(target_duration)
+        self.window = int(window)
+        self.max_segments = max(int(max_segments), self.window)
+        self.max_bytes = int(max_bytes)
+        self.part_target = float(part_target or 0.0)
+        # [{"seq", "data", "duration", "discontinuity", "created", "parts": [(start, end, duration, independent)]}]
+        self._segments = []
+        self._open = None     # 작성 중인 세그먼트 {"seq", "parts": [(data, duration, independent)], "discontinuity"}
+        self._bytes = 0
+        # 프로세스가 재시작돼도 세그먼트 이름이 겹치지 않도록 현재 시각(초)에서 시작
+        # (세그먼트는 2초마다 하나이므로 다음 실행의 시작 번호가 항상 더 큼) → HTTP에서 immutable 캐시 가능
+        self._next_seq = int(time.time())
+        self._discontinuity = False
+        self._cond = threading.Condition()
+
+    @property
+    def low_latency(self) -> bool:
+        return self.part_target > 0
+
+    def _append(self, seg: dict) -> None:
+        self._segments.append(seg)
+        self._bytes += len(seg["data"])
+        while len(self._segments) > self.max_segments or (
+                self._bytes > self.max_bytes and len(self._segments) > 1):
+            self._bytes -= len(self._segments.pop(0)["data"])
+
+    def add_segment(self, data: bytes, duration: float) -> int:
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._append({"seq": seq, "data": data, "duration": float(duration), "parts": [],
+                          "discontinuity": self._discontinuity, "created": time.time()})
+            self._discontinuity = False
+            self._cond.notify_all()
+        return seq
+
+    def add_part(self, data: bytes, duration: float, independent: bool):
+        """작성 중인 세그먼트에 부분 추가 → (seq, part 번호). 세그먼트가 없으면 새로 시작."""
+        with self._cond:
+            if self._open is None:
+                self._open = {"seq": self._next_seq, "parts": [], "discontinuity": self._discontinuity}
+                self._next_seq += 1
+                self._discontinuity = False
+            self._open["parts"].append((data, float(duration), bool(independent)))
+            self._cond.notify_all()
+            return self._open["seq"], len(self._open["parts"]) - 1
+
+    def end_segment(self):
+        """작성 중인 세그먼트를 완료 목록으로 옮김 → seq (부분이 없으면 None)."""
+        with self._cond:
+            seq = self._end_open()
+            self._cond.notify_all()
+            return seq
+
+    def _end_open(self):
+        seg = self._open
+        self._open = None
+        if seg is None or not seg["parts"]:
+            return None
+        parts = []
+        pos = 0
+        for data, duration, independent in seg["parts"]:
+            parts.append((pos, pos + len(data), duration, independent))
+            pos += len(data)
+        self._append({"seq": seg["seq"], "data": b''.join(d for d, _du, _i in seg["parts"]),
+                      "duration": sum(p[2] for p in parts), "parts": parts,
+                      "discontinuity": seg["discontinuity"], "created": time.time()})
+        return seg["seq"]
+
+    @property
+    def next_sequence(self) -> int:
+        """다음 세그먼트에 붙을 미디어 시퀀스 번호."""
+        with self._cond:
+            return self._next_seq
+
+    def rebase(self, seq: int) -> int:
+        """다음 세그먼트 번호를 seq로 맞춤 (ABR 렌디션끼리 같은 내용에 같은 번호). 이름이 겹치지 않도록 앞으로만 이동."""
+        with self._cond:
+            self._end_open()
+            if int(seq) > self._next_seq:
+                self._next_seq = int(seq)
+                if self._segments:
+                    self._discontinuity = True
+            return self._next_seq
+
+    def mark_discontinuity(self) -> None:
+        """인코더/파이프라인 재시작: 다음 세그먼트에 EXT-X-DISCONTINUITY."""
+        with self._cond:
+            # 재시작 전 작성 중이던 세그먼트는 그때까지의 부분으로 완료 처리
+            self._end_open()
+            if self._segments:
+                self._discontinuity = True
+
+    def clear(self) -> None:
+        with self._cond:
+            self._segments = []
+            self._open = None
+            self._bytes = 0
+            self._discontinuity = False
+
+    def get(self, seq: int):
+        with self._cond:
+            for seg in self._segments:
+                if seg["seq"] == seq:
+                    return seg["data"]
+        return None
+
+    def _find_part(self, seq: int, index: int):
+        if self._open is not None and self._open["seq"] == seq:
+            parts = self._open["parts"]
+            return parts[index][0] if index < len(parts) else None
+        for seg in self._segments:
+            if seg["seq"] == seq:
+                if index < len(seg["parts"]):
+                    start, end, _d, _i = seg["parts"][index]
+                    return seg["data"][start:end]
+                return b''  # 완료된 세그먼트에 없는 부분 (기다려도 생기지 않음)
+        return None
+
+    def get_part(self, seq: int, index: int, wait: bool = True):
+        """부분 세그먼트 데이터. 예고(preload hint)된 다음 부분이면 생길 때까지 대기."""
+        deadline = time.time() + self.target_duration * BLOCK_TIMEOUT_FACTOR
+        with self._cond:
+            while True:
+                data = self._find_part(seq, index)
+                if data is not None:
+                    return data or None
+                remaining = deadline - time.time()
+                # 작성 중이거나 바로 다음 세그먼트의 부분만 기다림
+                upcoming = seq >= (self._open["seq"] if self._open is not None else self._next_seq) and \
+                    seq <= self._next_seq
+                if not wait or remaining <= 0 or not upcoming:
+                    return None
+                self._cond.wait(remaining)
+
+    def _has(self, msn: int, part) -> bool:
+        if self._open is not None and self._open["seq"] == msn:
+            return part is not None and len(self._open["parts"]) > part
+        return msn < self._next_seq and (self._open is None or msn < self._open["seq"])
+
+    def wait_for(self, msn: int, part=None) -> bool:
+        """블로킹 리로드: 세그먼트 msn(의 부분 part)이 플레이리스트에 오를 때까지 대기."""
+        deadline = time.time() + self.target_duration * BLOCK_TIMEOUT_FACTOR
+        with self._cond:
+            while not self._has(msn, part):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def wait_ready(self, timeout: float) -> bool:
+        """재생할 내용(세그먼트, 저지연 모드면 부분 세그먼트)이 생길 때까지 대기 (온디맨드 시작 직후)."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while not (self._segments or (self._open is not None and self._open["parts"])):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"segments": len(self._segments), "bytes": self._bytes,
+                    "last_seq": self._segments[-1]["seq"] if self._segments else None,
+                    "open_parts": len(self._open["parts"]) if self._open is not None else 0}
+
+    def playlist(self) -> bytes:
+        with self._cond:
+            segs = self._segments[-self.window:]
+            open_seg = None
+            if self._open is not None:
+                open_seg = {"seq": self._open["seq"], "discontinuity": self._open["discontinuity"],
+                            "parts": [(d, i) for _data, d, i in self._open["parts"]]}
+        target = max([self.target_duration] + [s["duration"] for s in segs])
+        first_seq = segs[0]["seq"] if segs else (open_seg["seq"] if open_seg else 0)
+        lines = [
+            '#EXTM3U',
+            f'#EXT-X-VERSION:{6 if self.low_latency else 3}',
+            f'#EXT-X-TARGETDURATION:{int(math.ceil(target))}',
+            f'#EXT-X-MEDIA-SEQUENCE:{first_seq}',
+        ]
+        if self.low_latency:
+            lines.insert(2, f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={self.part_target * 3:.3f}')
+            lines.insert(3, f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}')
+        for n, s in enumerate(segs):
+            if s["discontinuity"]:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if self.low_latency and n >= len(segs) - PART_SEGMENTS:
+                for i, (_start, _end, d, independent) in enumerate(s["parts"]):
+                    lines.append(self._part_line(s["seq"], i, d, independent))
+            lines.append(f'#EXTINF:{s["duration"]:.3f},')
+            lines.append(SEGMENT_NAME.format(s["seq"]))
+        if self.low_latency:
+            if open_seg is not None:
+                if open_seg["discontinuity"]:
+                    lines.append('#EXT-X-DISCONTINUITY')
+                for i, (d, independent) in enumerate(open_seg["parts"]):
+                    lines.append(self._part_line(open_seg["seq"], i, d, independent))
+                hint = (open_seg["seq"], len(open_seg["parts"]))
+            else:
+                hint = (self._next_seq, 0)
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{PART_NAME.format(*hint)}"')
+        return ('\n'.join(lines) + '\n').encode('ascii')
+
+    @staticmethod
+    def _part_line(seq: int, index: int, duration: float, independent: bool) -> str:
+        line = f'#EXT-X-PART:DURATION={duration:.3f},URI="{PART_NAME.format(seq, index)}"'
+        return line + ',INDEPENDENT=YES' if independent else line
+
+    def respond(self, path: str):
+        """HTTP 경로 → (content-type, 본문). 저장소 대상이 아니거나 없는 세그먼트면 None."""
+        path, _, query = path.partition('?')
+        if path == '/' + PLAYLIST_NAME:
+            if self.low_latency and query:
+                q = parse_qs(query)
+                try:
+                    msn = int(q['_HLS_msn'][0]) if '_HLS_msn' in q else None
+                    part = int(q['_HLS_part'][0]) if '_HLS_part' in q else None
+                except ValueError:
+                    msn = part = None
+                if msn is not None:
+                    self.wait_for(msn, part)
+            return PLAYLIST_CONTENT_TYPE, self.playlist()
+        m = _SEGMENT_RE.match(path)
+        if m:
+            data = self.get(int(m.group(1)))
+            if data is not None:
+                return SEGMENT_CONTENT_TYPE, data
+            return None
+        m = _PART_RE.match(path)
+        if m and self.low_latency:
+            data = self.get_part(int(m.group(1)), int(m.group(2)))
+            if data is not None:
+                return SEGMENT_CONTENT_TYPE, data
+        return None
+
+
+class TsSegmenter:
+    """mpegtsmux 출력(appsink)을 키프레임 경계에서 잘라 HlsSegmentStore에 넣는다.
+    저지연 모드에서는 part_target마다 부분 세그먼트도 함께 넣는다.
+
+    segmenter = TsSegmenter(store)
+    appsink.connect('new-sample', segmenter.on_new_sample)
+    """
+
+    def __init__(self, store: HlsSegmentStore, on_segment=None):
+        self.store = store
+        self.on_segment = on_segment
+        self._chunks = []       # 현재 세그먼트(저지연 모드에서는 현재 부분)의 버퍼
+        self._start_pts = None  # 현재 세그먼트 시작
+        self._part_pts = None   # 현재 부분 시작
+        self._part_independent = False
+        self._seg_bytes = 0
+        self._pat = None
+        self._pmt = None
+        self._pmt_pid = None
+
+    def _scan_headers(self, data: bytes) -> None:
+        """PAT/PMT 패킷을 기억해 둔다 (세그먼트가 PAT/PMT 없이 시작하면 앞에 붙임)."""
+        for p in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            pkt = data[p:p + TS_PACKET_SIZE]
+            if pkt[0] != TS_SYNC_BYTE or not (pkt[1] & 0x40):
+                continue
+            pid = _ts_pid(pkt)
+            if pid == 0:
+                self._pat = pkt
+                self._pmt_pid = _pat_pmt_pid(pkt)
+            elif self._pmt_pid is not None and pid == self._pmt_pid:
+                self._pmt = pkt
+
+    def push(self, data: bytes, pts_ns, keyframe: bool) -> None:
+        if self._pat is None or self._pmt is None or keyframe:
+            self._scan_headers(data)
+        if pts_ns is not None:
+            if keyframe and self._start_pts is not None and (self._chunks or self._seg_bytes) and \
+                    (pts_ns - self._start_pts) / 1e9 >= self.store.target_duration * 0.95:
+                self._close(pts_ns)
+            elif self.store.low_latency and self._part_pts is not None and self._chunks and \
+                    (pts_ns - self._part_pts) / 1e9 >= self.store.part_target * 0.95:
+                self._flush_part(pts_ns)
+            if self._start_pts is None and keyframe:
+                self._start_pts = pts_ns
+                self._seg_bytes = 0
+            if self._part_pts is None and self._start_pts is not None:
+                self._part_pts = pts_ns
+                self._part_independent = keyframe
+        if self._start_pts is None:
+            # 첫 키프레임 이전 데이터는 디코드할 수 없으므로 버림
+            return
+        if not self._chunks and not self._seg_bytes and self._pat is not None and self._pmt is not None and \
+                not (len(data) >= TS_PACKET_SIZE and _ts_pid(data) == 0):
+            self._chunks.extend((self._pat, self._pmt))
+        self._chunks.append(data)
+
+    def _flush_part(self, next_pts_ns: int) -> None:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._seg_bytes += len(data)
+        self.store.add_part(data, (next_pts_ns - self._part_pts) / 1e9, self._part_independent)
+        self._part_pts = None
+
+    def _close(self, next_pts_ns: int) -> None:
+        duration = (next_pts_ns - self._start_pts) / 1e9
+        if self.store.low_latency:
+            if self._chunks:
+                self._flush_part(next_pts_ns)
+            size = self._seg_bytes
+            seq = self.store.end_segment()
+        else:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            size = len(data)
+            seq = self.store.add_segment(data, duration)
+        self._start_pts = None
+        self._part_pts = None
+        self._seg_bytes = 0
+        if self.on_segment is not None and seq is not None:
+            try:
+                self.on_segment(seq, duration, size)
+            except Exception:
+                pass
+
+    def on_new_sample(self, sink):
+        """appsink new-sample 콜백 (스트리밍 스레드)."""
+        from gi.repository import Gst
+        sample = sink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.OK
+        try:
+            data = bytes(info.data)
+        finally:
+            buf.unmap(info)
+        pts = buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else None
+        keyframe = not buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        self.push(data, pts, keyframe)
+        return Gst.FlowReturn.OK
+
+
+def create_store() -> HlsSegmentStore:
+    """환경 변수(HLS_LOW_LATENCY / HLS_PART_MS)에 맞는 저장소 생성."""
+    part = HLS_PART_SEC if HLS_LOW_LATENCY else 0.0
+    if part:
+        print(f"[HLS] 저지연 모드: 부분 세그먼트 {part * 1000:.0f}ms")
+    return HlsSegmentStore(target_duration=DEFAULT_TARGET_DURATION, window=DEFAULT_WINDOW,
+                           max_segments=DEFAULT_MAX_SEGMENTS, part_target=part)
+
+
+def master_playlist(variants) -> bytes:
+    """ABR 마스터 플레이리스트. variants: [{"uri", "bandwidth"(bps), "width", "height", "fps"}] (높은 화질부터)."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for v in variants:
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={int(v["bandwidth"])},RESOLUTION={int(v["width"])}x{int(v["height"])},'
+                     f'FRAME-RATE={float(v["fps"]):.3f}')
+        lines.append(v["uri"])
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def memory_sink_desc(name: str = 'hls_mem_sink') -> str:
+    """h264parse 뒤에 붙일 메모리 HLS 싱크 (mpegtsmux → appsink)."""
+    return (f"mpegtsmux ! appsink name={name} emit-signals=true sync=false async=false "
+            f"max-buffers=256 drop=false")
+
+
+def attach_memory_sink(pipeline, store: HlsSegmentStore, name: str = 'hls_mem_sink', on_segment=None) -> TsSegmenter:
+    """파이프라인의 appsink를 저장소에 연결하고 TsSegmenter 반환."""
+    sink = pipeline.get_by_name(name)
+    if sink is None:
+        raise RuntimeError(f'appsink 없음: {name}')
+    segmenter = TsSegmenter(store, on_segment)
+    sink.connect('new-sample', segmenter.on_new_sample)
+    store.mark_discontinuity()
+    return segmenter
+
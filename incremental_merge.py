@@ -0,0 +1,445 @@
+"""
+세그먼트 점진 병합 (조각 MP4 / fMP4)
+
+세그먼트가 마무리되는 즉시 일별/세션별 출력 파일 끝에 moof+mdat 조각으로 이어 붙입니다.
+출력은 매 추가 후에도 재생 가능한 상태를 유지하므로, 예약 병합은 이름 변경 수준의 마무리 단계만 남습니다.
+
+파일 구성:
+  ftyp | moov(mvex/mehd/trex) | free(예약) | moof mdat | moof mdat | ...
+
+- SPS/PPS가 바뀐 세그먼트는 예약 영역 안에서 moov를 다시 써서 stsd 엔트리를 추가
+- 해상도/코덱이 다른 세그먼트만 재인코딩 (mp4_merge와 동일 규칙)
+- 매 추가마다 조각을 fsync한 뒤 mehd(전체 길이)를 갱신하므로, 재부팅 시에도 마지막 완료 조각까지 보존
+- 다시 열 때 마지막 조각이 잘려 있으면 직전 완료 조각 끝으로 잘라냄
+- 추가된 세그먼트 목록은 <출력>.json 사이드카에 기록 (같은 세그먼트 중복 추가 방지)
+- 추가 전에 사이드카에 의도(pending: 세그먼트 이름, 추가 전 출력 크기)를 먼저 기록하고, 추가가 끝나면 지움.
+  사이드카에 반영되기 전에 멈췄다면 다시 열 때 출력을 그 크기로 잘라내므로 재제출해도 영상이 중복되지 않음
+- 세그먼트별 출력 내 위치(placements)와 submit(meta=...)로 받은 정보(세션 시각, 파라미터 타임라인)도 함께 기록
+- 조각 MP4 세그먼트(RECORDING_FRAGMENT_SEC)는 원본 조각 단위로 moof를 새로 쓰고 데이터는 그대로 이어 붙임
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+from mp4_utils import iter_boxes, iter_boxes_bytes, find_child
+from mp4_merge import (Mp4MergeError, FTYP, box, full_box, build_moov, read_video_track, needs_reencode,
+                       reencode_segment, estimate_bitrate_kbps, first_sync_index, rebase_timing,
+                       write_all, write_samples)
+
+# ftyp 뒤 moov+free가 차지하는 고정 영역 (stsd 엔트리가 늘어나도 조각 위치가 바뀌지 않도록)
+INIT_RESERVED_BYTES = 64 * 1024
+TRACK_ID = 1
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+
+def _fsync(f) -> None:
+    try:
+        os.fsync(f.fileno())
+    except Exception:
+        pass
+
+
+class IncrementalMerger:
+    """출력 fMP4 하나에 세그먼트를 순서대로 추가하는 병합기 (전용 스레드에서 처리).
+
+    merger = IncrementalMerger('/video/video_20250101_motion_merging.mp4')
+    merger.submit(seg_path, on_done=lambda path, ok: ...)
+    merger.finalize('/video/video_20250101_180000_merge_raw.mp4')
+    """
+
+    def __init__(self, output_path: str, reencode: bool = True):
+        self.output_path = output_path
+        self.sidecar_path = output_path + '.json'
+        self.reencode = reencode
+        self.timescale = 0
+        self.width = 0
+        self.height = 0
+        self.bitrate_kbps = 4000
+        self.entries = []
+        self.sequence = 0
+        self.next_decode_time = 0
+        self.segments = []
+        self.placements = []   # [{"segment", "start_s", "duration_s", ...meta}]
+        self.failed = []
+        self.closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._pending_paths = set()  # 추가 대기 중인 세그먼트 (용량 관리 삭제 제외용)
+        self._thread = None
+        if os.path.isfile(output_path):
+            self._recover()
+
+    # --- 상태 복구 ---
+    def _recover(self) -> None:
+        try:
+            with open(self.sidecar_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception:
+            state = {}
+        pending = state.get("pending")
+        size = os.path.getsize(self.output_path)
+        if pending:
+            # 사이드카에 반영되지 않은 추가: 추가 전 크기로 되돌림 (세그먼트는 다시 제출되면 새로 추가)
+            pending_size = int(pending.get("size", size))
+            if pending_size < size:
+                print(f"[증분병합] 완료되지 않은 추가 되돌림: {pending.get('segment')} ({size - pending_size}바이트)")
+                with open(self.output_path, 'r+b') as f:
+                    f.truncate(pending_size)
+                    _fsync(f)
+                size = pending_size
+        with open(self.output_path, 'rb') as f:
+            good_end = 0
+            moof_off = None
+            for btype, off, bsize, hsz in iter_boxes(f, 0, size):
+                end = off + bsize
+                if end > size:
+                    break
+                if btype in (b'ftyp', b'free'):
+                    good_end = end
+                elif btype == b'moov':
+                    f.seek(off)
+                    self._load_moov(f.read(bsize), hsz)
+                    good_end = end
+                elif btype == b'moof':
+                    f.seek(off)
+                    moof_off = (off, f.read(bsize), hsz)
+                elif btype == b'mdat' and moof_off is not None:
+                    self._load_moof(moof_off[1], moof_off[2])
+                    moof_off = None
+                    good_end = end
+        if not self.entries:
+            raise Mp4MergeError(f'초기화 moov 없음: {self.output_path}')
+        if good_end < size:
+            print(f"[증분병합] 잘린 조각 제거: {self.output_path} ({size - good_end}바이트)")
+            with open(self.output_path, 'r+b') as f:
+                f.truncate(good_end)
+                _fsync(f)
+        self.segments = list(state.get("segments", []))
+        self.placements = list(state.get("placements", []))
+        if pending:
+            # 되돌린 조각 길이가 mehd에 반영됐을 수 있으므로 다시 쓰고 의도 기록을 지움
+            with open(self.output_path, 'r+b', buffering=0) as f:
+                self._write_init(f)
+            self._save_sidecar()
+        print(f"[증분병합] 이어쓰기: {self.output_path} (조각 {self.sequence}개, "
+              f"{self.next_decode_time / float(self.timescale):.1f}s)")
+
+    def _load_moov(self, moov: bytes, hsz: int) -> None:
+        trak = find_child(moov, [b'trak'], hsz)
+        t_start, t_end = trak[0] + trak[2], trak[0] + trak[1]
+        mdhd = find_child(moov, [b'mdia', b'mdhd'], t_start, t_end)
+        p = mdhd[0] + mdhd[2]
+        self.timescale = struct.unpack_from('>I', moov, p + 4 + (16 if moov[p] == 1 else 8))[0]
+        stsd = find_child(moov, [b'mdia', b'minf', b'stbl', b'stsd'], t_start, t_end)
+        self.entries = [bytes(moov[off:off + bsize])
+                        for _t, off, bsize, _h in iter_boxes_bytes(moov, stsd[0] + stsd[2] + 8, stsd[0] + stsd[1])]
+        self.width, self.height = struct.unpack_from('>HH', self.entries[0], 32)
+
+    def _load_moof(self, moof: bytes, hsz: int) -> None:
+        mfhd = find_child(moof, [b'mfhd'], hsz)
+        self.sequence = max(self.sequence, struct.unpack_from('>I', moof, mfhd[0] + mfhd[2] + 4)[0])
+        traf = find_child(moof, [b'traf'], hsz)
+        t_start, t_end = traf[0] + traf[2], traf[0] + traf[1]
+        tfdt = find_child(moof, [b'tfdt'], t_start, t_end)
+        p = tfdt[0] + tfdt[2]
+        base = struct.unpack_from('>Q' if moof[p] == 1 else '>I', moof, p + 4)[0]
+        trun = find_child(moof, [b'trun'], t_start, t_end)
+        p = trun[0] + trun[2]
+        flags = struct.unpack_from('>I', moof, p)[0] & 0xFFFFFF
+        count = struct.unpack_from('>I', moof, p + 4)[0]
+        p += 8
+        if flags & 0x000001:
+            p += 4
+        if flags & 0x000004:
+            p += 4
+        per_sample = 4 * bin(flags & 0x000F00).count('1')
+        total = 0
+        if flags & 0x000100:
+            for i in range(count):
+                total += struct.unpack_from('>I', moof, p + i * per_sample)[0]
+        self.next_decode_time = max(self.next_decode_time, base + total)
+
+    # --- 초기화 세그먼트 ---
+    def _mvex(self) -> bytes:
+        movie_duration = int(round(self.next_decode_time * 1000 / float(self.timescale))) if self.timescale else 0
+        mehd = full_box(b'mehd', 1, 0, struct.pack('>Q', movie_duration))
+        trex = full_box(b'trex', 0, 0, struct.pack('>IIIII', TRACK_ID, 1, 0, 0, 0))
+        return box(b'mvex', mehd, trex)
+
+    def _init_region(self) -> bytes:
+        empty = [
+            full_box(b'stsd', 0, 0, struct.pack('>I', len(self.entries)), *self.entries),
+            full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+            full_box(b'stco', 0, 0, struct.pack('>I', 0)),
+        ]
+        moov = build_moov(self.timescale, self.width, self.height, 0, empty, self._mvex())
+        free = INIT_RESERVED_BYTES - len(moov)
+        if free < 8:
+            raise Mp4MergeError(f'초기화 영역 부족: moov {len(moov)}바이트')
+        return moov + struct.pack('>I4s', free, b'free') + bytes(free - 8)
+
+    def _write_init(self, f) -> None:
+        f.seek(len(FTYP))
+        write_all(f, self._init_region())
+        _fsync(f)
+
+    # --- 추가 ---
+    def _entry_index(self, entry: bytes, f) -> int:
+        if entry in self.entries:
+            return self.entries.index(entry) + 1
+        self.entries.append(entry)
+        try:
+            self._write_init(f)
+        except Mp4MergeError:
+            self.entries.pop()
+            raise
+        return len(self.entries)
+
+    def _moof(self, sdi: int, base_decode: int, durations, sizes, syncs, cts) -> bytes:
+        flags = 0x000001 | 0x000100 | 0x000200 | 0x000400
+        version = 0
+        if cts is not None:
+            flags |= 0x000800
+            version = 1 if any(c < 0 for c in cts) else 0
+        fmt = '>IIIi' if cts is not None else '>III'
+        rows = []
+        for i in range(len(sizes)):
+            row = (durations[i], sizes[i], SAMPLE_FLAGS_SYNC if syncs[i] else SAMPLE_FLAGS_NON_SYNC)
+            if cts is not None:
+                row += (cts[i],)
+            rows.append(struct.pack(fmt, *row))
+
+        def build(data_offset):
+            mfhd = full_box(b'mfhd', 0, 0, struct.pack('>I', self.sequence + 1))
+            # default-base-is-moof + sample-description-index-present
+            tfhd = full_box(b'tfhd', 0, 0x020000 | 0x000002, struct.pack('>II', TRACK_ID, sdi))
+            tfdt = full_box(b'tfdt', 1, 0, struct.pack('>Q', base_decode))
+            trun = full_box(b'trun', version, flags, struct.pack('>Ii', len(sizes), data_offset), *rows)
+            return box(b'moof', mfhd, box(b'traf', tfhd, tfdt, trun))
+
+        size = len(build(0))
+        return build(size + 8)
+
+    def _append_fragment(self, f, track, start: int, end: int, sdi: int, durations, cts) -> None:
+        sizes = track.sizes[start:end]
+        syncs = [track.is_sync(i) for i in range(start, end)]
+        moof = self._moof(sdi, self.next_decode_time, durations, sizes, syncs, cts)
+        total = sum(sizes)
+        if total + 8 > 0xFFFFFFFF:
+            raise Mp4MergeError('조각이 너무 큽니다')
+        f.seek(0, os.SEEK_END)
+        write_all(f, moof)
+        write_all(f, struct.pack('>I4s', total + 8, b'mdat'))
+        write_samples(f, track, start, end)
+        self.sequence += 1
+        self.next_decode_time += sum(durations)
+
+    def _create(self, track) -> None:
+        self.timescale = track.timescale
+        self.width, self.height = track.width, track.height
+        self.bitrate_kbps = estimate_bitrate_kbps(track)
+        self.entries = list(track.entries[:1])
+        d = os.path.dirname(self.output_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.output_path, 'wb', buffering=0) as f:
+            write_all(f, FTYP)
+            write_all(f, self._init_region())
+            _fsync(f)
+
+    def _append_segment(self, track, first: int, durations, cts) -> None:
+        with open(self.output_path, 'r+b', buffering=0) as f:
+            # 샘플 엔트리가 바뀌는 지점마다 조각을 나눔 (tfhd의 sample_description_index)
+            # 조각 MP4 세그먼트는 원본 조각 경계도 유지 → 조각마다 moof 하나 + 연속 데이터 한 번 복사
+            boundaries = set(track.fragment_starts)
+            run_start = first
+            for i in range(first + 1, track.sample_count + 1):
+                if i == track.sample_count or track.sdi[i] != track.sdi[run_start] or i in boundaries:
+                    sdi = self._entry_index(track.entries[track.sdi[run_start] - 1], f)
+                    a, b = run_start - first, i - first
+                    self._append_fragment(f, track, run_start, i, sdi, durations[a:b],
+                                          cts[a:b] if cts is not None else None)
+                    run_start = i
+            _fsync(f)
+            # 조각이 디스크에 기록된 뒤에 전체 길이(mehd) 갱신
+            self._write_init(f)
+
+    def _rollback(self, size: int, sequence: int, decode_time: int) -> None:
+        """추가 도중 실패: 출력과 상태를 추가 전으로 되돌리고 의도 기록을 지움."""
+        self.sequence = sequence
+        self.next_decode_time = decode_time
+        try:
+            with open(self.output_path, 'r+b', buffering=0) as f:
+                f.truncate(size)
+                self._write_init(f)
+            self._save_sidecar()
+        except Exception as e:
+            print(f"[증분병합] 되돌리기 실패 (다시 열 때 복구): {e}")
+
+    def append(self, segment_path: str, meta: dict = None) -> bool:
+        """세그먼트 하나를 즉시 추가 (호출 스레드에서 실행). 이미 추가된 세그먼트면 True."""
+        with self._lock:
+            if self.closed:
+                raise Mp4MergeError(f'이미 마무리된 출력: {self.output_path}')
+            name = os.path.basename(segment_path)
+            if name in self.segments:
+                return True
+            track = read_video_track(segment_path)
+            tmp = None
+            try:
+                if not self.entries:
+                    self._create(track)
+                if needs_reencode(track, self.width, self.height):
+                    if not self.reencode:
+                        raise Mp4MergeError(f'파라미터 불일치: {segment_path} ({track.width}x{track.height})')
+                    tmp = f"{self.output_path}.reenc.mp4"
+                    print(f"[증분병합] 재인코딩: {segment_path} ({track.width}x{track.height} → {self.width}x{self.height})")
+                    reencode_segment(segment_path, tmp, self.width, self.height, self.bitrate_kbps)
+                    track = read_video_track(tmp)
+                first = first_sync_index(track)
+                if first is None:
+                    raise Mp4MergeError(f'키프레임 없음: {segment_path}')
+                durations, cts = rebase_timing(track, self.timescale, first)
+                start_ticks = self.next_decode_time
+                start_sequence = self.sequence
+                # 쓰기 전에 의도를 기록: 사이드카 반영 전에 멈추면 다시 열 때 이 크기로 되돌림
+                start_size = os.path.getsize(self.output_path)
+                self._save_sidecar(pending={"segment": name, "size": start_size})
+                try:
+                    self._append_segment(track, first, durations, cts)
+                except Exception:
+                    self._rollback(start_size, start_sequence, start_ticks)
+                    raise
+                self.segments.append(name)
+                placement = dict(meta or {})
+                placement.update(segment=name, start_s=round(start_ticks / float(self.timescale), 6),
+                                 duration_s=round((self.next_decode_time - start_ticks) / float(self.timescale), 6))
+                self.placements.append(placement)
+                self._save_sidecar()
+            finally:
+                if tmp is not None:
+                    try:
+                        os.remove(tmp)
+                    except Exception:
+                        pass
+            print(f"[증분병합] 추가: {name} → {os.path.basename(self.output_path)} "
+                  f"({self.next_decode_time / float(self.timescale):.1f}s)")
+            return True
+
+    def _save_sidecar(self, pending: dict = None) -> None:
+        state = {
+            "output": self.output_path,
+            "segments": self.segments,
+            "placements": self.placements,
+            "fragments": self.sequence,
+            "duration_s": round(self.next_decode_time / float(self.timescale), 3) if self.timescale else 0.0,
+            "updated_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        if pending:
+            state["pending"] = pending
+        tmp = self.sidecar_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            _fsync(f)
+        os.replace(tmp, self.sidecar_path)
+
+    # --- 백그라운드 처리 ---
+    def submit(self, segment_path: str, on_done=None, meta: dict = None) -> None:
+        """세그먼트 추가를 전용 스레드에 맡긴다. on_done(path, ok)는 처리 후 호출, meta는 placements에 기록."""
+        with self._pending_cond:
+            self._pending += 1
+            self._pending_paths.add(segment_path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='incremental-merge', daemon=True)
+                self._thread.start()
+        self._queue.put((segment_path, on_done, meta))
+
+    def _run(self) -> None:
+        while True:
+            segment_path, on_done, meta = self._queue.get()
+            ok = False
+            try:
+                ok = self.append(segment_path, meta)
+            except Exception as e:
+                print(f"[증분병합] 추가 실패: {segment_path}: {e}")
+                self.failed.append(segment_path)
+            finally:
+                with self._pending_cond:
+                    self._pending -= 1
+                    self._pending_cond.notify_all()
+            if on_done is not None:
+                try:
+                    on_done(segment_path, ok)
+                except Exception as e:
+                    print(f"[증분병합] 콜백 실패: {e}")
+            # 콜백이 원본을 지우거나 다른 작업에 넘길 때까지 보호
+            with self._pending_cond:
+                self._pending_paths.discard(segment_path)
+
+    def pending_count(self) -> int:
+        with self._pending_cond:
+            return self._pending
+
+    def is_pending(self, segment_path: str) -> bool:
+        """세그먼트가 추가 대기/처리 중인지."""
+        with self._pending_cond:
+            return segment_path in self._pending_paths
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.time() + float(timeout)
+        with self._pending_cond:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_cond.wait(remaining)
+        return True
+
+    def duration_s(self) -> float:
+        return self.next_decode_time / float(self.timescale) if self.timescale else 0.0
+
+    def finalize(self, final_path: str = None, timeout: float = None, before_rename=None) -> dict:
+        """남은 추가 작업을 기다린 뒤 출력 이름을 확정하고 닫는다. 추가된 세그먼트가 없으면 None.
+
+        before_rename(final_path, segments)는 이름 확정 직전에 호출 (확정 파일이 보이기 전에 사이드카 기록용).
+        """
+        self.wait_idle(timeout)
+        with self._lock:
+            self.closed = True
+            if not self.segments:
+                # 초기화 영역만 기록된 출력은 남기지 않음
+                for path in (self.output_path, self.sidecar_path):
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+                return None
+            final_path = final_path or self.output_path
+            if before_rename is not None:
+                before_rename(final_path, list(self.segments))
+            if final_path != self.output_path:
+                os.replace(self.output_path, final_path)
+            try:
+                os.remove(self.sidecar_path)
+            except Exception:
+                pass
+            result = {
+                "path": final_path,
+                "segments": list(self.segments),
+                "placements": list(self.placements),
+                "failed": list(self.failed),
+                "fragments": self.sequence,
+                "duration_s": round(self.duration_s(), 3),
+            }
+        print(f"[증분병합] 마무리: {final_path} (세그먼트 {len(result['segments'])}개, {result['duration_s']:.1f}s)")
+        return result
@@ -0,0 +1,304 @@
+"""
+디스크 기반 백그라운드 작업 큐 (병합/검증/업로드/삭제)
+
+작업 하나는 <root>/<job_id>.json 파일 하나이며, 상태 전이는 임시 파일 기록 후 os.replace로 원자적으로 반영됩니다.
+프로세스가 작업 도중 죽으면 재시작 시 running 작업을 다시 queued로 돌려 이어서 처리합니다.
+
+- 상태: queued → running → done | failed (실패 시 지수 백오프 후 다시 queued, 최대 시도 횟수 초과 시 failed)
+- 핸들러: handler(job) → 후속 작업 [(type, payload), ...] 또는 None. 예외 시 재시도, PermanentJobError는 즉시 failed
+- 후속 작업 ID는 부모 ID에서 결정적으로 만들어, 부모 완료 기록 전에 죽어도 중복 생성되지 않음
+- 작업 유형별 동시 실행 수 제한, 작업 스레드는 nice/ionice로 캡처 루프보다 낮은 우선순위에서 실행
+
+예)
+  q = JobQueue('/video/.jobs', {'merge': do_merge, 'delete': do_delete}, concurrency={'merge': 1})
+  q.start()
+  q.enqueue('merge', {"segments": [...], "output": "..."}, job_id='merge-20250101')
+"""
+
+import ctypes
+import json
+import os
+import platform
+import threading
+import time
+import uuid
+
+import metrics
+
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SEC = 30.0
+RETRY_MAX_SEC = 3600.0
+# 완료/실패 작업 파일 보존 기간(초)
+JOB_RETENTION_SEC = 7 * 24 * 3600
+
+# ioprio_set 시스템 콜 번호 (아키텍처별)
+_IOPRIO_SET_NR = {'x86_64': 251, 'aarch64': 30, 'armv7l': 314, 'armv6l': 314, 'i686': 289}
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+
+
+class PermanentJobError(Exception):
+    """재시도해도 성공할 수 없는 작업 오류 (입력 파일 없음 등)."""
+
+
+def lower_thread_priority(nice: int = 10, io_class: int = IOPRIO_CLASS_IDLE, io_level: int = 7) -> None:
+    """현재 스레드의 CPU nice 값과 IO 우선순위를 낮춘다 (Linux에서 스레드 단위로 적용)."""
+    tid = threading.get_native_id()
+    if nice:
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, max(os.getpriority(os.PRIO_PROCESS, tid), int(nice)))
+        except Exception:
+            pass
+    nr = _IOPRIO_SET_NR.get(platform.machine())
+    if nr is None or io_class is None:
+        return
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        value = (int(io_class) << _IOPRIO_CLASS_SHIFT) | (0 if io_class == IOPRIO_CLASS_IDLE else int(io_level))
+        libc.syscall(nr, _IOPRIO_WHO_PROCESS, tid, value)
+    except Exception:
+        pass
+
+
+def retry_delay_sec(attempts: int) -> float:
+    return min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** max(0, int(attempts) - 1)))
+
+
+class JobQueue:
+    def __init__(self, root_dir: str, handlers: dict, concurrency: dict = None, max_workers: int = 2,
+                 nice: int = 10, io_class: int = IOPRIO_CLASS_IDLE, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.root_dir = root_dir
+        self.handlers = dict(handlers)
+        self.concurrency = dict(concurrency or {})
+        self.max_workers = max(1, int(max_workers))
+        self.nice = nice
+        self.io_class = io_class
+        self.max_attempts = int(max_attempts)
+        self._jobs = {}
+        self._running = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        os.makedirs(root_dir, exist_ok=True)
+        self._load()
+
+    # --- 저장 ---
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.root_dir, f'{job_id}.json')
+
+    def _save(self, job: dict) -> None:
+        job["updated_at"] = time.time()
+        path = self._path(job["id"])
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+            f.flush()
+            try:
+                os.fsync(f.fileno())
+            except Exception:
+                pass
+        os.replace(tmp, path)
+
+    def _load(self) -> None:
+        now = time.time()
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if name.endswith('.tmp'):
+                # 기록 도중 중단된 임시 파일 (원본은 이전 상태로 남아 있음)
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except Exception as e:
+                print(f"[JOB] 작업 파일 읽기 실패, 제외: {name}: {e}")
+                continue
+            if job.get("state") in ('done', 'failed'):
+                if now - float(job.get("updated_at", now)) > JOB_RETENTION_SEC:
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+                    continue
+            elif job.get("state") == 'running':
+                # 실행 중 프로세스 종료: 다시 대기열로 (시도 횟수는 시작 시 이미 기록됨)
+                job["state"] = 'queued'
+                job["last_error"] = 'interrupted'
+                self._save(job)
+                print(f"[JOB] 중단된 작업 재개: {job['id']} ({job['type']})")
+            self._jobs[job["id"]] = job
+
+    # --- 공개 API ---
+    def enqueue(self, job_type: str, payload: dict, job_id: str = None, max_attempts: int = None,
+                delay_sec: float = 0.0) -> dict:
+        """작업 추가. 같은 ID의 작업이 이미 있으면 새로 만들지 않고 기존 작업을 반환."""
+        if job_type not in self.handlers:
+            raise ValueError(f'알 수 없는 작업 유형: {job_type}')
+        job_id = job_id or f'{job_type}-{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        with self._cond:
+            existing = self._jobs.get(job_id)
+            if existing is not None:
+                return dict(existing)
+            now = time.time()
+            job = {
+                "id": job_id,
+                "type": job_type,
+                "payload": payload,
+                "state": 'queued',
+                "attempts": 0,
+                "max_attempts": int(max_attempts or self.max_attempts),
+                "not_before": now + float(delay_sec),
+                "created_at": now,
+                "updated_at": now,
+                "last_error": None,
+                "result": None,
+            }
+            self._save(job)
+            self._jobs[job_id] = job
+            self._cond.notify_all()
+        print(f"[JOB] 추가: {job_id} ({job_type})")
+        return dict(job)
+
+    def get(self, job_id: str):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self, state: str = None) -> list:
+        with self._cond:
+            jobs = [dict(j) for j in self._jobs.values() if state is None or j.get("state") == state]
+        return sorted(jobs, key=lambda j: j.get("created_at", 0))
+
+    def counts(self) -> dict:
+        out = {s: 0 for s in JOB_STATES}
+        with self._cond:
+            for j in self._jobs.values():
+                out[j.get("state")] = out.get(j.get("state"), 0) + 1
+        return out
+
+    def retry(self, job_id: str) -> bool:
+        """failed 작업을 다시 대기열에 넣는다 (시도 횟수 초기화)."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.get("state") != 'failed':
+                return False
+            job.update(state='queued', attempts=0, not_before=time.time())
+            self._save(job)
+            self._cond.notify_all()
+        return True
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self.max_workers):
+                t = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                self._threads.append(t)
+                t.start()
+        metrics.JOBS.set_function(lambda: self.counts()["queued"], state='queued')
+        metrics.JOBS.set_function(lambda: self.counts()["running"], state='running')
+        metrics.JOBS.set_function(lambda: self.counts()["failed"], state='failed')
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """대기 중/실행 중 작업이 없을 때까지 대기 (재시도 대기 중인 작업 포함)."""
+        deadline = None if timeout is None else time.time() + float(timeout)
+        with self._cond:
+            while any(j["state"] in ('queued', 'running') for j in self._jobs.values()):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    # --- 실행 ---
+    def _next_job(self):
+        """실행 가능한 가장 오래된 작업과 다음 확인까지 대기 시간 반환 (self._cond 안에서 호출)."""
+        now = time.time()
+        wake = None
+        best = None
+        for job in self._jobs.values():
+            if job["state"] != 'queued':
+                continue
+            limit = self.concurrency.get(job["type"])
+            if limit is not None and self._running.get(job["type"], 0) >= limit:
+                continue
+            if job["not_before"] > now:
+                wait = job["not_before"] - now
+                wake = wait if wake is None else min(wake, wait)
+                continue
+            if best is None or job["created_at"] < best["created_at"]:
+                best = job
+        return best, wake
+
+    def _worker(self) -> None:
+        lower_thread_priority(self.nice, self.io_class)
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    job, wake = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait(wake if wake is not None else 5.0)
+                job["state"] = 'running'
+                job["attempts"] += 1
+                job["started_at"] = time.time()
+                self._save(job)
+                self._running[job["type"]] = self._running.get(job["type"], 0) + 1
+                snapshot = json.loads(json.dumps(job))
+            try:
+                self._run_job(job, snapshot)
+            finally:
+                with self._cond:
+                    self._running[job["type"]] -= 1
+                    self._cond.notify_all()
+
+    def _run_job(self, job: dict, snapshot: dict) -> None:
+        t0 = time.time()
+        try:
+            result = self.handlers[job["type"]](snapshot)
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError)
+            with self._cond:
+                job["last_error"] = str(e)
+                if permanent or job["attempts"] >= job["max_attempts"]:
+                    job["state"] = 'failed'
+                    print(f"[JOB] 실패: {job['id']} ({job['type']}, {job['attempts']}회): {e}")
+                else:
+                    delay = retry_delay_sec(job["attempts"])
+                    job["state"] = 'queued'
+                    job["not_before"] = time.time() + delay
+                    print(f"[JOB] 재시도 예정: {job['id']} ({job['type']}) {delay:.0f}초 후: {e}")
+                self._save(job)
+            metrics.JOBS_FINISHED.inc(type=job["type"], status='failed' if job["state"] == 'failed' else 'retry')
+            return
+        # 후속 작업을 먼저 기록한 뒤 완료 처리 (중간에 죽으면 재실행되지만 후속 작업 ID가 같아 중복되지 않음)
+        followups = []
+        for i, item in enumerate(result or []):
+            f_type, f_payload = item[0], item[1]
+            followups.append(self.enqueue(f_type, f_payload, job_id=f'{job["id"]}.{i}-{f_type}')["id"])
+        with self._cond:
+            job["state"] = 'done'
+            job["result"] = {"followups": followups, "elapsed_s": round(time.time() - t0, 3)}
+            job["last_error"] = None
+            self._save(job)
+        metrics.JOBS_FINISHED.inc(type=job["type"], status='done')
+        print(f"[JOB] 완료: {job['id']} ({job['type']}, {time.time() - t0:.1f}s)")
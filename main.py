@@ -13,13 +13,19 @@ import numpy as np
 from pyzbar import pyzbar
 import time
 import threading
-from picamera2 import Picamera2
-from flask import Flask, render_template, Response, jsonify
+from camera_source import FrameScheduler, Picamera2, create_camera_source, camera_source_spec
+from recording_writer import BackgroundVideoWriter
+from storage_manager import StorageManager
+from recording_catalog import RecordingCatalog, format_entry
+from recording_index import RecordingIndexer, load_index, sprite_path
+from hls_store import HLS_LOW_LATENCY, HLS_STORE_MODE, attach_memory_sink, create_store, memory_sink_desc, prepare_file_output, tmpfs_dir
+from hls_http import BoundedHTTPServer, HlsRequestHandler
+import metrics
+from flask import Flask, render_template, Response, jsonify, request
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstApp', '1.0')
 from gi.repository import Gst, GstApp
-from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import base64
 from io import BytesIO
 from PIL import Image
@@ -41,9 +47,14 @@ cooldown_period = 3
 
 # 녹화 관련 전역 변수
 recording = False
-video_writer = None
+video_writer = None  # BackgroundVideoWriter (인코딩/쓰기는 전용 스레드)
 recording_start_time = None
 recording_filename = None
+# 녹화 파일 디렉터리 (mqtt_camera와 같은 VIDEO_OUTPUT_DIR, 용량 관리 대상)
+RECORDING_DIR = os.getenv("VIDEO_OUTPUT_DIR", "/home/openiot/project/video")
+storage_manager = None
+recording_catalog = None
+recording_indexer = RecordingIndexer()  # 키프레임 인덱스/썸네일 생성 (전용 스레드)
 
 # HLS 관련 전역 변수
 hls_enabled = True
@@ -53,9 +64,24 @@ hls_dir = os.path.abspath(os.path.join(os.getcwd(), 'hls'))
 hls_httpd_server = None
 hls_httpd_thread = None
 hls_http_port = 8090
+# HLS 세그먼트 저장 위치: memory(기본) | tmpfs | disk (hls_store.py 참고)
+hls_store = None
+hls_active_mode = None
+hls_output_dir = hls_dir
 hls_target_width = None
 hls_target_height = None
 hls_target_fps = None
+# appsrc need-data/enough-data로 갱신: 인코더가 밀려 있으면 프레임을 쌓지 않고 버림
+hls_feed = threading.Event()
+hls_resize_warned = False
+
+# 캡처 설정: HLS 목표 해상도/fps로 카메라를 설정하여 프레임마다 리사이즈하지 않음
+capture_width = 1280
+capture_height = 720
+capture_fps = 20
+capture_reconfigure = False   # 카메라 루프가 다음 프레임 전에 카메라를 다시 설정
+# 캡처 루프 페이싱 + HLS PTS(캡처 시각 기준)
+frame_scheduler = FrameScheduler(capture_fps)
 
 # --- MQTT 설정 ---
 MQTT_BROKER_HOST = os.getenv('MQTT_BROKER_HOST', '192.168.0.76')
@@ -363,7 +389,7 @@ def start_hls_http_server(port: int = None):
     const video = document.getElementById('video');
     const src = 'index.m3u8';
     if (Hls.isSupported()) {
-      const hls = new Hls({maxBufferLength:10});
+      const hls = new Hls({maxBufferLength:10, lowLatencyMode:true});
       hls.loadSource(src);
       hls.attachMedia(video);
       hls.on(Hls.Events.MANIFEST_PARSED, function(){ video.play(); });
@@ -380,28 +406,24 @@ def start_hls_http_server(port: int = None):
                 f.write(html)
     except Exception:
         pass
-    class HLSHandler(SimpleHTTPRequestHandler):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, directory=hls_dir, **kwargs)
-        def end_headers(self):
-            try:
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Range, Content-Type, Origin, Accept')
-            except Exception:
-                pass
-            super().end_headers()
-        def do_OPTIONS(self):
-            try:
-                self.send_response(204)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Range, Content-Type, Origin, Accept')
-                self.end_headers()
-            except Exception:
-                pass
+    class HLSHandler(HlsRequestHandler):
+        def get_store(self):
+            return hls_store if hls_active_mode == 'memory' else None
+        def get_directory(self):
+            return hls_output_dir
+        def route(self, path):
+            if path == '/metrics':
+                return metrics.CONTENT_TYPE, metrics.render_latest()
+            # 뷰어 페이지는 저장소 모드와 관계없이 hls_dir에서 응답
+            if path in ('/', '/index.html'):
+                try:
+                    with open(os.path.join(hls_dir, 'index.html'), 'rb') as f:
+                        return 'text/html; charset=utf-8', f.read()
+                except Exception:
+                    return None
+            return None
     try:
-        hls_httpd_server = ThreadingHTTPServer(("0.0.0.0", int(port)), HLSHandler)
+        hls_httpd_server = BoundedHTTPServer(("0.0.0.0", int(port)), HLSHandler)
         hls_httpd_thread = threading.Thread(target=hls_httpd_server.serve_forever, daemon=True)
         hls_httpd_thread.start()
         print(f"[HLS] HTTP 서버 시작: http://0.0.0.0:{port}/index.m3u8")
@@ -421,8 +443,65 @@ def stop_hls_http_server():
     hls_httpd_server = None
     hls_httpd_thread = None
 
+def request_capture_config(width: int, height: int, fps: int) -> None:
+    """카메라 캡처 해상도/fps를 HLS 목표에 맞추도록 요청 (카메라 루프가 다음 프레임 전에 반영)."""
+    global capture_width, capture_height, capture_fps, capture_reconfigure
+    width, height, fps = int(width), int(height), max(1, int(fps))
+    if (width, height, fps) == (capture_width, capture_height, capture_fps):
+        return
+    capture_width, capture_height, capture_fps = width, height, fps
+    capture_reconfigure = True
+
+def reconfigure_capture(camera_type, picam2, cap, source_spec):
+    """카메라를 capture_width/height/fps로 다시 설정 → (picam2, cap). 실패하면 기존 설정 유지."""
+    size = (capture_width, capture_height)
+    try:
+        if camera_type == "Picamera2":
+            picam2.stop()
+            picam2.configure(picam2.create_video_configuration(main={'size': size, 'format': 'RGB888'}))
+            picam2.start()
+            picam2.set_controls({"FrameRate": capture_fps})
+        elif camera_type == "Synthetic":
+            picam2.stop()
+            picam2.close()
+            picam2 = create_camera_source(capture_width, capture_height, capture_fps, source_spec)
+            picam2.start()
+        elif camera_type == "OpenCV" and cap:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, capture_width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, capture_height)
+            cap.set(cv2.CAP_PROP_FPS, capture_fps)
+        print(f"[CAMERA] 캡처 설정 변경: {capture_width}x{capture_height}@{capture_fps}")
+    except Exception as e:
+        print(f"[CAMERA] 캡처 설정 변경 실패 (HLS는 리사이즈로 대체): {e}")
+    frame_scheduler.set_fps(capture_fps)
+    return picam2, cap
+
+def push_hls_frame(frame, capture_ns: int) -> None:
+    """BGR 프레임을 HLS appsrc에 넣는다. PTS는 캡처 시각 기준, 인코더가 밀려 있으면(enough-data) 드롭."""
+    global hls_resize_warned
+    appsrc = hls_appsrc
+    if appsrc is None:
+        return
+    if not hls_feed.is_set():
+        metrics.FRAMES_DROPPED.inc(consumer='hls')
+        return
+    if frame.shape[1] != hls_target_width or frame.shape[0] != hls_target_height:
+        # 카메라가 요청한 해상도를 지원하지 않는 경우에만
+        if not hls_resize_warned:
+            hls_resize_warned = True
+            print(f"[HLS] 캡처 {frame.shape[1]}x{frame.shape[0]} ≠ 목표 {hls_target_width}x{hls_target_height}: 리사이즈")
+        frame = cv2.resize(frame, (int(hls_target_width), int(hls_target_height)))
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    buf = Gst.Buffer.new_wrapped(rgb.tobytes())
+    buf.pts = frame_scheduler.stamp(capture_ns)
+    buf.dts = buf.pts
+    buf.duration = frame_scheduler.period_ns
+    if appsrc.emit('push-buffer', buf) != Gst.FlowReturn.OK:
+        metrics.FRAMES_DROPPED.inc(consumer='hls')
+
 def start_hls_pipeline(width: int, height: int, framerate: int):
     global hls_pipeline, hls_appsrc, hls_target_width, hls_target_height, hls_target_fps
+    global hls_store, hls_active_mode, hls_output_dir, hls_resize_warned
     if not hls_enabled:
         return
     if hls_pipeline is not None:
@@ -432,26 +511,56 @@ def start_hls_pipeline(width: int, height: int, framerate: int):
     kbps = 2000
     hls_target_width = int(width)
     hls_target_height = int(height)
-    hls_target_fps = int(framerate)
-    launch = (
-        f"appsrc name=hls_src is-live=true format=time do-timestamp=true block=true "
-        f"caps=video/x-raw,format=RGB,width={width},height={height},framerate={framerate}/1 ! "
+    hls_target_fps = max(1, int(framerate))
+    hls_resize_warned = False
+    # 캡처를 HLS 해상도/fps로 맞추고, 캡처 시각 기준 PTS를 0부터 다시 시작
+    request_capture_config(hls_target_width, hls_target_height, hls_target_fps)
+    frame_scheduler.reset_timebase()
+    # 큐는 2프레임까지만: 넘치면 enough-data → 캡처 루프가 드롭 (block=true로 루프가 멈추지 않도록)
+    max_bytes = hls_target_width * hls_target_height * 3 * 2
+    encode = (
+        f"appsrc name=hls_src is-live=true format=time do-timestamp=false block=false max-bytes={max_bytes} "
+        f"caps=video/x-raw,format=RGB,width={width},height={height},framerate={hls_target_fps}/1 ! "
         f"videoconvert ! video/x-raw,format=I420 ! "
-        f"x264enc tune=zerolatency key-int-max=60 bitrate={kbps} ! h264parse ! mpegtsmux ! "
-        f"hlssink name=hlsink target-duration=2 max-files=10 playlist-location={os.path.join(hls_dir, 'index.m3u8')} location={os.path.join(hls_dir, 'segment_%05d.ts')}"
+        f"x264enc tune=zerolatency key-int-max=60 bitrate={kbps} ! h264parse ! "
     )
+    mode = HLS_STORE_MODE if HLS_STORE_MODE in ('memory', 'tmpfs', 'disk') else 'memory'
+    if mode == 'memory':
+        # 세그먼트를 메모리 링에 보관 (SD 카드 기록 없음), 실패 시 tmpfs로 대체
+        try:
+            if hls_store is None:
+                hls_store = create_store()
+            hls_pipeline = Gst.parse_launch(encode + memory_sink_desc())
+            attach_memory_sink(hls_pipeline, hls_store)
+        except Exception as e:
+            print(f"[HLS] 메모리 세그먼트 저장소 사용 불가, tmpfs로 대체: {e}")
+            hls_pipeline = None
+            mode = 'tmpfs'
     try:
-        hls_pipeline = Gst.parse_launch(launch)
+        if mode != 'memory':
+            if HLS_LOW_LATENCY:
+                print("[HLS] 저지연(부분 세그먼트) 모드는 memory 저장소에서만 지원됩니다. 일반 HLS로 동작합니다.")
+            hls_output_dir = tmpfs_dir(hls_dir) if mode == 'tmpfs' else hls_dir
+            playlist, segment = prepare_file_output(hls_output_dir)
+            hls_pipeline = Gst.parse_launch(
+                encode + f"mpegtsmux ! hlssink name=hlsink target-duration=2 max-files=10 "
+                f"playlist-location={playlist} location={segment}")
         hls_appsrc = hls_pipeline.get_by_name('hls_src')
+        hls_appsrc.connect('need-data', lambda _src, _length: hls_feed.set())
+        hls_appsrc.connect('enough-data', lambda _src: hls_feed.clear())
+        hls_feed.set()
         hls_pipeline.set_state(Gst.State.PLAYING)
-        print("[HLS] 파이프라인 시작")
+        hls_active_mode = mode
+        print(f"[HLS] 파이프라인 시작 (저장소: {hls_output_dir if mode != 'memory' else 'memory'})")
     except Exception as e:
         print(f"[HLS] 파이프라인 시작 실패: {e}")
         hls_pipeline = None
         hls_appsrc = None
+        hls_active_mode = None
 
 def stop_hls_pipeline():
     global hls_pipeline, hls_appsrc
+    hls_feed.clear()
     try:
         if hls_pipeline is not None:
             hls_pipeline.set_state(Gst.State.NULL)
@@ -672,127 +781,150 @@ def camera_stream():
     # 시스템 상태 확인
     check_system_status()
     
+    global capture_reconfigure
     camera_type = None
     picam2 = None
     cap = None
     
-    # 1단계: Picamera2 시도 (Pi Camera 3 전용) - 제공된 코드 방식 참고
-    try:
-        print("1단계: Picamera2 초기화 시도 중...")
-        picam2 = Picamera2()
-        
-        # 제공된 코드와 동일한 방식으로 설정
-        cfg = picam2.create_video_configuration(
-            main={'size': (1280, 720), 'format': 'RGB888'}
-        )
+    # 0단계: CAMERA_SOURCE=synthetic / file:<경로> 이면 하드웨어 없이 합성 소스 사용
+    source_spec = camera_source_spec()
+    if source_spec.lower() != 'picamera2':
+        try:
+            print(f"0단계: 합성 카메라 소스 사용 (CAMERA_SOURCE={source_spec})")
+            picam2 = create_camera_source(capture_width, capture_height, capture_fps, source_spec)
+            picam2.start()
+            camera_type = "Synthetic"
+        except Exception as e:
+            print(f"합성 카메라 소스 초기화 실패: {e}")
+            return
+
+    if camera_type is None:
+        # 1단계: Picamera2 시도 (Pi Camera 3 전용) - 제공된 코드 방식 참고
+        try:
+            print("1단계: Picamera2 초기화 시도 중...")
+            if Picamera2 is None:
+                raise RuntimeError("picamera2 모듈 없음")
+            picam2 = Picamera2()
+        
+            # 제공된 코드와 동일한 방식으로 설정 (해상도는 HLS 목표에 맞춤)
+            cfg = picam2.create_video_configuration(
+                main={'size': (capture_width, capture_height), 'format': 'RGB888'}
+            )
         
-        print("카메라 설정 적용 중...")
-        picam2.configure(cfg)
+            print("카메라 설정 적용 중...")
+            picam2.configure(cfg)
         
-        print("카메라 시작 중...")
-        picam2.start()
+            print("카메라 시작 중...")
+            picam2.start()
         
-        # 자동 초점 설정 (제공된 코드와 동일)
-        picam2.set_controls({"FrameRate": 20})
-        picam2.set_controls({"AfMode": 2})  # 0=Manual, 1=Auto, 2=Continuous
+            # 자동 초점 설정 (제공된 코드와 동일)
+            picam2.set_controls({"FrameRate": capture_fps})
+            picam2.set_controls({"AfMode": 2})  # 0=Manual, 1=Auto, 2=Continuous
         
-        print("✅ 자동 초점이 활성화되었습니다.")
+            print("✅ 자동 초점이 활성화되었습니다.")
         
-        # 카메라 안정화를 위한 대기
-        print("카메라 안정화 대기 중...")
-        time.sleep(2)
+            # 카메라 안정화를 위한 대기
+            print("카메라 안정화 대기 중...")
+            time.sleep(2)
         
-        # 초기 프레임으로 카메라 상태 확인 (제공된 코드와 동일한 방식)
-        print("초기 프레임 캡처 테스트...")
-        test_frame = picam2.capture_array()
-        if test_frame is not None:
-            print(f"✅ Picamera2 초기화 성공! 프레임 크기: {test_frame.shape}")
-            camera_type = "Picamera2"
-        else:
-            print("❌ 초기 프레임 캡처 실패")
-            raise Exception("초기 프레임 캡처 실패")
+            # 초기 프레임으로 카메라 상태 확인 (제공된 코드와 동일한 방식)
+            print("초기 프레임 캡처 테스트...")
+            test_frame = picam2.capture_array()
+            if test_frame is not None:
+                print(f"✅ Picamera2 초기화 성공! 프레임 크기: {test_frame.shape}")
+                camera_type = "Picamera2"
+            else:
+                print("❌ 초기 프레임 캡처 실패")
+                raise Exception("초기 프레임 캡처 실패")
             
-    except Exception as e:
-        print(f"Picamera2 초기화 실패: {e}")
-        print("2단계: OpenCV로 대안 시도 중...")
+        except Exception as e:
+            print(f"Picamera2 초기화 실패: {e}")
+            print("2단계: OpenCV로 대안 시도 중...")
         
-        # 2단계: OpenCV 시도
-        try:
-            # CM5 + IO 보드에서 사용 가능한 카메라 장치 찾기
-            camera_devices = []
-            for i in range(5):  # video0부터 video4까지 시도
-                if os.path.exists(f'/dev/video{i}'):
-                    camera_devices.append(i)
+            # 2단계: OpenCV 시도
+            try:
+                # CM5 + IO 보드에서 사용 가능한 카메라 장치 찾기
+                camera_devices = []
+                for i in range(5):  # video0부터 video4까지 시도
+                    if os.path.exists(f'/dev/video{i}'):
+                        camera_devices.append(i)
             
-            print(f"발견된 비디오 장치: {camera_devices}")
+                print(f"발견된 비디오 장치: {camera_devices}")
             
-            if not camera_devices:
-                print("❌ 사용 가능한 비디오 장치가 없습니다.")
-                print("CM5 + IO 보드 설정을 확인하세요.")
-                return
+                if not camera_devices:
+                    print("❌ 사용 가능한 비디오 장치가 없습니다.")
+                    if Picamera2 is not None:
+                        print("CM5 + IO 보드 설정을 확인하세요.")
+                        return
+                    # 라즈베리파이가 아닌 환경(x86 CI 등): 합성 카메라로 대체
+                    print("3단계: 합성 카메라 소스로 대체합니다.")
+                    source_spec = 'synthetic'
+                    picam2 = create_camera_source(capture_width, capture_height, capture_fps, source_spec)
+                    picam2.start()
+                    camera_type = "Synthetic"
             
-            # 각 장치로 카메라 열기 시도
-            for device_index in camera_devices:
-                print(f"비디오 장치 {device_index}로 카메라 열기 시도...")
-                cap = cv2.VideoCapture(device_index)
+                # 각 장치로 카메라 열기 시도
+                for device_index in camera_devices:
+                    print(f"비디오 장치 {device_index}로 카메라 열기 시도...")
+                    cap = cv2.VideoCapture(device_index)
                 
-                if cap.isOpened():
-                    # 제공된 코드와 동일한 방식으로 설정
-                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                    if cap.isOpened():
+                        # 제공된 코드와 동일한 방식으로 설정
+                        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
                     
-                    # 안정적인 해상도 설정
-                    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                    cap.set(cv2.CAP_PROP_FPS, 20)
+                        # 안정적인 해상도 설정
+                        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+                        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+                        cap.set(cv2.CAP_PROP_FPS, 20)
                     
-                    # 설정 적용을 위한 대기
-                    time.sleep(1)
+                        # 설정 적용을 위한 대기
+                        time.sleep(1)
                     
-                    # 자동 초점 설정
-                    try:
-                        cap.set(cv2.CAP_PROP_AUTOFOCUS, 1)
-                        print("✅ OpenCV 자동 초점 활성화")
-                    except Exception as e:
-                        print(f"⚠️  OpenCV 자동 초점 설정 실패: {e}")
+                        # 자동 초점 설정
+                        try:
+                            cap.set(cv2.CAP_PROP_AUTOFOCUS, 1)
+                            print("✅ OpenCV 자동 초점 활성화")
+                        except Exception as e:
+                            print(f"⚠️  OpenCV 자동 초점 설정 실패: {e}")
                     
-                    # 카메라 정보 확인
-                    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-                    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                    fps = cap.get(cv2.CAP_PROP_FPS)
+                        # 카메라 정보 확인
+                        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+                        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+                        fps = cap.get(cv2.CAP_PROP_FPS)
                     
-                    print(f"✅ OpenCV 카메라가 열렸습니다! (장치: {device_index})")
-                    print(f"  해상도: {width}x{height}, FPS: {fps}")
+                        print(f"✅ OpenCV 카메라가 열렸습니다! (장치: {device_index})")
+                        print(f"  해상도: {width}x{height}, FPS: {fps}")
                     
-                    # 제공된 코드와 동일한 방식으로 프레임 읽기 테스트
-                    print("테스트 프레임 읽기 시작...")
-                    ret, test_frame = cap.read()
-                    if ret and test_frame is not None:
-                        print(f"✅ 테스트 프레임 성공: {test_frame.shape}")
-                        camera_type = "OpenCV"
-                        break
+                        # 제공된 코드와 동일한 방식으로 프레임 읽기 테스트
+                        print("테스트 프레임 읽기 시작...")
+                        ret, test_frame = cap.read()
+                        if ret and test_frame is not None:
+                            print(f"✅ 테스트 프레임 성공: {test_frame.shape}")
+                            camera_type = "OpenCV"
+                            break
+                        else:
+                            print("❌ 테스트 프레임 실패")
+                            cap.release()
+                            cap = None
                     else:
-                        print("❌ 테스트 프레임 실패")
-                        cap.release()
-                        cap = None
-                else:
-                    print(f"  장치 {device_index} 열기 실패")
-                    if cap:
-                        cap.release()
-                        cap = None
+                        print(f"  장치 {device_index} 열기 실패")
+                        if cap:
+                            cap.release()
+                            cap = None
             
-            if not camera_type:
-                print("❌ 모든 비디오 장치에서 카메라를 열 수 없습니다.")
-                print("\n💡 문제 해결 방법:")
-                print("1. 카메라 하드웨어 연결 확인")
-                print("2. sudo apt-get install v4l-utils")
-                print("3. v4l2-ctl --list-devices 실행")
-                print("4. sudo chmod 666 /dev/video*")
-                print("5. 시스템 재부팅")
-                return
+                if not camera_type:
+                    print("❌ 모든 비디오 장치에서 카메라를 열 수 없습니다.")
+                    print("\n💡 문제 해결 방법:")
+                    print("1. 카메라 하드웨어 연결 확인")
+                    print("2. sudo apt-get install v4l-utils")
+                    print("3. v4l2-ctl --list-devices 실행")
+                    print("4. sudo chmod 666 /dev/video*")
+                    print("5. 시스템 재부팅")
+                    return
                 
-        except Exception as e:
-            print(f"OpenCV 카메라 초기화 실패: {e}")
-            return
+            except Exception as e:
+                print(f"OpenCV 카메라 초기화 실패: {e}")
+                return
     
     if not camera_type:
         print("❌ 카메라를 초기화할 수 없습니다.")
@@ -801,10 +933,20 @@ def camera_stream():
     print(f"✅ {camera_type} 카메라가 성공적으로 시작되었습니다!")
     camera_active = True
     frame_count = 0
+    if camera_type == "OpenCV" and cap:
+        capture_reconfigure = True   # 테스트용 640x480으로 열었으므로 HLS 목표로 다시 설정
+    frame_scheduler.set_fps(capture_fps)
+    fps_meter = metrics.FpsMeter(capture_fps)
     
     try:
         while camera_active:
             try:
+                if capture_reconfigure:
+                    capture_reconfigure = False
+                    picam2, cap = reconfigure_capture(camera_type, picam2, cap, source_spec)
+                    fps_meter = metrics.FpsMeter(capture_fps)
+                # 고정 fps 페이싱: 처리 시간과 관계없이 다음 프레임 시각까지 대기
+                frame_scheduler.wait()
                 # 프레임 캡처
                 if camera_type == "Picamera2":
                     frame = picam2.capture_array()
@@ -814,6 +956,9 @@ def camera_stream():
                         print("❌ Picamera2에서 프레임을 읽을 수 없습니다.")
                         time.sleep(0.1)
                         continue
+                elif camera_type == "Synthetic":
+                    # 합성 소스는 이미 BGR 배치이며 fps에 맞춰 페이싱됨
+                    frame = picam2.capture_array()
                 else:
                     # 제공된 코드와 동일한 방식으로 프레임 캡처
                     ret, frame = cap.read()
@@ -822,11 +967,13 @@ def camera_stream():
                         time.sleep(0.1)
                         continue
                 
+                capture_ns = time.monotonic_ns()
+                fps_meter.tick(capture_ns / 1e9)
                 frame_count += 1
                 
-                # 프레임 크기 조정 (웹 스트리밍 최적화)
-                if frame.shape[0] > 720 or frame.shape[1] > 1280:
-                    frame = cv2.resize(frame, (1280, 720))
+                # 프레임 크기 조정 (카메라가 요청보다 큰 해상도를 낸 경우만)
+                if frame.shape[0] > capture_height or frame.shape[1] > capture_width:
+                    frame = cv2.resize(frame, (capture_width, capture_height))
                 
                 # 향상된 QR 코드 디코딩
                 qr_results = detect_qr_codes_enhanced(frame)
@@ -952,24 +1099,9 @@ def camera_stream():
                 if recording:
                     write_frame_to_recording(frame)
                 
-                # HLS 프레임 푸시 (RGB)
+                # HLS 프레임 푸시 (RGB, 캡처 시각 PTS)
                 try:
-                    if hls_appsrc is not None:
-                        # 파이프라인 캡스에 맞춰 리사이즈
-                        if hls_target_width and hls_target_height:
-                            if frame.shape[1] != hls_target_width or frame.shape[0] != hls_target_height:
-                                frame = cv2.resize(frame, (int(hls_target_width), int(hls_target_height)))
-                        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        data = rgb.tobytes()
-                        buf = Gst.Buffer.new_allocate(None, len(data), None)
-                        buf.fill(0, data)
-                        # 간단 duration만 설정 (타임스탬프는 omit)
-                        try:
-                            fps_val = int(hls_target_fps) if hls_target_fps else 20
-                        except Exception:
-                            fps_val = 20
-                        buf.duration = int(1e9/max(1, fps_val))
-                        hls_appsrc.emit('push-buffer', buf)
+                    push_hls_frame(frame, capture_ns)
                 except Exception:
                     pass
 
@@ -980,9 +1112,6 @@ def camera_stream():
                     # 최근 10개 결과만 유지
                     qr_detection_results = qr_detection_results[-10:]
                 
-                # 웹 스트리밍을 위해 약간의 지연
-                time.sleep(0.05)  # 지연 시간을 줄여서 성능 향상
-                
             except Exception as e:
                 print(f"프레임 처리 오류: {e}")
                 time.sleep(0.1)
@@ -998,7 +1127,7 @@ def camera_stream():
         if recording:
             stop_recording()
         
-        if camera_type == "Picamera2" and picam2:
+        if camera_type in ("Picamera2", "Synthetic") and picam2:
             picam2.stop()
             picam2.close()
         elif camera_type == "OpenCV" and cap:
@@ -1178,29 +1307,29 @@ def hls_off_route():
 
 @app.route('/list_recordings')
 def list_recordings_route():
-    """녹화된 파일 목록 API"""
+    """녹화된 파일 목록 API (카탈로그 조회: ?offset=0&limit=100&kind=manual|motion|schedule|all&since=&until=)
+
+    since/until은 epoch 초 또는 'YYYY-MM-DD HH:MM:SS'. 기본은 수동 녹화(recording_*.mp4) 최신순.
+    """
     try:
-        # 현재 디렉토리에서 녹화 파일들 찾기
-        recording_files = []
-        for filename in os.listdir('.'):
-            if filename.startswith('recording_') and filename.endswith('.mp4'):
-                file_path = os.path.join('.', filename)
-                file_stat = os.stat(file_path)
-                
-                recording_files.append({
-                    'filename': filename,
-                    'size_mb': round(file_stat.st_size / (1024 * 1024), 2),
-                    'created_time': datetime.fromtimestamp(file_stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
-                    'modified_time': datetime.fromtimestamp(file_stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-        
-        # 생성 시간 기준으로 정렬 (최신순)
-        recording_files.sort(key=lambda x: x['created_time'], reverse=True)
-        
+        args = request.args
+        kind = args.get('kind', 'manual')
+        total, entries = get_recording_catalog().query(
+            kind=None if kind == 'all' else kind,
+            since=parse_time_arg(args.get('since')),
+            until=parse_time_arg(args.get('until')),
+            offset=int(args.get('offset', 0)),
+            limit=int(args.get('limit', 100)),
+            newest_first=args.get('order', 'desc') != 'asc',
+        )
+        summary = get_recording_catalog().summary(None if kind == 'all' else kind)
         return jsonify({
             'status': 'success',
-            'files': recording_files,
-            'count': len(recording_files)
+            'files': [format_entry(e) for e in entries],
+            'count': len(entries),
+            'total': total,
+            'total_size_mb': round(summary['size'] / (1024 * 1024), 2),
+            'offset': int(args.get('offset', 0)),
         })
         
     except Exception as e:
@@ -1209,6 +1338,15 @@ def list_recordings_route():
             'message': f'파일 목록 조회 실패: {e}'
         })
 
+def parse_time_arg(value):
+    """epoch 초 또는 'YYYY-MM-DD HH:MM:SS' → epoch 초 (없으면 None)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(value.replace('T', ' '), '%Y-%m-%d %H:%M:%S').timestamp()
+
 @app.route('/delete_recording/<filename>')
 def delete_recording_route(filename):
     """녹화 파일 삭제 API"""
@@ -1220,9 +1358,11 @@ def delete_recording_route(filename):
                 'message': '잘못된 파일명입니다.'
             })
         
-        file_path = os.path.join('.', filename)
+        file_path = os.path.join(RECORDING_DIR, filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            get_storage_manager().note_removed(file_path)
+            get_recording_catalog().note_removed(file_path)
             return jsonify({
                 'status': 'success',
                 'message': f'파일 {filename}이 삭제되었습니다.'
@@ -1250,7 +1390,7 @@ def download_recording_route(filename):
                 'message': '잘못된 파일명입니다.'
             })
         
-        file_path = os.path.join('.', filename)
+        file_path = os.path.join(RECORDING_DIR, filename)
         if os.path.exists(file_path):
             from flask import send_file
             return send_file(
@@ -1282,7 +1422,7 @@ def play_recording_route(filename):
                 'message': '잘못된 파일명입니다.'
             })
         
-        file_path = os.path.join('.', filename)
+        file_path = os.path.join(RECORDING_DIR, filename)
         if os.path.exists(file_path):
             from flask import send_file
             return send_file(
@@ -1301,6 +1441,50 @@ def play_recording_route(filename):
             'message': f'파일 재생 실패: {e}'
         })
 
+@app.route('/recording_index/<filename>')
+def recording_index_route(filename):
+    """녹화 파일 키프레임 인덱스 API (키프레임 시각/바이트 오프셋 + 썸네일 타일 위치)"""
+    if not filename.startswith('recording_') or not filename.endswith('.mp4'):
+        return jsonify({'status': 'error', 'message': '잘못된 파일명입니다.'})
+    file_path = os.path.join(RECORDING_DIR, filename)
+    if not os.path.exists(file_path):
+        return jsonify({'status': 'error', 'message': '파일을 찾을 수 없습니다.'})
+    index = load_index(file_path)
+    if index is None:
+        # 요청 스레드에서 디코드하지 않고 백그라운드 생성만 예약
+        recording_indexer.submit(file_path)
+        return jsonify({'status': 'pending', 'message': '인덱스 생성 중입니다.'})
+    return jsonify({'status': 'success', 'index': index})
+
+@app.route('/recording_thumbs/<filename>')
+def recording_thumbs_route(filename):
+    """녹화 파일 썸네일 스프라이트 (없으면 생성 예약 후 404)"""
+    if not filename.startswith('recording_') or not filename.endswith('.mp4'):
+        return Response(status=400)
+    file_path = os.path.join(RECORDING_DIR, filename)
+    if load_index(file_path) is None or not os.path.exists(sprite_path(file_path)):
+        if os.path.exists(file_path):
+            recording_indexer.submit(file_path)
+        return Response(status=404)
+    from flask import send_file
+    return send_file(sprite_path(file_path), mimetype='image/jpeg', max_age=3600)
+
+def get_storage_manager():
+    """녹화 디렉터리 용량 관리자 싱글톤 (생성 시 한 번 스캔 후 삭제 스레드 시작)."""
+    global storage_manager
+    if storage_manager is None:
+        storage_manager = StorageManager(RECORDING_DIR)
+        storage_manager.start()
+    return storage_manager
+
+def get_recording_catalog():
+    """녹화 파일 카탈로그 싱글톤 (캐시 로드 + 한 번 스캔 후 inotify 감시 시작)."""
+    global recording_catalog
+    if recording_catalog is None:
+        recording_catalog = RecordingCatalog(RECORDING_DIR)
+        recording_catalog.start()
+    return recording_catalog
+
 def start_recording(frame):
     """녹화 시작"""
     global recording, video_writer, recording_start_time, recording_filename
@@ -1310,23 +1494,26 @@ def start_recording(frame):
     
     try:
         # 현재 시간으로 파일명 생성
+        # 여유 공간 확인 (가득 찬 SD 카드에 쓰다 조용히 실패하지 않도록 시작 전에 거부)
+        if not get_storage_manager().admit(kind='manual'):
+            return False, "저장 공간이 부족합니다."
+        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        recording_filename = f"recording_{timestamp}.mp4"
+        recording_filename = os.path.join(RECORDING_DIR, f"recording_{timestamp}.mp4")
         
         # 프레임 크기 가져오기
         height, width = frame.shape[:2]
         
-        # VideoWriter 초기화 (H.264 코덱 사용)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer = cv2.VideoWriter(recording_filename, fourcc, 20.0, (width, height))
-        
-        if not video_writer.isOpened():
+        # 백그라운드 writer 초기화 (H.264, 캡처 루프는 큐에 넣기만 함)
+        writer = BackgroundVideoWriter(recording_filename, 20.0, (width, height))
+        if not writer.open():
             return False, "비디오 writer를 초기화할 수 없습니다."
+        video_writer = writer
         
         recording = True
         recording_start_time = time.time()
         
-        print(f"✅ 녹화가 시작되었습니다: {recording_filename}")
+        print(f"✅ 녹화가 시작되었습니다: {recording_filename} ({writer.codec})")
         return True, f"녹화가 시작되었습니다: {recording_filename}"
         
     except Exception as e:
@@ -1343,8 +1530,12 @@ def stop_recording():
     try:
         recording = False
         
+        dropped = 0
         if video_writer:
-            video_writer.release()
+            # 큐에 남은 프레임을 모두 쓴 뒤 파일을 닫음
+            if not video_writer.close():
+                print("⚠️ 녹화 writer 종료 대기 시간 초과")
+            dropped = video_writer.dropped
             video_writer = None
         
         if recording_start_time:
@@ -1353,14 +1544,18 @@ def stop_recording():
             
             # 파일 크기 확인
             if os.path.exists(recording_filename):
+                get_storage_manager().note_file(recording_filename, 'manual')
+                get_recording_catalog().note_file(recording_filename)
+                recording_indexer.submit(recording_filename)
                 file_size = os.path.getsize(recording_filename)
                 file_size_mb = file_size / (1024 * 1024)
                 
                 print(f"✅ 녹화가 완료되었습니다: {recording_filename}")
                 print(f"  - 녹화 시간: {duration:.1f}초")
                 print(f"  - 파일 크기: {file_size_mb:.2f}MB")
+                print(f"  - 드롭 프레임: {dropped}")
                 
-                return True, f"녹화 완료: {recording_filename} ({duration:.1f}초, {file_size_mb:.2f}MB)"
+                return True, f"녹화 완료: {recording_filename} ({duration:.1f}초, {file_size_mb:.2f}MB, 드롭 {dropped}프레임)"
             else:
                 return False, "녹화 파일을 찾을 수 없습니다."
         
@@ -1381,25 +1576,30 @@ def get_recording_status():
         }
     
     duration = time.time() - recording_start_time if recording_start_time else 0
+    writer = video_writer
     
     return {
         'recording': True,
         'filename': recording_filename,
         'duration': f"{duration:.1f}초",
+        'written_frames': writer.written if writer else 0,
+        'dropped_frames': writer.dropped if writer else 0,
+        'queued_frames': writer.qsize() if writer else 0,
         'message': f"녹화 중: {recording_filename} ({duration:.1f}초)"
     }
 
 def write_frame_to_recording(frame):
-    """프레임을 녹화 파일에 쓰기"""
+    """프레임을 녹화 큐에 넣기 (논블로킹, 큐가 가득 차면 드롭)"""
     global recording, video_writer
     
-    if recording and video_writer and video_writer.isOpened():
-        try:
-            video_writer.write(frame)
-        except Exception as e:
-            print(f"❌ 프레임 녹화 실패: {e}")
+    writer = video_writer
+    if recording and writer:
+        if writer.error is not None:
+            print(f"❌ 프레임 녹화 실패: {writer.error}")
             # 녹화 오류 시 자동으로 녹화 중지
             stop_recording()
+            return
+        writer.write(frame)
 
 def create_templates():
     """HTML 템플릿 생성"""
@@ -1654,6 +1854,16 @@ def create_templates():
         .recording-info-left {
             flex: 1;
         }
+        .recording-thumb {
+            width: 160px;
+            height: 90px;
+            margin-right: 15px;
+            border-radius: 6px;
+            background-color: rgba(0,0,0,0.3);
+            background-repeat: no-repeat;
+            background-position: 0 0;
+            flex-shrink: 0;
+        }
         .recording-info-right {
             display: flex;
             gap: 10px;
@@ -1998,7 +2208,7 @@ def create_templates():
                 .then(response => response.json())
                 .then(data => {
                     if (data.status === 'success') {
-                        displayRecordings(data.files);
+                        displayRecordings(data.files, data);
                     } else {
                         console.error('녹화 파일 목록 조회 실패:', data.message);
                         document.getElementById('recordingsList').innerHTML = 
@@ -2012,7 +2222,7 @@ def create_templates():
                 });
         }
         
-        function displayRecordings(files) {
+        function displayRecordings(files, data) {
             const container = document.getElementById('recordingsList');
             
             if (files.length === 0) {
@@ -2022,7 +2232,7 @@ def create_templates():
             }
             
             // 요약 정보 업데이트
-            updateRecordingsSummary(files);
+            updateRecordingsSummary(files, data);
             
             let html = '';
             files.forEach(file => {
@@ -2036,10 +2246,11 @@ def create_templates():
                 
                 html += `
                     <div class="recording-item">
+                        <div class="recording-thumb" style="background-image: url('/recording_thumbs/${file.filename}')"></div>
                         <div class="recording-info-left">
                             <div class="recording-filename">${file.filename}</div>
                             <div class="recording-details">
-                                📏 크기: ${sizeText} | 📅 생성: ${file.created_time}
+                                📏 크기: ${sizeText} | 📅 생성: ${file.created_time}${file.duration_s ? ` | ⏱️ ${file.duration_s.toFixed(1)}초` : ''}${file.resolution ? ` | ${file.resolution}` : ''}
                             </div>
                         </div>
                         <div class="recording-info-right">
@@ -2056,7 +2267,7 @@ def create_templates():
             container.innerHTML = html;
         }
         
-        function updateRecordingsSummary(files) {
+        function updateRecordingsSummary(files, data) {
             const summaryDiv = document.getElementById('recordingsSummary');
             const fileCountSpan = document.getElementById('fileCount');
             const totalSizeSpan = document.getElementById('totalSize');
@@ -2067,10 +2278,12 @@ def create_templates():
             }
             
             // 총 파일 크기 계산
-            const totalSizeMB = files.reduce((sum, file) => sum + file.size_mb, 0);
+            // (목록은 페이지 단위이므로 전체 개수/크기는 서버 요약 사용)
+            const totalSizeMB = data && data.total_size_mb !== undefined
+                ? data.total_size_mb : files.reduce((sum, file) => sum + file.size_mb, 0);
             
             // 파일 개수와 총 크기 표시
-            fileCountSpan.textContent = `${files.length}개 파일`;
+            fileCountSpan.textContent = `${data && data.total !== undefined ? data.total : files.length}개 파일`;
             
             if (totalSizeMB >= 1024) {
                 totalSizeSpan.textContent = `총 ${(totalSizeMB / 1024).toFixed(2)}GB`;
@@ -0,0 +1,349 @@
+"""
+프로세스 내 메트릭 레지스트리 (Counter / Gauge / Histogram) + Prometheus 텍스트 포맷 출력
+
+외부 의존성 없이 동작합니다. 값 갱신은 락 하나로 보호되며, 렌더링은 스크레이프 시점에만 수행됩니다.
+HLS HTTP 서버의 /metrics 경로 또는 start_metrics_http_server(port)로 노출합니다.
+
+예)
+  FRAMES_CAPTURED.inc()
+  FRAMES_DROPPED.inc(consumer='rtsp')
+  with QR_DECODE_SECONDS.time():
+      ...
+"""
+
+import math
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 기본 히스토그램 경계(초)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(v) -> str:
+    if v == math.inf:
+        return '+Inf'
+    if v == -math.inf:
+        return '-Inf'
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), registry=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: 라벨 {self.labelnames} 필요, {tuple(labels)} 전달됨')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), registry=None):
+        super().__init__(name, help_text, labelnames, registry)
+        self._functions = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels) -> None:
+        """스크레이프 시점에 fn()을 호출하여 값을 채운다."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                v = fn()
+                if v is not None:
+                    with self._lock:
+                        self._values[key] = float(v)
+            except Exception:
+                pass
+        return super().render()
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._t0, **self._labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help_text, labelnames, registry)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            else:
+                state["counts"][-1] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def time(self, **labels):
+        """with 블록 실행 시간을 관측하는 컨텍스트 매니저."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]})
+                           for k, v in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), state["counts"]):
+                cumulative += c
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {state["count"]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'중복 메트릭: {metric.name}')
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# --- 펌웨어 공용 메트릭 ---
+FRAMES_CAPTURED = Counter('camera_frames_captured_total', '카메라에서 캡처한 프레임 수')
+FRAMES_DROPPED = Counter('camera_frames_dropped_total', '소비자별 드롭된 프레임 수 (capture: 카메라 간격 초과로 건너뛴 프레임)',
+                         ('consumer',))
+CAPTURE_FPS = Gauge('camera_capture_fps', '최근 1초 구간의 실측 캡처 fps')
+TARGET_FPS = Gauge('camera_target_fps', '설정된 목표 fps')
+APPSRC_PUSH_SECONDS = Histogram('camera_appsrc_push_seconds', 'appsrc push-buffer 호출 시간(변환 포함)', ('consumer',))
+QR_DECODE_SECONDS = Histogram('camera_qr_decode_seconds', 'QR 검출/디코드 시간')
+QR_DETECTIONS = Counter('camera_qr_detections_total', '쿨다운을 통과한 QR 인식 수')
+MOTION_SECONDS = Histogram('camera_motion_detect_seconds', '옵티컬 플로우 모션 판정 시간')
+MOTION_ACTIVE = Gauge('camera_motion_active', '현재 모션 감지 상태 (1=모션)')
+SEGMENTS_OPENED = Counter('camera_segments_opened_total', '열린 녹화 세그먼트 수', ('kind',))
+SEGMENT_ROTATIONS = Counter('camera_segment_rotations_total', '스케줄 모드 세그먼트 로테이션 수')
+SEGMENTS_FINALIZED = Counter('camera_segments_finalized_total', '마무리된 세그먼트 수', ('status',))
+SEGMENT_FINALIZE_SECONDS = Histogram('camera_segment_finalize_seconds', '세그먼트 EOS/검증 소요 시간',
+                                     buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0))
+HLS_SEGMENTS = Counter('camera_hls_segments_total', '기록된 HLS 세그먼트 수')
+HLS_SEGMENT_WRITE_SECONDS = Histogram('camera_hls_segment_write_seconds',
+                                      'HLS 세그먼트 미디어 종료 시점부터 파일이 닫힐 때까지의 시간',
+                                      buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+HLS_VIEWERS = Gauge('camera_hls_viewers', '최근 HLS_IDLE_SEC 안에 요청한 HLS 시청자(IP) 수')
+HLS_ACTIVE = Gauge('camera_hls_active', 'HLS 파이프라인(인코딩) 동작 여부 (온디맨드, 1=동작)')
+HLS_STARTUP_SECONDS = Histogram('camera_hls_startup_seconds', '온디맨드 HLS: 첫 요청부터 재생 가능한 플레이리스트까지의 시간',
+                                buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0))
+RTSP_CLIENTS = Gauge('camera_rtsp_clients', '접속 중인 RTSP 클라이언트 수')
+MQTT_MESSAGES = Counter('camera_mqtt_messages_total', '처리한 MQTT 메시지 수', ('topic',))
+MQTT_HANDLE_SECONDS = Histogram('camera_mqtt_handle_seconds', 'MQTT 메시지 처리 시간', ('topic',))
+JOBS = Gauge('camera_jobs', '백그라운드 작업 큐 상태별 작업 수', ('state',))
+JOBS_FINISHED = Counter('camera_jobs_finished_total', '유형/결과별 백그라운드 작업 실행 수 (retry: 재시도 예정)', ('type', 'status'))
+STORAGE_USED_BYTES = Gauge('camera_storage_used_bytes', '녹화 디렉터리 사용량(인덱스 합계)')
+STORAGE_FREE_BYTES = Gauge('camera_storage_free_bytes', '녹화 디렉터리 파일시스템 여유 공간')
+STORAGE_EVICTED = Counter('camera_storage_evicted_total', '용량 관리로 삭제한 파일 수', ('class', 'reason'))
+STORAGE_WRITES_REFUSED = Counter('camera_storage_writes_refused_total', '여유 공간 부족으로 거부한 기록 수', ('kind',))
+UPLOAD_BYTES = Counter('camera_upload_bytes_total', '업로드로 전송한 바이트 수 (재전송 포함)')
+UPLOADS = Counter('camera_uploads_total', '결과별 파일 업로드 시도 수', ('status',))
+RECORDING_FRAME_GAPS = Counter('camera_recording_frame_gaps_total', '검증한 녹화의 타임스탬프 끊김 수')
+RECORDING_DROPPED_FRAMES = Counter('camera_recording_dropped_frames_total', '검증한 녹화의 추정 드롭 프레임 수')
+ENCODER_CPU_PERCENT = Gauge('camera_encoder_cpu_percent',
+                            '공유 인코더 렌디션별 CPU 사용률(코어 1개=100, shared=변환/gamma 공통 단계)', ('rendition',))
+
+
+def _clock_ticks() -> int:
+    try:
+        return os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return 100
+
+
+def read_thread_cpu() -> dict:
+    """tid → {"name", "cpu_s"} (utime+stime)."""
+    out = {}
+    ticks = float(_clock_ticks())
+    task_dir = '/proc/self/task'
+    try:
+        tids = os.listdir(task_dir)
+    except Exception:
+        return out
+    for tid in tids:
+        try:
+            with open(os.path.join(task_dir, tid, 'stat'), 'r') as f:
+                stat = f.read()
+            # comm은 괄호 안에 공백이 있을 수 있으므로 마지막 ')' 기준으로 분리
+            name = stat[stat.index('(') + 1:stat.rindex(')')]
+            fields = stat[stat.rindex(')') + 2:].split()
+            cpu_s = (int(fields[11]) + int(fields[12])) / ticks
+            out[int(tid)] = {"name": name, "cpu_s": cpu_s}
+        except Exception:
+            continue
+    return out
+
+
+class FpsMeter:
+    """캡처 간격으로 실측 fps 게이지와 capture 드롭 카운터를 갱신."""
+
+    def __init__(self, target_fps: float, window_sec: float = 1.0):
+        self.target_fps = float(target_fps)
+        self.window_sec = float(window_sec)
+        self._window_start = None
+        self._window_frames = 0
+        self._last = None
+        TARGET_FPS.set(self.target_fps)
+
+    def tick(self, now: float = None) -> None:
+        now = time.monotonic() if now is None else now
+        FRAMES_CAPTURED.inc()
+        if self._last is not None and self.target_fps > 0:
+            expected = 1.0 / self.target_fps
+            gap = now - self._last
+            # 기대 간격의 1.5배 이상 벌어지면 그 사이 프레임을 놓친 것으로 본다
+            if gap > expected * 1.5:
+                FRAMES_DROPPED.inc(max(1, int(round(gap / expected)) - 1), consumer='capture')
+        self._last = now
+        if self._window_start is None:
+            self._window_start = now
+        self._window_frames += 1
+        elapsed = now - self._window_start
+        if elapsed >= self.window_sec:
+            CAPTURE_FPS.set(round(self._window_frames / elapsed, 2))
+            self._window_start = now
+            self._window_frames = 0
+
+
+def render_latest() -> bytes:
+    return REGISTRY.render().encode('utf-8')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_latest()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+
+
+def start_metrics_http_server(port: int, host: str = '0.0.0.0'):
+    """전용 포트에 /metrics 서버 시작 (중복 호출 시 무시)."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+    try:
+        _metrics_server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+        threading.Thread(target=_metrics_server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"[METRICS] HTTP 서버 시작: http://{host}:{port}/metrics")
+    except Exception as e:
+        print(f"[METRICS] HTTP 서버 시작 실패: {e}")
+        _metrics_server = None
+    return _metrics_server
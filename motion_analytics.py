@@ -0,0 +1,290 @@
+"""
+QR 인식 / 옵티컬 플로우 모션 감지 로직
+
+camera_on(실시간)과 replay.py(오프라인 재생)가 동일한 판정 로직을 공유하도록 분리한 모듈입니다.
+Picamera2/GPIO/GStreamer에 의존하지 않습니다.
+"""
+
+import cv2
+import numpy as np
+try:
+    from pyzbar import pyzbar
+except Exception:
+    pyzbar = None
+
+# 옵티컬 플로우 기본 파라미터 (camera_on 기본값)
+OF_DEFAULT_PARAMS = {
+    "target_width": 640,
+    "interval_frames": 1,
+    "redetect_interval": 30,
+    "max_corners": 200,
+    "quality_level": 0.003,
+    "min_distance": 7,
+    "block_size": 3,
+    "win_size": (25, 25),
+    "max_level": 2,
+    "min_mag": 1.0,
+    "fb_thresh": 4.0,
+    "min_moving_pts": 8,
+    "idle_timeout": 2.0,  # 모션이 사라진 뒤 이 시간(초) 지나면 세그먼트 종료
+}
+
+
+# --- QR ---
+def enhance_image_for_qr(frame: np.ndarray):
+    if frame is None:
+        return None
+    try:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    except Exception:
+        return frame
+    denoised = cv2.fastNlMeansDenoising(gray)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    enhanced = clahe.apply(denoised)
+    kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+    sharpened = cv2.filter2D(enhanced, -1, kernel)
+    return sharpened
+
+def detect_qr_codes_enhanced(frame: np.ndarray):
+    if frame is None or pyzbar is None:
+        return []
+    decoded_original = pyzbar.decode(frame)
+    enhanced = enhance_image_for_qr(frame)
+    decoded_enhanced = pyzbar.decode(enhanced) if enhanced is not None else []
+    all_results = []
+    for obj in decoded_original:
+        all_results.append({ 'data': obj.data.decode('utf-8'), 'rect': obj.rect, 'polygon': obj.polygon, 'quality': 'original' })
+    for obj in decoded_enhanced:
+        data = obj.data.decode('utf-8')
+        if not any(r['data'] == data for r in all_results):
+            all_results.append({ 'data': data, 'rect': obj.rect, 'polygon': obj.polygon, 'quality': 'enhanced' })
+    return all_results
+
+
+class QrScanner:
+    """QR 검출 + 쿨다운 판정. 새로 처리해야 할 결과만 반환한다."""
+
+    def __init__(self, cooldown_period: float = 3.0):
+        self.cooldown_period = float(cooldown_period)
+        self.last_data = None
+        self.last_time = 0.0
+
+    def scan(self, frame: np.ndarray, now: float):
+        """프레임을 검사해 (전체 결과, 쿨다운을 통과한 결과) 반환."""
+        results = detect_qr_codes_enhanced(frame)
+        accepted = []
+        for res in results:
+            data = res.get('data') if isinstance(res, dict) else None
+            if not data:
+                continue
+            if (data != self.last_data) or (now - self.last_time > self.cooldown_period):
+                accepted.append(res)
+                self.last_data = data
+                self.last_time = now
+        return results, accepted
+
+
+# --- Optical Flow ---
+def clamp_roi(roi, frame_w: int, frame_h: int):
+    """ROI 사각형 [x, y, w, h]를 프레임 경계 안으로 클램프. 미설정/오류 시 전체 프레임."""
+    x, y, w, h = 0, 0, frame_w, frame_h
+    try:
+        if isinstance(roi, (list, tuple)) and len(roi) == 4:
+            rx, ry, rw, rh = [int(v) for v in roi]
+            rx = max(0, min(rx, frame_w - 1))
+            ry = max(0, min(ry, frame_h - 1))
+            rw = max(1, min(int(rw), frame_w - rx))
+            rh = max(1, min(int(rh), frame_h - ry))
+            x, y, w, h = rx, ry, rw, rh
+    except Exception:
+        pass
+    return x, y, w, h
+
+
+class OpticalFlowMotionDetector:
+    """LK 옵티컬 플로우 + Forward-Backward 검증 기반 모션 판정기."""
+
+    def __init__(self, **params):
+        p = dict(OF_DEFAULT_PARAMS)
+        p.update({k: v for k, v in params.items() if v is not None})
+        self.params = p
+        self.target_width = int(p["target_width"])
+        self.interval_frames = int(p["interval_frames"])
+        self.redetect_interval = int(p["redetect_interval"])
+        self.max_corners = int(p["max_corners"])
+        self.quality_level = float(p["quality_level"])
+        self.min_distance = float(p["min_distance"])
+        self.block_size = int(p["block_size"])
+        self.win_size = tuple(p["win_size"])
+        self.max_level = int(p["max_level"])
+        self.term_criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        self.min_mag = float(p["min_mag"])
+        self.fb_thresh = float(p["fb_thresh"])
+        self.min_moving_pts = int(p["min_moving_pts"])
+        self.draw_overlay = True
+        self.reset()
+
+    def reset(self) -> None:
+        self.prev_gray_small = None
+        self.prev_pts = None
+        self.since_redetect = 0
+        self.frame_idx = 0
+        self.motion = False
+        self.moving_count = 0
+        # 오버레이용 벡터/스케일 버퍼 [(x1, y1, x0, y0), ...]
+        self.last_vectors = None
+        self.last_scale = (1.0, 1.0)
+        self._mask_key = None
+        self._mask_full = None
+        self._mask_small = None
+
+    def _masks_for(self, frame_h: int, frame_w: int, roi_rect, small_size):
+        """ROI 마스크(원본/다운스케일)를 (해상도, ROI)별로 캐시하여 재사용."""
+        key = (frame_h, frame_w, tuple(roi_rect), small_size)
+        if key != self._mask_key:
+            x, y, rw, rh = roi_rect
+            mask = np.zeros((frame_h, frame_w), dtype=np.uint8)
+            cv2.rectangle(mask, (x, y), (x + rw - 1, y + rh - 1), 255, -1)
+            self._mask_full = mask
+            if small_size is not None:
+                self._mask_small = cv2.resize(mask, small_size, interpolation=cv2.INTER_NEAREST)
+            else:
+                self._mask_small = mask
+            self._mask_key = key
+        return self._mask_full, self._mask_small
+
+    def _redetect(self, gray_small, roi_mask_small) -> None:
+        self.prev_pts = cv2.goodFeaturesToTrack(
+            gray_small,
+            maxCorners=self.max_corners,
+            qualityLevel=self.quality_level,
+            minDistance=self.min_distance,
+            blockSize=self.block_size,
+            mask=roi_mask_small,
+        )
+        self.prev_gray_small = gray_small
+        self.since_redetect = 0
+
+    def update(self, frame: np.ndarray, roi=None) -> bool:
+        """프레임 한 장을 처리하고 모션 여부 반환. 프레임은 RGB(또는 동일 레이아웃)로 가정."""
+        h_total, w_total = frame.shape[:2]
+        roi_rect = clamp_roi(roi, w_total, h_total)
+        # 모션 감지 (RGB -> GRAY)
+        try:
+            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        except Exception:
+            gray = frame
+
+        # 1) 다운스케일 그레이/마스크 준비
+        h_total, w_total = gray.shape[:2]
+        small_size = None
+        if w_total != self.target_width:
+            scale = self.target_width / float(w_total)
+            small_size = (int(w_total * scale), int(h_total * scale))
+        full_mask, roi_mask_small = self._masks_for(h_total, w_total, roi_rect, small_size)
+        roi_gray = cv2.bitwise_and(gray, gray, mask=full_mask)
+        if small_size is not None:
+            gray_small = cv2.resize(roi_gray, small_size, interpolation=cv2.INTER_AREA)
+        else:
+            gray_small = roi_gray
+
+        self.frame_idx += 1
+        do_flow = (self.interval_frames <= 1) or (self.frame_idx % self.interval_frames == 0)
+        if not do_flow:
+            return self.motion
+        if self.prev_gray_small is None or self.prev_pts is None or self.since_redetect >= self.redetect_interval:
+            self._redetect(gray_small, roi_mask_small)
+            # 첫 프레임은 모션 판정하지 않음
+            self.motion = False
+            self.moving_count = 0
+            return self.motion
+
+        self.motion = False
+        self.moving_count = 0
+        if self.prev_pts is None or len(self.prev_pts) == 0:
+            return self.motion
+        prev_pts_f32 = self.prev_pts.astype(np.float32)
+        next_pts, status, _err = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray_small, gray_small, prev_pts_f32, None,
+            winSize=self.win_size,
+            maxLevel=self.max_level,
+            criteria=self.term_criteria,
+        )
+        if next_pts is None or status is None:
+            # 추적 실패 → 재검출
+            self._redetect(gray_small, roi_mask_small)
+            self.last_vectors = None
+            return self.motion
+
+        status_flat = status.ravel()
+        good_new = next_pts[status_flat == 1]
+        good_old = prev_pts_f32[status_flat == 1]
+
+        # Forward-Backward 체크
+        if good_new is not None and len(good_new) > 0:
+            back_pts, back_status, _ = cv2.calcOpticalFlowPyrLK(
+                gray_small, self.prev_gray_small, good_new.reshape(-1, 1, 2).astype(np.float32), None,
+                winSize=self.win_size,
+                maxLevel=self.max_level,
+                criteria=self.term_criteria,
+            )
+            if back_pts is not None and back_status is not None:
+                back_pts = np.reshape(back_pts, (-1, 2))
+                fb_err = np.linalg.norm(np.reshape(good_old, (-1, 2)) - back_pts, axis=1)
+                fb_mask = fb_err <= self.fb_thresh
+                good_new = np.reshape(good_new, (-1, 2))[fb_mask]
+                good_old = np.reshape(good_old, (-1, 2))[fb_mask]
+
+        # 이동량 기반 모션 판정
+        if good_new is not None and len(good_new) > 0:
+            good_new = np.reshape(good_new, (-1, 2))
+            good_old = np.reshape(good_old, (-1, 2))
+            mag = np.linalg.norm(good_new - good_old, axis=1)
+            moving = mag >= self.min_mag
+            self.moving_count = int(np.sum(moving))
+            self.motion = self.moving_count >= self.min_moving_pts
+            # 오버레이용 벡터 저장 (다운스케일 좌표 기준)
+            if self.draw_overlay:
+                self.last_vectors = [
+                    (float(n[0]), float(n[1]), float(o[0]), float(o[1]))
+                    for n, o in zip(good_new[moving], good_old[moving])
+                ]
+                sx = float(w_total) / float(gray_small.shape[1]) if gray_small.shape[1] > 0 else 1.0
+                sy = float(h_total) / float(gray_small.shape[0]) if gray_small.shape[0] > 0 else 1.0
+                self.last_scale = (sx, sy)
+        else:
+            self.last_vectors = None
+
+        # 상태 업데이트
+        self.prev_gray_small = gray_small
+        if good_new is not None and len(good_new) > 0:
+            self.prev_pts = good_new.reshape(-1, 1, 2)
+        else:
+            self.prev_pts = None
+        self.since_redetect += 1
+        return self.motion
+
+
+class MotionSegmentTracker:
+    """모션 판정 결과로 세그먼트 열기/닫기 시점을 결정 (idle_timeout 경과 시 닫기)."""
+
+    def __init__(self, idle_timeout: float = OF_DEFAULT_PARAMS["idle_timeout"]):
+        self.idle_timeout = float(idle_timeout)
+        self.active = False
+        self.last_motion_time = 0.0
+
+    def reset(self) -> None:
+        self.active = False
+
+    def update(self, motion: bool, now: float):
+        """'open' / 'close' / None 반환."""
+        if motion:
+            self.last_motion_time = now
+            if not self.active:
+                self.active = True
+                return 'open'
+            return None
+        if self.active and (now - self.last_motion_time) > self.idle_timeout:
+            self.active = False
+            return 'close'
+        return None
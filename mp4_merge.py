@@ -0,0 +1,626 @@
+"""
+MP4 세그먼트 무재인코딩 병합 (프로세스 내 스트림 카피)
+
+세그먼트 mp4의 비디오 트랙 샘플 테이블(stsz/stco/co64/stsc/stts/ctts/stss)을 읽어
+H.264 액세스 유닛을 디코드 없이 하나의 mp4(faststart: moov → mdat)로 이어 붙입니다.
+조각 MP4(fMP4) 세그먼트는 moof/trun에서 샘플을 읽으며, 전원 차단으로 잘린 마지막 조각은 제외합니다.
+
+- 타임스탬프: 세그먼트별 DTS를 0부터 이어 붙이고, 타임스케일이 다르면 누적 오차 없이 환산
+- SPS/PPS 변경: 샘플 엔트리(avc1 + avcC)가 다르면 stsd에 엔트리를 추가하고 stsc로 전환
+- 해상도/코덱이 기준(첫 세그먼트)과 다른 세그먼트만 GStreamer로 재인코딩한 뒤 같은 방식으로 병합
+- 세그먼트 첫 샘플이 키프레임이 아니면 첫 키프레임 이전 샘플은 버림 (이어 붙인 뒤 디코드 불가)
+- 샘플 데이터 복사는 os.copy_file_range(가능 시)로 사용자 공간 복사 없이 수행
+
+예)
+  stats = concat_mp4(['a_seg000_raw.mp4', 'a_seg001_raw.mp4'], 'merged.mp4')
+  python3 mp4_merge.py merged.mp4 video_*_seg*_raw.mp4
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+from mp4_utils import (iter_boxes, iter_boxes_bytes, find_child, parse_track_ids, parse_trex, iter_complete_fragments,
+                       parse_moof_samples, SAMPLE_IS_NON_SYNC)
+
+# 출력 청크당 최대 샘플 수 (청크가 너무 크면 일부 플레이어의 탐색이 느려짐)
+CHUNK_MAX_SAMPLES = 30
+COPY_BLOCK_BYTES = 4 * 1024 * 1024
+H264_SAMPLE_ENTRIES = (b'avc1', b'avc3')
+# 1904-01-01 기준 mp4 시간
+MP4_EPOCH_OFFSET = 2082844800
+REENCODE_TIMEOUT_SEC = 600.0
+
+
+class Mp4MergeError(Exception):
+    pass
+
+
+class VideoTrack:
+    """세그먼트 하나의 비디오 트랙 샘플 테이블 (샘플 단위로 펼친 상태)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.timescale = 0
+        self.width = 0
+        self.height = 0
+        self.entries = []      # stsd 샘플 엔트리 원본 바이트
+        self.sizes = []
+        self.offsets = []
+        self.durations = []
+        self.cts = None        # ctts 오프셋 (없으면 None)
+        self.sync = None       # 키프레임 샘플 인덱스(0-based) 집합, None이면 전부 키프레임
+        self.sdi = []          # 샘플별 stsd 엔트리 인덱스(1-based)
+        self.fragment_starts = []  # 조각 MP4면 원본 조각별 첫 샘플 인덱스
+        self.fragment_offsets = []  # fragment_starts에 대응하는 moof 파일 오프셋
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.sizes)
+
+    @property
+    def codec(self) -> bytes:
+        return self.entries[0][4:8] if self.entries else b''
+
+    def duration_ticks(self) -> int:
+        return sum(self.durations)
+
+    def data_bytes(self) -> int:
+        return sum(self.sizes)
+
+    def is_sync(self, i: int) -> bool:
+        return self.sync is None or i in self.sync
+
+
+def _full_box_payload(data: bytes, off: int, hsz: int):
+    p = off + hsz
+    return data[p], p + 4
+
+
+def _parse_table(data: bytes, box, fmt: str):
+    """엔트리 개수 + 고정 길이 엔트리로 이뤄진 풀 박스를 튜플 리스트로 읽는다."""
+    if box is None:
+        return None
+    _version, p = _full_box_payload(data, box[0], box[2])
+    count = struct.unpack_from('>I', data, p)[0]
+    step = struct.calcsize(fmt)
+    p += 4
+    return [struct.unpack_from(fmt, data, p + i * step) for i in range(count)]
+
+
+def read_video_track(path: str) -> VideoTrack:
+    """mp4 파일에서 첫 번째 비디오 트랙의 샘플 테이블을 읽는다."""
+    size = os.path.getsize(path)
+    moov = None
+    fragments = []
+    with open(path, 'rb') as f:
+        for btype, off, bsize, hsz in iter_boxes(f, 0, size):
+            if btype == b'moov':
+                f.seek(off)
+                moov = f.read(bsize)
+                moov_hsz = hsz
+            elif btype == b'moof':
+                fragments.append((off, bsize, hsz))
+        if moov is None:
+            raise Mp4MergeError(f'moov 없음: {path}')
+        for btype, off, bsize, hsz in iter_boxes_bytes(moov, moov_hsz):
+            if btype != b'trak':
+                continue
+            t_start, t_end = off + hsz, off + bsize
+            hdlr = find_child(moov, [b'mdia', b'hdlr'], t_start, t_end)
+            if hdlr is None or moov[hdlr[0] + hdlr[2] + 8:hdlr[0] + hdlr[2] + 12] != b'vide':
+                continue
+            track = _read_trak(path, moov, t_start, t_end)
+            if fragments:
+                track_id, _ts = parse_track_ids(moov, t_start, t_end)
+                _read_fragments(track, f, fragments, size, track_id, parse_trex(moov, moov_hsz).get(track_id))
+            return track
+    raise Mp4MergeError(f'비디오 트랙 없음: {path}')
+
+
+def _read_fragments(track: VideoTrack, f, fragments, file_size: int, track_id: int, trex) -> None:
+    """조각(moof/mdat)의 샘플을 트랙 뒤에 이어 붙인다. 데이터가 파일 끝을 넘는 조각부터는 버린다."""
+    sync = [track.is_sync(i) for i in range(track.sample_count)]
+    cts = list(track.cts) if track.cts is not None else None
+    for off, moof, hsz in iter_complete_fragments(f, fragments, file_size):
+        parsed = parse_moof_samples(moof, off, hsz, track_id, trex)
+        if parsed is None:
+            continue
+        _decode_time, samples = parsed
+        if any(data_off + size > file_size for data_off, size, _d, _c, _fl, _s in samples):
+            print(f"[mp4-merge] 잘린 조각 이후 제외: {track.path} (offset {off})")
+            break
+        if not samples:
+            continue
+        track.fragment_starts.append(track.sample_count)
+        track.fragment_offsets.append(off)
+        for data_off, size, dur, c, flags, sdi in samples:
+            track.offsets.append(data_off)
+            track.sizes.append(size)
+            track.durations.append(dur)
+            track.sdi.append(sdi)
+            sync.append(not (flags & SAMPLE_IS_NON_SYNC))
+            if c and cts is None:
+                cts = [0] * (track.sample_count - 1)
+            if cts is not None:
+                cts.append(c)
+    track.cts = cts
+    track.sync = None if all(sync) else {i for i, v in enumerate(sync) if v}
+
+
+def _read_trak(path: str, moov: bytes, t_start: int, t_end: int) -> VideoTrack:
+    track = VideoTrack(path)
+    mdhd = find_child(moov, [b'mdia', b'mdhd'], t_start, t_end)
+    version, p = _full_box_payload(moov, mdhd[0], mdhd[2])
+    track.timescale = struct.unpack_from('>I', moov, p + (16 if version == 1 else 8))[0]
+    stbl = find_child(moov, [b'mdia', b'minf', b'stbl'], t_start, t_end)
+    if stbl is None or track.timescale <= 0:
+        raise Mp4MergeError(f'샘플 테이블 없음: {path}')
+    s_start, s_end = stbl[0] + stbl[2], stbl[0] + stbl[1]
+
+    def child(name):
+        return find_child(moov, [name], s_start, s_end)
+
+    stsd = child(b'stsd')
+    _, p = _full_box_payload(moov, stsd[0], stsd[2])
+    for btype, off, bsize, hsz in iter_boxes_bytes(moov, p + 4, stsd[0] + stsd[1]):
+        track.entries.append(bytes(moov[off:off + bsize]))
+    if not track.entries:
+        raise Mp4MergeError(f'샘플 엔트리 없음: {path}')
+    # VisualSampleEntry: 헤더(8) + reserved/data_reference_index(8) + pre_defined/reserved(16) → width, height
+    track.width, track.height = struct.unpack_from('>HH', track.entries[0], 32)
+
+    stsz = child(b'stsz')
+    _, p = _full_box_payload(moov, stsz[0], stsz[2])
+    sample_size, count = struct.unpack_from('>II', moov, p)
+    if sample_size:
+        track.sizes = [sample_size] * count
+    else:
+        track.sizes = list(struct.unpack_from(f'>{count}I', moov, p + 8))
+    if count == 0:
+        return track
+
+    stco = child(b'stco')
+    if stco is not None:
+        chunk_offsets = [e[0] for e in _parse_table(moov, stco, '>I')]
+    else:
+        co64 = child(b'co64')
+        if co64 is None:
+            raise Mp4MergeError(f'청크 오프셋 없음: {path}')
+        chunk_offsets = [e[0] for e in _parse_table(moov, co64, '>Q')]
+    stsc = _parse_table(moov, child(b'stsc'), '>III')
+    si = 0
+    for i, (first, per, sdi) in enumerate(stsc):
+        last = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+        for c in range(first - 1, last):
+            off = chunk_offsets[c]
+            for _ in range(per):
+                if si >= count:
+                    break
+                track.offsets.append(off)
+                track.sdi.append(sdi)
+                off += track.sizes[si]
+                si += 1
+    if si != count:
+        raise Mp4MergeError(f'stsc/stco가 샘플 수와 맞지 않음: {path} ({si}/{count})')
+
+    for n, delta in _parse_table(moov, child(b'stts'), '>II'):
+        track.durations.extend([delta] * n)
+    del track.durations[count:]
+    if len(track.durations) < count:
+        track.durations.extend([track.durations[-1] if track.durations else 0] * (count - len(track.durations)))
+
+    ctts = child(b'ctts')
+    if ctts is not None:
+        version = moov[ctts[0] + ctts[2]]
+        track.cts = []
+        for n, off in _parse_table(moov, ctts, '>Ii' if version == 1 else '>II'):
+            track.cts.extend([off] * n)
+        del track.cts[count:]
+        track.cts.extend([0] * (count - len(track.cts)))
+
+    stss = child(b'stss')
+    if stss is not None:
+        track.sync = {e[0] - 1 for e in _parse_table(moov, stss, '>I')}
+    return track
+
+
+def needs_reencode(track: VideoTrack, width: int, height: int) -> bool:
+    """기준 해상도로 그대로 이어 붙일 수 없는 세그먼트인지 (코덱/해상도 차이)."""
+    if track.codec not in H264_SAMPLE_ENTRIES:
+        return True
+    if any(e[4:8] not in H264_SAMPLE_ENTRIES for e in track.entries):
+        return True
+    return (track.width, track.height) != (width, height)
+
+
+def estimate_bitrate_kbps(track: VideoTrack, default: int = 4000) -> int:
+    seconds = track.duration_ticks() / float(track.timescale) if track.timescale else 0.0
+    if seconds <= 0:
+        return default
+    return max(200, int(track.data_bytes() * 8 / seconds / 1000))
+
+
+def reencode_segment(src: str, dst: str, width: int, height: int, bitrate_kbps: int = 4000,
+                     timeout: float = REENCODE_TIMEOUT_SEC) -> None:
+    """해상도/코덱이 다른 세그먼트 하나를 기준 파라미터의 H.264 mp4로 재인코딩."""
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    desc = (
+        f"filesrc location={src} ! decodebin ! videoconvert ! videoscale ! "
+        f"video/x-raw,format=I420,width={int(width)},height={int(height)} ! "
+        f"x264enc speed-preset=ultrafast tune=zerolatency bitrate={int(bitrate_kbps)} key-int-max=60 ! "
+        f"h264parse ! video/x-h264,stream-format=avc,alignment=au ! mp4mux ! filesink location={dst}"
+    )
+    pipeline = Gst.parse_launch(desc)
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = pipeline.get_bus().timed_pop_filtered(int(timeout * Gst.SECOND),
+                                                    Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg is None:
+            raise Mp4MergeError(f'재인코딩 시간 초과: {src}')
+        if msg.type == Gst.MessageType.ERROR:
+            err, _dbg = msg.parse_error()
+            raise Mp4MergeError(f'재인코딩 실패: {src}: {err}')
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+# --- 출력 박스 생성 ---
+def box(btype: bytes, *payload) -> bytes:
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), btype) + body
+
+
+def full_box(btype: bytes, version: int, flags: int, *payload) -> bytes:
+    return box(btype, struct.pack('>I', (version << 24) | flags), *payload)
+
+
+MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+FTYP = box(b'ftyp', struct.pack('>4sI', b'isom', 512), b'isomiso2avc1mp41')
+
+
+def _run_length(values):
+    runs = []
+    for v in values:
+        if runs and runs[-1][1] == v:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, v])
+    return runs
+
+
+def build_moov(timescale: int, width: int, height: int, media_duration: int, stbl_boxes, mvex: bytes = b'') -> bytes:
+    """단일 비디오 트랙 moov 생성. mvex를 주면 조각(fMP4) 파일의 초기화 moov가 된다."""
+    ts = int(timescale)
+    movie_ts = 1000
+    movie_duration = int(round(media_duration * movie_ts / float(ts)))
+    now = int(time.time()) + MP4_EPOCH_OFFSET
+    v_mvhd = 1 if movie_duration > 0xFFFFFFFF else 0
+    v_mdhd = 1 if media_duration > 0xFFFFFFFF else 0
+
+    if v_mvhd:
+        mvhd_times = struct.pack('>QQIQ', now, now, movie_ts, movie_duration)
+        tkhd_times = struct.pack('>QQII', now, now, 1, 0) + struct.pack('>Q', movie_duration)
+    else:
+        mvhd_times = struct.pack('>IIII', now, now, movie_ts, movie_duration)
+        tkhd_times = struct.pack('>IIIII', now, now, 1, 0, movie_duration)
+    mvhd = full_box(b'mvhd', v_mvhd, 0, mvhd_times,
+                    struct.pack('>IH10x', 0x00010000, 0x0100), MATRIX, bytes(24), struct.pack('>I', 2))
+    tkhd = full_box(b'tkhd', v_mvhd, 3, tkhd_times,
+                    struct.pack('>8xhhh2x', 0, 0, 0), MATRIX,
+                    struct.pack('>II', int(width) << 16, int(height) << 16))
+    if v_mdhd:
+        mdhd_times = struct.pack('>QQIQ', now, now, ts, media_duration)
+    else:
+        mdhd_times = struct.pack('>IIII', now, now, ts, media_duration)
+    mdhd = full_box(b'mdhd', v_mdhd, 0, mdhd_times, struct.pack('>HH', 0x55C4, 0))  # 'und'
+    hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00')
+    vmhd = full_box(b'vmhd', 0, 1, bytes(8))
+    dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+    stbl = box(b'stbl', *stbl_boxes)
+    minf = box(b'minf', vmhd, dinf, stbl)
+    mdia = box(b'mdia', mdhd, hdlr, minf)
+    trak = box(b'trak', tkhd, mdia)
+    return box(b'moov', mvhd, trak, mvex)
+
+
+def _build_moov(plan: dict, chunk_offsets, use_co64: bool) -> bytes:
+    durations = plan["durations"]
+    stsd = full_box(b'stsd', 0, 0, struct.pack('>I', len(plan["entries"])), *plan["entries"])
+    stts_runs = _run_length(durations)
+    stts = full_box(b'stts', 0, 0, struct.pack('>I', len(stts_runs)),
+                     b''.join(struct.pack('>II', n, d) for n, d in stts_runs))
+    boxes = [stsd, stts]
+    if plan["cts"] is not None:
+        ctts_runs = _run_length(plan["cts"])
+        negative = any(v < 0 for _, v in ctts_runs)
+        fmt = '>Ii' if negative else '>II'
+        boxes.append(full_box(b'ctts', 1 if negative else 0, 0, struct.pack('>I', len(ctts_runs)),
+                               b''.join(struct.pack(fmt, n, v) for n, v in ctts_runs)))
+    if plan["sync"] is not None:
+        boxes.append(full_box(b'stss', 0, 0, struct.pack('>I', len(plan["sync"])),
+                               struct.pack(f'>{len(plan["sync"])}I', *plan["sync"])))
+    stsc = []
+    for idx, (count, sdi) in enumerate(plan["chunks"]):
+        if not stsc or stsc[-1][1] != count or stsc[-1][2] != sdi:
+            stsc.append((idx + 1, count, sdi))
+    boxes.append(full_box(b'stsc', 0, 0, struct.pack('>I', len(stsc)),
+                           b''.join(struct.pack('>III', *e) for e in stsc)))
+    sizes = plan["sizes"]
+    if sizes and all(s == sizes[0] for s in sizes):
+        boxes.append(full_box(b'stsz', 0, 0, struct.pack('>II', sizes[0], len(sizes))))
+    else:
+        boxes.append(full_box(b'stsz', 0, 0, struct.pack('>II', 0, len(sizes)), struct.pack(f'>{len(sizes)}I', *sizes)))
+    if use_co64:
+        boxes.append(full_box(b'co64', 0, 0, struct.pack('>I', len(chunk_offsets)),
+                               struct.pack(f'>{len(chunk_offsets)}Q', *chunk_offsets)))
+    else:
+        boxes.append(full_box(b'stco', 0, 0, struct.pack('>I', len(chunk_offsets)),
+                               struct.pack(f'>{len(chunk_offsets)}I', *chunk_offsets)))
+    return build_moov(plan["timescale"], plan["width"], plan["height"], sum(durations), boxes)
+
+
+def first_sync_index(track: VideoTrack):
+    """첫 키프레임 샘플 인덱스 (없으면 None). 그 이전 샘플은 이어 붙이면 디코드할 수 없다."""
+    for i in range(track.sample_count):
+        if track.is_sync(i):
+            return i
+    return None
+
+
+def rebase_timing(track: VideoTrack, timescale: int, first: int = 0):
+    """first 샘플부터의 (durations, cts)를 출력 타임스케일로 환산.
+
+    세그먼트 내 DTS를 누적 시간으로 환산하므로 타임스케일이 달라도 반올림 오차가 쌓이지 않는다.
+    길이 0인 샘플(마지막 샘플 등)은 직전의 유효한 길이로 채운다.
+    """
+    same = track.timescale == timescale
+    last_dur = next((d for d in reversed(track.durations) if d > 0), 1)
+    durations = []
+    cum_in = 0
+    prev_out = 0
+    for i in range(first, track.sample_count):
+        d = track.durations[i] if track.durations[i] > 0 else last_dur
+        cum_in += d
+        cur_out = cum_in if same else int(round(cum_in * timescale / float(track.timescale)))
+        durations.append(max(1, cur_out - prev_out))
+        prev_out = cur_out
+    cts = None
+    if track.cts is not None:
+        cts = [c if same else int(round(c * timescale / float(track.timescale))) for c in track.cts[first:]]
+    return durations, cts
+
+
+def _plan(tracks) -> dict:
+    """세그먼트 트랙들을 하나의 샘플 테이블로 합친다 (출력 타임스케일 = 첫 세그먼트)."""
+    ref = tracks[0]
+    ts = ref.timescale
+    plan = {
+        "timescale": ts, "width": ref.width, "height": ref.height,
+        "entries": [], "sizes": [], "durations": [], "cts": None, "sync": [],
+        "chunks": [],   # (샘플 수, stsd 인덱스)
+        "copies": [],   # (트랙, 시작 샘플, 끝 샘플) 순서대로 mdat에 기록
+    }
+    entry_index = {}
+    has_cts = any(t.cts is not None for t in tracks)
+    if has_cts:
+        plan["cts"] = []
+    all_sync = True
+    for t in tracks:
+        first = first_sync_index(t)
+        if first is None:
+            print(f"[mp4-merge] 키프레임 없음, 건너뜀: {t.path}")
+            continue
+        if first > 0:
+            print(f"[mp4-merge] {t.path}: 첫 키프레임 이전 {first}개 샘플 제외")
+        durations, cts = rebase_timing(t, ts, first)
+        plan["durations"].extend(durations)
+        if has_cts:
+            plan["cts"].extend(cts if cts is not None else [0] * len(durations))
+        seg_base = len(plan["sizes"])
+        chunk_start = first
+        for i in range(first, t.sample_count):
+            plan["sizes"].append(t.sizes[i])
+            if t.is_sync(i):
+                plan["sync"].append(seg_base + (i - first) + 1)
+            else:
+                all_sync = False
+            # 청크 경계: 최대 샘플 수, 샘플 엔트리 변경, 세그먼트 끝
+            end_chunk = (i + 1 == t.sample_count or i + 1 - chunk_start >= CHUNK_MAX_SAMPLES
+                         or t.sdi[i + 1] != t.sdi[i])
+            if end_chunk:
+                entry = t.entries[t.sdi[i] - 1]
+                if entry not in entry_index:
+                    plan["entries"].append(entry)
+                    entry_index[entry] = len(plan["entries"])
+                plan["chunks"].append((i + 1 - chunk_start, entry_index[entry]))
+                chunk_start = i + 1
+        plan["copies"].append((t, first, t.sample_count))
+    if not plan["sizes"]:
+        raise Mp4MergeError('병합할 샘플이 없습니다')
+    if all_sync:
+        plan["sync"] = None
+    return plan
+
+
+def _copy_range(src, dst, offset: int, length: int) -> None:
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        try:
+            while length > 0:
+                n = copy_file_range(src.fileno(), dst.fileno(), min(length, COPY_BLOCK_BYTES), offset)
+                if n <= 0:
+                    break
+                offset += n
+                length -= n
+            if length == 0:
+                return
+        except OSError:
+            pass
+    src.seek(offset)
+    while length > 0:
+        block = src.read(min(length, COPY_BLOCK_BYTES))
+        if not block:
+            raise Mp4MergeError(f'샘플 데이터 부족: {src.name}')
+        write_all(dst, block)
+        length -= len(block)
+
+
+def write_all(dst, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        n = dst.write(view)
+        view = view[n:]
+
+
+def write_samples(dst, track: VideoTrack, first: int, end: int) -> None:
+    """샘플을 순서대로 복사하되, 원본에서 연속인 구간은 한 번에 복사."""
+    with open(track.path, 'rb') as src:
+        run_off = None
+        run_len = 0
+        for i in range(first, end):
+            off, size = track.offsets[i], track.sizes[i]
+            if run_off is not None and run_off + run_len == off:
+                run_len += size
+                continue
+            if run_off is not None:
+                _copy_range(src, dst, run_off, run_len)
+            run_off, run_len = off, size
+        if run_off is not None:
+            _copy_range(src, dst, run_off, run_len)
+
+
+def concat_mp4(segment_paths, output_path: str, reencode: bool = True) -> dict:
+    """세그먼트 mp4들을 하나로 병합. 실패 시 Mp4MergeError.
+
+    반환: {"segments", "copied", "reencoded", "skipped", "samples", "sample_entries",
+           "duration_s", "bytes", "elapsed_s"}
+    """
+    t0 = time.time()
+    tracks = []
+    skipped = []
+    for p in segment_paths:
+        try:
+            t = read_video_track(p)
+            if t.sample_count > 0:
+                tracks.append(t)
+            else:
+                skipped.append(p)
+        except Exception as e:
+            print(f"[mp4-merge] 세그먼트 읽기 실패, 건너뜀: {p}: {e}")
+            skipped.append(p)
+    if not tracks:
+        raise Mp4MergeError('읽을 수 있는 세그먼트가 없습니다')
+
+    ref = next((t for t in tracks if t.codec in H264_SAMPLE_ENTRIES), None)
+    if ref is None:
+        raise Mp4MergeError('H.264 세그먼트가 없습니다')
+    temp_files = []
+    reencoded = 0
+    try:
+        merged_tracks = []
+        for t in tracks:
+            if t is not ref and needs_reencode(t, ref.width, ref.height):
+                if not reencode:
+                    print(f"[mp4-merge] 파라미터 불일치, 건너뜀: {t.path} ({t.codec!r} {t.width}x{t.height})")
+                    skipped.append(t.path)
+                    continue
+                tmp = f"{output_path}.reenc{len(temp_files)}.mp4"
+                temp_files.append(tmp)
+                print(f"[mp4-merge] 재인코딩: {t.path} ({t.codec.decode(errors='replace')} {t.width}x{t.height} → {ref.width}x{ref.height})")
+                try:
+                    reencode_segment(t.path, tmp, ref.width, ref.height, estimate_bitrate_kbps(ref))
+                    t = read_video_track(tmp)
+                    reencoded += 1
+                except Exception as e:
+                    print(f"[mp4-merge] 재인코딩 실패, 건너뜀: {t.path}: {e}")
+                    skipped.append(t.path)
+                    continue
+            merged_tracks.append(t)
+
+        plan = _plan(merged_tracks)
+        total = sum(plan["sizes"])
+        ftyp = FTYP
+        mdat_hsz = 16 if total + 8 > 0xFFFFFFFF else 8
+
+        def layout(use_co64):
+            # moov 크기는 청크 오프셋 값과 무관하므로 0으로 한 번 만들어 크기를 구한 뒤 실제 값으로 다시 만든다
+            probe = _build_moov(plan, [0] * len(plan["chunks"]), use_co64)
+            data_start = len(ftyp) + len(probe) + mdat_hsz
+            offsets = []
+            pos = data_start
+            si = 0
+            for count, _sdi in plan["chunks"]:
+                offsets.append(pos)
+                pos += sum(plan["sizes"][si:si + count])
+                si += count
+            return offsets, pos
+
+        chunk_offsets, end_pos = layout(False)
+        use_co64 = end_pos > 0xFFFFFFFF
+        if use_co64:
+            chunk_offsets, end_pos = layout(True)
+        moov = _build_moov(plan, chunk_offsets, use_co64)
+
+        tmp_out = output_path + '.part'
+        # copy_file_range와 write가 같은 파일 위치를 공유하도록 버퍼 없이 연다
+        with open(tmp_out, 'wb', buffering=0) as dst:
+            write_all(dst, ftyp)
+            write_all(dst, moov)
+            if mdat_hsz == 16:
+                write_all(dst, struct.pack('>I4sQ', 1, b'mdat', total + 16))
+            else:
+                write_all(dst, struct.pack('>I4s', total + 8, b'mdat'))
+            for track, first, end in plan["copies"]:
+                write_samples(dst, track, first, end)
+            written = os.fstat(dst.fileno()).st_size
+        if written != end_pos:
+            os.remove(tmp_out)
+            raise Mp4MergeError(f'출력 크기 불일치: {written} != {end_pos}')
+        os.replace(tmp_out, output_path)
+    finally:
+        for tmp in temp_files:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+    stats = {
+        "segments": len(plan["copies"]),
+        "copied": len(plan["copies"]) - reencoded,
+        "reencoded": reencoded,
+        "skipped": skipped,
+        "samples": len(plan["sizes"]),
+        "sample_entries": len(plan["entries"]),
+        "duration_s": round(sum(plan["durations"]) / float(plan["timescale"]), 3),
+        "bytes": end_pos,
+        "elapsed_s": round(time.time() - t0, 3),
+    }
+    print(f"[mp4-merge] 완료: {output_path} (세그먼트 {stats['segments']}개, 재인코딩 {reencoded}개, "
+          f"{stats['duration_s']:.1f}s, {stats['elapsed_s']:.2f}s 소요)")
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='세그먼트 mp4 무재인코딩 병합')
+    parser.add_argument('output', help='출력 mp4 경로')
+    parser.add_argument('segments', nargs='+', help='병합할 세그먼트 (순서대로)')
+    parser.add_argument('--no-reencode', action='store_true', help='파라미터가 다른 세그먼트는 재인코딩하지 않고 제외')
+    args = parser.parse_args(argv)
+    try:
+        stats = concat_mp4(args.segments, args.output, reencode=not args.no_reencode)
+    except Mp4MergeError as e:
+        print(f"[mp4-merge] 실패: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+MP4(ISO BMFF) 박스 파싱 유틸리티
+
+GStreamer/ffmpeg 없이 순수 파이썬으로 mp4 헤더를 읽어 세그먼트 검증 등에 사용합니다.
+"""
+
+import os
+import struct
+
+def read_box_header(f, offset: int, end: int):
+    """offset 위치의 박스 헤더를 읽어 (type, size, header_size) 반환. 읽을 수 없으면 None."""
+    if offset + 8 > end:
+        return None
+    f.seek(offset)
+    hdr = f.read(8)
+    if len(hdr) < 8:
+        return None
+    size, btype = struct.unpack('>I4s', hdr)
+    header_size = 8
+    if size == 1:
+        ext = f.read(8)
+        if len(ext) < 8:
+            return None
+        size = struct.unpack('>Q', ext)[0]
+        header_size = 16
+    elif size == 0:
+        # 파일 끝까지 이어지는 박스 (기록 중단된 mdat 등)
+        size = end - offset
+    if size < header_size:
+        return None
+    return btype, size, header_size
+
+
+def iter_boxes(f, start: int, end: int):
+    """[start, end) 구간의 박스를 순회하며 (type, offset, size, header_size)를 생성."""
+    offset = start
+    while offset < end:
+        hdr = read_box_header(f, offset, end)
+        if hdr is None:
+            return
+        btype, size, header_size = hdr
+        yield btype, offset, size, header_size
+        offset += size
+
+
+def iter_boxes_bytes(data: bytes, start: int = 0, end: int = None):
+    """메모리에 읽어둔 박스 데이터를 순회하며 (type, offset, size, header_size)를 생성."""
+    if end is None:
+        end = len(data)
+    offset = start
+    while offset + 8 <= end:
+        size, btype = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            return
+        yield btype, offset, size, header_size
+        offset += size
+
+
+def find_child(data: bytes, path, start: int = 0, end: int = None):
+    """박스 경로(예: [b'trak', b'mdia'])를 따라 내려가 첫 번째 매칭 박스의 (offset, size, header_size) 반환."""
+    if end is None:
+        end = len(data)
+    cur_start, cur_end = start, end
+    found = None
+    for name in path:
+        found = None
+        for btype, off, size, hsz in iter_boxes_bytes(data, cur_start, cur_end):
+            if btype == name:
+                found = (off, size, hsz)
+                break
+        if found is None:
+            return None
+        cur_start, cur_end = found[0] + found[2], found[0] + found[1]
+    return found
+
+
+# 조각 MP4 플래그 (ISO/IEC 14496-12 tfhd/trun)
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_DURATION = 0x000008
+TFHD_DEFAULT_SIZE = 0x000010
+TFHD_DEFAULT_FLAGS = 0x000020
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_DURATION = 0x000100
+TRUN_SIZE = 0x000200
+TRUN_FLAGS = 0x000400
+TRUN_CTS = 0x000800
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+def parse_track_ids(moov: bytes, trak_start: int, trak_end: int):
+    """trak 구간에서 (track_ID, mdhd timescale) 반환."""
+    tkhd = find_child(moov, [b'tkhd'], trak_start, trak_end)
+    p = tkhd[0] + tkhd[2]
+    track_id = struct.unpack_from('>I', moov, p + (20 if moov[p] == 1 else 12))[0]
+    mdhd = find_child(moov, [b'mdia', b'mdhd'], trak_start, trak_end)
+    p = mdhd[0] + mdhd[2]
+    timescale = struct.unpack_from('>I', moov, p + (20 if moov[p] == 1 else 12))[0]
+    return track_id, timescale
+
+
+def parse_trex(moov: bytes, header_size: int = 8) -> dict:
+    """mvex/trex 기본값: track_ID → (sample_description_index, duration, size, flags)."""
+    out = {}
+    mvex = find_child(moov, [b'mvex'], header_size)
+    if mvex is None:
+        return out
+    for btype, off, bsize, hsz in iter_boxes_bytes(moov, mvex[0] + mvex[2], mvex[0] + mvex[1]):
+        if btype == b'trex':
+            track_id, sdi, duration, size, flags = struct.unpack_from('>5I', moov, off + hsz + 4)
+            out[track_id] = (sdi, duration, size, flags)
+    return out
+
+
+def iter_complete_fragments(f, fragments, file_size: int):
+    """(offset, size, header_size) moof 목록 중 파일 안에 완전히 들어 있는 것만 (offset, moof 바이트, header_size)로 생성.
+
+    전원 차단으로 잘린 마지막 조각에서 멈춘다 (샘플 데이터가 파일 끝을 넘는 경우 포함은 parse_moof_samples가 거름).
+    """
+    for off, bsize, hsz in fragments:
+        if off + bsize > file_size:
+            return
+        f.seek(off)
+        yield off, f.read(bsize), hsz
+
+
+def parse_moof_samples(moof: bytes, moof_offset: int, header_size: int, track_id: int, trex=None):
+    """moof 하나에서 track_id 트랙의 (base_decode_time, 샘플 목록) 반환. 트랙이 없으면 None.
+
+    샘플: (파일 오프셋, 크기, 길이, cts 오프셋, 샘플 플래그, stsd 인덱스)
+    """
+    defaults = trex or (1, 0, 0, 0)
+    for btype, off, bsize, hsz in iter_boxes_bytes(moof, header_size):
+        if btype != b'traf':
+            continue
+        t_start, t_end = off + hsz, off + bsize
+        tfhd = find_child(moof, [b'tfhd'], t_start, t_end)
+        if tfhd is None:
+            continue
+        p = tfhd[0] + tfhd[2]
+        flags = struct.unpack_from('>I', moof, p)[0] & 0xFFFFFF
+        if struct.unpack_from('>I', moof, p + 4)[0] != track_id:
+            continue
+        q = p + 8
+        base = moof_offset
+        sdi, d_dur, d_size, d_flags = defaults
+        if flags & TFHD_BASE_DATA_OFFSET:
+            base = struct.unpack_from('>Q', moof, q)[0]
+            q += 8
+        if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+            sdi = struct.unpack_from('>I', moof, q)[0]
+            q += 4
+        if flags & TFHD_DEFAULT_DURATION:
+            d_dur = struct.unpack_from('>I', moof, q)[0]
+            q += 4
+        if flags & TFHD_DEFAULT_SIZE:
+            d_size = struct.unpack_from('>I', moof, q)[0]
+            q += 4
+        if flags & TFHD_DEFAULT_FLAGS:
+            d_flags = struct.unpack_from('>I', moof, q)[0]
+        decode_time = 0
+        tfdt = find_child(moof, [b'tfdt'], t_start, t_end)
+        if tfdt is not None:
+            p = tfdt[0] + tfdt[2]
+            decode_time = struct.unpack_from('>Q' if moof[p] == 1 else '>I', moof, p + 4)[0]
+        samples = []
+        data_pos = base
+        for b2, off2, bsize2, hsz2 in iter_boxes_bytes(moof, t_start, t_end):
+            if b2 != b'trun':
+                continue
+            p = off2 + hsz2
+            version = moof[p]
+            t_flags = struct.unpack_from('>I', moof, p)[0] & 0xFFFFFF
+            count = struct.unpack_from('>I', moof, p + 4)[0]
+            p += 8
+            if t_flags & TRUN_DATA_OFFSET:
+                data_pos = base + struct.unpack_from('>i', moof, p)[0]
+                p += 4
+            first_flags = None
+            if t_flags & TRUN_FIRST_SAMPLE_FLAGS:
+                first_flags = struct.unpack_from('>I', moof, p)[0]
+                p += 4
+            for i in range(count):
+                dur, size, s_flags, cts = d_dur, d_size, d_flags, 0
+                if t_flags & TRUN_DURATION:
+                    dur = struct.unpack_from('>I', moof, p)[0]
+                    p += 4
+                if t_flags & TRUN_SIZE:
+                    size = struct.unpack_from('>I', moof, p)[0]
+                    p += 4
+                if t_flags & TRUN_FLAGS:
+                    s_flags = struct.unpack_from('>I', moof, p)[0]
+                    p += 4
+                elif i == 0 and first_flags is not None:
+                    s_flags = first_flags
+                if t_flags & TRUN_CTS:
+                    cts = struct.unpack_from('>i' if version == 1 else '>I', moof, p)[0]
+                    p += 4
+                samples.append((data_pos, size, dur, cts, s_flags, sdi))
+                data_pos += size
+        return decode_time, samples
+    return None
+
+
+def parse_mvhd(data: bytes, offset: int, header_size: int):
+    """mvhd 박스에서 (timescale, duration) 반환."""
+    p = offset + header_size
+    version = data[p]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, p + 4 + 16)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, p + 4 + 8)
+    return timescale, duration
+
+
+def parse_sample_entry(moov: bytes, header_size: int = 8):
+    """첫 trak의 첫 샘플 엔트리에서 (codec, width, height) 반환. 없으면 None.
+
+    codec은 RFC 6381 형식 (avc1이면 avcC의 profile/level을 붙여 'avc1.64002a').
+    """
+    stsd = find_child(moov, [b'trak', b'mdia', b'minf', b'stbl', b'stsd'], header_size)
+    if stsd is None:
+        return None
+    for btype, off, bsize, hsz in iter_boxes_bytes(moov, stsd[0] + stsd[2] + 8, stsd[0] + stsd[1]):
+        if bsize < hsz + 28:
+            return None
+        # VisualSampleEntry: 헤더 + reserved/data_reference_index(8) + pre_defined/reserved(16) → width, height
+        width, height = struct.unpack_from('>HH', moov, off + hsz + 24)
+        codec = btype.decode('ascii', 'replace')
+        avcc = find_child(moov, [b'avcC'], off + hsz + 78, off + bsize)
+        if avcc is not None and avcc[1] >= avcc[2] + 4:
+            p = avcc[0] + avcc[2]
+            codec += '.' + moov[p + 1:p + 4].hex()
+        return codec, width, height
+    return None
+
+
+def probe_mp4(path: str) -> dict:
+    """mp4 최상위 박스 구조를 읽어 요약 정보를 반환.
+
+    반환: {"size", "has_ftyp", "has_moov", "has_mdat", "fragmented", "fragment_count",
+           "timescale", "duration_s", "truncated", "codec", "width", "height"}
+    """
+    info = {
+        "size": 0,
+        "has_ftyp": False,
+        "has_moov": False,
+        "has_mdat": False,
+        "fragmented": False,
+        "fragment_count": 0,
+        "timescale": 0,
+        "duration_s": 0.0,
+        "truncated": False,
+        "codec": None,
+        "width": 0,
+        "height": 0,
+    }
+    size = os.path.getsize(path)
+    info["size"] = size
+    with open(path, 'rb') as f:
+        moov = None
+        moov_hsz = 8
+        last_end = 0
+        fragments = []
+        for btype, off, bsize, hsz in iter_boxes(f, 0, size):
+            last_end = off + bsize
+            if btype == b'ftyp':
+                info["has_ftyp"] = True
+            elif btype == b'moov':
+                info["has_moov"] = True
+                f.seek(off)
+                moov = f.read(bsize)
+                moov_hsz = hsz
+            elif btype == b'mdat':
+                info["has_mdat"] = True
+            elif btype == b'moof':
+                info["fragmented"] = True
+                info["fragment_count"] += 1
+                fragments.append((off, bsize, hsz))
+        if last_end > size:
+            info["truncated"] = True
+        if moov is not None:
+            entry = parse_sample_entry(moov, moov_hsz)
+            if entry is not None:
+                info["codec"], info["width"], info["height"] = entry
+            mvhd = find_child(moov, [b'mvhd'], moov_hsz)
+            if mvhd is not None:
+                timescale, duration = parse_mvhd(moov, mvhd[0], mvhd[2])
+                if duration == 0:
+                    # 조각 MP4: 전체 길이는 mvex/mehd에 기록됨
+                    mehd = find_child(moov, [b'mvex', b'mehd'], moov_hsz)
+                    if mehd is not None:
+                        p = mehd[0] + mehd[2]
+                        duration = struct.unpack_from('>Q' if moov[p] == 1 else '>I', moov, p + 4)[0]
+                info["timescale"] = int(timescale)
+                if timescale > 0:
+                    info["duration_s"] = float(duration) / float(timescale)
+                if duration == 0 and fragments:
+                    # streamable 조각 MP4(mehd 없음) 또는 기록 중 중단: 완전한 조각의 샘플 길이 합
+                    info["duration_s"] = _fragments_duration_s(f, moov, moov_hsz, fragments, size)
+    return info
+
+
+def _fragments_duration_s(f, moov: bytes, moov_hsz: int, fragments, file_size: int) -> float:
+    trak = find_child(moov, [b'trak'], moov_hsz)
+    if trak is None:
+        return 0.0
+    track_id, timescale = parse_track_ids(moov, trak[0] + trak[2], trak[0] + trak[1])
+    if timescale <= 0:
+        return 0.0
+    trex = parse_trex(moov, moov_hsz).get(track_id)
+    end_time = 0
+    for off, moof, hsz in iter_complete_fragments(f, fragments, file_size):
+        parsed = parse_moof_samples(moof, off, hsz, track_id, trex)
+        if parsed is None:
+            continue
+        decode_time, samples = parsed
+        for data_off, size, dur, _cts, _flags, _sdi in samples:
+            if data_off + size > file_size:
+                return end_time / float(timescale)
+            decode_time += dur
+        end_time = max(end_time, decode_time)
+    return end_time / float(timescale)
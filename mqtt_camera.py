@@ -10,10 +10,6 @@ import os
 import re
 import psutil
 import subprocess
-import shutil
-import tempfile
-from pyzbar import pyzbar
-from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from functools import partial
  
 # import RPi.GPIO as GPIO
@@ -22,8 +18,22 @@ gi.require_version('Gst', '1.0')
 gi.require_version('GstRtspServer', '1.0')
 gi.require_version('GstApp', '1.0')
 from gi.repository import Gst, GstRtspServer, GObject, GstApp
-from gpiozero import LED, Button  # type: ignore
-from picamera2 import Picamera2, Preview  # type: ignore
+from camera_source import create_camera_source, create_led, create_button
+from motion_analytics import OpticalFlowMotionDetector, MotionSegmentTracker, QrScanner, detect_qr_codes_enhanced, enhance_image_for_qr
+from segment_finalizer import SegmentFinalizer, FINALIZE_EOS_TIMEOUT_SEC, FINALIZE_NULL_TIMEOUT_SEC, verify_segment_file, load_segment_index
+from job_queue import JobQueue, PermanentJobError
+from storage_manager import SIDECAR_SUFFIXES, StorageManager, classify
+from uploader import Uploader, UploadError
+import metrics
+from mp4_merge import concat_mp4
+from incremental_merge import IncrementalMerger
+from recording_catalog import read_meta, write_meta
+from recording_index import ensure_index
+from recording_verify import analyze_timestamps
+from hls_store import HLS_LOW_LATENCY, HLS_STORE_MODE, PLAYLIST_CONTENT_TYPE, attach_memory_sink, create_store, master_playlist, memory_sink_desc, prepare_file_output, tmpfs_dir
+from hls_http import BoundedHTTPServer, HlsRequestHandler
+from grading import TIMELINE_SUFFIX, grade_video, load_timeline, needs_grading, save_timeline, switches_from_placements
+from encode_hub import SharedEncoder, EncodedSubscriber, build_h264_appsrc_pipeline, build_mp4_writer_pipeline, H264_CAPS, JPEG_CAPS
 from datetime import datetime, timedelta, timezone
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
@@ -31,7 +41,8 @@ except Exception:
     ZoneInfo = None
 
 # --- Postprocess settings ---
-postprocess_after_capture = True  # 캡처 종료 후 후처리 모드로 최종 영상 생성
+# 1이면 인코더는 gamma/WB/gray 없이(중립) 기록하고, 병합 후 파라미터 타임라인을 적용한 보정본을 따로 생성 (grading.py)
+postprocess_after_capture = os.getenv('POSTPROCESS_AFTER_CAPTURE', '0') == '1'
 
 # 전역 설정 변수들
 current_gamma = 1.0
@@ -47,7 +58,7 @@ current_roi_poly = None
 # 감마 LUT 캐시
 gamma_lut = None
 gamma_lut_for = None  # LUT가 반영된 감마 값 캐시
-LED_PIN = LED(18)  # 사용할 GPIO 핀 번호
+LED_PIN = create_led(18)  # 사용할 GPIO 핀 번호 (CAMERA_GPIO=null이면 더미)
 camera_thread = None
 # 스케줄러 스레드 포인터
 scheduler_thread_schedule = None
@@ -56,10 +67,30 @@ scheduler_thread_motion = None
 # 모션 감지 세그먼트 전역 수집 (OF 모드에서 세그먼트 닫힐 때 경로 추가)
 global_detection_segments = []
 global_detection_segments_lock = threading.Lock()
-# 병합 작업 중 파일 저장 억제 플래그
-merge_in_progress = False
-# 예약 병합 시 세션 내부 병합을 건너뛰기 위한 플래그
-scheduled_merge_initiated = False
+# 세그먼트 백그라운드 마무리 작업자 (EOS/검증/인덱스 기록)
+segment_finalizer = None
+# 점진 병합기 (출력 경로 → IncrementalMerger). 마무리된 세그먼트는 즉시 출력 fMP4 끝에 추가
+incremental_mergers = {}
+incremental_mergers_lock = threading.Lock()
+closed_merge_outputs = set()
+# 모션 세그먼트가 추가되는 현재 출력 (예약 병합 시 마무리 후 새 파일로 교체)
+motion_merge_path = None
+# 디스크 기반 후처리 작업 큐 (병합/검증/업로드/삭제, 재부팅 후 이어서 처리)
+job_queue = None
+JOB_DIR = os.getenv('CAMERA_JOB_DIR', '')
+# 업로드 대상 (미설정 시 업로드 작업 생략): 병합 결과를 {UPLOAD_URL}/{파일명}으로 청크 업로드 (uploader.py)
+UPLOAD_URL = os.getenv('UPLOAD_URL', '')
+UPLOAD_DELETE_AFTER = os.getenv('UPLOAD_DELETE_AFTER', '1') == '1'
+# 업링크를 RTSP 송출과 나눠 쓰므로 업로드 대역폭/동시 업로드 수 제한
+UPLOAD_MAX_KBPS = float(os.getenv('UPLOAD_MAX_KBPS', '2000'))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(4 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = max(1, int(os.getenv('UPLOAD_CONCURRENCY', '1')))
+UPLOAD_MODE = os.getenv('UPLOAD_MODE', 'put')
+uploader = None
+# 세그먼트/수동 녹화 조각 MP4 간격(초). 0이면 faststart mp4 (전원 차단 시 기록 중이던 세그먼트 전체 손실)
+RECORDING_FRAGMENT_SEC = float(os.getenv('RECORDING_FRAGMENT_SEC', '2'))
+# 녹화 디렉터리 용량 관리 (워터마크/보존 기간은 STORAGE_* 환경 변수)
+storage_manager = None
 # 스케줄 캡처 활성 플래그(예약 시간에만 True)
 schedule_capture_active = False
 
@@ -80,14 +111,16 @@ session_param_events = []  # [{"t_ns": int, "gamma": float, "wb": str, "mode": s
 # RTSP 서버 전역 싱글톤
 rtsp_server = None
 rtsp_mounts = None
-rtsp_factory = None
 rtsp_loop = None
-rtsp_appsrc_ref = {"appsrc": None}
-rtsp_scale_caps_element = None
-rtsp_vb_element = None  # RTSP용 videobalance 참조
-gamma_element = None
-rtsp_x264_element = None  # RTSP용 x264enc 참조
-rtsp_path = "/test"
+# RTSP 마운트: RTSP_MOUNTS="/main=main,/sub=640x360@10:600,/mjpeg-compatible=640x360@5:jpeg"
+# 마운트마다 공유 인코더 렌디션(크기/fps/비트레이트/코덱)을 따로 구독. 기본은 기존 /test (MQTT frame 설정을 따름)
+rtsp_mounts_env = os.getenv('RTSP_MOUNTS', '/test=frame')
+rtsp_mount_list = []    # [{"path", "size", "fps", "kbps", "codec", "factory", "appsrc", "subscriber", "clients"}]
+rtsp_clients = set()    # 접속 중인 RTSPClient. 마운트별 clients가 비어 있으면 그 마운트 구독을 끊음
+rtsp_clients_lock = threading.Lock()
+rtsp_path = "/test"     # 첫 번째 마운트 (로그/벤치마크용)
+# 공유 H.264 인코더 (파일/HLS/RTSP가 같은 인코딩 결과를 구독)
+encode_hub = None
 restart_lock = threading.Lock()
 rtsp_last_stream_log_time = 0.0
 # 스케줄러 깨우기 이벤트 (MQTT 시간 갱신 시 즉시 재계산)
@@ -101,14 +134,41 @@ motion_update_event = threading.Event()
 hls_enabled = True
 hls_pipeline = None
 hls_appsrc = None
+hls_subscriber = None  # 공유 인코더 구독자 (HLS 파이프라인 appsrc)
 hls_dir = os.path.abspath(os.path.join(os.getcwd(), 'hls'))
 hls_httpd_server = None
 hls_httpd_thread = None
 hls_http_port = 8090
+# HLS 세그먼트 저장 위치: memory(메모리 링, 기본) | tmpfs | disk (hls_store.py 참고)
+hls_store = None          # HlsSegmentStore (memory 모드)
+hls_segmenter = None
+hls_active_mode = None    # 실제 사용 중인 모드 (memory 실패 시 tmpfs/disk로 대체)
+hls_output_dir = hls_dir  # tmpfs/disk 모드에서 hlssink2가 기록하고 HTTP 서버가 읽는 디렉터리
+# 온디맨드 HLS: 첫 시청자가 index.m3u8을 요청하면 파이프라인(인코딩) 시작, HLS_IDLE_SEC 동안 요청이 없으면 정지
+hls_on_demand = os.getenv('HLS_ON_DEMAND', '1') == '1'
+hls_idle_sec = float(os.getenv('HLS_IDLE_SEC', '30'))
+hls_startup_timeout_sec = 6.0  # 콜드 스타트 시 첫 세그먼트를 기다리는 최대 시간
+hls_params = None         # (width, height, fps, bitrate_kbps): ensure_hls로 요청된 설정
+hls_viewers = {}          # 클라이언트 IP → 마지막 HLS 요청 시각
+hls_lock = threading.RLock()
+hls_idle_thread = None
+# HLS ABR: 한 번의 캡처에서 렌디션 사다리를 인코딩하고 /index.m3u8에 마스터 플레이리스트 공개 (memory 저장소 전용)
+HLS_ABR_MAX_RUNGS = 3
+hls_abr_enabled = os.getenv('HLS_ABR', '0') == '1'
+hls_abr_ladder_env = os.getenv('HLS_ABR_LADDER', '1080,540,270')  # 렌디션 높이(px), 캡처 해상도보다 작은 것만 사용
+hls_abr_ladder = []       # parse_abr_ladder 결과 (아래 HLS helpers에서 초기화)
+hls_abr_rungs = []        # [{"name", "width", "height", "kbps", "rendition", "pipeline", "subscriber", "store"}]
+hls_abr_stores = {}       # 렌디션 이름 → HlsSegmentStore (재시작해도 시퀀스 유지)
+hls_abr_timebase = [None] # 렌디션 구독자 공통 시간축 (렌디션 전환 시 PTS 일치)
+hls_abr_sequence = [None] # 렌디션 저장소 공통 시퀀스 기준 (같은 내용 = 같은 MSN, _HLS_msn 전환 시 일치)
+# 전용 메트릭 포트 (미설정 시 HLS HTTP 서버의 /metrics로만 노출)
+metrics_http_port = int(os.getenv('METRICS_PORT', '0') or 0)
 
 # 수동 녹화 (main.py 호환)
 manual_recording = False
-manual_video_writer = None
+manual_pipeline = None
+manual_appsrc = None
+manual_subscriber = None
 manual_recording_start_time = None
 manual_recording_filename = None
 
@@ -119,7 +179,7 @@ qr_detection_time = 0
 cooldown_period = 3
 
 def reset_rtsp_server():
-    global rtsp_server, rtsp_mounts, rtsp_factory, rtsp_loop, rtsp_appsrc_ref, rtsp_vb_element, gamma_element
+    global rtsp_server, rtsp_mounts, rtsp_loop
     try:
         if rtsp_loop is not None:
             try:
@@ -130,12 +190,17 @@ def reset_rtsp_server():
         pass
     rtsp_server = None
     rtsp_mounts = None
-    rtsp_factory = None
     rtsp_loop = None
-    rtsp_appsrc_ref = {"appsrc": None}
-    rtsp_vb_element = None
-    gamma_element = None
-    globals()['rtsp_x264_element'] = None
+    for mount in rtsp_mount_list:
+        sub = mount["subscriber"]
+        if sub is not None and encode_hub is not None:
+            encode_hub.unsubscribe(sub)
+        mount["factory"] = mount["appsrc"] = mount["subscriber"] = None
+    with rtsp_clients_lock:
+        rtsp_clients.clear()
+        for mount in rtsp_mount_list:
+            mount["clients"].clear()
+    metrics.RTSP_CLIENTS.set(0)
 
 # Optical Flow 전역 토글 (MQTT로 제어)
 of_enabled = True              # True: 옵티컬 플로우 계산/모션 판정 활성화
@@ -144,8 +209,13 @@ of_overlay_enabled = False     # True: RTSP에 옵티컬 플로우 벡터 오버
 # 세션 종료 제어 이벤트 (MQTT 'camera_off')
 camera_stop_event = threading.Event()
 
+# 단계별 소요 시간 수집기 (pipeline_bench.StageProfiler 등). None이면 측정하지 않음
+stage_profiler = None
+
 # --- Persistence: 마지막 모드(JSON)에 저장/로드 ---
-STATE_FILE = "/home/openiot/project/openiot-201-firmware-camera/raspberrypi_cam/camera_state.json"
+STATE_FILE = os.getenv("CAMERA_STATE_FILE", "/home/openiot/project/openiot-201-firmware-camera/raspberrypi_cam/camera_state.json")
+# 녹화 출력 디렉터리 (헤드리스/CI 실행 시 VIDEO_OUTPUT_DIR로 변경)
+VIDEO_OUTPUT_DIR = os.getenv("VIDEO_OUTPUT_DIR", "/home/openiot/project/video")
 
 # --- System Information Functions ---
 def get_cpu_temp():
@@ -219,35 +289,6 @@ def get_mac_address():
     except Exception:
         return "00:00:00:00:00:00"
 
-def enhance_image_for_qr(frame: np.ndarray):
-    if frame is None:
-        return None
-    try:
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    except Exception:
-        return frame
-    denoised = cv2.fastNlMeansDenoising(gray)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(denoised)
-    kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-    sharpened = cv2.filter2D(enhanced, -1, kernel)
-    return sharpened
-
-def detect_qr_codes_enhanced(frame: np.ndarray):
-    if frame is None:
-        return []
-    decoded_original = pyzbar.decode(frame)
-    enhanced = enhance_image_for_qr(frame)
-    decoded_enhanced = pyzbar.decode(enhanced) if enhanced is not None else []
-    all_results = []
-    for obj in decoded_original:
-        all_results.append({ 'data': obj.data.decode('utf-8'), 'rect': obj.rect, 'polygon': obj.polygon, 'quality': 'original' })
-    for obj in decoded_enhanced:
-        data = obj.data.decode('utf-8')
-        if not any(r['data'] == data for r in all_results):
-            all_results.append({ 'data': data, 'rect': obj.rect, 'polygon': obj.polygon, 'quality': 'enhanced' })
-    return all_results
-
 def parse_server_info(qr_data: str):
     try:
         return json.loads(qr_data)
@@ -282,62 +323,93 @@ def send_pairing_request(endpoint_url: str):
     except Exception as e:
         print(f"[QR] pairing 실패: {e}")
         return False
+def handle_qr_payload(data: str) -> None:
+    """인식된 QR 데이터 처리: endpoint가 있으면 페어링, 아니면 서버 정보로 커미션 요청 (별도 스레드)."""
+    try:
+        qr_json = json.loads(data)
+        if isinstance(qr_json, dict) and 'endpoint' in qr_json:
+            endpoint_url = qr_json['endpoint']
+            threading.Thread(target=send_pairing_request, args=(endpoint_url,), daemon=True).start()
+        else:
+            print("[QR] endpoint 없음")
+    except json.JSONDecodeError:
+        server_info = parse_server_info(data)
+        if server_info:
+            threading.Thread(target=send_commission_request, args=(server_info,), daemon=True).start()
+    except Exception:
+        pass
+
 # --- Manual Recording (main.py 호환) ---
-def start_recording_manual(frame: np.ndarray):
-    global manual_recording, manual_video_writer, manual_recording_start_time, manual_recording_filename
+# 공유 인코더의 'main' 스트림을 그대로 mp4로 먹싱 (재인코딩 없음).
+# 쓰기는 mp4 파이프라인 스트리밍 스레드에서 수행되고, appsrc 큐가 차면 구독자가 프레임을 드롭한다.
+MANUAL_RECORDING_MAX_BYTES = 4 * 1024 * 1024
+
+def start_recording_manual(frame: np.ndarray = None):
+    global manual_recording, manual_pipeline, manual_appsrc, manual_subscriber
+    global manual_recording_start_time, manual_recording_filename
     if manual_recording:
         return False, "이미 녹화 중입니다."
+    hub = encode_hub
+    if hub is None:
+        return False, "카메라 세션이 실행 중이 아닙니다."
+    if not get_storage_manager().admit(kind='manual'):
+        return False, "저장 공간이 부족합니다."
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        manual_recording_filename = f"recording_{timestamp}.mp4"
-        h, w = frame.shape[:2]
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        manual_video_writer = cv2.VideoWriter(manual_recording_filename, fourcc, float(current_fps), (w, h))
-        if not manual_video_writer.isOpened():
-            manual_video_writer = None
-            return False, "비디오 writer를 초기화할 수 없습니다."
+        manual_recording_filename = os.path.join(VIDEO_OUTPUT_DIR, f"recording_{timestamp}.mp4")
+        os.makedirs(VIDEO_OUTPUT_DIR, exist_ok=True)
+        manual_pipeline, manual_appsrc = build_mp4_writer_pipeline(manual_recording_filename, RECORDING_FRAGMENT_SEC)
+        manual_pipeline.set_state(Gst.State.PLAYING)
+        manual_subscriber = EncodedSubscriber('manual', manual_appsrc, max_bytes=MANUAL_RECORDING_MAX_BYTES)
+        hub.subscribe('main', manual_subscriber)
         manual_recording = True
         manual_recording_start_time = time.time()
         print(f"✅ 수동 녹화 시작: {manual_recording_filename}")
         return True, f"녹화가 시작되었습니다: {manual_recording_filename}"
     except Exception as e:
         print(f"❌ 수동 녹화 시작 실패: {e}")
+        try:
+            if manual_pipeline is not None:
+                manual_pipeline.set_state(Gst.State.NULL)
+        except Exception:
+            pass
+        manual_pipeline = None
+        manual_appsrc = None
+        manual_subscriber = None
         return False, f"녹화 시작 실패: {e}"
 
 def stop_recording_manual():
-    global manual_recording, manual_video_writer, manual_recording_start_time, manual_recording_filename
+    """구독 해제 후 EOS/검증은 세그먼트 finalizer에 넘긴다 (호출 스레드는 대기하지 않음)."""
+    global manual_recording, manual_pipeline, manual_appsrc, manual_subscriber
+    global manual_recording_start_time, manual_recording_filename
     if not manual_recording:
         return False, "녹화 중이 아닙니다."
     try:
         manual_recording = False
-        if manual_video_writer:
-            manual_video_writer.release()
-            manual_video_writer = None
+        sub = manual_subscriber
+        if sub is not None and sub.hub is not None:
+            sub.hub.unsubscribe(sub)
         duration = time.time() - manual_recording_start_time if manual_recording_start_time else 0
         manual_recording_start_time = None
-        if manual_recording_filename and os.path.exists(manual_recording_filename):
-            size_mb = os.path.getsize(manual_recording_filename) / (1024 * 1024)
-            print(f"✅ 수동 녹화 완료: {manual_recording_filename} ({duration:.1f}s, {size_mb:.2f}MB)")
-            return True, f"녹화 완료: {manual_recording_filename} ({duration:.1f}초, {size_mb:.2f}MB)"
-        return True, "녹화가 중지되었습니다."
+        pushed = sub.pushed if sub is not None else 0
+        dropped = sub.dropped if sub is not None else 0
+        if manual_pipeline is not None:
+            info = {"path": manual_recording_filename, "start_ns": 0, "end_ns": int(duration * 1e9), "kind": 'manual'}
+            get_segment_finalizer(VIDEO_OUTPUT_DIR).submit(manual_pipeline, manual_appsrc, info)
+        manual_pipeline = None
+        manual_appsrc = None
+        manual_subscriber = None
+        print(f"✅ 수동 녹화 완료: {manual_recording_filename} ({duration:.1f}s, {pushed}프레임, 드롭 {dropped})")
+        return True, f"녹화 완료: {manual_recording_filename} ({duration:.1f}초, 드롭 {dropped}프레임)"
     except Exception as e:
         print(f"❌ 수동 녹화 중지 실패: {e}")
         return False, f"녹화 중지 실패: {e}"
 
-def write_frame_to_manual_recording(frame: np.ndarray):
-    global manual_recording, manual_video_writer
-    if manual_recording and manual_video_writer is not None and manual_video_writer.isOpened():
-        try:
-            manual_video_writer.write(frame)
-        except Exception as e:
-            print(f"❌ 프레임 녹화 실패: {e}")
-            stop_recording_manual()
-
 def load_last_mode_from_disk() -> None:
     """마지막 설정(of_enabled, color_mode, wb, frame, roi, schedule/motion time)을 디스크에서 로드하여 적용."""
     global of_enabled, current_mode, current_wb, current_frame, current_roi, current_gamma, current_bitrate
     global SCHEDULE_MODE_HOUR, SCHEDULE_MODE_MINUTE, SCHEDULE_DURATION_SEC, SCHEDULE_DAYS
-    global MOTION_MODE_HOUR, MOTION_MODE_MINUTE, MOTION_DAYS
+    global MOTION_MODE_HOUR, MOTION_MODE_MINUTE, MOTION_DAYS, hls_abr_enabled, hls_abr_ladder
     try:
         if os.path.isfile(STATE_FILE):
             with open(STATE_FILE, 'r', encoding='utf-8') as f:
@@ -383,6 +455,15 @@ def load_last_mode_from_disk() -> None:
                         if br > 0:
                             current_bitrate = br
                             
+                except Exception:
+                    pass
+                # HLS ABR
+                try:
+                    if 'hls_abr' in data:
+                        hls_abr_enabled = bool(data.get('hls_abr'))
+                    ladder = parse_abr_ladder(data.get('hls_abr_ladder'))
+                    if ladder:
+                        hls_abr_ladder = ladder
                 except Exception:
                     pass
                 # ROI 사각형 우선 적용
@@ -471,6 +552,8 @@ def save_last_mode_to_disk() -> None:
             'frame': str(current_frame),
             'gamma': float(current_gamma),
             'bitrate': int(current_bitrate),
+            'hls_abr': bool(hls_abr_enabled),
+            'hls_abr_ladder': list(hls_abr_ladder),
             'roi': [int(v) for v in current_roi] if isinstance(current_roi, (list, tuple)) and len(current_roi) == 4 else None,
             'schedule_time': f"{SCHEDULE_MODE_HOUR:02d}:{SCHEDULE_MODE_MINUTE:02d}",
             'schedule_days': days_str_list,
@@ -498,11 +581,8 @@ def start_hls_http_server(port: int = None):
         port = hls_http_port
     if hls_httpd_server is not None:
         return
-    ensure_hls_dir()
-    # 기본 index.html 생성/업데이트 (항상 최신 템플릿으로 갱신)
-    try:
-        index_path = os.path.join(hls_dir, 'index.html')
-        html = """<!DOCTYPE html>
+    # 뷰어 페이지는 메모리에서 응답 (SD 카드에 쓰지 않음)
+    html = """<!DOCTYPE html>
 <html lang=\"ko\">
 <head>
   <meta charset=\"UTF-8\"/>
@@ -545,7 +625,8 @@ def start_hls_http_server(port: int = None):
         if (window._hls) { try { window._hls.destroy(); } catch(e){} }
         const hls = new Hls({
           maxBufferLength: 8,
-          liveSyncDuration: 3,
+          // 저지연 플레이리스트(PART-HOLD-BACK)가 있으면 부분 세그먼트로 재생, 없으면 일반 HLS
+          lowLatencyMode: true,
           enableWorker: true
         });
         window._hls = hls;
@@ -568,28 +649,37 @@ def start_hls_http_server(port: int = None):
     play(urlInput.value.trim());
   </script>
   </body>
-</html>"""
-        with open(index_path, 'w', encoding='utf-8') as f:
-            f.write(html)
-    except Exception:
-        pass
-    class HLSHandler(SimpleHTTPRequestHandler):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, directory=hls_dir, **kwargs)
-        def end_headers(self):
-            try:
-                self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
-                self.send_header('Pragma', 'no-cache')
-                self.send_header('Expires', '0')
-                self.send_header('Access-Control-Allow-Origin', '*')
-            except Exception:
-                pass
-            try:
-                super().end_headers()
-            except Exception:
-                pass
+</html>""".encode('utf-8')
+    class HLSHandler(HlsRequestHandler):
+        def route(self, path):
+            if path == '/metrics':
+                return metrics.CONTENT_TYPE, metrics.render_latest()
+            if path == '/index.m3u8' and hls_abr_rungs:
+                return PLAYLIST_CONTENT_TYPE, abr_master_playlist()
+            if path in ('/', '/index.html'):
+                return 'text/html; charset=utf-8', html
+            return None
+        def before_media(self, path):
+            t0 = time.time()
+            # 첫 시청자의 플레이리스트 요청이면 파이프라인을 켜고 첫 세그먼트까지 대기
+            if note_hls_request(self.client_address[0], start=(path == '/index.m3u8')):
+                wait_hls_ready(t0)
+        def get_store(self):
+            return hls_store if hls_active_mode == 'memory' else None
+        def store_for(self, path):
+            # ABR 렌디션: /abr/<이름>/index.m3u8, /abr/<이름>/segment_*.ts
+            if path.startswith('/abr/'):
+                name, _, rest = path[len('/abr/'):].partition('/')
+                query = self.path.partition('?')[2]
+                for rung in list(hls_abr_rungs):
+                    if rung["name"] == name:
+                        return rung["store"], '/' + rest + ('?' + query if query else '')
+                return None, None
+            return super().store_for(path)
+        def get_directory(self):
+            return hls_output_dir
     try:
-        hls_httpd_server = ThreadingHTTPServer(("0.0.0.0", int(port)), HLSHandler)
+        hls_httpd_server = BoundedHTTPServer(("0.0.0.0", int(port)), HLSHandler)
         hls_httpd_thread = threading.Thread(target=hls_httpd_server.serve_forever, daemon=True)
         hls_httpd_thread.start()
         print(f"[HLS] HTTP 서버 시작: http://0.0.0.0:{port}/index.m3u8")
@@ -610,37 +700,104 @@ def stop_hls_http_server():
     hls_httpd_thread = None
 
 def start_hls_pipeline(width: int, height: int, framerate: int, bitrate_kbps: int):
-    global hls_pipeline, hls_appsrc
+    """HLS 출력 파이프라인 시작. 인코딩은 공유 인코더(main 렌디션)가 담당하고 여기서는 TS 분할만 수행.
+
+    HLS_STORE=memory(기본)이면 세그먼트를 메모리 링에 보관하고 HTTP 서버가 바로 응답 (SD 카드 기록 없음).
+    memory 파이프라인을 만들 수 없으면 tmpfs, tmpfs를 쓸 수 없으면 디스크(hls_dir)로 대체.
+    width/height/framerate/bitrate_kbps는 공유 인코더 설정을 따르므로 호환용으로만 유지.
+    """
+    global hls_pipeline, hls_appsrc, hls_subscriber, hls_store, hls_segmenter, hls_active_mode, hls_output_dir
     if not hls_enabled:
         return
     if hls_pipeline is not None:
         return
-    ensure_hls_dir()
     Gst.init(None)
-    # GOP=framerate*2, 주기적 SPS/PPS 삽입(config-interval=1)
-    keyint = max(1, int(framerate) * 2)
-    playlist = os.path.join(hls_dir, 'index.m3u8')
-    segment = os.path.join(hls_dir, 'segment_%05d.ts')
-    launch = (
-        f"appsrc name=hls_src is-live=true format=time do-timestamp=true block=true "
-        f"caps=video/x-raw,format=RGB,width={width},height={height},framerate={framerate}/1 ! "
-        f"videoconvert ! video/x-raw,format=I420 ! "
-        f"x264enc tune=zerolatency speed-preset=ultrafast key-int-max={keyint} bitrate={bitrate_kbps} ! "
-        f"h264parse config-interval=1 ! mpegtsmux alignment=7 ! "
-        f"hlssink name=hlsink target-duration=2 max-files=10 playlist-length=6 playlist-location={playlist} location={segment}"
-    )
+    mode = HLS_STORE_MODE if HLS_STORE_MODE in ('memory', 'tmpfs', 'disk') else 'memory'
+    if hls_abr_enabled:
+        if mode == 'memory' and start_hls_abr(width, height, framerate, bitrate_kbps):
+            return
+        print("[HLS] ABR을 시작할 수 없어 단일 렌디션으로 동작합니다 (ABR은 memory 저장소 전용)")
+    if mode == 'memory':
+        try:
+            if hls_store is None:
+                hls_store = create_store()
+            hls_pipeline, hls_appsrc = build_h264_appsrc_pipeline(memory_sink_desc(), name='hls_src')
+            hls_segmenter = attach_memory_sink(hls_pipeline, hls_store, on_segment=on_hls_memory_segment)
+        except Exception as e:
+            print(f"[HLS] 메모리 세그먼트 저장소 사용 불가, tmpfs로 대체: {e}")
+            hls_pipeline = None
+            hls_appsrc = None
+            hls_segmenter = None
+            mode = 'tmpfs'
+    if mode != 'memory':
+        if HLS_LOW_LATENCY:
+            print("[HLS] 저지연(부분 세그먼트) 모드는 memory 저장소에서만 지원됩니다. 일반 HLS로 동작합니다.")
+        if mode == 'tmpfs':
+            hls_output_dir = tmpfs_dir(hls_dir)
+        else:
+            ensure_hls_dir()
+            hls_output_dir = hls_dir
+        playlist, segment = prepare_file_output(hls_output_dir)
     try:
-        hls_pipeline = Gst.parse_launch(launch)
-        hls_appsrc = hls_pipeline.get_by_name('hls_src')
+        if mode != 'memory':
+            # hlssink2는 키프레임 기준으로 직접 분할 (인코더가 다른 파이프라인에 있어도 동작)
+            hls_pipeline, hls_appsrc = build_h264_appsrc_pipeline(
+                f"hlssink2 name=hlsink target-duration=2 max-files=10 playlist-length=6 "
+                f"playlist-location={playlist} location={segment}",
+                name='hls_src')
+            # 세그먼트 종료 메시지로 세그먼트 수/기록 지연 측정
+            hls_bus = hls_pipeline.get_bus()
+            hls_bus.enable_sync_message_emission()
+            hls_bus.connect('sync-message::element', on_hls_element_message)
         hls_pipeline.set_state(Gst.State.PLAYING)
-        print("[HLS] 파이프라인 시작")
+        hls_active_mode = mode
+        hls_subscriber = EncodedSubscriber('hls', hls_appsrc)
+        if encode_hub is not None:
+            encode_hub.subscribe('main', hls_subscriber)
+        metrics.HLS_ACTIVE.set(1)
+        where = hls_output_dir if mode != 'memory' else 'memory'
+        print(f"[HLS] 파이프라인 시작 (저장소: {where})")
     except Exception as e:
         print(f"[HLS] 파이프라인 시작 실패: {e}")
         hls_pipeline = None
         hls_appsrc = None
+        hls_subscriber = None
+        hls_segmenter = None
+        hls_active_mode = None
+
+def on_hls_memory_segment(seq: int, duration: float, size: int):
+    """메모리 저장소에 세그먼트가 추가될 때 호출 (스트리밍 스레드)."""
+    metrics.HLS_SEGMENTS.inc()
+
+def on_hls_element_message(bus, msg):
+    """HLS 세그먼트 파일이 닫힐 때 호출 (스트리밍 스레드)."""
+    try:
+        st = msg.get_structure()
+        # hlssink2(splitmuxsink): fragment-closed의 running-time은 세그먼트 미디어 종료 시점
+        if st is None or st.get_name() != 'splitmuxsink-fragment-closed':
+            return
+        metrics.HLS_SEGMENTS.inc()
+        pipeline = hls_pipeline
+        ok_rt, running_time = st.get_uint64('running-time')
+        if pipeline is None or not ok_rt or running_time == Gst.CLOCK_TIME_NONE:
+            return
+        media_end = running_time
+        clock = pipeline.get_clock()
+        if clock is None:
+            return
+        now_rt = clock.get_time() - pipeline.get_base_time()
+        lag = (now_rt - media_end) / 1e9
+        if 0.0 <= lag < 60.0:
+            metrics.HLS_SEGMENT_WRITE_SECONDS.observe(lag)
+    except Exception:
+        pass
 
 def stop_hls_pipeline():
-    global hls_pipeline, hls_appsrc
+    global hls_pipeline, hls_appsrc, hls_subscriber, hls_segmenter
+    stop_hls_abr()
+    if hls_subscriber is not None and encode_hub is not None:
+        encode_hub.unsubscribe(hls_subscriber)
+    hls_subscriber = None
     try:
         if hls_pipeline is not None:
             hls_pipeline.set_state(Gst.State.NULL)
@@ -648,6 +805,204 @@ def stop_hls_pipeline():
         pass
     hls_pipeline = None
     hls_appsrc = None
+    hls_segmenter = None
+    metrics.HLS_ACTIVE.set(0)
+    # 메모리 저장소는 유지 (재시작 시 시퀀스를 이어 가고 EXT-X-DISCONTINUITY로 표시)
+
+def parse_abr_ladder(value) -> list:
+    """'1080,540,270' / [1080, 540] / ['540p'] → 렌디션 높이 목록 (내림차순, 중복 제거)."""
+    if value is None:
+        return []
+    items = value.split(',') if isinstance(value, str) else list(value)
+    heights = set()
+    for v in items:
+        try:
+            h = int(str(v).strip().lower().rstrip('p'))
+        except ValueError:
+            continue
+        if h >= 144:
+            heights.add(h - h % 2)
+    return sorted(heights, reverse=True)
+
+hls_abr_ladder = parse_abr_ladder(hls_abr_ladder_env) or [1080, 540, 270]
+
+def abr_ladder(width: int, height: int, bitrate_kbps: int) -> list:
+    """캡처 크기 기준 렌디션 사다리. 최상위는 캡처 해상도(main 렌디션), 아래는 사다리 높이로 축소.
+    낮은 렌디션일수록 픽셀당 비트를 조금 더 준다 (면적 비율^0.75)."""
+    rungs = [{"name": f"{height}p", "width": width, "height": height, "kbps": int(bitrate_kbps), "rendition": 'main'}]
+    for h in hls_abr_ladder:
+        if h >= height:
+            continue
+        if len(rungs) >= HLS_ABR_MAX_RUNGS:
+            break
+        w = int(round(width * h / float(height) / 2.0)) * 2
+        ratio = (w * h) / float(width * height)
+        rungs.append({"name": f"{h}p", "width": w, "height": h,
+                      "kbps": max(150, int(bitrate_kbps * ratio ** 0.75)), "rendition": None})
+    return rungs
+
+def abr_master_playlist() -> bytes:
+    fps = encode_hub.fps if encode_hub is not None else current_fps
+    return master_playlist([{"uri": f"abr/{r['name']}/index.m3u8", "bandwidth": r["kbps"] * 1100,
+                             "width": r["width"], "height": r["height"], "fps": fps} for r in list(hls_abr_rungs)])
+
+def start_hls_abr(width: int, height: int, framerate: int, bitrate_kbps: int) -> bool:
+    """ABR 렌디션별 TS 분할 파이프라인(메모리 저장소) 시작. 실패하면 정리 후 False."""
+    global hls_pipeline, hls_active_mode
+    rungs = abr_ladder(int(width), int(height), int(bitrate_kbps))
+    hls_abr_timebase[0] = None
+    try:
+        for rung in rungs:
+            if rung["name"] not in hls_abr_stores:
+                hls_abr_stores[rung["name"]] = create_store()
+        # 저장소마다 따로 시작 번호를 정하면 같은 세그먼트의 MSN이 렌디션마다 달라지므로 공통 기준으로 맞춤
+        # (나중에 생긴 렌디션도 현재 공통 번호로, 이미 쓴 번호는 재사용하지 않도록 가장 앞선 번호 기준)
+        base = max([hls_abr_sequence[0] or 0] + [hls_abr_stores[r["name"]].next_sequence for r in rungs])
+        for rung in rungs:
+            hls_abr_stores[rung["name"]].rebase(base)
+        hls_abr_sequence[0] = base
+        for rung in rungs:
+            store = hls_abr_stores[rung["name"]]
+            pipeline, appsrc = build_h264_appsrc_pipeline(memory_sink_desc(), name='hls_src')
+            attach_memory_sink(pipeline, store, on_segment=on_hls_memory_segment)
+            rung["store"] = store
+            rung["pipeline"] = pipeline
+            rung["subscriber"] = EncodedSubscriber(f"hls_{rung['name']}", appsrc, timebase=hls_abr_timebase)
+            pipeline.set_state(Gst.State.PLAYING)
+            hls_abr_rungs.append(rung)
+    except Exception as e:
+        print(f"[HLS] ABR 파이프라인 시작 실패: {e}")
+        stop_hls_abr()
+        return False
+    hls_pipeline = rungs[0]["pipeline"]
+    hls_active_mode = 'memory'
+    subscribe_hls_abr()
+    metrics.HLS_ACTIVE.set(1)
+    print("[HLS] ABR 시작: " + ', '.join(f"{r['name']}({r['width']}x{r['height']} {r['kbps']}kbps)" for r in rungs))
+    return True
+
+def subscribe_hls_abr():
+    """ABR 구독자를 공유 인코더 렌디션에 연결 (인코더가 나중에 생기면 ensure_encode_hub에서 다시 호출)."""
+    if encode_hub is None or not hls_abr_rungs:
+        return
+    # 렌디션 전환이 깨끗하도록 모든 렌디션의 키프레임을 같은 프레임에 맞춤
+    encode_hub.set_keyframe_alignment(True)
+    for rung in hls_abr_rungs:
+        sub = rung["subscriber"]
+        if sub.hub is not None:
+            continue
+        if rung["rendition"] != 'main':
+            rung["rendition"] = encode_hub.ensure_rendition(rung["width"], rung["height"], rung["kbps"])
+        encode_hub.subscribe(rung["rendition"], sub)
+
+def stop_hls_abr():
+    global hls_abr_rungs
+    rungs = hls_abr_rungs
+    hls_abr_rungs = []
+    for rung in rungs:
+        sub = rung.get("subscriber")
+        if sub is not None and encode_hub is not None:
+            encode_hub.unsubscribe(sub)
+        try:
+            rung["pipeline"].set_state(Gst.State.NULL)
+        except Exception:
+            pass
+
+def restart_hls_output():
+    """ABR 설정 변경 반영: 키프레임 정렬을 맞추고, 동작 중인 HLS 파이프라인은 새 구성으로 재시작."""
+    with hls_lock:
+        if encode_hub is not None:
+            encode_hub.set_keyframe_alignment(hls_abr_enabled)
+        if hls_pipeline is None or hls_params is None:
+            return
+        stop_hls_pipeline()
+        start_hls_pipeline(*hls_params)
+
+def ensure_hls(width: int, height: int, framerate: int, bitrate_kbps: int):
+    """HLS HTTP 서버 시작 + 파이프라인 설정 기록. 온디맨드면 시청자가 있을 때만 파이프라인을 켠다."""
+    global hls_params
+    with hls_lock:
+        hls_params = (int(width), int(height), int(framerate), int(bitrate_kbps))
+        start_hls_http_server()
+        if not hls_on_demand:
+            start_hls_pipeline(*hls_params)
+            return
+        start_hls_idle_watcher()
+        if active_hls_viewers() > 0:
+            start_hls_pipeline(*hls_params)
+
+def active_hls_viewers() -> int:
+    """최근 hls_idle_sec 안에 요청한 시청자(IP) 수."""
+    now = time.time()
+    with hls_lock:
+        for ip, t in list(hls_viewers.items()):
+            if now - t > hls_idle_sec:
+                del hls_viewers[ip]
+        n = len(hls_viewers)
+    metrics.HLS_VIEWERS.set(n)
+    return n
+
+def note_hls_request(client_ip: str, start: bool = True) -> bool:
+    """HLS 요청 기록 (HTTP 스레드). 꺼져 있던 파이프라인을 이번 요청으로 켰으면 True."""
+    with hls_lock:
+        if client_ip not in hls_viewers:
+            print(f"[HLS] 시청자 접속: {client_ip}")
+        hls_viewers[client_ip] = time.time()
+        if not start or not hls_on_demand or not hls_enabled or hls_pipeline is not None or hls_params is None:
+            return False
+        print("[HLS] 첫 시청자 요청: 파이프라인 시작")
+        start_hls_pipeline(*hls_params)
+        return hls_pipeline is not None
+
+def wait_hls_ready(t0: float) -> None:
+    """콜드 스타트 직후 첫 세그먼트(저지연이면 첫 부분)가 생길 때까지 플레이리스트 응답을 미룬다.
+    구독 시 공유 인코더에 키프레임을 즉시 요청하므로 GOP를 기다리지 않는다."""
+    store = hls_abr_rungs[0]["store"] if hls_abr_rungs else hls_store
+    if hls_active_mode == 'memory' and store is not None:
+        ready = store.wait_ready(hls_startup_timeout_sec)
+    else:
+        playlist = os.path.join(hls_output_dir, 'index.m3u8')
+        deadline = t0 + hls_startup_timeout_sec
+        while not os.path.exists(playlist) and time.time() < deadline:
+            time.sleep(0.05)
+        ready = os.path.exists(playlist)
+    if ready:
+        elapsed = time.time() - t0
+        metrics.HLS_STARTUP_SECONDS.observe(elapsed)
+        print(f"[HLS] 재생 준비 완료: {elapsed:.2f}s")
+
+def idle_hls_pipeline(reason: str = '') -> None:
+    """온디맨드 HLS 정지: 파이프라인/구독 해제 (구독자가 없으면 공유 인코더 렌디션도 멈춤)."""
+    with hls_lock:
+        if hls_pipeline is None:
+            return
+        print(f"[HLS] 인코딩 정지{': ' + reason if reason else ''}")
+        stop_hls_pipeline()
+        # 다음 시청자가 오래된 세그먼트를 받지 않도록 비움
+        for store in [hls_store] + list(hls_abr_stores.values()):
+            if store is not None:
+                store.clear()
+        if hls_active_mode != 'memory':
+            try:
+                os.remove(os.path.join(hls_output_dir, 'index.m3u8'))
+            except Exception:
+                pass
+
+def hls_idle_loop():
+    while True:
+        time.sleep(1.0)
+        try:
+            if hls_on_demand and active_hls_viewers() == 0 and hls_pipeline is not None:
+                idle_hls_pipeline(f'{hls_idle_sec:.0f}초 동안 시청자 없음')
+        except Exception as e:
+            print(f"[HLS] 유휴 감시 오류: {e}")
+
+def start_hls_idle_watcher():
+    global hls_idle_thread
+    if hls_idle_thread is not None and hls_idle_thread.is_alive():
+        return
+    hls_idle_thread = threading.Thread(target=hls_idle_loop, name='hls-idle', daemon=True)
+    hls_idle_thread.start()
 
 # --- Schedule Helpers ---
 def parse_schedule_days(days_value):
@@ -743,71 +1098,6 @@ def parse_duration_seconds(value) -> int:
     except Exception:
         return None
 
-# Full-frame ROI mask builder (rectangle only)
-def build_roi_mask_full(frame_shape, roi_rect=None, roi_poly=None):
-    h, w = frame_shape
-    mask = None
-    has_rect = roi_rect is not None and len(roi_rect) == 4
-    # 폴리곤 지원 제거: has_poly는 항상 False
-    has_poly = False
-    if has_rect:
-        mask = np.zeros((h, w), dtype=np.uint8)
-        print("Rectangle ROI 사용")
-        x, y, rw, rh = map(int, roi_rect)
-        x = max(0, min(x, w - 1))
-        y = max(0, min(y, h - 1))
-        rw = max(1, min(int(rw), w - x))
-        rh = max(1, min(int(rh), h - y))
-        cv2.rectangle(mask, (x, y), (x + rw - 1, y + rh - 1), 255, -1)
-    return mask
-
-def measure_file_fps_gst(video_path: str) -> None:
-    """저장된 파일을 디코드하며 fpsdisplaysink로 평균 FPS를 콘솔에 출력한다.
-
-    video_path: 측정할 비디오 파일 경로
-    """
-    try:
-        if not os.path.isfile(video_path):
-            print(f"[FPS] 파일을 찾을 수 없습니다: {video_path}")
-            return
-        pipeline_str = (
-            f"filesrc location={video_path} ! decodebin ! videoconvert ! "
-            f"fpsdisplaysink name=post_fpssink video-sink=fakesink text-overlay=false silent=true signal-fps-measurements=true sync=true"
-        )
-        pipeline = Gst.parse_launch(pipeline_str)
-        fpssink = pipeline.get_by_name('post_fpssink')
-        try:
-            # fps-measurements(fps, droprate, avg_fps) 시그널이 지원되면 연결
-            def on_fps(_elem, fps, droprate, avg):
-                try:
-                    print(f"[POST-FPS] fps={fps} drop={droprate} avg={avg:.2f}")
-                except Exception:
-                    pass
-            if fpssink is not None and hasattr(fpssink, 'connect'):
-                try:
-                    fpssink.connect('fps-measurements', on_fps)
-                    print("[POST-FPS] fps-measurements 시그널이 지원되어 연결되었습니다.")
-                except Exception:
-                    print("[POST-FPS] fps-measurements 시그널을 지원하지 않습니다.")
-            else:
-                print("[POST-FPS] fps-measurements 시그널을 지원하지 않습니다.")
-
-        except Exception:
-            pass
-        pipeline.set_state(Gst.State.PLAYING)
-        bus = pipeline.get_bus()
-        try:
-            bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS)
-        except Exception:
-            pass
-        try:
-            pipeline.set_state(Gst.State.NULL)
-        except Exception:
-            pass
-        print(f"[POST-FPS] 완료: {video_path}")
-    except Exception as e:
-        print(f"[FPS] 측정 실패: {e}")
-
 def begin_session_timeline(epoch_time: float) -> None:
     """세션 시작 시 타임라인 초기화 및 초기 이벤트 기록."""
     global session_active, session_epoch_time, session_param_events
@@ -851,6 +1141,374 @@ def record_param_change_event() -> None:
         "mode": str(current_mode),
     })
 
+def on_segment_finalized(info: dict) -> None:
+    """finalizer 검증 완료 콜백: 검증된 모션 세그먼트만 예약 병합 후보에 추가."""
+    metrics.SEGMENTS_FINALIZED.inc(status=str(info.get("status")))
+    if info.get("finalize_ms") is not None:
+        metrics.SEGMENT_FINALIZE_SECONDS.observe(info["finalize_ms"] / 1000.0)
+    kind = info.get("kind")
+    # 모션 세그먼트는 파일명으로 구분되지 않으므로 등급을 직접 지정
+    get_storage_manager().note_file(info["path"], kind if kind in ('motion', 'manual') else None)
+    if not info.get("verified"):
+        return
+    with incremental_mergers_lock:
+        if kind == 'motion':
+            output = current_motion_merge_path()
+        else:
+            output = info.get("merge_output")
+        if not output or output in closed_merge_outputs:
+            merger = None
+        else:
+            merger = get_incremental_merger(output)
+    if merger is None:
+        if kind == 'motion':
+            with global_detection_segments_lock:
+                global_detection_segments.append(info["path"])
+        elif output:
+            enqueue_late_segment(info["path"])
+        return
+    meta = {"start_ns": int(info.get("start_ns") or 0)}
+    if info.get("param_events"):
+        meta["events"] = info["param_events"]
+    merger.submit(info["path"], on_done=partial(on_segment_merged, kind, output), meta=meta)
+
+def on_segment_merged(kind: str, output: str, path: str, ok: bool) -> None:
+    """점진 병합 완료 콜백: 성공 시 원본 세그먼트 삭제, 모션 세그먼트 실패 시 예약 병합 대상으로 남김."""
+    storage = get_storage_manager()
+    if ok:
+        storage.note_file(output)
+        try:
+            if os.path.isfile(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"[정리] 세그먼트 삭제 실패: {path}, {e}")
+        storage.note_removed(path)
+    elif kind == 'motion':
+        with global_detection_segments_lock:
+            global_detection_segments.append(path)
+    elif output in closed_merge_outputs and os.path.isfile(path):
+        # 추가 대기 중에 세션 출력이 확정됨
+        enqueue_late_segment(path)
+
+def enqueue_late_segment(path: str) -> None:
+    """세션 출력이 이미 확정된 뒤에 마무리된 세그먼트를 버리지 않고 별도 병합 작업으로 넘김."""
+    name = os.path.basename(path)[:-len('.mp4')]
+    late = os.path.join(os.path.dirname(path), name.replace('_raw', '') + '_late_merge_file.mp4')
+    get_job_queue().enqueue('merge', {"output": late, "segments": [path]}, job_id=f'merge-late-{name}')
+    print(f"[병합] 세션 병합 이후 마무리된 세그먼트: {os.path.basename(path)} → {os.path.basename(late)}")
+
+def get_incremental_merger(output_path: str) -> IncrementalMerger:
+    """출력 경로별 점진 병합기 반환 (incremental_mergers_lock 안에서 호출)."""
+    merger = incremental_mergers.get(output_path)
+    if merger is None:
+        merger = IncrementalMerger(output_path)
+        incremental_mergers[output_path] = merger
+    return merger
+
+def current_motion_merge_path() -> str:
+    """모션 세그먼트 출력 경로 (없으면 새로 정함, incremental_mergers_lock 안에서 호출)."""
+    global motion_merge_path
+    if motion_merge_path is None:
+        now_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        motion_merge_path = os.path.join(VIDEO_OUTPUT_DIR, f'video_{now_str}_motion_merging.mp4')
+    return motion_merge_path
+
+def finalize_incremental_merge(output_path: str, final_path: str, timeout: float = None):
+    """점진 병합 출력을 닫고 final_path로 확정. 추가된 세그먼트가 없으면 None."""
+    global motion_merge_path
+    with incremental_mergers_lock:
+        merger = incremental_mergers.pop(output_path, None)
+        closed_merge_outputs.add(output_path)
+        if output_path == motion_merge_path:
+            motion_merge_path = None
+    if merger is None:
+        if not os.path.isfile(output_path):
+            return None
+        # 재시작 후에는 디스크의 출력에서 상태를 복구하여 마무리
+        merger = IncrementalMerger(output_path)
+    try:
+        result = merger.finalize(final_path, timeout=timeout, before_rename=write_merge_meta)
+    except Exception as e:
+        print(f"[병합] 점진 병합 마무리 실패: {output_path}, {e}")
+        return None
+    if result is not None and result["failed"]:
+        print(f"[병합] 추가 실패 세그먼트 {len(result['failed'])}개: {result['failed']}")
+    storage = get_storage_manager()
+    storage.note_removed(output_path)
+    if result is not None:
+        storage.note_file(final_path)
+    return result
+
+def write_merge_meta(final_path: str, segments: list) -> None:
+    """병합 결과의 카탈로그용 사이드카 기록 (세그먼트/모션 이벤트 수는 mp4 헤더에 없음, 모션 세그먼트 하나 = 이벤트 하나)."""
+    motion = classify(os.path.basename(final_path)) == 'motion'
+    write_meta(final_path, segments=len(segments), motion_events=len(segments) if motion else 0,
+               kind='motion' if motion else 'schedule')
+
+def recover_incremental_merges() -> None:
+    """재부팅 전 진행 중이던 점진 병합 출력 처리: 모션 출력은 이어쓰고, 세션 출력은 마무리."""
+    global motion_merge_path
+    try:
+        names = sorted(os.listdir(VIDEO_OUTPUT_DIR))
+    except Exception:
+        return
+    for name in names:
+        path = os.path.join(VIDEO_OUTPUT_DIR, name)
+        try:
+            if name.endswith('_motion_merging.mp4'):
+                with incremental_mergers_lock:
+                    get_incremental_merger(path)
+                    if motion_merge_path is not None and motion_merge_path != path:
+                        # 이어쓸 모션 출력은 가장 최근 것 하나만 유지
+                        stale = motion_merge_path
+                    else:
+                        stale = None
+                    motion_merge_path = path
+                if stale is not None:
+                    finalize_incremental_merge(stale, stale.replace('_motion_merging.mp4', '_merge_raw.mp4'))
+            elif name.endswith('_session_merging.mp4'):
+                # 세션 종료 전에 중단된 출력: 세션 종료 시와 같은 ID로 병합 작업 등록 (이미 있으면 무시)
+                get_job_queue().enqueue('merge', {"incremental": path,
+                                                  "output": path.replace('_session_merging.mp4', '_merge_file.mp4'),
+                                                  "segments": []},
+                                        job_id=f"merge-{name[:-len('.mp4')]}")
+        except Exception as e:
+            print(f"[병합] 점진 병합 복구 실패: {path}, {e}")
+    recover_orphan_segments()
+
+def recover_orphan_segments() -> None:
+    """전원 차단 등으로 마무리되지 못한 세그먼트 구제.
+
+    조각 MP4 세그먼트는 마지막 완료 조각까지 유효하므로 검증되면 점진 병합에 추가한다.
+    같은 세션의 스케줄 세그먼트가 있었으면 세션 출력으로, 아니면 모션 출력으로 보낸다.
+    """
+    try:
+        names = sorted(n for n in os.listdir(VIDEO_OUTPUT_DIR) if re.search(r'_seg\d+_raw\.mp4$', n))
+    except Exception:
+        return
+    if not names:
+        return
+    referenced = set()
+    for job in get_job_queue().list_jobs('queued') + get_job_queue().list_jobs('running'):
+        referenced.update(job.get("payload", {}).get("segments") or [])
+    index = load_segment_index(os.path.join(VIDEO_OUTPUT_DIR, 'segment_index.jsonl'))
+    for name in names:
+        path = os.path.join(VIDEO_OUTPUT_DIR, name)
+        if path in referenced:
+            continue
+        result = verify_segment_file(path)
+        if not result["verified"]:
+            print(f"[복구] 세그먼트 구제 불가: {name} ({result['reason']})")
+            continue
+        session = name.split('_seg')[0]
+        session_out = os.path.join(VIDEO_OUTPUT_DIR, f'{session}_session_merging.mp4')
+        kinds = {rec.get("kind") for p, rec in index.items() if os.path.basename(p).startswith(session + '_seg')}
+        kind = 'schedule' if os.path.isfile(session_out) or 'schedule' in kinds else 'motion'
+        with incremental_mergers_lock:
+            output = session_out if kind == 'schedule' else current_motion_merge_path()
+            merger = get_incremental_merger(output)
+        print(f"[복구] 세그먼트 구제: {name} ({result['duration_s']:.1f}s) → {os.path.basename(output)}")
+        merger.submit(path, on_done=partial(on_segment_merged, kind, output))
+        if kind == 'schedule':
+            get_job_queue().enqueue('merge', {"incremental": output,
+                                              "output": output.replace('_session_merging.mp4', '_merge_file.mp4'),
+                                              "segments": []},
+                                    job_id=f"merge-{os.path.basename(output)[:-len('.mp4')]}")
+
+# --- 후처리 작업 핸들러 (job_queue) ---
+def job_merge(job: dict):
+    """점진 병합 출력 확정 + 점진 병합에 들어가지 못한 세그먼트 스트림 카피 병합 → 결과별 검증 작업."""
+    payload = job["payload"]
+    output = payload["output"]
+    produced = []
+    merged_names = set()
+    timeline_path = output + TIMELINE_SUFFIX
+    if payload.get("incremental"):
+        result = finalize_incremental_merge(payload["incremental"], output)
+        if result is not None:
+            produced.append(output)
+            merged_names = {os.path.basename(p) for p in result["segments"]}
+            # 카탈로그용 사이드카는 이름 확정 전에 기록됨 (finalize_incremental_merge → write_merge_meta)
+            placements = result.get("placements", [])
+            if needs_grading(switches_from_placements(placements)):
+                save_timeline(timeline_path, placements)
+        elif os.path.isfile(output):
+            # 이전 실행에서 이미 확정됨 (확정 직후 중단)
+            produced.append(output)
+    leftovers = [p for p in payload.get("segments", [])
+                 if os.path.isfile(p) and os.path.basename(p) not in merged_names]
+    followups = []
+    for p in produced:
+        if os.path.isfile(timeline_path):
+            # 중립 원본은 그대로 두고(재보정용) 타임라인을 적용한 보정본을 만들어 검증/업로드
+            followups.append(('grade', {"path": p, "timeline": timeline_path,
+                                        "output": p[:-len('.mp4')] + '_graded.mp4'}))
+        else:
+            followups.append(('verify', {"path": p}))
+    if leftovers:
+        rest = output if not produced else output[:-len('.mp4')] + '_rest.mp4'
+        if not merge_segments_mp4(leftovers, rest):
+            raise RuntimeError(f'세그먼트 병합 실패: {rest}')
+        write_merge_meta(rest, leftovers)
+        get_storage_manager().note_file(rest)
+        # 원본 세그먼트는 병합 결과 검증 후에 삭제
+        followups.append(('verify', {"path": rest, "delete_after": leftovers}))
+    if not followups:
+        print(f"[병합] 병합할 세그먼트가 없습니다: {output}")
+    return followups
+
+def job_grade(job: dict):
+    """후처리 모드: 병합된 중립 원본에 파라미터 타임라인(gamma/WB/gray) 적용 → 보정본 검증 작업."""
+    payload = job["payload"]
+    path = payload["path"]
+    if not os.path.isfile(path):
+        raise PermanentJobError(f'파일 없음: {path}')
+    try:
+        placements = load_timeline(payload["timeline"])
+    except Exception as e:
+        raise PermanentJobError(f'타임라인 읽기 실패: {payload["timeline"]}: {e}') from e
+    output = payload["output"]
+    if not get_storage_manager().admit(os.path.getsize(path), kind='grade'):
+        raise RuntimeError('여유 공간 부족')
+    grade_video(path, output, switches_from_placements(placements), int(current_bitrate) // 1000)
+    meta = read_meta(path)
+    if meta:
+        write_meta(output, **meta)
+    get_storage_manager().note_file(output)
+    return [('verify', {"path": output})]
+
+def job_verify(job: dict):
+    """병합 결과 mp4 검증 → 통과 시 인덱스 생성/원본 삭제/업로드 작업."""
+    payload = job["payload"]
+    path = payload["path"]
+    if not os.path.isfile(path):
+        raise PermanentJobError(f'파일 없음: {path}')
+    result = verify_segment_file(path)
+    if not result["verified"]:
+        raise PermanentJobError(f'검증 실패: {path} ({result["reason"]})')
+    print(f"[병합] 검증 완료: {path} ({result['duration_s']:.1f}s)")
+    try:
+        # 캡처 루프 정지로 생긴 타임스탬프 끊김 확인 (샘플 테이블만 읽음, 디코드 없음)
+        timing = analyze_timestamps(path)
+        if timing["gap_count"]:
+            metrics.RECORDING_FRAME_GAPS.inc(timing["gap_count"])
+            metrics.RECORDING_DROPPED_FRAMES.inc(timing["dropped_frames_est"])
+            print(f"[병합] ⚠️ 프레임 끊김 {timing['gap_count']}회 (추정 드롭 {timing['dropped_frames_est']}프레임, "
+                  f"{timing['frames']}/{timing['expected_frames']}): {path}")
+    except Exception as e:
+        print(f"[병합] 타임스탬프 분석 실패: {path}, {e}")
+    followups = [('index', {"path": path})]
+    if payload.get("delete_after"):
+        followups.append(('delete', {"paths": payload["delete_after"]}))
+    if UPLOAD_URL:
+        followups.append(('upload', {"path": path}))
+    return followups
+
+def job_index(job: dict):
+    """검증된 영상의 키프레임 인덱스/썸네일 스프라이트 생성 (업로드 후 삭제되었으면 생략)."""
+    path = job["payload"]["path"]
+    if not os.path.isfile(path):
+        return None
+    ensure_index(path)
+    return None
+
+def job_upload(job: dict):
+    """병합 결과를 청크 업로드 (실패 시 저널/서버 오프셋에서 이어서 재시도). 서버 sha256 확인 후에만 로컬 삭제."""
+    path = job["payload"]["path"]
+    if not os.path.isfile(path):
+        raise PermanentJobError(f'파일 없음: {path}')
+    print(f"[업로드] 영상 전송 시작: {path} → {UPLOAD_URL}")
+    try:
+        get_uploader().upload_file(path)
+    except UploadError as e:
+        if e.permanent:
+            raise PermanentJobError(str(e)) from e
+        raise
+    return [('delete', {"paths": [path]})] if UPLOAD_DELETE_AFTER else None
+
+def get_uploader() -> Uploader:
+    """업로더 싱글톤 (진행 저널: VIDEO_OUTPUT_DIR/.uploads)."""
+    global uploader
+    if uploader is None:
+        uploader = Uploader(UPLOAD_URL, os.path.join(VIDEO_OUTPUT_DIR, '.uploads'), max_kbps=UPLOAD_MAX_KBPS,
+                            chunk_bytes=UPLOAD_CHUNK_BYTES, max_concurrent=UPLOAD_CONCURRENCY, mode=UPLOAD_MODE)
+    return uploader
+
+def job_delete(job: dict):
+    for p in job["payload"].get("paths", []):
+        try:
+            if os.path.isfile(p):
+                os.remove(p)
+                print(f"[정리] 삭제: {p}")
+        except FileNotFoundError:
+            pass
+        for suffix in SIDECAR_SUFFIXES:
+            try:
+                os.remove(p + suffix)
+            except OSError:
+                pass
+        get_storage_manager().note_removed(p)
+    return None
+
+def get_job_queue() -> JobQueue:
+    """후처리 작업 큐 싱글톤 (작업 디렉터리: CAMERA_JOB_DIR 또는 VIDEO_OUTPUT_DIR/.jobs)."""
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(
+            JOB_DIR or os.path.join(VIDEO_OUTPUT_DIR, '.jobs'),
+            {'merge': job_merge, 'grade': job_grade, 'verify': job_verify, 'index': job_index,
+             'upload': job_upload, 'delete': job_delete},
+            concurrency={'merge': 1, 'grade': 1, 'verify': 1, 'index': 1, 'upload': UPLOAD_CONCURRENCY,
+                         'delete': 1},
+            max_workers=max(2, UPLOAD_CONCURRENCY + 1),
+        )
+        job_queue.start()
+    return job_queue
+
+def storage_protected(path: str) -> bool:
+    """용량 관리 삭제 제외 대상: 병합 대기 중인 세그먼트와 대기/실행 중 작업이 참조하는 파일."""
+    with incremental_mergers_lock:
+        if path in incremental_mergers:
+            return True
+        mergers = list(incremental_mergers.values())
+    if any(m.is_pending(path) for m in mergers):
+        return True
+    with global_detection_segments_lock:
+        if path in global_detection_segments:
+            return True
+    if job_queue is not None:
+        for job in job_queue.list_jobs('queued') + job_queue.list_jobs('running'):
+            payload = job.get("payload") or {}
+            refs = list(payload.get("segments") or []) + list(payload.get("delete_after") or [])
+            refs += [payload.get("path"), payload.get("incremental"), payload.get("output")]
+            if path in refs:
+                return True
+    return False
+
+def segment_storage_classes() -> dict:
+    """세그먼트 인덱스에 기록된 종류 → 보존 등급 (on_segment_finalized와 같은 기준, 재시작 후 스캔용)."""
+    index = load_segment_index(os.path.join(VIDEO_OUTPUT_DIR, 'segment_index.jsonl'))
+    return {os.path.basename(p): rec["kind"] for p, rec in index.items() if rec.get("kind") in ('motion', 'manual')}
+
+def get_storage_manager() -> StorageManager:
+    """녹화 디렉터리 용량 관리자 싱글톤 (생성 시 한 번 스캔 후 삭제 스레드 시작)."""
+    global storage_manager
+    if storage_manager is None:
+        storage_manager = StorageManager(VIDEO_OUTPUT_DIR, protect=storage_protected,
+                                         segment_classes=segment_storage_classes)
+        storage_manager.start()
+    return storage_manager
+
+def get_segment_finalizer(output_dir: str) -> SegmentFinalizer:
+    """세그먼트 finalizer 싱글톤 반환 (인덱스: output_dir/segment_index.jsonl)."""
+    global segment_finalizer
+    if segment_finalizer is None:
+        segment_finalizer = SegmentFinalizer(
+            index_path=os.path.join(output_dir, 'segment_index.jsonl'),
+            on_finalized=on_segment_finalized,
+        )
+    return segment_finalizer
+
 # 간단 화이트 밸런스(Gray-World) 적용: RGB 프레임 입력 → RGB 프레임 출력
 def apply_simple_wb_rgb(rgb_frame: np.ndarray) -> np.ndarray:
     try:
@@ -874,313 +1532,295 @@ def apply_simple_wb_rgb(rgb_frame: np.ndarray) -> np.ndarray:
     except Exception:
         return rgb_frame
 
-def render_merged_raw_from_segments(segment_paths, output_path):
-    """세그먼트들을 디코드→단순 병합→재인코딩하여 하나의 mp4 생성(후처리 없음).
+def merge_segments_mp4(segment_paths, output_path) -> bool:
+    """세그먼트 mp4들을 프로세스 내 스트림 카피로 병합 (mp4_merge).
 
-    안정성과 호환성을 위해 final 병합과 동일한 방식으로 프레임 단위 병합하되,
-    감마/화이트밸런스/모드 변경 등 후처리는 적용하지 않습니다.
+    H.264 액세스 유닛을 디코드 없이 이어 붙이며, 해상도/코덱이 다른 세그먼트만 재인코딩합니다.
     """
     if not segment_paths:
-        print("[병합-raw] 세그먼트가 없습니다.")
-        return
+        print("[병합] 입력 세그먼트가 없습니다")
+        return False
     try:
-        Gst.init(None)
-
-        # 첫 세그먼트에서 캡스 정보 취득
-        first_path = segment_paths[0]
-        in_pipeline_str = (
-            f"filesrc location={first_path} ! qtdemux name=demux "
-            f"h264parse name=parser ! avdec_h264 name=decoder ! videoconvert ! video/x-raw,format=RGB ! "
-            f"appsink name=in_snk emit-signals=true sync=false drop=false max-buffers=1"
-        )
-        in_pipeline = Gst.parse_launch(in_pipeline_str)
-        demux = in_pipeline.get_by_name('demux')
-        parser = in_pipeline.get_by_name('parser')
-        in_sink = in_pipeline.get_by_name('in_snk')
-        def on_pad_added(demux_elem, pad):
-            sinkpad = parser.get_static_pad('sink')
-            if not sinkpad.is_linked():
-                try:
-                    pad.link(sinkpad)
-                except Exception:
-                    pass
-        demux.connect('pad-added', on_pad_added)
-        in_pipeline.set_state(Gst.State.PLAYING)
-
-        first_sample = in_sink.emit('pull-sample')
-        if first_sample is None:
-            in_pipeline.set_state(Gst.State.NULL)
-            raise RuntimeError('첫 세그먼트에서 샘플을 읽지 못했습니다')
-        caps = first_sample.get_caps()
-        s = caps.get_structure(0)
-        width = s.get_value('width')
-        height = s.get_value('height')
-        num, den = (30, 1)
-        if s.has_field('framerate'):
-            try:
-                num, den = s.get_fraction('framerate')
-            except Exception:
-                num, den = (30, 1)
-        frame_duration_ns = int(1e9 * (den / max(1, num)))
+        stats = concat_mp4(segment_paths, output_path)
+        if stats["skipped"]:
+            print(f"[병합] 제외된 세그먼트 {len(stats['skipped'])}개: {stats['skipped']}")
+        return True
+    except Exception as e:
+        print(f"[병합] 실패: {e}")
+        return False
 
-        # 출력 파이프라인 생성 (후처리 없음)
-        out_pipeline_str = (
-            f"appsrc name=out_src is-live=false format=time do-timestamp=false caps=video/x-raw,format=RGB,width={width},height={height},framerate={num}/{den} ! "
-            f"videoconvert ! x264enc quantizer=20 pass=qual qp-min=20 qp-max=40 key-int-max=60 speed-preset=ultrafast ! h264parse config-interval=-1 ! mp4mux faststart=true ! filesink location={output_path}"
-        )
-        out_pipeline = Gst.parse_launch(out_pipeline_str)
-        out_src = out_pipeline.get_by_name('out_src')
-        out_pipeline.set_state(Gst.State.PLAYING)
-
-        cumulative_pts = 0
-        def push_frame(sample):
-            nonlocal cumulative_pts
-            buf = sample.get_buffer()
-            ok, mapinfo = buf.map(Gst.MapFlags.READ)
-            if not ok:
-                return
-            try:
-                data = bytes(mapinfo.data)
-            finally:
-                buf.unmap(mapinfo)
-            out_buf = Gst.Buffer.new_allocate(None, len(data), None)
-            out_buf.fill(0, data)
-            out_buf.pts = cumulative_pts
-            out_buf.dts = cumulative_pts
-            out_buf.duration = frame_duration_ns
-            out_src.emit('push-buffer', out_buf)
-            cumulative_pts += frame_duration_ns
-
-        # 첫 샘플 처리
-        push_frame(first_sample)
-        while True:
-            sample = in_sink.emit('pull-sample')
-            if sample is None:
-                break
-            push_frame(sample)
-        in_pipeline.set_state(Gst.State.NULL)
-
-        # 나머지 세그먼트 처리
-        for p in segment_paths[1:]:
-            in_pipeline_str = (
-                f"filesrc location={p} ! qtdemux name=demux "
-                f"h264parse name=parser ! avdec_h264 name=decoder ! videoconvert ! video/x-raw,format=RGB ! "
-                f"appsink name=in_snk emit-signals=true sync=false drop=false max-buffers=1"
-            )
-            in_pipeline = Gst.parse_launch(in_pipeline_str)
-            demux = in_pipeline.get_by_name('demux')
-            parser = in_pipeline.get_by_name('parser')
-            in_sink = in_pipeline.get_by_name('in_snk')
-            def on_pad_added2(demux_elem, pad):
-                sinkpad = parser.get_static_pad('sink')
-                if not sinkpad.is_linked():
-                    try:
-                        pad.link(sinkpad)
-                    except Exception:
-                        pass
-            demux.connect('pad-added', on_pad_added2)
-            in_pipeline.set_state(Gst.State.PLAYING)
+# --- RTSP Server ---
+def parse_rtsp_mounts(value) -> list:
+    """'/main=main,/sub=640x360@10:600,/mjpeg-compatible=640x360@5:jpeg' → 마운트 설정 목록.
 
-            while True:
-                sample = in_sink.emit('pull-sample')
-                if sample is None:
-                    break
-                push_frame(sample)
-            in_pipeline.set_state(Gst.State.NULL)
-
-        out_src.emit('end-of-stream')
-        bus_out = out_pipeline.get_bus()
-        bus_out.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS)
-        out_pipeline.set_state(Gst.State.NULL)
-        print(f"[병합-raw] 완료: {output_path}")
-    except Exception as e:
-        print(f"[병합-raw] 실패: {e}")
-    
-def ffmpeg_concat_mp4(segment_paths, output_path) -> bool:
+    크기: main(인코더 입력 해상도) | frame(MQTT frame 설정을 따름) | WxH
+    @fps는 입력보다 낮을 때만 적용, :<kbps>는 비트레이트, :jpeg는 MJPEG(RTP/JPEG) 출력.
     """
-    ffmpeg concat demuxer로 mp4 파일들을 무재인코딩 병합(스트림 카피) 시도.
-    모든 입력이 동일 코덱/프로필/타임베이스이어야 성공. 실패 시 False.
-    """
-    try:
-        if not segment_paths:
-            print("[concat] 입력 세그먼트가 없습니다")
-            return False
-        # ffmpeg 확인
-        ffmpeg_bin = shutil.which('ffmpeg')
-        if ffmpeg_bin is None:
-            print("[concat] ffmpeg를 찾을 수 없습니다")
-            return False
-        # 임시 파일 목록 생성
-        with tempfile.NamedTemporaryFile('w', delete=False, suffix='.txt', encoding='utf-8') as tf:
-            list_path = tf.name
-            for p in segment_paths:
-                if isinstance(p, str) and os.path.isfile(p):
-                    tf.write(f"file '{p}'\n")
-        # concat demuxer + stream copy
-        cmd = [ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', '-movflags', '+faststart', output_path]
-        print(f"[concat] 실행: {' '.join(cmd)}")
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    mounts = []
+    for item in str(value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        path, sep, spec = item.partition('=')
+        path = '/' + path.strip().strip('/')
+        if not sep or path == '/' or any(m["path"] == path for m in mounts):
+            print(f"[RTSP] 마운트 설정 무시: {item}")
+            continue
+        head, *opts = spec.strip().lower().split(':')
+        size, _, fps = head.partition('@')
+        mount = {"path": path, "size": size or 'frame', "fps": None, "kbps": None, "codec": 'h264',
+                 "factory": None, "appsrc": None, "subscriber": None, "clients": set()}
         try:
-            os.unlink(list_path)
-        except Exception:
-            pass
-        if res.returncode == 0 and os.path.isfile(output_path):
-            print(f"[concat] 성공: {output_path}")
-            return True
-        print(f"[concat] 실패: rc={res.returncode}, err={res.stderr[:200]}")
-        return False
-    except Exception as e:
-        print(f"[concat] 예외: {e}")
-        return False
+            if size not in ('', 'main', 'frame'):
+                w, h = size.split('x', 1)
+                mount["size"] = (int(w), int(h))
+            if fps:
+                mount["fps"] = max(1, int(fps))
+            for opt in opts:
+                if opt in ('jpeg', 'mjpeg'):
+                    mount["codec"] = 'jpeg'
+                elif opt and opt != 'h264':
+                    mount["kbps"] = max(1, int(opt))
+        except ValueError:
+            print(f"[RTSP] 마운트 설정 무시: {item}")
+            continue
+        mounts.append(mount)
+    return mounts
+
+rtsp_mount_list = parse_rtsp_mounts(rtsp_mounts_env) or parse_rtsp_mounts('/test=frame')
+rtsp_path = rtsp_mount_list[0]["path"]
+
+def rtsp_mount_for(path: str):
+    """요청 경로(예: /sub/stream=0) → 마운트 (가장 긴 접두사)."""
+    best = None
+    for mount in rtsp_mount_list:
+        p = mount["path"]
+        if path == p or path.startswith(p + '/'):
+            if best is None or len(p) > len(best["path"]):
+                best = mount
+    return best
+
+def rtsp_rendition_name(mount=None) -> str:
+    """마운트 설정에 맞는 공유 인코더 렌디션. 입력과 같은 설정이면 main을 공유 (같은 크기끼리는 스케일러 공유)."""
+    mount = mount or rtsp_mount_list[0]
+    if encode_hub is None:
+        return 'main'
+    try:
+        size = mount["size"]
+        if size == 'main':
+            tw, th = encode_hub.width, encode_hub.height
+        elif size == 'frame':
+            tw, th = str(current_frame).lower().replace(' ', '').split('x', 1)
+        else:
+            tw, th = size
+        return encode_hub.ensure_rendition(int(tw), int(th), mount["kbps"], fps=mount["fps"], codec=mount["codec"])
+    except Exception:
+        return 'main'
 
-def ffmpeg_concat_mp4(segment_paths, output_path) -> bool:
-    """
-    ffmpeg concat demuxer로 mp4 파일들을 무재인코딩 병합(스트림 카피) 시도.
-    모든 입력이 동일 코덱/프로필/타임베이스이어야 성공. 실패 시 False.
-    """
+def attach_rtsp_subscriber(mount, force: bool = False):
+    """마운트에 클라이언트가 있으면(force면 무조건) 구독자를 공유 인코더에 연결 (구독 시 키프레임 요청 → 즉시 재생)."""
+    sub = mount["subscriber"]
+    if sub is None or sub.hub is not None or encode_hub is None:
+        return
+    if not force:
+        with rtsp_clients_lock:
+            if not mount["clients"]:
+                return
     try:
-        if not segment_paths:
-            print("[concat] 입력 세그먼트가 없습니다")
-            return False
-        # ffmpeg, ffprobe 확인
-        ffmpeg_bin = shutil.which('ffmpeg')
-        if ffmpeg_bin is None:
-            print("[concat] ffmpeg를 찾을 수 없습니다")
-            return False
-        # 임시 파일 목록 생성
-        with tempfile.NamedTemporaryFile('w', delete=False, suffix='.txt', encoding='utf-8') as tf:
-            list_path = tf.name
-            for p in segment_paths:
-                if isinstance(p, str) and os.path.isfile(p):
-                    tf.write(f"file '{p}'\n")
-        # concat demuxer + stream copy
-        cmd = [ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', '-movflags', '+faststart', output_path]
-        print(f"[concat] 실행: {' '.join(cmd)}")
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        encode_hub.subscribe(rtsp_rendition_name(mount), sub)
+        print(f"[RTSP] {mount['path']}: 송출 시작")
+    except Exception as e:
+        print(f"[RTSP] {mount['path']} 구독 실패: {e}")
+
+def detach_rtsp_subscriber(mount):
+    """마운트의 마지막 클라이언트가 나가면 구독 해제 → 렌디션 valve가 닫혀 인코딩/버퍼 전달을 하지 않음."""
+    sub = mount["subscriber"]
+    hub = sub.hub if sub is not None else None
+    if hub is None:
+        return
+    with rtsp_clients_lock:
+        if mount["clients"]:
+            return
+    hub.unsubscribe(sub)
+    print(f"[RTSP] {mount['path']}: 접속 클라이언트 없음, 송출 중지")
+
+def retarget_rtsp_frame_mounts():
+    """MQTT frame 변경: frame 크기를 따르는 마운트만 새 렌디션으로 전환 (클라이언트가 없으면 다음 접속 때 반영)."""
+    if encode_hub is None:
+        return
+    for mount in rtsp_mount_list:
+        sub = mount["subscriber"]
+        if mount["size"] != 'frame' or sub is None or sub.hub is None:
+            continue
+        rendition = rtsp_rendition_name(mount)
+        encode_hub.move_subscriber(sub, rendition)
+        print(f"[RTSP] {mount['path']} 렌디션 전환: {rendition}")
+
+def end_rtsp_streams(hub):
+    """세션 종료: 마운트별 구독 해제 후 EOS."""
+    for mount in rtsp_mount_list:
+        src = mount["appsrc"]
+        if src is None:
+            continue
         try:
-            os.unlink(list_path)
+            if mount["subscriber"] is not None:
+                hub.unsubscribe(mount["subscriber"])
+            src.emit('end-of-stream')
         except Exception:
             pass
-        if res.returncode == 0 and os.path.isfile(output_path):
-            print(f"[concat] 성공: {output_path}")
-            return True
-        print(f"[concat] 실패: rc={res.returncode}, err={res.stderr[:200]}")
-        return False
-    except Exception as e:
-        print(f"[concat] 예외: {e}")
-        return False
 
-# --- RTSP Server ---
+def _rtsp_request_path(ctx) -> str:
+    try:
+        return ctx.uri.abspath or ''
+    except Exception:
+        return ''
+
+def on_rtsp_client_connected(server, client):
+    """RTSP 클라이언트 접속/종료 추적. 요청 경로로 마운트를 찾아 마운트별 접속 수 0↔1 전환에서 구독을 붙이고 뗀다."""
+    with rtsp_clients_lock:
+        rtsp_clients.add(client)
+        metrics.RTSP_CLIENTS.set(len(rtsp_clients))
+    client.connect("closed", on_rtsp_client_closed)
+    client.connect("describe-request", on_rtsp_client_request)
+    # 같은 연결에서 TEARDOWN 후 다시 PLAY하는 경우
+    client.connect("play-request", on_rtsp_client_request)
+    client.connect("teardown-request", on_rtsp_client_teardown)
+
+def on_rtsp_client_request(client, ctx):
+    mount = rtsp_mount_for(_rtsp_request_path(ctx))
+    if mount is None:
+        return
+    with rtsp_clients_lock:
+        mount["clients"].add(client)
+    attach_rtsp_subscriber(mount)
+
+def on_rtsp_client_teardown(client, ctx):
+    mount = rtsp_mount_for(_rtsp_request_path(ctx))
+    if mount is None:
+        return
+    with rtsp_clients_lock:
+        mount["clients"].discard(client)
+    detach_rtsp_subscriber(mount)
+
+def on_rtsp_client_closed(client):
+    with rtsp_clients_lock:
+        rtsp_clients.discard(client)
+        metrics.RTSP_CLIENTS.set(len(rtsp_clients))
+        for mount in rtsp_mount_list:
+            mount["clients"].discard(client)
+    # 요청 처리 전에 끊긴 클라이언트도 있으므로 모든 마운트를 확인
+    for mount in rtsp_mount_list:
+        detach_rtsp_subscriber(mount)
+
+def _rtsp_launch(mount) -> str:
+    if mount["codec"] == 'jpeg':
+        return (
+            f"( appsrc name=rtsp_src is-live=true do-timestamp=true format=time block=false caps={JPEG_CAPS} ! "
+            f"jpegparse ! rtpjpegpay name=pay0 pt=26 )"
+        )
+    return (
+        f"( appsrc name=rtsp_src is-live=true do-timestamp=true format=time block=false caps={H264_CAPS} ! "
+        f"h264parse ! rtph264pay name=pay0 pt=96 config-interval=1 )"
+    )
+
+def _rtsp_mount_factory(mount):
+    """마운트 하나의 공유 미디어 팩토리. 미디어가 만들어질 때 appsrc 구독자를 붙인다."""
+    factory = GstRtspServer.RTSPMediaFactory()
+    factory.set_shared(True)
+    factory.set_launch(_rtsp_launch(mount))
+
+    def on_media_unprepared(media):
+        sub = mount["subscriber"]
+        if sub is not None and encode_hub is not None:
+            encode_hub.unsubscribe(sub)
+        mount["subscriber"] = None
+        mount["appsrc"] = None
+        print(f"[DEBUG] RTSP media unprepared: {mount['path']}")
+
+    def on_media_configure(factory, media):  # 콜백함수 설정
+        element = media.get_element()
+        src = element.get_by_name("rtsp_src")
+        if src:
+            mount["appsrc"] = src
+            # 첫 마운트는 기존 지표 이름(consumer="rtsp") 유지
+            name = 'rtsp' if mount is rtsp_mount_list[0] else f"rtsp{mount['path'].replace('/', '_')}"
+            mount["subscriber"] = EncodedSubscriber(name, src, live_timestamps=True)
+            # 미디어 준비(SDP용 캡스)에 데이터가 필요하므로 요청한 클라이언트를 기다리지 않고 바로 구독
+            attach_rtsp_subscriber(mount, force=True)
+            print(f"[DEBUG] RTSP appsrc ready: {mount['path']}")
+        media.connect("unprepared", on_media_unprepared)
+
+    factory.connect("media-configure", on_media_configure)
+    return factory
+
 def ensure_rtsp_server(width: int, height: int, framerate: int, bitrate_kbps: int, service_port: str = "8554"):
-    global rtsp_server, rtsp_mounts, rtsp_factory, rtsp_loop, rtsp_appsrc_ref, current_mode, rtsp_vb_element, current_gamma, file_gamma, current_frame
+    """RTSP 서버 싱글톤 생성. 마운트마다 공유 인코더 렌디션의 H.264(또는 JPEG)를 페이로드만 해서 송출한다.
+
+    width/height/framerate/bitrate_kbps는 공유 인코더 설정을 따르므로 호환용으로만 유지.
+    """
+    global rtsp_server, rtsp_mounts, rtsp_loop
     if rtsp_server is not None:
         return
     Gst.init(None)
-    # target scale size from current_frame
-    try:
-        tw, th = str(current_frame).lower().replace(' ', '').split('x', 1)
-        target_w = int(tw); target_h = int(th)
-    except Exception:
-        target_w, target_h = width, height
     rtsp_server = GstRtspServer.RTSPServer()
     try:
         rtsp_server.set_service(service_port)
     except Exception:
         pass
     rtsp_mounts = rtsp_server.get_mount_points()
-    rtsp_factory = GstRtspServer.RTSPMediaFactory()
-    rtsp_factory.set_shared(True)
-    # gamma 요소를 파이프라인에 추가 + videoscale 로 target 해상도로 스케일링
-    launch_str = (
-        f"( appsrc name=rtsp_src is-live=true block=true do-timestamp=true format=time "
-        f"caps=video/x-raw,format=RGB,width={width},height={height},framerate={framerate}/1 ! "
-        f"videoscale name=rtsp_vscale add-borders=true ! capsfilter name=rtsp_scale_caps caps=video/x-raw,format=RGB,width={target_w},height={target_h} ! "
-        f"videobalance name=rtsp_vb ! "
-        f"gamma name=rtsp_gamma gamma={current_gamma} ! "
-        f"videoconvert ! video/x-raw,format=I420 ! "
-        f"x264enc tune=zerolatency qp-min=25 qp-max=35 noise-reduction=30 b-adapt=false vbv-buf-capacity=400 speed-preset=superfast key-int-max=30 bitrate={bitrate_kbps} ! "
-        f"h264parse ! rtph264pay name=pay0 pt=96 config-interval=2 )"
-    )
-    rtsp_factory.set_launch(launch_str)
-    
-
-    def on_media_configure(factory, media):  # 콜백함수 설정
-        element = media.get_element()
-        src = element.get_by_name("rtsp_src")
-        if src:
-            rtsp_appsrc_ref["appsrc"] = src
-            print("[DEBUG] RTSP appsrc ready")  
-        global rtsp_vb_element, gamma_element
-        vb = element.get_by_name("rtsp_vb")
-        gamma_element = element.get_by_name("rtsp_gamma")
+    for mount in rtsp_mount_list:
+        mount["factory"] = _rtsp_mount_factory(mount)
+        # 마운트 추가 (이미 존재하면 무시)
         try:
-            # x264enc는 동적으로 이름이 pay0 이전에 생성되므로 파이프라인에서 탐색
-            x264 = None
-            try:
-                x264 = element.get_by_name('x264enc0') or element.get_by_name('x264enc')
-            except Exception:
-                x264 = None
-            globals()['rtsp_x264_element'] = x264
-        except Exception:
-            globals()['rtsp_x264_element'] = None
-        try:
-            globals()['rtsp_scale_caps_element'] = element.get_by_name('rtsp_scale_caps')
-        except Exception:
-            globals()['rtsp_scale_caps_element'] = None
-        try:
-            globals()['rtsp_videobox_element'] = element.get_by_name('rtsp_videobox')
-        except Exception:
-            globals()['rtsp_videobox_element'] = None
-        # no dynamic scale caps element anymore
-        if vb:
-            # 초기 설정값 설정
-            rtsp_vb_element = vb
-
-            # gstreamer에서 조정 가능한 카메라 설정값 예시
-            # vb.set_property('brightness', 0.0)  # 밝기 -1 ~ 1
-            # vb.set_property('contrast', 0.0)    # 대비 0 ~ 2
-            # vb.set_property('hue', 0.0)        # 휘도 -1 ~ 1
-            # vb.set_property('saturation', 0.0) # 채도 0 ~ 2
-            # vb.set_property('gamma', 1.0)      # 감마 0.5~ 2.5 (실제 범위 0 ~ 4)
-            try:
-                vb.set_property('saturation', 0.0 if current_mode == 'gray' else 1.0)
-            except Exception:
-                pass
-        if gamma_element:
-            # 초기 감마값 적용
-            try:
-                gamma_element.set_property('gamma', current_gamma)
-            except Exception:
-                pass
-
-    rtsp_factory.connect("media-configure", on_media_configure)
-    # 마운트 추가 (이미 존재하면 무시)
-    try:
-        rtsp_mounts.add_factory(rtsp_path, rtsp_factory)
-    except Exception as e:
-        print(f"[DEBUG] mount add warning: {e}")
+            rtsp_mounts.add_factory(mount["path"], mount["factory"])
+        except Exception as e:
+            print(f"[DEBUG] mount add warning: {e}")
+    rtsp_server.connect("client-connected", on_rtsp_client_connected)
     rtsp_server.attach(None)
     # GLib MainLoop 백그라운드 실행
     rtsp_loop = GObject.MainLoop()
     import threading
     threading.Thread(target=rtsp_loop.run, daemon=True).start()
-    print(f"[DEBUG] RTSP server running at rtsp://127.0.0.1:{service_port}{rtsp_path}")
+    for mount in rtsp_mount_list:
+        print(f"[DEBUG] RTSP server running at rtsp://127.0.0.1:{service_port}{mount['path']}")
+
+def ensure_encode_hub(width: int, height: int, framerate: int, bitrate_kbps: int) -> SharedEncoder:
+    """공유 인코더 생성(또는 입력 크기/fps 변경 시 재구성) 후 상시 구독자(HLS/RTSP) 연결."""
+    global encode_hub
+    if encode_hub is None:
+        if postprocess_after_capture:
+            # 후처리 모드: 원본은 중립으로 기록 (파라미터는 병합 후 grading.py에서 적용)
+            encode_hub = SharedEncoder(width, height, framerate, bitrate_kbps, gamma=1.0, saturation=1.0,
+                                       align_keyframes=hls_abr_enabled)
+        else:
+            encode_hub = SharedEncoder(width, height, framerate, bitrate_kbps, gamma=current_gamma,
+                                       saturation=0.0 if current_mode == 'gray' else 1.0,
+                                       align_keyframes=hls_abr_enabled)
+        encode_hub.start()
+    else:
+        encode_hub.reconfigure(width, height, framerate, bitrate_kbps)
+    if hls_subscriber is not None and hls_subscriber.hub is None:
+        encode_hub.subscribe('main', hls_subscriber)
+    subscribe_hls_abr()
+    for mount in rtsp_mount_list:
+        attach_rtsp_subscriber(mount)
+    return encode_hub
 
 def set_gamma(gamma_value: float):
     """
-    RTSP 스트림의 gamma 값을 동적으로 변경합니다.
+    공유 인코더(파일/HLS/RTSP 공통)의 gamma 값을 동적으로 변경합니다.
     """
-    global gamma_element
+    if postprocess_after_capture:
+        print(f"[ENC] 후처리 모드: gamma {gamma_value}는 타임라인에만 기록됩니다.")
+        return
     try:
-        if file_gamma is not None:
-            file_gamma.set_property('gamma', gamma_value)
-        if gamma_element is not None:
-            gamma_element.set_property('gamma', gamma_value)
-            print(f"[RTSP] gamma 값이 {gamma_value}로 변경되었습니다.")
+        if encode_hub is not None:
+            encode_hub.set_gamma(gamma_value)
+            print(f"[ENC] gamma 값이 {gamma_value}로 변경되었습니다.")
         else:
-            print("[RTSP] gamma element가 아직 준비되지 않았습니다.")
+            print("[ENC] 공유 인코더가 아직 준비되지 않았습니다.")
     except Exception as e:
-        print(f"[RTSP] gamma 변경 실패: {e}")
+        print(f"[ENC] gamma 변경 실패: {e}")
 # --- Remote MQTT Client Class ---
 class RemoteMQTTClient:
     def __init__(self, client_id, broker_host='127.0.0.1', broker_port=8883):
@@ -1537,9 +2177,19 @@ class RemoteMQTTClient:
     
 
     def on_message(self, client, userdata, msg):
-        """메시지 수신 시 처리"""
+        """메시지 수신 시 처리 (토픽별 처리 시간/건수 메트릭 기록)"""
+        t0 = time.perf_counter()
+        try:
+            self.handle_message(client, userdata, msg)
+        finally:
+            metrics.MQTT_MESSAGES.inc(topic=msg.topic)
+            metrics.MQTT_HANDLE_SECONDS.observe(time.perf_counter() - t0, topic=msg.topic)
+
+    def handle_message(self, client, userdata, msg):
+        """메시지 처리 본체"""
         global current_gamma, current_mode, current_wb, current_roi, current_bitrate, of_enabled, current_frame, current_fps, camera_thread
         global SCHEDULE_MODE_HOUR, SCHEDULE_MODE_MINUTE, MOTION_MODE_HOUR, MOTION_MODE_MINUTE, SCHEDULE_DAYS, MOTION_DAYS, SCHEDULE_DURATION_SEC
+        global hls_abr_enabled, hls_abr_ladder
 
         raw = msg.payload.decode('utf-8', 'ignore')
         print(f'수신 [{msg.topic}]: {raw}')
@@ -1569,21 +2219,26 @@ class RemoteMQTTClient:
                         w, h = [int(v) for v in str(current_frame).split('x')]
                     except Exception:
                         w, h = 1280, 720
-                    start_hls_http_server()
-                    start_hls_pipeline(w, h, int(current_fps), int(current_bitrate//1000))
+                    ensure_hls(w, h, int(current_fps), int(current_bitrate//1000))
                     print('[CMD] HLS 시작')
                 elif cmd in ['hls_off', 'hls_stop']:
-                    # 항상 켜짐: 중지 요청 무시하고 유지
-                    try:
-                        w, h = [int(v) for v in str(current_frame).split('x')]
-                    except Exception:
-                        w, h = 1280, 720
-                    try:
-                        start_hls_http_server()
-                        start_hls_pipeline(w, h, int(current_fps), int(current_bitrate//1000))
-                    except Exception:
-                        pass
-                    print('[CMD] HLS 항상 켜짐: 중지 요청 무시하고 유지')
+                    if hls_on_demand:
+                        # HTTP 서버는 유지: 인코딩만 멈추고 다음 시청자 요청 시 다시 시작
+                        with hls_lock:
+                            hls_viewers.clear()
+                        idle_hls_pipeline('hls_off 요청')
+                        print('[CMD] HLS 인코딩 정지 (다음 시청자 요청 시 재시작)')
+                    else:
+                        # 항상 켜짐: 중지 요청 무시하고 유지
+                        try:
+                            w, h = [int(v) for v in str(current_frame).split('x')]
+                        except Exception:
+                            w, h = 1280, 720
+                        try:
+                            ensure_hls(w, h, int(current_fps), int(current_bitrate//1000))
+                        except Exception:
+                            pass
+                        print('[CMD] HLS 항상 켜짐: 중지 요청 무시하고 유지')
                 elif cmd in ['start_recording', 'record_on']:
                     try:
                         if camera_frame is not None:
@@ -1638,15 +2293,10 @@ class RemoteMQTTClient:
                             save_last_mode_to_disk()
                         except Exception:
                             pass
-                        # 파일/RTSP 파이프라인 videobalance에 동기 적용
+                        # 공유 인코더 videobalance에 적용 (파일/HLS/RTSP 공통)
                         try:
-                            if 'file_vb_element' in globals() and file_vb_element is not None:
-                                file_vb_element.set_property('saturation', 0.0 if current_mode == 'gray' else 1.0)
-                        except Exception:
-                            pass
-                        try:
-                            if rtsp_vb_element is not None:
-                                rtsp_vb_element.set_property('saturation', 0.0 if current_mode == 'gray' else 1.0)
+                            if encode_hub is not None and not postprocess_after_capture:
+                                encode_hub.set_saturation(0.0 if current_mode == 'gray' else 1.0)
                         except Exception:
                             pass
                 except Exception as e:
@@ -1662,7 +2312,7 @@ class RemoteMQTTClient:
                             save_last_mode_to_disk()
                         except Exception:
                             pass
-                        # 파일/RTSP 모두 프레임 푸시 직전 경로에서 apply_simple_wb_rgb()로 반영하므로
+                        # 공유 인코더로 프레임을 넣기 직전에 apply_simple_wb_rgb()로 반영하므로
                         # 여기서는 상태만 업데이트하면 즉시 반영됨
                 except Exception as e:  
                     print(f"WB 값 파싱 실패: {e}")
@@ -1677,6 +2327,9 @@ class RemoteMQTTClient:
                         pass
                 except Exception as e:
                     print(f"감마 값 파싱 실패: {e}")
+            if 'mode' in update_dict or 'wb' in update_dict or 'gamma' in update_dict:
+                # 세션 타임라인에 기록 (후처리 모드에서는 병합 후 이 타임라인으로 보정)
+                record_param_change_event()
             if 'frame' in update_dict:
                 # 해상도 문자열 "WxH" 파싱 후 즉시 반영 준비
                 try:
@@ -1691,17 +2344,11 @@ class RemoteMQTTClient:
                             save_last_mode_to_disk()
                         except Exception:
                             pass
-                        # 파이프라인 재생성 없이, scale caps/videobox 속성만 갱신
-                        # 파일 파이프라인은 그대로 유지 (요청에 따라 미변경)
+                        # 세션 재시작 없이 frame을 따르는 RTSP 마운트만 새 크기의 렌디션으로 전환 (파일/HLS는 세션 해상도 유지)
                         try:
-                            # RTSP 파이프라인: RGB caps 갱신
-                            if 'rtsp_scale_caps_element' in globals() and rtsp_scale_caps_element is not None:
-                                caps_str = f"video/x-raw,format=RGB,pixel-aspect-ratio=1/1,width={w_new},height={h_new}"
-                                new_caps = Gst.Caps.from_string(caps_str)
-                                rtsp_scale_caps_element.set_property('caps', new_caps)
-                                print(f"[RTSP] videoscale caps updated: {caps_str}")
+                            retarget_rtsp_frame_mounts()
                         except Exception as e_caps2:
-                            print(f"[RTSP] videoscale caps update failed: {e_caps2}")
+                            print(f"[RTSP] 렌디션 전환 실패: {e_caps2}")
                 except Exception as e:
                     print(f"Frame 값 파싱 실패: {e}")
             # (삭제됨) Crop 설정
@@ -1716,15 +2363,30 @@ class RemoteMQTTClient:
                         save_last_mode_to_disk()
                     except Exception:
                         pass
-                    # RTSP 인코더 런타임 반영
+                    # 공유 인코더(main 렌디션) 런타임 반영
                     try:
-                        if 'rtsp_x264_element' in globals() and rtsp_x264_element is not None:
-                            rtsp_x264_element.set_property('bitrate', max(1, int(current_bitrate // 1000)))
-                            print(f"[RTSP] x264enc bitrate updated: {current_bitrate//1000} kbps")
+                        if encode_hub is not None:
+                            encode_hub.set_bitrate(max(1, int(current_bitrate // 1000)))
+                            print(f"[ENC] x264enc bitrate updated: {current_bitrate//1000} kbps")
                     except Exception as e:
-                        print(f"[RTSP] bitrate update failed: {e}")
+                        print(f"[ENC] bitrate update failed: {e}")
                 except Exception as e:
                     print(f"Bitrate 값 파싱 실패: {e}")
+            # HLS ABR (렌디션 사다리) 설정
+            if 'hls_abr' in update_dict or 'hls_abr_ladder' in update_dict:
+                try:
+                    if 'hls_abr' in update_dict:
+                        val = str(update_dict['hls_abr']).lower()
+                        hls_abr_enabled = val in ['on', 'true', '1', 'yes']
+                    if 'hls_abr_ladder' in update_dict:
+                        ladder = parse_abr_ladder(update_dict['hls_abr_ladder'])
+                        if ladder:
+                            hls_abr_ladder = ladder
+                    print(f"HLS ABR: {'on' if hls_abr_enabled else 'off'} ladder={hls_abr_ladder}")
+                    save_last_mode_to_disk()
+                    restart_hls_output()
+                except Exception as e:
+                    print(f"HLS ABR 설정 실패: {e}")
             # Optical Flow 토글
             if 'opt_flow' in update_dict:
                 try:
@@ -1937,7 +2599,7 @@ def remote_subscriber_test():
         print("구독 완료. 메시지 수신 대기 중입니다. (Ctrl+C로 종료)")
         print("메시지를 받으려면 다른 기기에서 발행자 테스트를 실행하세요.")
 
-        button = Button(17, pull_up=False)
+        button = create_button(17, pull_up=False)
 
         try:
             while True:
@@ -2003,7 +2665,7 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
     ROI는 사각형 [x, y, w, h]으로 지정합니다.
     SCHEDULE_DURATION_SEC 값을 넣으면 해당 시간(초)만큼 동작하고, 값을 넣지 않으면 무한 동작합니다.
     """
-    global file_vb_element, current_fps, current_bitrate, current_roi_poly, current_frame, file_gamma
+    global current_fps, current_bitrate, current_roi_poly, current_frame
 
     gi.require_version('Gst', '1.0') # GStreamer 사용을 위해 필요
     gi.require_version('GstApp', '1.0') # APPSRC 사용을 위해 필요
@@ -2017,28 +2679,23 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     # 출력 디렉터리
-    output_dir = '/home/openiot/project/video'# '/home/openiot/project/video'#'/mnt/video'
+    output_dir = VIDEO_OUTPUT_DIR  # '/home/openiot/project/video'#'/mnt/video'
     os.makedirs(output_dir, exist_ok=True)
     segment_index = 0
     # 세그먼트 원본 파일 + 세션 기준 시작/종료 시간(ns)
     segment_infos = []  # [{"path": str, "start_ns": int, "end_ns": Optional[int]}]
     
-    # Picamera2 구성 (RGB 포맷으로 사용)
-    picam2 = Picamera2()
-    cfg = picam2.create_video_configuration(
-        main={'size': (int(width), int(height)), 'format': 'RGB888'}
-    )
+    # 카메라 소스 구성 (기본 Picamera2 RGB888, CAMERA_SOURCE=synthetic/file:... 이면 합성 소스)
+    picam2 = create_camera_source(int(width), int(height), int(current_fps))
     # 카메라 세션 시작
-    picam2.configure(cfg)
-    picam2.set_controls({"FrameRate": current_fps})
-    picam2.set_controls({"AfMode": 2})   # 0=Manual, 1=Auto, 2=Continuous
     picam2.start()
-    # RTSP 서버를 유지하고, 존재하지 않을 때만 생성 (스케일링으로 출력만 조정)
+    # 공유 인코더: 세션 해상도로 한 번만 인코딩하여 파일/HLS/RTSP가 구독
+    hub = ensure_encode_hub(int(width), int(height), int(framerate), int(bitrate // 1000))
+    # RTSP 서버를 유지하고, 존재하지 않을 때만 생성 (크기가 다르면 공유 인코더 렌디션으로 조정)
     ensure_rtsp_server(int(width), int(height), framerate, bitrate // 1000)
     # HLS 서버/파이프라인 시작 (옵션)
     try:
-        start_hls_http_server()
-        start_hls_pipeline(int(width), int(height), int(framerate), int(bitrate // 1000))
+        ensure_hls(int(width), int(height), int(framerate), int(bitrate // 1000))
     except Exception as e:
         print(f"[HLS] 시작 실패(무시): {e}")
     bitrate_kbps = bitrate // 1000
@@ -2046,9 +2703,10 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
     # 1) RTSP 서버 구성 (GstRtspServer) - 클라이언트 RTSP 서버에 접속 시에만 활성화됨 - 설정한 파이프라인 사용
     # ensure_rtsp_server에서 설정됨
 
-    # 2) 파일 저장 파이프라인: 모션 발생 시에만 동적으로 생성/종료
+    # 2) 파일 저장 파이프라인: 모션 발생 시에만 동적으로 생성/종료 (공유 인코더 구독, mp4 mux만 수행)
     file_pipeline = None
     file_appsrc = None
+    file_subscriber = None
     segment_open = False
     segment_start_ns = 0
 
@@ -2061,113 +2719,118 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
         camera_stop_event.clear()
     except Exception:
         pass
-    frame_duration_ns = int(1 / framerate * 1e9)
     session_postprocess = postprocess_after_capture
-    prev_gray = None
-    last_motion_time = 0.0
     # 세션 시작과 동시에 파일 저장 파이프라인 오픈
     # 스케줄 모드(비-OF)에서는 1분(60초) 단위로 분할 저장 후 병합
     schedule_segment_length_sec = 60
-    output_file_h264 = (
-        os.path.join(output_dir, f'video_{timestamp}_seg{segment_index:03d}_raw.mp4')
-        if not of_enabled else os.path.join(output_dir, f'video_{timestamp}_raw.mp4')
-    )
-    if os.path.exists(output_file_h264):
+    finalizer = get_segment_finalizer(output_dir)
+    storage = get_storage_manager()
+    segment_kind = 'motion' if of_enabled else 'schedule'
+    # 세그먼트 하나의 예상 크기 (여유 공간 확인용, 모션 세그먼트도 같은 길이로 가정)
+    segment_expected_bytes = int(bitrate_kbps) * 125 * schedule_segment_length_sec
+    # 여유 공간 부족으로 열지 못한 스케줄 세그먼트의 재시도 시각(ns)
+    segment_retry_ns = 0
+    # 스케줄 세그먼트는 세션 출력에 즉시 추가 (모션 세그먼트는 예약 병합까지 공용 모션 출력에 추가)
+    session_merge_path = os.path.join(output_dir, f'video_{timestamp}_session_merging.mp4')
+
+    def build_file_pipeline(location: str):
+        """세그먼트 하나를 기록할 파일 파이프라인 생성 (세그먼트마다 새로 생성, 종료 시 finalizer로 이관).
+
+        gamma/gray/WB는 공유 인코더 입력 단계에서 이미 적용되므로 여기서는 mp4 mux만 수행.
+        """
+        return build_mp4_writer_pipeline(location, RECORDING_FRAGMENT_SEC)
+
+    def open_segment(start_ns: int) -> bool:
+        """새 세그먼트 파일을 열고 segment_infos에 등록."""
+        nonlocal file_pipeline, file_appsrc, file_subscriber, segment_open, segment_start_ns, segment_index, output_file_h264
+        nonlocal segment_retry_ns
+        if not storage.admit(segment_expected_bytes, kind=segment_kind):
+            # 가득 찬 디스크에 쓰다 조용히 깨지는 대신 기록을 건너뛰고 잠시 후 다시 시도
+            segment_retry_ns = int(start_ns) + int(10 * 1e9)
+            return False
+        output_file_h264 = os.path.join(output_dir, f'video_{timestamp}_seg{segment_index:03d}_raw.mp4')
         try:
-            os.remove(output_file_h264)
+            if os.path.exists(output_file_h264):
+                os.remove(output_file_h264)
         except Exception:
             pass
-    # 감마는 RGB 색공간에서만 적용되므로 RGB 구간을 삽입한 뒤 재변환
-    file_pipeline_str = (
-        f"appsrc name=file_src is-live=true format=time do-timestamp=true block=true "
-        f"caps=video/x-raw,format=I420,width={current_frame.split('x')[0]},height={current_frame.split('x')[1]},framerate={current_fps}/1 ! "
-        f"queue max-size-buffers=0 max-size-time=0 max-size-bytes=0 ! "
-        f"videoconvert ! video/x-raw,format=RGB ! "
-        f"gamma name=gamma gamma={current_gamma} ! "
-        f"videobalance name=file_vb ! "
-        f"videoconvert ! video/x-raw,format=I420 ! "
-        f"videorate ! video/x-raw,width={current_frame.split('x')[0]},height={current_frame.split('x')[1]},framerate={current_fps}/1 !"
-        f"x264enc sliced-threads=true quantizer=20 pass=qual qp-min=20 qp-max=40 key-int-max=60 speed-preset=ultrafast ! h264parse ! mp4mux faststart=true ! filesink name=file_sink location={output_file_h264} sync=false"
-    )
-    file_pipeline = Gst.parse_launch(file_pipeline_str)
-    file_gamma = file_pipeline.get_by_name('gamma')  # 일단은 초기에 설정을 하면 반영됨
-    # 파일 파이프라인용 videobalance 참조 보관 (gray/rgb 모드 전환용)
-    try:
-        file_vb_element = file_pipeline.get_by_name('file_vb')
-        if file_vb_element is not None:
-            try:
-                file_vb_element.set_property('saturation', 0.0 if current_mode == 'gray' else 1.0)
-            except Exception:
-                pass
-    except Exception:
-        pass
-    # print(f"current_gamma: {current_gamma}")
-    # if file_gamma is not None:
-    #     file_gamma.set_property('gamma', current_gamma)
-    file_appsrc = file_pipeline.get_by_name('file_src')
-    try:
-        globals()['file_x264_element'] = file_pipeline.get_by_name('file_x264')
-    except Exception:
-        globals()['file_x264_element'] = None
-    # no dynamic file scale caps element anymore
-    # OF 모드에서는 시작 시 파일 파이프라인을 열지 않음(모션 발생 시 오픈)
-    if of_enabled:
-        segment_open = False
-        segment_start_ns = 0
-    else:
-        file_pipeline.set_state(Gst.State.PLAYING)
+        try:
+            file_pipeline, file_appsrc = build_file_pipeline(output_file_h264)
+            file_pipeline.set_state(Gst.State.PLAYING)
+            # 다음 키프레임부터 기록 (구독 시 키프레임 요청)
+            file_subscriber = EncodedSubscriber('file', file_appsrc)
+            hub.subscribe('main', file_subscriber)
+        except Exception as e:
+            print(f"[세그먼트] 파이프라인 생성 실패: {e}")
+            segment_retry_ns = int(start_ns) + int(10 * 1e9)
+            file_pipeline = None
+            file_appsrc = None
+            file_subscriber = None
+            return False
         segment_open = True
-        segment_start_ns = 0
-        segment_infos.append({"path": output_file_h264, "start_ns": int(segment_start_ns), "end_ns": None})
+        segment_start_ns = int(start_ns)
+        segment_infos.append({"path": output_file_h264, "start_ns": int(segment_start_ns), "end_ns": None, "kind": segment_kind,
+                              "merge_output": session_merge_path})
+        metrics.SEGMENTS_OPENED.inc(kind=segment_kind)
+        segment_index += 1
         LED_PIN.on()
-    # --- Optical Flow 설정 및 상태 ---
-    of_target_width = 640
-    of_interval_frames = 1
-    of_redetect_interval = 30
-    of_max_corners = 200
-    of_quality_level = 0.003
-    of_min_distance = 7
-    of_block_size = 3
-    of_win_size = (25, 25)
-    of_max_level = 2
-    of_term_criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
-    of_min_mag = 1.0
-    of_fb_thresh = 4.0 # 1.5
-    of_min_moving_pts = 8
-    of_idle_timeout = 2.0  # 모션이 사라진 뒤 이 시간(초) 지나면 세그먼트 종료
-    # 오버레이 옵션 (RTSP 프레임에 벡터 표시)
-    of_draw_overlay = True
-    of_thickness = 3
-    of_color = (255, 255, 255)
-    of_alpha = 0.6
-    # 오버레이용 벡터/스케일 버퍼
-    of_last_vectors = None  # [(x1, y1, x0, y0), ...]
-    of_last_scale = (1.0, 1.0)
-    prev_gray_small = None
-    prev_pts = None
-    prev_motion_mask_small = None
-    since_redetect = 0
-    frame_idx_of = 0
+        return True
+
+    def close_segment(end_ns: int):
+        """열린 세그먼트를 닫는다. EOS 대기/검증은 finalizer 스레드에서 수행하고 여기서는 넘기기만 한다."""
+        nonlocal file_pipeline, file_appsrc, file_subscriber, segment_open
+        if not segment_open or file_pipeline is None:
+            return None
+        info = None
+        if len(segment_infos) > 0 and segment_infos[-1].get("end_ns") is None:
+            info = segment_infos[-1]
+            info["end_ns"] = int(end_ns)
+        if info is None:
+            info = {"path": output_file_h264, "start_ns": int(segment_start_ns), "end_ns": int(end_ns), "kind": segment_kind,
+                    "merge_output": session_merge_path}
+        if session_postprocess:
+            # 병합 출력의 placements로 넘어가 후처리 보정 구간이 됨
+            info["param_events"] = [dict(e) for e in session_param_events]
+        # 구독 해제 후 넘김 (이후 이 appsrc로는 버퍼가 들어가지 않음)
+        if file_subscriber is not None:
+            hub.unsubscribe(file_subscriber)
+        finalizer.submit(file_pipeline, file_appsrc, info)
+        file_pipeline = None
+        file_appsrc = None
+        file_subscriber = None
+        segment_open = False
+        LED_PIN.off()
+        return info
+
+    # OF 모드에서는 시작 시 파일 파이프라인을 열지 않음(모션 발생 시 오픈)
+    output_file_h264 = None
+    if not of_enabled:
+        open_segment(0)
+    # --- Optical Flow 설정 및 상태 (판정 로직은 motion_analytics 공용: replay.py와 동일) ---
+    motion_detector = OpticalFlowMotionDetector()
+    motion_tracker = MotionSegmentTracker(motion_detector.params["idle_timeout"])
+    qr_scanner = QrScanner(cooldown_period)
     motion = False
     detection_segments: list[str] = []
-    merged_index = 0
+    fps_meter = metrics.FpsMeter(framerate)
 
     # --- ROI: 사각형만 사용 ---
     try:
         # 모드별 종료 조건: OF 모드 → camera_off 수신 전까지, 스케줄 모드 → duration까지
         camera_stop_event.clear()
-        # HLS PTS 누적
-        hls_pts_ns = 0
         while True:
             # duration이 지정된 경우, 해당 시간(초)만큼만 동작
             if duration is not None:
                 if (time.time() - session_start_time) >= duration:
                     print(f"[카메라] 지정된 동작 시간({duration}초) 경과, 세션 종료")
                     break
-            # t_loop0 = time.time()
-            # t0 = time.time()
+            prof = stage_profiler
+            if prof is not None:
+                prof.begin_frame()
             frame = picam2.capture_array()  # RGB 포맷 (caps와 일치)
-            # t1 = time.time()
+            fps_meter.tick()
+            if prof is not None:
+                prof.mark('capture')
             # 종료 조건: 외부 stop 이벤트로만 제어
             if camera_stop_event.is_set():
                 break
@@ -2180,411 +2843,91 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
             # QR 인식 및 처리 (쿨다운)
             try:
                 now_t = time.time()
-                results = detect_qr_codes_enhanced(frame)
-                for res in results:
-                    data = res.get('data') if isinstance(res, dict) else None
-                    if not data:
-                        continue
-                    if (data != last_qr_data) or (now_t - qr_detection_time > cooldown_period):
-                        try:
-                            qr_json = json.loads(data)
-                            if 'endpoint' in qr_json:
-                                endpoint_url = qr_json['endpoint']
-                                threading.Thread(target=send_pairing_request, args=(endpoint_url,), daemon=True).start()
-                            else:
-                                print("[QR] endpoint 없음")
-                        except json.JSONDecodeError:
-                            server_info = parse_server_info(data)
-                            if server_info:
-                                threading.Thread(target=send_commission_request, args=(server_info,), daemon=True).start()
-                        except Exception:
-                            pass
-                        globals()['last_qr_data'] = data
-                        globals()['qr_detection_time'] = now_t
-            except Exception:
-                pass
-
-            # 수동 녹화 프레임 쓰기
-            try:
-                if manual_recording:
-                    write_frame_to_manual_recording(frame)
+                with metrics.QR_DECODE_SECONDS.time():
+                    _qr_all, qr_accepted = qr_scanner.scan(frame, now_t)
+                if qr_accepted:
+                    metrics.QR_DETECTIONS.inc(len(qr_accepted))
+                for res in qr_accepted:
+                    handle_qr_payload(res['data'])
+                    globals()['last_qr_data'] = res['data']
+                    globals()['qr_detection_time'] = now_t
             except Exception:
                 pass
+            if prof is not None:
+                prof.mark('qr')
 
             if of_enabled:
-                # ROI 사각형 추출 (프레임 경계 안전 클램프)
-                h_total, w_total = frame.shape[:2]
-                # 기본값: 전체 프레임
-                x, y, w, h = 0, 0, w_total, h_total
-                try:
-                    if isinstance(current_roi, (list, tuple)) and len(current_roi) == 4:
-                        rx, ry, rw, rh = [int(v) for v in current_roi]
-                        rx = max(0, min(rx, w_total - 1))
-                        ry = max(0, min(ry, h_total - 1))
-                        rw = max(1, min(int(rw), w_total - rx))
-                        rh = max(1, min(int(rh), h_total - ry))
-                        x, y, w, h = rx, ry, rw, rh
-                        print(f"Rectangle ROI 사용: {(x, y, w, h)}")
-                    else:
-                        print("Rectangle ROI 미설정: 전체 프레임 사용")
-                except Exception:
-                    print("Rectangle ROI 파싱 실패: 전체 프레임 사용")
-
-                # 모션 감지 (RGB -> GRAY)
-                # 입력이 RGB라고 가정하여 RGB2GRAY 사용 (예외 시 BGR2GRAY fallback)
-                try:
-                    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-                except Exception:
-                    print("RGB2GRAY 변환 false")
-                    gray = frame
-
-                # 전체 프레임 기준 사각형 ROI 마스크 생성/적용
-                full_mask = build_roi_mask_full((gray.shape[0], gray.shape[1]), (x, y, w, h), None)
-                if full_mask is not None:
-                    roi_gray = cv2.bitwise_and(gray, gray, mask=full_mask)
-                else:
-                    roi_gray = gray
-
-                # prev_gray도 ROI로 맞춰서 관리
-                if prev_gray is not None and full_mask is not None:
-                    prev_gray_roi = cv2.bitwise_and(prev_gray, prev_gray, mask=full_mask)
-                else:
-                    prev_gray_roi = prev_gray
-
-                # --- 옵티컬 플로우 기반 모션 감지 ---
-                # 1) 다운스케일 그레이/마스크 준비
-                h_total, w_total = gray.shape[:2]
-                if w_total != of_target_width:
-                    scale = of_target_width / float(w_total)
-                    new_w = int(w_total * scale)
-                    new_h = int(h_total * scale)
-                    gray_small = cv2.resize(roi_gray if full_mask is not None else gray, (new_w, new_h), interpolation=cv2.INTER_AREA)
-                    roi_mask_small = cv2.resize(full_mask, (new_w, new_h), interpolation=cv2.INTER_NEAREST) if full_mask is not None else None
-                else:
-                    gray_small = roi_gray if full_mask is not None else gray
-                    roi_mask_small = full_mask
-
-                frame_idx_of += 1
-                do_flow = (of_interval_frames <= 1) or (frame_idx_of % of_interval_frames == 0)
-                # 옵티컬 플로우 계산
-                if do_flow:
-                    if prev_gray_small is None or prev_pts is None or since_redetect >= of_redetect_interval:
-                        prev_pts = (
-                            cv2.goodFeaturesToTrack(
-                                gray_small,
-                                maxCorners=of_max_corners,
-                                qualityLevel=of_quality_level,
-                                minDistance=of_min_distance,
-                                blockSize=of_block_size,
-                                mask=roi_mask_small,
-                            )
-                        )
-                        prev_gray_small = gray_small
-                        prev_motion_mask_small = roi_mask_small
-                        since_redetect = 0
-                        # 첫 프레임은 모션 판정하지 않음
-                        motion = False
-                    else:
-                        motion = False
-                        if prev_pts is not None and len(prev_pts) > 0:
-                            prev_pts_f32 = prev_pts.astype(np.float32)
-                            next_pts, status, err = cv2.calcOpticalFlowPyrLK(
-                                prev_gray_small, gray_small, prev_pts_f32, None,
-                                winSize=of_win_size,
-                                maxLevel=of_max_level,
-                                criteria=of_term_criteria,
-                            )
-                            if next_pts is not None and status is not None:
-                                status_flat = status.ravel()
-                                good_new = next_pts[status_flat == 1]
-                                good_old = prev_pts_f32[status_flat == 1]
-
-                                # Forward-Backward 체크
-                                if good_new is not None and len(good_new) > 0:
-                                    back_pts, back_status, _ = cv2.calcOpticalFlowPyrLK(
-                                        gray_small, prev_gray_small, good_new.reshape(-1, 1, 2).astype(np.float32), None,
-                                        winSize=of_win_size,
-                                        maxLevel=of_max_level,
-                                        criteria=of_term_criteria,
-                                    )
-                                    if back_pts is not None and back_status is not None:
-                                        back_status = back_status.ravel()
-                                        back_pts = np.reshape(back_pts, (-1, 2))
-                                        fb_err = np.linalg.norm(np.reshape(good_old, (-1, 2)) - back_pts, axis=1)
-                                        fb_mask = fb_err <= of_fb_thresh
-                                        good_new = np.reshape(good_new, (-1, 2))[fb_mask]
-                                        good_old = np.reshape(good_old, (-1, 2))[fb_mask]
-
-                                # 이동량 기반 모션 판정
-                                if good_new is not None and len(good_new) > 0:
-                                    disp = good_new - good_old
-                                    mag = np.linalg.norm(disp, axis=1)
-                                    moving_count = int(np.sum(mag >= of_min_mag))
-                                    motion = moving_count >= of_min_moving_pts
-                                    # 오버레이용 벡터 저장 (다운스케일 좌표 기준)
-                                    try:
-                                        if of_draw_overlay:
-                                            vectors = []
-                                            for (npt, opt) in zip(good_new, good_old):
-                                                a, b = float(npt[0]), float(npt[1])
-                                                c, d = float(opt[0]), float(opt[1])
-                                                if np.hypot(a - c, b - d) >= of_min_mag:
-                                                    vectors.append((a, b, c, d))
-                                            # 다운스케일→원본 스케일
-                                            sx = float(w_total) / float(gray_small.shape[1]) if gray_small.shape[1] > 0 else 1.0
-                                            sy = float(h_total) / float(gray_small.shape[0]) if gray_small.shape[0] > 0 else 1.0
-                                            of_last_vectors = vectors
-                                            of_last_scale = (sx, sy)
-                                    except Exception:
-                                        pass
-                                else:
-                                    of_last_vectors = None
-
-                                # 상태 업데이트
-                                prev_gray_small = gray_small
-                                if good_new is not None and len(good_new) > 0:
-                                    prev_pts = good_new.reshape(-1, 1, 2)
-                                else:
-                                    prev_pts = None
-                                prev_motion_mask_small = roi_mask_small
-                                since_redetect += 1
-                            else:
-                                # 추적 실패 → 재검출
-                                prev_pts = cv2.goodFeaturesToTrack(
-                                    gray_small,
-                                    maxCorners=of_max_corners,
-                                    qualityLevel=of_quality_level,
-                                    minDistance=of_min_distance,
-                                    blockSize=of_block_size,
-                                    mask=roi_mask_small,
-                                )
-                                prev_gray_small = gray_small
-                                prev_motion_mask_small = roi_mask_small
-                                since_redetect = 0
-                                of_last_vectors = None
-
-                # 프레임 차이 로직 사용 안 함: prev_gray는 유지만 함
-                if prev_gray is None:
-                    prev_gray = gray.copy()
-                else:
-                    prev_gray = gray
+                # 옵티컬 플로우 기반 모션 감지 (ROI 사각형은 프레임 경계 안으로 클램프)
+                with metrics.MOTION_SECONDS.time():
+                    motion = motion_detector.update(frame, current_roi)
+                metrics.MOTION_ACTIVE.set(1 if motion else 0)
             else:
                 print("of_enabled false only raw file")
+            if prof is not None:
+                prof.mark('optical_flow')
 
             now_ns = int((time.time() - session_start_time) * 1e9)
-            if motion:
-                # 모션 발생: 시간 갱신 및 OF 모드에서 세그먼트 오픈
-                last_motion_time = time.time()
-                if of_enabled and not segment_open:
-                    # 새 세그먼트 파일명
-                    print("motion detected")
-                    output_file_h264 = os.path.join(output_dir, f'video_{timestamp}_seg{segment_index:03d}_raw.mp4')
-                    # 기존 파일 삭제 없이 진행
-                    # 파이프라인을 반복문에서 새로 만들지 않고, 이미 생성된 file_pipeline을 재활용
-                    # 단, 파일 경로만 동적으로 변경 (filesink location property만 변경)
-                    # 기존 파일 삭제 없이 진행
-                    try:
-                        # 파이프라인 정지
-                        file_pipeline.set_state(Gst.State.NULL)
-                        # filesink location만 변경 + caps(해상도/프레임레이트) 반영
-                        filesink = file_pipeline.get_by_name('file_sink') or file_pipeline.get_by_name('filesink0') or file_pipeline.get_by_name('filesink')
-                        if filesink is not None:
-                            filesink.set_property('location', output_file_h264)
-                        # no dynamic file caps update; next session will apply current_frame
-                        # gamma 값도 필요시 갱신
-                        file_gamma = file_pipeline.get_by_name('gamma')
-                        if file_gamma is not None:
-                            try:
-                                file_gamma.set_property('gamma', current_gamma)
-                            except Exception:
-                                pass
-                        # appsrc 재참조
-                        file_appsrc = file_pipeline.get_by_name('file_src')
-                        # 파이프라인 재시작
-                        file_pipeline.set_state(Gst.State.PLAYING)
-                        segment_open = True
-                        segment_start_ns = int((time.time() - session_start_time) * 1e9)
-                        segment_infos.append({"path": output_file_h264, "start_ns": int(segment_start_ns), "end_ns": None})
-                        segment_index += 1
-                        LED_PIN.on()
-                    except Exception:
-                        pass
-
-            # 파일 파이프라인(appsrc)은 I420를 기대하므로, RGB에서 간단 WB 적용 후 I420로 변환
+            segment_event = motion_tracker.update(motion, time.time()) if of_enabled else None
+            if segment_event == 'open' and not segment_open:
+                # 모션 발생: 새 세그먼트 오픈 (세그먼트마다 새 파이프라인, 닫을 때 finalizer로 넘김)
+                print("motion detected")
+                if not open_segment(int((time.time() - session_start_time) * 1e9)):
+                    motion_tracker.reset()
+
+            # 공유 인코더로 프레임을 한 번만 전달 (WB는 auto일 때 여기서, gamma/gray는 인코더 파이프라인에서 적용,
+            # 후처리 모드에서는 모두 생략하고 병합 후 적용)
+            # 인코딩 결과는 파일 세그먼트/HLS/RTSP 구독자에게 나눠 전달됨
             try:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                if str(current_wb).lower() == 'auto':
-                    frame_rgb = apply_simple_wb_rgb(frame_rgb)
-                i420 = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2YUV_I420)
-                data = i420.tobytes()
-            except Exception:
-                # 변환 실패 시 안전하게 기존 RGB로 대체(파이프라인 caps와 불일치 가능)
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                data = frame_rgb.tobytes()
-            buf = Gst.Buffer.new_allocate(None, len(data), None)
-            buf.fill(0, data)
-            # 병합 중에는 파일 저장을 중단하고, 아니면 세그먼트가 열려 있을 때에만 파일 파이프라인으로 푸시
-            if (not merge_in_progress) and segment_open and file_appsrc is not None:
-                pts = max(0, now_ns - segment_start_ns)
-                buf.pts = pts
-                buf.duration = frame_duration_ns
-                file_appsrc.emit('push-buffer', buf)
-
-            # HLS로 프레임 푸시 (항상)
-            try:
-                if hls_appsrc is not None:
-                    hls_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    hls_bytes = hls_rgb.tobytes()
-                    hls_buf = Gst.Buffer.new_allocate(None, len(hls_bytes), None)
-                    hls_buf.fill(0, hls_bytes)
-                    hls_buf.pts = int(hls_pts_ns)
-                    hls_buf.dts = int(hls_pts_ns)
-                    hls_buf.duration = frame_duration_ns
-                    hls_appsrc.emit('push-buffer', hls_buf)
-                    hls_pts_ns += frame_duration_ns
+                if str(current_wb).lower() == 'auto' and not session_postprocess:
+                    enc_frame = apply_simple_wb_rgb(frame)
+                else:
+                    enc_frame = frame
+                with metrics.APPSRC_PUSH_SECONDS.time(consumer='encoder'):
+                    hub.push_frame(enc_frame)
             except Exception:
-                pass
+                metrics.FRAMES_DROPPED.inc(consumer='encoder')
+            if prof is not None:
+                prof.mark('encode')
 
             # 스케줄 모드: 1분 경과 시 세그먼트 로테이션 (OF 모드 아님)
             if (not of_enabled) and segment_open:
                 try:
                     if (now_ns - int(segment_start_ns)) >= int(schedule_segment_length_sec * 1e9):
-                        # 현재 세그먼트 종료
-                        try:
-                            file_appsrc.emit('end-of-stream')
-                            bus_file = file_pipeline.get_bus()
-                            bus_file.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS)
-                        except Exception:
-                            pass
-                        try:
-                            file_pipeline.set_state(Gst.State.NULL)
-                        except Exception:
-                            pass
-                        # 종료 시간 기록 및 병합 후보 추가
-                        try:
-                            if len(segment_infos) > 0 and segment_infos[-1].get("end_ns") is None:
-                                segment_infos[-1]["end_ns"] = int(now_ns)
-                        except Exception:
-                            pass
-
-                        # 다음 세그먼트 준비
-                        output_file_h264 = os.path.join(output_dir, f'video_{timestamp}_seg{segment_index+1:03d}_raw.mp4')
-                        try:
-                            filesink = file_pipeline.get_by_name('file_sink') or file_pipeline.get_by_name('filesink0') or file_pipeline.get_by_name('filesink')
-                            if filesink is not None:
-                                filesink.set_property('location', output_file_h264)
-                            file_gamma = file_pipeline.get_by_name('gamma')
-                            if file_gamma is not None:
-                                try:
-                                    file_gamma.set_property('gamma', current_gamma)
-                                except Exception:
-                                    pass
-                            file_appsrc = file_pipeline.get_by_name('file_src')
-                            file_pipeline.set_state(Gst.State.PLAYING)
-                            segment_open = True
-                            segment_start_ns = int(now_ns)
-                            segment_index += 1
-                            segment_infos.append({"path": output_file_h264, "start_ns": int(segment_start_ns), "end_ns": None})
-                            LED_PIN.on()
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-            # t2 = time.time()
-            # OF 모드: 모션 idle 시 세그먼트 종료 및 3회 병합 처리
-            if of_enabled and segment_open and (time.time() - last_motion_time) > float(of_idle_timeout):
-                try:
-                    file_appsrc.emit('end-of-stream')
-                    bus_file = file_pipeline.get_bus()
-                    bus_file.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS)
-                except Exception:
-                    pass
-                try:
-                    file_pipeline.set_state(Gst.State.NULL)
-                except Exception:
-                    pass
-                segment_open = False
-                try:
-                    if len(segment_infos) > 0 and segment_infos[-1].get("end_ns") is None:
-                        segment_infos[-1]["end_ns"] = int((time.time() - session_start_time) * 1e9)
-                        # 막 닫힌 세그먼트 경로를 병합 후보에 추가
-                        detection_segments.append(segment_infos[-1]["path"])
-                        try:
-                            with global_detection_segments_lock:
-                                global_detection_segments.append(segment_infos[-1]["path"])
-                        except Exception:
-                            pass
+                        # 현재 세그먼트는 finalizer로 넘기고 바로 다음 세그먼트 오픈 (EOS 대기 없음)
+                        close_segment(now_ns)
+                        open_segment(now_ns)
+                        metrics.SEGMENT_ROTATIONS.inc()
                 except Exception:
                     pass
-                LED_PIN.off()
+            elif (not of_enabled) and now_ns >= segment_retry_ns:
+                # 여유 공간 부족으로 열지 못한 세그먼트 재시도
+                open_segment(now_ns)
+            # OF 모드: 모션 idle 시 세그먼트 종료 (병합 후보 등록은 finalizer 검증 완료 후 수행)
+            if segment_event == 'close' and segment_open:
+                closed = close_segment(int((time.time() - session_start_time) * 1e9))
+                if closed is not None:
+                    detection_segments.append(closed["path"])
                 # 실시간 병합은 수행하지 않음. 세션 종료 시 한 번에 병합.
                 # (세그먼트 경로는 detection_segments에 누적)
-            # print(
-            #     f"capture: {(t1 - t0)*1000:.2f} ms, "
-            #     f"loop: {(t1 - t_loop0)*1000:.2f} ms"
-            # )
-            # RTSP appsrc 준비 시 푸시: 스케줄 모드에서는 항상 송출, 모션 감지 모드에서는 모션이 없을 때만 송출
-            if rtsp_appsrc_ref["appsrc"] is not None and ((not of_enabled and not segment_open) or (of_enabled and not motion)):
-                try:
-                    rtsp_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    # 간단 화이트 밸런스 (auto일 때만)
-                    if str(current_wb).lower() == 'auto':
-                        rtsp_frame = apply_simple_wb_rgb(rtsp_frame)
-                    # gamma는 RTSP 파이프라인 요소(rtsp_gamma)가 적용. 여기서는 중복 적용 안 함
-                    rtsp_data = rtsp_frame.tobytes()
-                    rtsp_buf = Gst.Buffer.new_allocate(None, len(rtsp_data), None)
-                    rtsp_buf.fill(0, rtsp_data)
-                    # rtsp_pts_ns = int((time.time() - session_start_time) * 1e9)
-                    # rtsp_buf.pts = rtsp_pts_ns
-                    # rtsp_buf.dts = rtsp_pts_ns
-                    rtsp_buf.duration = frame_duration_ns
-                    rtsp_appsrc_ref["appsrc"].emit('push-buffer', rtsp_buf)
-                    # 스트리밍 상태 로그 (5초 간격)
-                    try:
-                        now_t = time.time()
-                        if now_t - globals().get('rtsp_last_stream_log_time', 0.0) >= 5.0:
-                            print("스트리밍 중")
-                            globals()['rtsp_last_stream_log_time'] = now_t
-                    except Exception:
-                        pass
-                except Exception:
-                    pass
-        # 남아있는 세그먼트 정리
-        if segment_open and file_appsrc is not None and file_pipeline is not None:
-            try:
-                file_appsrc.emit('end-of-stream')
-                bus_file = file_pipeline.get_bus()
-                bus_file.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS)
-            except Exception:
-                pass
-            # 세그먼트 종료 시간 기록
-            try:
-                if len(segment_infos) > 0 and segment_infos[-1].get("end_ns") is None:
-                    segment_infos[-1]["end_ns"] = int((time.time() - session_start_time) * 1e9)
-                    # 병합 대상에 마지막 세그먼트 추가
-                    try:
-                        detection_segments.append(segment_infos[-1]["path"])
-                        try:
-                            with global_detection_segments_lock:
-                                global_detection_segments.append(segment_infos[-1]["path"])
-                        except Exception:
-                            pass
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-        if rtsp_appsrc_ref["appsrc"] is not None:
-            try:
-                rtsp_appsrc_ref["appsrc"].emit('end-of-stream')
-            except Exception:
-                pass
+            if prof is not None:
+                prof.mark('segment')
+            if prof is not None:
+                prof.end_frame()
+        # 남아있는 세그먼트 정리 (finalizer로 이관)
+        if segment_open:
+            closed = close_segment(int((time.time() - session_start_time) * 1e9))
+            if closed is not None:
+                detection_segments.append(closed["path"])
+        end_rtsp_streams(hub)
     finally:
-        # 정리 및 스레드 상태 초기화
-        if file_pipeline is not None:
+        # 정리 및 스레드 상태 초기화 (예외로 루프를 빠져나온 경우에도 열린 세그먼트는 finalizer로 이관)
+        if segment_open:
             try:
-                file_pipeline.set_state(Gst.State.NULL)
+                close_segment(int((time.time() - session_start_time) * 1e9))
             except Exception:
                 pass
+        if manual_recording:
+            stop_recording_manual()
         LED_PIN.off()
         try:
             picam2.stop()
@@ -2601,52 +2944,27 @@ def camera_on(SCHEDULE_DURATION_SEC=None):
         camera_thread = None
         # 후처리 모드: 저장된 원본 영상에 대해 오프라인 처리 수행
         try:
-            if len(segment_infos) > 0 and not scheduled_merge_initiated:
-                # 세션 종료 시, 분할 생성된 세그먼트를 하나의 merge_raw로 병합
+            if len(segment_infos) > 0:
+                # 세션 종료 시: 세그먼트는 마무리되는 즉시 세션 출력에 추가되었으므로 출력 확정은 작업 큐에 맡김
                 try:
+                    # finalizer가 남은 세그먼트를 마무리(→ 점진 병합 제출)할 때까지 대기 (시간 제한)
+                    if not finalizer.wait_idle(timeout=FINALIZE_EOS_TIMEOUT_SEC + FINALIZE_NULL_TIMEOUT_SEC + 5.0):
+                        print(f"[병합] 세그먼트 마무리 대기 시간 초과: {finalizer.pending_count()}개 미완료")
                     seg_pattern = re.compile(r"_seg\d+_raw\.mp4$")
-                    # 스케줄 모드/모션 모드 공통 병합: segment_infos 기준으로 수집
-                    segments_to_merge = [s["path"] for s in segment_infos if isinstance(s, dict) and os.path.isfile(s.get("path", "")) and seg_pattern.search(os.path.basename(s.get("path", "")))]
-                    merged_success = False
-                    if segments_to_merge:
-                        # 날짜와 시간을 파일명에 추가
+                    schedule_infos = [s for s in segment_infos if isinstance(s, dict) and s.get("kind") == 'schedule' and seg_pattern.search(os.path.basename(s.get("path", "")))]
+                    schedule_segments = [s["path"] for s in schedule_infos if s.get("verified")]
+                    # 대기 시간 안에 검증되지 못한 세그먼트도 이후 세션 출력(또는 별도 병합 작업)으로 들어가므로 작업은 항상 등록
+                    if schedule_infos:
                         now = datetime.now(ZoneInfo("Asia/Seoul"))
                         now_str = now.strftime("%Y%m%d_%H%M%S")
                         merged_raw = os.path.join(output_dir, f'video_{now_str}_merge_file.mp4')
-                        try:
-                            if os.path.exists(merged_raw):
-                                os.remove(merged_raw)
-                        except Exception:
-                            pass
-                        # concat 시도 후 실패 시 디코드/재인코딩 병합으로 폴백
-                        if not ffmpeg_concat_mp4(segments_to_merge, merged_raw):
-                            render_merged_raw_from_segments(segments_to_merge, merged_raw)
-                        merged_success = True
-                        print(f"[병합] 최종 merge_raw 생성: {merged_raw} (세그먼트 {len(segments_to_merge)}개)")
-                    else:
-                        print("[병합] 병합할 세그먼트가 없습니다.")
+                        base = os.path.basename(session_merge_path)[:-len('.mp4')]
+                        get_job_queue().enqueue('merge', {"incremental": session_merge_path, "output": merged_raw,
+                                                          "segments": schedule_segments},
+                                                job_id=f'merge-{base}')
+                        print(f"[병합] 병합 작업 등록: {merged_raw} (세그먼트 {len(schedule_segments)}/{len(schedule_infos)}개 검증 완료)")
                 except Exception as e_merge:
                     print(f"[병합] 실패: {e_merge}")
-
-                # # FPS 측정: 개별 파일만 대상으로 수행
-                # try:
-                #     for p in [s["path"] for s in segment_infos if os.path.isfile(s["path"])]:
-                #         measure_file_fps_gst(p)
-                # except Exception:
-                #     pass
-
-                # 병합 성공 시 병합에 사용된 세그먼트 원본 삭제
-                try:
-                    if 'merged_success' in locals() and merged_success and 'segments_to_merge' in locals():
-                        for p in segments_to_merge:
-                            try:
-                                if os.path.isfile(p):
-                                    os.remove(p)
-                                    print(f"[정리] 세그먼트 삭제: {p}")
-                            except Exception as e_del:
-                                print(f"[정리] 세그먼트 삭제 실패: {p}, {e_del}")
-                except Exception:
-                    pass
         except Exception as e:
             print(f'[후처리] 실패: {e}')
         finally:
@@ -2659,16 +2977,27 @@ def main():
     LED_PIN.off()  # 시작 시 LED 꺼짐
     # 마지막 모드 로드 (재부팅 후에도 유지)
     load_last_mode_from_disk()
+    # 후처리 작업 큐 시작 (재부팅 전 미완료 작업 이어서 처리) 및 진행 중이던 점진 병합 출력 복구
+    get_job_queue()
+    recover_incremental_merges()
+    # 녹화 디렉터리 용량 관리 시작 (한 번 스캔 후 워터마크/보존 기간 기준 삭제)
+    get_storage_manager()
+
+    # 메트릭: HLS HTTP 서버의 /metrics 외에 METRICS_PORT가 지정되면 전용 포트로도 노출
+    if metrics_http_port:
+        metrics.start_metrics_http_server(metrics_http_port)
 
-    # 프로그램 시작 시 HLS 항상 켜기
+    # 프로그램 시작 시 HLS 서버 켜기 (온디맨드면 파이프라인은 첫 시청자 요청 시 시작)
     try:
         w, h = [int(v) for v in str(current_frame).split('x')]
     except Exception:
         w, h = 1280, 720
     try:
-        start_hls_http_server()
-        start_hls_pipeline(int(w), int(h), int(current_fps), int(current_bitrate // 1000))
-        print('[BOOT] HLS 항상 켜짐: 서버/파이프라인 시작')
+        ensure_hls(int(w), int(h), int(current_fps), int(current_bitrate // 1000))
+        if hls_on_demand:
+            print(f'[BOOT] HLS 온디맨드: 서버 시작, 시청자 요청 시 인코딩 (유휴 {hls_idle_sec:.0f}초 후 정지)')
+        else:
+            print('[BOOT] HLS 항상 켜짐: 서버/파이프라인 시작')
     except Exception as e:
         print(f"[BOOT] HLS 시작 실패(무시): {e}")
 
@@ -2823,77 +3152,33 @@ def main():
                         continue
                 if not reached_target:
                     continue
-                # 시간 도달: 모션 감지 모드일 때만 병합 수행
-                global of_enabled, merge_in_progress, scheduled_merge_initiated, camera_thread
+                # 시간 도달: 모션 감지 모드일 때만 병합 마무리 수행
+                # 세그먼트는 마무리 즉시 모션 출력에 추가되어 있으므로 카메라를 멈추지 않고 출력 이름만 확정
+                global of_enabled
                 if of_enabled:
                     try:
-                        # 1) 카메라 정지 요청
-                        scheduled_merge_initiated = True
-                        try:
-                            camera_stop_event.set()
-                        except Exception:
-                            pass
-                        # 2) 세션 종료 대기 (최대 15초)
-                        try:
-                            if camera_thread is not None and camera_thread.is_alive():
-                                waited = 0.0
-                                while camera_thread.is_alive() and waited < 15.0:
-                                    time.sleep(0.2)
-                                    waited += 0.2
-                        except Exception:
-                            pass
-
-                        # 3) 병합만 수행 (저장 중단 보장)
-                        merge_in_progress = True
+                        now_str = time.strftime("%Y%m%d_%H%M%S")
+                        output_dir = VIDEO_OUTPUT_DIR  # '/home/openiot/project/video'#'/mnt/video'
+                        os.makedirs(output_dir, exist_ok=True)
+                        merged_raw = os.path.join(output_dir, f'video_{now_str}_merge_raw.mp4')
+                        with incremental_mergers_lock:
+                            current = motion_merge_path
+                        # 점진 병합에 실패한 세그먼트는 작업에 함께 기록 (재부팅 후에도 유지)
                         with global_detection_segments_lock:
                             seg_pattern = re.compile(r"_seg\d+_raw\.mp4$")
                             segments_to_merge = [p for p in global_detection_segments if isinstance(p, str) and os.path.isfile(p) and seg_pattern.search(os.path.basename(p))]
                             global_detection_segments.clear()
-                        if segments_to_merge:
-                            now_str = time.strftime("%Y%m%d_%H%M%S")
-                            output_dir = '/home/openiot/project/video'# '/home/openiot/project/video'#'/mnt/video'
-                            os.makedirs(output_dir, exist_ok=True)
-                            merged_raw = os.path.join(output_dir, f'video_{now_str}_merge_raw.mp4')
-                            try:
-                                if os.path.exists(merged_raw):
-                                    os.remove(merged_raw)
-                            except Exception:
-                                pass
-                            if not ffmpeg_concat_mp4(segments_to_merge, merged_raw):
-                                render_merged_raw_from_segments(segments_to_merge, merged_raw)
-                            print("영상 병합 성공")
-                            print("sFTP 서버로 영상 전송 진행 중")
-                            # 병합 완료 후, 사용된 세그먼트 원본 삭제
-                            try:
-                                for seg_path in segments_to_merge:
-                                    try:
-                                        if isinstance(seg_path, str) and os.path.isfile(seg_path):
-                                            os.remove(seg_path)
-                                    except Exception:
-                                        pass
-                            except Exception:
-                                pass
-
-                        # 4) 병합 후 재시작: 모션 모드일 때만 재시작 (스케줄 모드 전환 시 재시작 금지)
-                        try:
-                            if of_enabled:
-                                if camera_thread is None or not camera_thread.is_alive():
-                                    camera_stop_event.clear()
-                                    camera_thread = threading.Thread(target=lambda: camera_on(), daemon=True)
-                                    camera_thread.start()
-                                    print("[스케줄러-모션-병합] 병합 후 카메라 재시작 완료")
-                            else:
-                                print("[스케줄러-모션-병합] 모션 모드 아님 → 병합 후 재시작 생략")
-                        except Exception as e:
-                            print(f"[스케줄러-모션-병합] 병합 후 재시작 오류: {e}")
+                        if current or segments_to_merge:
+                            get_job_queue().enqueue('merge', {"incremental": current, "output": merged_raw,
+                                                              "segments": segments_to_merge},
+                                                    job_id=f'merge-motion-{now_str}')
+                        else:
+                            print("[스케줄러-모션-병합] 병합할 세그먼트 없음")
                     except Exception as e:
                         try:
                             print(f"[스케줄러-모션-병합] 오류: {e}")
                         except Exception:
                             pass
-                    finally:
-                        merge_in_progress = False
-                        scheduled_merge_initiated = False
             except Exception as e:
                 try:
                     print(f"[스케줄러] 오류: {e}")
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+엔드투엔드 파이프라인 벤치마크
+
+합성 카메라 소스(camera_source)로 camera_on 세션 전체(QR, 옵티컬 플로우, WB, 파일 인코딩, HLS, RTSP)를
+해상도/fps 조합별로 실행하고 달성 fps, 단계별 지연 히스토그램, 스레드별 CPU, RSS를 JSON으로 기록합니다.
+각 조합은 별도 프로세스(--worker)에서 실행되어 GStreamer/전역 상태가 섞이지 않습니다.
+
+예)
+  python3 pipeline_bench.py --config 1920x1080@30 --config 1280x720@30 --duration 20 --output bench.json
+  python3 pipeline_bench.py --config 1280x720@30 --rtsp-client --compare bench_prev.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from metrics import read_thread_cpu
+
+# 지연 히스토그램 경계(ms). 마지막 버킷은 +Inf
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 33, 50, 100, 200, 500)
+
+DEFAULT_CONFIGS = ('1920x1080@30', '1280x720@30', '640x480@30')
+
+
+class StageProfiler:
+    """camera_on 루프의 단계별 소요 시간을 수집 (mqtt_camera.stage_profiler에 설정하여 사용).
+
+    루프에서 begin_frame() → mark('capture') → mark('qr') ... → end_frame() 순으로 호출.
+    mark()는 직전 mark(또는 begin_frame) 이후 경과 시간을 해당 단계에 누적한다.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.frames = 0
+        self.first_frame_t = None
+        self.last_frame_t = None
+        self._t_frame = None
+        self._t_last = None
+
+    def begin_frame(self) -> None:
+        now = time.perf_counter()
+        if self.first_frame_t is None:
+            self.first_frame_t = now
+        self._t_frame = now
+        self._t_last = now
+
+    def mark(self, stage: str) -> None:
+        if self._t_last is None:
+            return
+        now = time.perf_counter()
+        self.samples.setdefault(stage, []).append((now - self._t_last) * 1000.0)
+        self._t_last = now
+
+    def end_frame(self) -> None:
+        if self._t_frame is None:
+            return
+        now = time.perf_counter()
+        self.samples.setdefault('loop', []).append((now - self._t_frame) * 1000.0)
+        self.frames += 1
+        self.last_frame_t = now
+        self._t_frame = None
+        self._t_last = None
+
+    def achieved_fps(self):
+        if self.frames < 2 or self.first_frame_t is None or self.last_frame_t is None:
+            return None
+        elapsed = self.last_frame_t - self.first_frame_t
+        return round((self.frames - 1) / elapsed, 2) if elapsed > 0 else None
+
+    def summary(self) -> dict:
+        return {stage: histogram(values) for stage, values in self.samples.items()}
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def histogram(values_ms) -> dict:
+    """지연 목록(ms) → 통계 + 버킷 카운트."""
+    vals = sorted(values_ms)
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for v in vals:
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if v <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["le_inf"]
+    return {
+        "count": len(vals),
+        "mean": round(sum(vals) / len(vals), 3) if vals else 0.0,
+        "p50": round(_percentile(vals, 0.50), 3),
+        "p95": round(_percentile(vals, 0.95), 3),
+        "p99": round(_percentile(vals, 0.99), 3),
+        "max": round(vals[-1], 3) if vals else 0.0,
+        "buckets": dict(zip(labels, counts)),
+    }
+
+
+# --- /proc 기반 프로세스/스레드 자원 측정 (Linux) ---
+def read_rss_mb() -> dict:
+    out = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    out["rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+                elif line.startswith('VmHWM:'):
+                    out["peak_rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+    except Exception:
+        pass
+    return out
+
+
+def thread_cpu_delta(before: dict, after: dict, wall_s: float) -> dict:
+    """스레드 이름별 CPU 사용량(초, %) 합산. 파이썬 스레드는 threading 이름으로 표시."""
+    py_names = {}
+    for t in threading.enumerate():
+        if getattr(t, 'native_id', None) is not None:
+            py_names[t.native_id] = t.name
+    out = {}
+    for tid, rec in after.items():
+        used = rec["cpu_s"] - before.get(tid, {}).get("cpu_s", 0.0)
+        if used <= 0:
+            continue
+        name = py_names.get(tid, rec["name"])
+        slot = out.setdefault(name, {"cpu_s": 0.0, "threads": 0})
+        slot["cpu_s"] += used
+        slot["threads"] += 1
+    for slot in out.values():
+        slot["cpu_s"] = round(slot["cpu_s"], 3)
+        slot["cpu_pct"] = round(100.0 * slot["cpu_s"] / wall_s, 1) if wall_s > 0 else None
+    return dict(sorted(out.items(), key=lambda kv: -kv[1]["cpu_s"]))
+
+
+def parse_config(text: str):
+    """'1280x720@30' → (1280, 720, 30)."""
+    size, _, fps = text.strip().lower().partition('@')
+    w, h = size.split('x', 1)
+    return int(w), int(h), int(fps or 30)
+
+
+def _start_rtsp_client(url: str):
+    """RTSP 스트림을 소비하는 GStreamer 클라이언트 (RTSP 경로가 실제로 인코딩되도록)."""
+    from gi.repository import Gst
+    pipe = Gst.parse_launch(f'rtspsrc location={url} latency=0 ! fakesink sync=false')
+    pipe.set_state(Gst.State.PLAYING)
+    return pipe
+
+
+# --- worker: 한 조합을 현재 프로세스에서 실행 ---
+def run_worker(args) -> dict:
+    width, height, fps = parse_config(args.config)
+    workdir = tempfile.mkdtemp(prefix='pipeline_bench_')
+    os.environ.setdefault('CAMERA_SOURCE', 'synthetic:bars')
+    os.environ.setdefault('CAMERA_GPIO', 'null')
+    os.environ.setdefault('SYNTHETIC_OBJECTS', '2')
+    # 시청자 없이도 HLS 인코딩까지 포함해 측정
+    os.environ.setdefault('HLS_ON_DEMAND', '0')
+    if args.qr_payload:
+        os.environ.setdefault('SYNTHETIC_QR', args.qr_payload)
+    os.environ['VIDEO_OUTPUT_DIR'] = os.path.join(workdir, 'video')
+    os.environ['CAMERA_STATE_FILE'] = os.path.join(workdir, 'camera_state.json')
+    # hls_dir은 import 시점의 작업 디렉터리 기준
+    os.chdir(workdir)
+
+    import mqtt_camera
+    mqtt_camera.current_frame = f"{width}x{height}"
+    mqtt_camera.current_fps = fps
+    mqtt_camera.current_roi = (0, 0, width, height)
+    mqtt_camera.current_wb = args.wb
+    mqtt_camera.of_enabled = (args.mode == 'motion')
+    profiler = StageProfiler()
+    mqtt_camera.stage_profiler = profiler
+
+    rtsp_client = None
+    if args.rtsp_client:
+        def _delayed_client():
+            nonlocal rtsp_client
+            # camera_on이 RTSP 서버를 만든 뒤 접속
+            time.sleep(2.0)
+            try:
+                rtsp_client = _start_rtsp_client(f"rtsp://127.0.0.1:8554{mqtt_camera.rtsp_path}")
+            except Exception as e:
+                print(f"[BENCH] RTSP 클라이언트 시작 실패: {e}", file=sys.stderr)
+        threading.Thread(target=_delayed_client, name='bench-rtsp-client', daemon=True).start()
+
+    cpu_before = read_thread_cpu()
+    t0 = time.perf_counter()
+    mqtt_camera.camera_on(SCHEDULE_DURATION_SEC=args.duration)
+    wall_s = time.perf_counter() - t0
+    cpu_after = read_thread_cpu()
+    if rtsp_client is not None:
+        try:
+            from gi.repository import Gst
+            rtsp_client.set_state(Gst.State.NULL)
+        except Exception:
+            pass
+
+    result = {
+        "config": args.config,
+        "width": width,
+        "height": height,
+        "fps_target": fps,
+        "mode": args.mode,
+        "wb": args.wb,
+        "rtsp_client": bool(args.rtsp_client),
+        "duration_s": args.duration,
+        "frames": profiler.frames,
+        "fps_achieved": profiler.achieved_fps(),
+        "session_wall_s": round(wall_s, 3),
+        "stages": profiler.summary(),
+        "threads": thread_cpu_delta(cpu_before, cpu_after, wall_s),
+        "process_cpu_s": round(sum(v["cpu_s"] for v in cpu_after.values())
+                               - sum(v["cpu_s"] for v in cpu_before.values()), 3),
+    }
+    result.update(read_rss_mb())
+    return result
+
+
+def _git_revision():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_config(config: str, args) -> dict:
+    """조합 하나를 자식 프로세스로 실행하고 결과 dict 반환."""
+    fd, out_path = tempfile.mkstemp(prefix='bench_', suffix='.json')
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', '--config', config,
+           '--duration', str(args.duration), '--mode', args.mode, '--wb', args.wb, '--output', out_path]
+    if args.rtsp_client:
+        cmd.append('--rtsp-client')
+    cmd += ['--qr-payload', args.qr_payload]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__)) + os.pathsep + env.get('PYTHONPATH', '')
+    proc = None
+    try:
+        proc = subprocess.run(cmd, env=env, timeout=args.duration + args.timeout_margin,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with open(out_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"config": config, "error": "timeout"}
+    except Exception as e:
+        tail = proc.stdout.decode(errors='replace')[-2000:] if proc is not None and proc.stdout else ''
+        return {"config": config, "error": str(e), "log_tail": tail}
+    finally:
+        try:
+            os.remove(out_path)
+        except Exception:
+            pass
+
+
+def compare_results(current: dict, baseline: dict, max_fps_drop_pct: float) -> list:
+    """이전 결과와 비교하여 회귀 목록 반환 (fps 하락, loop p95 증가)."""
+    prev = {r.get("config"): r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in current.get("runs", []):
+        old = prev.get(run.get("config"))
+        if not old or run.get("fps_achieved") is None or old.get("fps_achieved") is None:
+            continue
+        drop = 100.0 * (old["fps_achieved"] - run["fps_achieved"]) / max(old["fps_achieved"], 1e-6)
+        line = (f"{run['config']}: fps {old['fps_achieved']} → {run['fps_achieved']} ({-drop:+.1f}%), "
+                f"loop p95 {old.get('stages', {}).get('loop', {}).get('p95')} → "
+                f"{run.get('stages', {}).get('loop', {}).get('p95')} ms")
+        print(f"[BENCH] {line}", file=sys.stderr)
+        if drop > max_fps_drop_pct:
+            regressions.append(line)
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description='camera_on 엔드투엔드 파이프라인 벤치마크')
+    ap.add_argument('--config', action='append', default=[], help='WxH@fps (여러 번 지정 가능)')
+    ap.add_argument('--duration', type=int, default=20, help='조합별 세션 길이(초)')
+    ap.add_argument('--mode', choices=('motion', 'schedule'), default='motion',
+                    help='motion: 옵티컬 플로우 + 모션 세그먼트, schedule: 상시 녹화')
+    ap.add_argument('--wb', default='auto', help="화이트 밸런스 ('auto'면 WB 단계 포함)")
+    ap.add_argument('--rtsp-client', action='store_true', help='RTSP 클라이언트를 붙여 RTSP 인코딩까지 측정')
+    ap.add_argument('--qr-payload', default='bench-qr', help='합성 프레임에 삽입할 QR 문자열 (빈 문자열이면 생략)')
+    ap.add_argument('--timeout-margin', type=int, default=120, help='조합별 추가 허용 시간(초, 병합 포함)')
+    ap.add_argument('--compare', default=None, help='비교할 이전 결과 JSON')
+    ap.add_argument('--max-fps-drop', type=float, default=5.0, help='회귀로 판단할 fps 하락률(%%)')
+    ap.add_argument('--output', default=None, help='결과 JSON 경로 (기본: stdout)')
+    ap.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.worker:
+        result = run_worker(argparse.Namespace(**{**vars(args), "config": args.config[0]}))
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        # camera_on이 남긴 데몬 스레드(GLib 루프 등)를 기다리지 않고 종료
+        os._exit(0)
+
+    configs = args.config or list(DEFAULT_CONFIGS)
+    report = {
+        "revision": _git_revision(),
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "host": {"machine": platform.machine(), "python": platform.python_version(),
+                 "system": platform.system(), "cpus": os.cpu_count()},
+        "runs": [],
+    }
+    for config in configs:
+        print(f"[BENCH] {config} ({args.duration}s, mode={args.mode}) 실행 중...", file=sys.stderr)
+        run = run_config(config, args)
+        report["runs"].append(run)
+        if "error" in run:
+            print(f"[BENCH] {config} 실패: {run['error']}", file=sys.stderr)
+        else:
+            loop = run.get("stages", {}).get("loop", {})
+            print(f"[BENCH] {config}: fps={run['fps_achieved']} loop p50={loop.get('p50')}ms "
+                  f"p95={loop.get('p95')}ms rss={run.get('rss_mb')}MB", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.max_fps_drop)
+        if regressions:
+            print(f"[BENCH] 회귀 {len(regressions)}건", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""
+녹화 파일 카탈로그 (헤더 정보 캐시 + 시간 인덱스 + 페이지 조회)
+
+목록 요청마다 디렉터리를 훑고 파일마다 stat하는 대신, 시작 시 한 번 스캔한 결과를 메모리에 두고
+inotify(리눅스) 이벤트로 바뀐 파일만 다시 읽습니다. inotify를 쓸 수 없으면 조회 시 디렉터리 mtime이
+바뀌었을 때만 다시 스캔합니다. 녹화 코드가 note_file()/note_removed()로 직접 알려줄 수도 있습니다.
+
+- 항목: 크기, 시작/수정 시각, 길이, 해상도, 코덱(mp4 헤더), 세그먼트 수, 모션 이벤트 수, 보존 등급
+- 세그먼트/모션 이벤트 수는 헤더에 없으므로 병합 시 기록한 <파일>.meta.json 사이드카에서 읽음 (write_meta)
+- 헤더 정보는 <디렉터리>/.catalog.json에 저장하여 재시작 시 크기/mtime(및 메타 사이드카 mtime)이 같은 파일은 다시 읽지 않음
+- 시작 시각 순으로 정렬된 인덱스를 유지하므로 시간 범위/페이지 조회는 파일 수와 무관하게 빠름
+- 작성 중인 파일(*_merging.mp4, *.part.mp4)은 목록에 넣지 않음
+
+예)
+  catalog = RecordingCatalog('/video')
+  catalog.start()
+  total, items = catalog.query(kind='manual', since=t0, offset=0, limit=50)
+"""
+
+import bisect
+import ctypes
+import json
+import os
+import re
+import select
+import struct
+import threading
+import time
+from datetime import datetime
+
+from mp4_utils import probe_mp4
+from storage_manager import classify
+
+CATALOG_FILE = '.catalog.json'
+META_SUFFIX = '.meta.json'
+# 캐시 파일 기록 간격(초): 변경이 몰려도 한 번만 저장
+SAVE_DELAY_SEC = 5.0
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+_NAME_TIME_RE = re.compile(r'(\d{8}_\d{6})')
+
+
+def write_meta(mp4_path: str, **fields) -> None:
+    """헤더에 없는 녹화 정보(세그먼트 수, 모션 이벤트 수 등)를 <파일>.meta.json에 기록."""
+    path = mp4_path + META_SUFFIX
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(fields, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[카탈로그] 메타 기록 실패: {path}, {e}")
+
+
+def read_meta(mp4_path: str) -> dict:
+    try:
+        with open(mp4_path + META_SUFFIX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def meta_mtime(mp4_path: str):
+    """<파일>.meta.json의 mtime. 없으면 None."""
+    try:
+        return os.stat(mp4_path + META_SUFFIX).st_mtime
+    except OSError:
+        return None
+
+
+def listed(name: str) -> bool:
+    """카탈로그 대상 파일명 (완성된 mp4만)."""
+    return (name.endswith('.mp4') and not name.startswith('.')
+            and not name.endswith('_merging.mp4') and not name.endswith('.part.mp4'))
+
+
+def start_time_from_name(name: str):
+    """파일명의 YYYYmmdd_HHMMSS → epoch 초. 없으면 None."""
+    m = _NAME_TIME_RE.search(name)
+    if not m:
+        return None
+    try:
+        return time.mktime(time.strptime(m.group(1), '%Y%m%d_%H%M%S'))
+    except Exception:
+        return None
+
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except Exception:
+        return None
+
+
+class RecordingCatalog:
+    def __init__(self, root_dir: str, cache_path: str = None):
+        self.root_dir = root_dir
+        self.cache_path = cache_path or os.path.join(root_dir, CATALOG_FILE)
+        self._entries = {}   # name -> dict
+        self._order = []     # [(start_ts, name)] 시작 시각 오름차순
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._dir_mtime = None
+        self._save_at = None
+        self._fd = None
+        self._thread = None
+        self._stopped = False
+        os.makedirs(root_dir, exist_ok=True)
+        self._load_cache()
+        self.rescan()
+
+    # --- 캐시 ---
+    def _load_cache(self) -> None:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f).get("entries", {})
+        except Exception:
+            return
+        for name, entry in cached.items():
+            if isinstance(entry, dict) and listed(name):
+                self._entries[name] = entry
+
+    def _save_cache(self) -> None:
+        with self._lock:
+            data = {"entries": dict(self._entries), "saved_at": time.time()}
+            self._save_at = None
+        tmp = self.cache_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            print(f"[카탈로그] 캐시 저장 실패: {e}")
+
+    def _schedule_save(self) -> None:
+        """self._lock 안에서 호출."""
+        if self._save_at is None:
+            self._save_at = time.time() + SAVE_DELAY_SEC
+
+    # --- 인덱스 갱신 ---
+    def _probe(self, name: str, st) -> dict:
+        path = os.path.join(self.root_dir, name)
+        entry = {
+            "filename": name,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "ctime": st.st_ctime,
+            "kind": classify(name),
+            "duration_s": 0.0,
+            "width": 0,
+            "height": 0,
+            "codec": None,
+            "segments": None,
+            "motion_events": None,
+            "valid": False,
+            "meta_mtime": meta_mtime(path),
+        }
+        try:
+            info = probe_mp4(path)
+            entry.update(duration_s=round(info["duration_s"], 3), width=info["width"], height=info["height"],
+                         codec=info["codec"], valid=bool(info["has_moov"]))
+        except Exception as e:
+            print(f"[카탈로그] 헤더 읽기 실패: {name}, {e}")
+        meta = read_meta(path)
+        entry["segments"] = meta.get("segments", 1 if entry["kind"] in ('manual', 'segment') else None)
+        entry["motion_events"] = meta.get("motion_events")
+        if meta.get("kind"):
+            entry["kind"] = meta["kind"]
+        start = meta.get("start_ts") or start_time_from_name(name)
+        entry["start_ts"] = float(start) if start else st.st_mtime - entry["duration_s"]
+        return entry
+
+    def _refresh(self, name: str) -> bool:
+        """파일 하나를 다시 확인. 크기/mtime(메타 사이드카 포함)이 캐시와 같으면 헤더를 다시 읽지 않음. 변경되면 True."""
+        path = os.path.join(self.root_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        with self._lock:
+            old = self._entries.get(name)
+        if st is None:
+            if old is None:
+                return False
+            with self._lock:
+                self._remove_locked(name)
+            return True
+        if (old is not None and old.get("size") == st.st_size and old.get("mtime") == st.st_mtime
+                and old.get("meta_mtime") == meta_mtime(path)):
+            return False
+        entry = self._probe(name, st)
+        with self._lock:
+            self._remove_locked(name)
+            self._entries[name] = entry
+            bisect.insort(self._order, (entry["start_ts"], name))
+            self._schedule_save()
+        return True
+
+    def _remove_locked(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        key = (entry["start_ts"], name)
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+        self._schedule_save()
+
+    def rescan(self) -> None:
+        """디렉터리를 훑어 캐시와 맞춤 (시작 시, inotify 큐 넘침 시, inotify 없이 디렉터리가 바뀐 경우)."""
+        try:
+            self._dir_mtime = os.stat(self.root_dir).st_mtime
+            with os.scandir(self.root_dir) as it:
+                names = {e.name for e in it if listed(e.name)}
+        except OSError as e:
+            print(f"[카탈로그] 디렉터리 스캔 실패: {self.root_dir}, {e}")
+            return
+        with self._lock:
+            if not self._order and self._entries:
+                # 캐시에서 읽은 항목의 시간 인덱스 구성
+                self._order = sorted((e.get("start_ts", 0.0), n) for n, e in self._entries.items())
+            gone = [n for n in self._entries if n not in names]
+            for n in gone:
+                self._remove_locked(n)
+        for name in names:
+            self._refresh(name)
+
+    def note_file(self, path: str) -> None:
+        """녹화 코드에서 파일 완성/변경 알림."""
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root_dir):
+            self._mark(os.path.basename(path))
+
+    def note_removed(self, path: str) -> None:
+        self.note_file(path)
+
+    def _mark(self, name: str) -> None:
+        if name.endswith(META_SUFFIX):
+            name = name[:-len(META_SUFFIX)]
+        if listed(name):
+            with self._lock:
+                self._dirty.add(name)
+
+    def _drain_dirty(self) -> None:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for name in dirty:
+            self._refresh(name)
+
+    # --- 조회 ---
+    def query(self, kind: str = None, since: float = None, until: float = None, offset: int = 0,
+              limit: int = DEFAULT_PAGE_SIZE, newest_first: bool = True):
+        """시작 시각 [since, until) 범위의 항목을 페이지 단위로 반환 → (전체 개수, 항목 목록)."""
+        if self._fd is None:
+            # inotify 미사용: 디렉터리 mtime이 바뀐 경우에만 다시 스캔
+            try:
+                if os.stat(self.root_dir).st_mtime != self._dir_mtime:
+                    self.rescan()
+            except OSError:
+                pass
+        self._drain_dirty()
+        offset = max(0, int(offset))
+        limit = max(1, min(MAX_PAGE_SIZE, int(limit)))
+        with self._lock:
+            lo = 0 if since is None else bisect.bisect_left(self._order, (float(since), ''))
+            hi = len(self._order) if until is None else bisect.bisect_left(self._order, (float(until), ''))
+            keys = self._order[lo:hi]
+            if newest_first:
+                keys = keys[::-1]
+            if kind:
+                keys = [k for k in keys if self._entries[k[1]].get("kind") == kind]
+            page = [dict(self._entries[name]) for _ts, name in keys[offset:offset + limit]]
+            total = len(keys)
+        return total, page
+
+    def get(self, name: str):
+        self._drain_dirty()
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry is not None else None
+
+    def summary(self, kind: str = None) -> dict:
+        with self._lock:
+            entries = [e for e in self._entries.values() if not kind or e.get("kind") == kind]
+        return {"count": len(entries), "size": sum(e.get("size", 0) for e in entries),
+                "duration_s": round(sum(e.get("duration_s", 0.0) for e in entries), 3)}
+
+    # --- 파일 감시 ---
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(self.root_dir), _WATCH_MASK) >= 0:
+                self._fd = fd
+            elif fd >= 0:
+                os.close(fd)
+        if self._fd is None:
+            print("[카탈로그] inotify 사용 불가, 조회 시 디렉터리 변경 확인으로 대체")
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='recording-catalog', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._save_cache()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                if self._fd is not None:
+                    ready, _, _ = select.select([self._fd], [], [], 1.0)
+                    if ready:
+                        self._read_events(os.read(self._fd, 64 * 1024))
+                    # 이벤트가 오는 즉시 헤더를 읽어 두어 조회 시 지연 없음
+                    self._drain_dirty()
+                else:
+                    time.sleep(1.0)
+                if self._save_at is not None and time.time() >= self._save_at:
+                    self._save_cache()
+            except Exception as e:
+                print(f"[카탈로그] 감시 실패: {e}")
+                time.sleep(1.0)
+
+    def _read_events(self, data: bytes) -> None:
+        p = 0
+        while p + _EVENT_HEADER.size <= len(data):
+            _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, p)
+            name = data[p + _EVENT_HEADER.size:p + _EVENT_HEADER.size + length].split(b'\0', 1)[0]
+            p += _EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.rescan()
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                print(f"[카탈로그] 감시 디렉터리가 사라졌습니다: {self.root_dir}")
+            elif name:
+                self._mark(os.fsdecode(name))
+
+
+def format_entry(entry: dict) -> dict:
+    """API 응답용 항목 (기존 /list_recordings 필드 유지 + 헤더 정보)."""
+    return {
+        "filename": entry["filename"],
+        "size_mb": round(entry.get("size", 0) / (1024 * 1024), 2),
+        "created_time": datetime.fromtimestamp(entry.get("start_ts") or entry.get("ctime", 0)).strftime('%Y-%m-%d %H:%M:%S'),
+        "modified_time": datetime.fromtimestamp(entry.get("mtime", 0)).strftime('%Y-%m-%d %H:%M:%S'),
+        "duration_s": entry.get("duration_s", 0.0),
+        "resolution": f"{entry['width']}x{entry['height']}" if entry.get("width") else None,
+        "codec": entry.get("codec"),
+        "segments": entry.get("segments"),
+        "motion_events": entry.get("motion_events"),
+        "kind": entry.get("kind"),
+        "valid": entry.get("valid", False),
+    }
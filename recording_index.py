@@ -0,0 +1,310 @@
+"""
+녹화 파일 키프레임 인덱스 + 썸네일 스프라이트 생성
+
+병합된 영상/녹화 파일마다 키프레임 위치 표와 작은 JPEG 썸네일 스프라이트를 만들어 파일 옆에 캐시합니다.
+웹 UI는 파일을 내려받지 않고 미리보기를 바로 보여 주고, 탐색 시 키프레임 바이트 오프셋으로 바로 이동할 수 있습니다.
+
+- 키프레임 표: mp4 샘플 테이블(stss 또는 moof/trun 플래그)에서 읽으며 디코드하지 않음
+- 썸네일: 선택한 키프레임(I 프레임)의 샘플만 읽어 Annex-B로 이어 붙인 뒤 그 프레임들만 디코드
+  (H.264가 아닌 파일은 cv2로 해당 키프레임 위치만 디코드)
+- 결과: <파일>.index.json (키프레임 표 + 스프라이트 타일 위치), <파일>.thumbs.jpg (스프라이트)
+- 원본 크기/mtime을 함께 기록하여 파일이 바뀌면 다시 생성
+
+<파일>.index.json:
+  {"duration_s", "width", "height", "codec",
+   "keyframes": [{"t": 초(PTS), "offset": 샘플 바이트 오프셋, "size": 바이트, "fragment_offset": moof 오프셋|null}],
+   "thumbnails": {"sprite": 파일명, "tile_width", "tile_height", "columns", "items": [{"t", "x", "y"}]}}
+
+예)
+  python3 recording_index.py video_20250101_120000_merge_file.mp4
+"""
+
+import argparse
+import bisect
+import json
+import os
+import queue
+import struct
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from job_queue import lower_thread_priority
+from mp4_merge import H264_SAMPLE_ENTRIES, read_video_track
+from mp4_utils import iter_boxes_bytes
+
+INDEX_SUFFIX = '.index.json'
+SPRITE_SUFFIX = '.thumbs.jpg'
+THUMB_WIDTH = 160
+THUMB_COLUMNS = 10
+# 썸네일 간격(초)과 파일당 최대 개수 (긴 파일은 간격을 넓힘)
+THUMB_INTERVAL_SEC = 10.0
+MAX_THUMBS = 60
+JPEG_QUALITY = 70
+ANNEXB_START_CODE = b'\x00\x00\x00\x01'
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def sprite_path(path: str) -> str:
+    return path + SPRITE_SUFFIX
+
+
+def load_index(path: str):
+    """캐시된 인덱스 반환. 없거나 원본이 바뀌었으면 None."""
+    try:
+        st = os.stat(path)
+        with open(index_path(path), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except Exception:
+        return None
+    if index.get("source_size") != st.st_size or index.get("source_mtime") != st.st_mtime:
+        return None
+    return index
+
+
+def avcc_parameter_sets(entry: bytes):
+    """avc1/avc3 샘플 엔트리의 avcC에서 (NAL 길이 필드 크기, [SPS..., PPS...]) 반환. 없으면 None."""
+    # VisualSampleEntry 고정 영역(헤더 8 + 78) 뒤에 avcC 등 하위 박스
+    for btype, off, bsize, hsz in iter_boxes_bytes(entry, 86):
+        if btype != b'avcC':
+            continue
+        p, end = off + hsz, off + bsize
+        try:
+            length_size = (entry[p + 4] & 0x03) + 1
+            nals = []
+            q = p + 5
+            # SPS 개수(하위 5비트) + SPS들, PPS 개수 + PPS들
+            for mask in (0x1f, 0xff):
+                count = entry[q] & mask
+                q += 1
+                for _ in range(count):
+                    n = struct.unpack_from('>H', entry, q)[0]
+                    if q + 2 + n > end:
+                        return None
+                    nals.append(entry[q + 2:q + 2 + n])
+                    q += 2 + n
+        except (IndexError, struct.error):
+            return None
+        return length_size, nals
+    return None
+
+
+def sample_to_annexb(data: bytes, length_size: int) -> bytes:
+    """길이 접두 NAL(mp4 샘플) → 시작 코드 NAL(Annex-B)."""
+    out = []
+    p = 0
+    while p + length_size <= len(data):
+        n = int.from_bytes(data[p:p + length_size], 'big')
+        p += length_size
+        out.append(ANNEXB_START_CODE)
+        out.append(data[p:p + n])
+        p += n
+    return b''.join(out)
+
+
+def keyframe_table(track) -> list:
+    """키프레임마다 {"t", "offset", "size", "fragment_offset"} (표시 시각 순)."""
+    out = []
+    dts = 0
+    scale = float(track.timescale or 1)
+    for i in range(track.sample_count):
+        if track.is_sync(i):
+            pts = dts + (track.cts[i] if track.cts is not None else 0)
+            frag = None
+            if track.fragment_starts:
+                k = bisect.bisect_right(track.fragment_starts, i) - 1
+                if k >= 0:
+                    frag = track.fragment_offsets[k]
+            out.append({"t": round(pts / scale, 3), "offset": track.offsets[i], "size": track.sizes[i],
+                        "fragment_offset": frag, "sample": i})
+        dts += track.durations[i]
+    out.sort(key=lambda k: k["t"])
+    return out
+
+
+def pick_thumbnails(keyframes: list, duration_s: float) -> list:
+    """간격마다 그 시각 이후 첫 키프레임 (중복 제외)."""
+    if not keyframes:
+        return []
+    interval = max(THUMB_INTERVAL_SEC, duration_s / float(MAX_THUMBS)) if duration_s > 0 else THUMB_INTERVAL_SEC
+    times = [k["t"] for k in keyframes]
+    picked = []
+    t = 0.0
+    while len(picked) < MAX_THUMBS:
+        i = bisect.bisect_left(times, t)
+        if i >= len(keyframes):
+            break
+        if not picked or picked[-1] is not keyframes[i]:
+            picked.append(keyframes[i])
+        t = max(t + interval, keyframes[i]["t"] + 1e-3)
+    return picked
+
+
+def _decode_h264_keyframes(path: str, track, picked: list) -> list:
+    """선택한 키프레임 샘플만 읽어 Annex-B 스트림으로 만든 뒤 그 프레임들만 디코드."""
+    chunks = []
+    with open(path, 'rb') as f:
+        for k in picked:
+            params = avcc_parameter_sets(track.entries[track.sdi[k["sample"]] - 1])
+            if params is None:
+                return []
+            length_size, nals = params
+            f.seek(k["offset"])
+            data = f.read(k["size"])
+            # 키프레임마다 SPS/PPS를 앞에 붙여 각 프레임을 독립적으로 디코드 가능하게 함
+            chunks.extend(ANNEXB_START_CODE + n for n in nals)
+            chunks.append(sample_to_annexb(data, length_size))
+    fd, tmp = tempfile.mkstemp(suffix='.h264')
+    frames = []
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join(chunks))
+        cap = cv2.VideoCapture(tmp)
+        while len(frames) < len(picked):
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    finally:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+    return frames
+
+
+def _decode_seek_keyframes(path: str, picked: list) -> list:
+    """H.264가 아닌 파일: 키프레임 샘플 위치로 탐색하여 한 프레임씩 디코드."""
+    frames = []
+    cap = cv2.VideoCapture(path)
+    try:
+        for k in picked:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, k["sample"])
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def build_sprite(frames: list, width: int, height: int):
+    """프레임들을 THUMB_WIDTH 폭 타일로 줄여 격자 한 장으로 합침 → (이미지, 타일 폭, 타일 높이)."""
+    tile_w = THUMB_WIDTH
+    tile_h = max(2, int(round(THUMB_WIDTH * height / float(width or 1) / 2.0)) * 2)
+    cols = min(THUMB_COLUMNS, len(frames))
+    rows = (len(frames) + cols - 1) // cols
+    sprite = np.zeros((rows * tile_h, cols * tile_w, 3), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        tile = cv2.resize(frame, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+        r, c = divmod(i, cols)
+        sprite[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w] = tile
+    return sprite, tile_w, tile_h
+
+
+def build_index(path: str, thumbnails: bool = True) -> dict:
+    """키프레임 표와 썸네일 스프라이트를 만들어 파일 옆에 저장하고 인덱스를 반환."""
+    st = os.stat(path)
+    track = read_video_track(path)
+    keyframes = keyframe_table(track)
+    duration_s = track.duration_ticks() / float(track.timescale or 1)
+    index = {
+        "source_size": st.st_size,
+        "source_mtime": st.st_mtime,
+        "duration_s": round(duration_s, 3),
+        "width": track.width,
+        "height": track.height,
+        "codec": track.codec.decode('ascii', 'replace'),
+        "keyframes": [{k: v for k, v in kf.items() if k != "sample"} for kf in keyframes],
+        "thumbnails": None,
+    }
+    if thumbnails and keyframes:
+        picked = pick_thumbnails(keyframes, duration_s)
+        if track.codec in H264_SAMPLE_ENTRIES:
+            frames = _decode_h264_keyframes(path, track, picked)
+        else:
+            frames = _decode_seek_keyframes(path, picked)
+        if frames:
+            sprite, tile_w, tile_h = build_sprite(frames, track.width, track.height)
+            ok, jpg = cv2.imencode('.jpg', sprite, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+            if ok:
+                tmp = sprite_path(path) + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(jpg.tobytes())
+                os.replace(tmp, sprite_path(path))
+                cols = min(THUMB_COLUMNS, len(frames))
+                index["thumbnails"] = {
+                    "sprite": os.path.basename(sprite_path(path)),
+                    "tile_width": tile_w,
+                    "tile_height": tile_h,
+                    "columns": cols,
+                    "items": [{"t": k["t"], "x": (i % cols) * tile_w, "y": (i // cols) * tile_h}
+                              for i, k in enumerate(picked[:len(frames)])],
+                }
+    tmp = index_path(path) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, index_path(path))
+    thumbs = len(index["thumbnails"]["items"]) if index["thumbnails"] else 0
+    print(f"[인덱스] 생성: {path} (키프레임 {len(keyframes)}개, 썸네일 {thumbs}개)")
+    return index
+
+
+def ensure_index(path: str) -> dict:
+    """캐시가 유효하면 그대로, 아니면 새로 생성."""
+    return load_index(path) or build_index(path)
+
+
+class RecordingIndexer:
+    """인덱스 생성을 낮은 우선순위의 전용 스레드에서 처리 (녹화/스트리밍 경로를 막지 않음).
+
+    indexer = RecordingIndexer()
+    indexer.submit('/video/recording_20250101_120000.mp4')
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, path: str) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='recording-indexer', daemon=True)
+                self._thread.start()
+        self._queue.put(path)
+
+    def _run(self) -> None:
+        lower_thread_priority()
+        while True:
+            path = self._queue.get()
+            try:
+                if os.path.isfile(path):
+                    ensure_index(path)
+            except Exception as e:
+                print(f"[인덱스] 생성 실패: {path}, {e}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description='녹화 파일 키프레임 인덱스/썸네일 스프라이트 생성')
+    ap.add_argument('paths', nargs='+')
+    ap.add_argument('--no-thumbnails', action='store_true')
+    ap.add_argument('--force', action='store_true', help='캐시가 있어도 다시 생성')
+    args = ap.parse_args()
+    for path in args.paths:
+        index = None if args.force else load_index(path)
+        if index is None:
+            index = build_index(path, thumbnails=not args.no_thumbnails)
+        print(json.dumps({"path": path, "keyframes": len(index["keyframes"]), "duration_s": index["duration_s"],
+                          "thumbnails": bool(index["thumbnails"])}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+녹화 파일 무결성 검증 + 디코드 처리량 벤치마크
+
+녹화 파일마다 다음을 구조화된 결과(JSON)로 반환합니다.
+- 컨테이너 분석(디코드 없음): 프레임 수 vs 기대 프레임 수, 타임스탬프 간격 끊김(캡처 루프 정지),
+  드롭 프레임 추정, 키프레임 간격, 잘린 파일 여부
+- 디코드 측정(GStreamer, sync=false): 디코드 fps(처리량), 실시간 대비 배속, 디코드된 프레임 수, 디코드 오류
+
+녹화 타임스탬프는 캡처 시각으로 찍히므로 캡처 루프가 멈추면 샘플 간격이 벌어집니다.
+간격이 중앙값의 GAP_FACTOR배를 넘으면 끊김으로 보고, 그 사이에 빠진 프레임 수를 드롭 추정치로 합산합니다.
+
+디렉터리를 주면 mp4 파일 전체를 프로세스 풀(spawn)로 나눠 검사합니다. 문제가 있는 파일이 있으면 종료 코드 1.
+
+예)
+  python3 recording_verify.py /home/openiot/project/video --workers 2 --output verify.json
+  python3 recording_verify.py merged.mp4 --no-decode
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mp4_merge import read_video_track
+from mp4_utils import probe_mp4
+
+# 샘플 간격이 중앙값의 이 배수를 넘으면 끊김으로 판단
+GAP_FACTOR = 1.5
+# 드롭 추정치가 기대 프레임 수의 이 비율을 넘으면 문제로 보고
+MAX_DROP_RATIO = 0.01
+# 결과에 남길 끊김 목록 최대 개수 (개수/합계는 전체 기준)
+MAX_REPORTED_GAPS = 50
+DECODE_TIMEOUT_SEC = 600.0
+
+_gst = None
+
+
+def _get_gst():
+    """GStreamer는 디코드 측정 시에만 초기화 (컨테이너 분석만 할 때는 불필요)."""
+    global _gst
+    if _gst is None:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        Gst.init(None)
+        _gst = Gst
+    return _gst
+
+
+def analyze_timestamps(path: str) -> dict:
+    """샘플 테이블만 읽어 프레임 수/끊김/드롭 추정/키프레임 간격 계산."""
+    track = read_video_track(path)
+    n = track.sample_count
+    scale = float(track.timescale or 1)
+    durations = [d for d in track.durations[:max(0, n - 1)] if d > 0]  # 마지막 샘플 길이는 추정값
+    median = sorted(durations)[len(durations) // 2] if durations else 0
+    nominal_fps = scale / median if median else 0.0
+    duration_s = track.duration_ticks() / scale
+    gaps = []
+    dropped = 0
+    t = 0
+    for i in range(max(0, n - 1)):
+        d = track.durations[i]
+        if median and d > median * GAP_FACTOR:
+            missing = int(round(d / float(median))) - 1
+            dropped += max(0, missing)
+            gaps.append({"t": round(t / scale, 3), "gap_ms": round(d * 1000.0 / scale, 1), "missing": missing})
+        t += d
+    keyframes = [i for i in range(n) if track.is_sync(i)]
+    intervals = [b - a for a, b in zip(keyframes, keyframes[1:])]
+    expected = int(round(duration_s * nominal_fps)) if nominal_fps else n
+    return {
+        "codec": track.codec.decode('ascii', 'replace'),
+        "width": track.width,
+        "height": track.height,
+        "duration_s": round(duration_s, 3),
+        "frames": n,
+        "nominal_fps": round(nominal_fps, 3),
+        "expected_frames": expected,
+        "dropped_frames_est": dropped,
+        "gap_count": len(gaps),
+        "gap_total_s": round(sum(g["gap_ms"] for g in gaps) / 1000.0, 3),
+        "gaps": gaps[:MAX_REPORTED_GAPS],
+        "keyframes": len(keyframes),
+        "first_is_keyframe": bool(keyframes) and keyframes[0] == 0,
+        "keyframe_interval": {
+            "mean_frames": round(sum(intervals) / float(len(intervals)), 2) if intervals else None,
+            "max_frames": max(intervals) if intervals else None,
+            "max_s": round(max(intervals) / nominal_fps, 3) if intervals and nominal_fps else None,
+        },
+    }
+
+
+def measure_file_fps_gst(video_path: str, timeout: float = DECODE_TIMEOUT_SEC) -> dict:
+    """파일을 GStreamer로 끝까지 디코드(sync=false)하여 디코드 처리량과 오류를 측정.
+
+    반환: {"frames", "elapsed_s", "fps", "errors", "warnings", "completed"}
+    """
+    Gst = _get_gst()
+    result = {"frames": 0, "elapsed_s": 0.0, "fps": 0.0, "errors": [], "warnings": 0, "completed": False}
+    if not os.path.isfile(video_path):
+        result["errors"].append('파일 없음')
+        return result
+    pipeline = Gst.Pipeline.new('verify')
+    src = Gst.ElementFactory.make('filesrc')
+    src.set_property('location', video_path)
+    decode = Gst.ElementFactory.make('decodebin')
+    sink = Gst.ElementFactory.make('fakesink')
+    sink.set_property('sync', False)
+    for elem in (src, decode, sink):
+        pipeline.add(elem)
+    src.link(decode)
+
+    def on_pad(_elem, pad):
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        if caps is not None and caps.to_string().startswith('video/'):
+            pad.link(sink.get_static_pad('sink'))
+    decode.connect('pad-added', on_pad)
+
+    def on_buffer(_pad, _info):
+        result["frames"] += 1
+        return Gst.PadProbeReturn.OK
+    sink.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+
+    t0 = time.time()
+    pipeline.set_state(Gst.State.PLAYING)
+    bus = pipeline.get_bus()
+    deadline = t0 + timeout
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                result["errors"].append('디코드 시간 초과')
+                break
+            msg = bus.timed_pop_filtered(int(remaining * Gst.SECOND),
+                                         Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.WARNING)
+            if msg is None:
+                continue
+            if msg.type == Gst.MessageType.EOS:
+                result["completed"] = True
+                break
+            if msg.type == Gst.MessageType.WARNING:
+                result["warnings"] += 1
+                continue
+            err, _debug = msg.parse_error()
+            result["errors"].append(str(err))
+            break
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    result["elapsed_s"] = round(time.time() - t0, 3)
+    if result["elapsed_s"] > 0:
+        result["fps"] = round(result["frames"] / result["elapsed_s"], 1)
+    return result
+
+
+def verify_recording(path: str, decode: bool = True) -> dict:
+    """파일 하나 검사 → 구조화된 결과 ("issues"가 비어 있으면 정상)."""
+    out = {"path": path, "size": 0, "issues": []}
+    try:
+        probe = probe_mp4(path)
+        out["size"] = probe["size"]
+        if probe["truncated"]:
+            out["issues"].append('truncated')
+        out.update(analyze_timestamps(path))
+    except Exception as e:
+        out["issues"].append(f'unreadable: {e}')
+        return out
+    if out["gap_count"]:
+        out["issues"].append('timestamp_gaps')
+    if out["expected_frames"] and out["dropped_frames_est"] > out["expected_frames"] * MAX_DROP_RATIO:
+        out["issues"].append('dropped_frames')
+    if not out["first_is_keyframe"]:
+        out["issues"].append('no_leading_keyframe')
+    if decode:
+        try:
+            dec = measure_file_fps_gst(path)
+        except Exception as e:
+            dec = {"errors": [f'GStreamer 사용 불가: {e}'], "frames": 0, "fps": 0.0, "completed": False}
+        if out["duration_s"] > 0 and dec.get("elapsed_s"):
+            dec["realtime_factor"] = round(out["duration_s"] / dec["elapsed_s"], 2)
+        out["decode"] = dec
+        if dec["errors"]:
+            out["issues"].append('decode_error')
+        elif dec["frames"] != out["frames"]:
+            out["issues"].append('decode_frame_mismatch')
+    return out
+
+
+def list_recordings(paths) -> list:
+    """인자(파일/디렉터리) → 검사할 mp4 목록 (작성 중인 파일 제외)."""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            names = sorted(n for n in os.listdir(p) if n.endswith('.mp4') and not n.endswith('_merging.mp4')
+                           and not n.endswith('.part.mp4'))
+            out.extend(os.path.join(p, n) for n in names)
+        else:
+            out.append(p)
+    return out
+
+
+def verify_paths(paths, workers: int = 1, decode: bool = True) -> dict:
+    """여러 파일을 프로세스 풀로 검사하고 요약과 함께 반환."""
+    files = list_recordings(paths)
+    t0 = time.time()
+    if workers > 1 and len(files) > 1:
+        # GStreamer는 fork 이후 사용이 안전하지 않으므로 spawn으로 새 인터프리터에서 실행
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            results = list(pool.map(verify_recording, files, [decode] * len(files)))
+    else:
+        results = [verify_recording(f, decode) for f in files]
+    decoded = [r["decode"] for r in results if r.get("decode") and r["decode"].get("elapsed_s")]
+    summary = {
+        "files": len(results),
+        "with_issues": sum(1 for r in results if r["issues"]),
+        "dropped_frames_est": sum(r.get("dropped_frames_est", 0) for r in results),
+        "gap_count": sum(r.get("gap_count", 0) for r in results),
+        "elapsed_s": round(time.time() - t0, 3),
+    }
+    if decoded:
+        frames = sum(d["frames"] for d in decoded)
+        busy = sum(d["elapsed_s"] for d in decoded)
+        summary["decode_frames"] = frames
+        summary["decode_fps"] = round(frames / busy, 1) if busy else 0.0
+    return {"summary": summary, "results": results}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description='녹화 파일 무결성 검증 / 디코드 처리량 측정')
+    ap.add_argument('paths', nargs='+', help='mp4 파일 또는 디렉터리')
+    ap.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='검사 프로세스 수')
+    ap.add_argument('--no-decode', action='store_true', help='컨테이너 분석만 (디코드 측정 생략)')
+    ap.add_argument('--output', default=None, help='결과 JSON 경로 (기본: stdout)')
+    args = ap.parse_args(argv)
+    report = verify_paths(args.paths, workers=args.workers, decode=not args.no_decode)
+    for r in report["results"]:
+        status = 'OK' if not r["issues"] else ','.join(r["issues"])
+        dec = r.get("decode") or {}
+        print(f"[검증] {os.path.basename(r['path'])}: {status} frames={r.get('frames')}/{r.get('expected_frames')} "
+              f"gaps={r.get('gap_count', 0)} decode_fps={dec.get('fps', '-')}", file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if report["summary"]["with_issues"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+캡처 루프 밖에서 프레임을 H.264 mp4로 기록하는 백그라운드 writer
+
+캡처 루프는 write()로 프레임을 제한 크기 큐에 넣기만 하고, 인코딩/파일 쓰기는 전용 스레드가 수행합니다.
+큐가 가득 차면 가장 새 프레임을 버리고 드롭 카운터를 올립니다 (캡처 루프는 절대 대기하지 않음).
+
+인코더 선택 순서:
+  1) OpenCV GStreamer 백엔드: appsrc → x264enc → h264parse → mp4mux
+  2) OpenCV FFmpeg 백엔드 fourcc 'avc1' (H.264)
+  3) fourcc 'mp4v' (H.264 인코더가 없는 환경의 마지막 대안)
+"""
+
+import queue
+import threading
+import time
+
+import cv2
+
+import metrics
+
+DEFAULT_QUEUE_SIZE = 60
+
+
+def _gst_h264_pipeline(path: str, fps: float, bitrate_kbps: int) -> str:
+    return (
+        "appsrc ! videoconvert ! video/x-raw,format=I420 ! "
+        f"x264enc tune=zerolatency speed-preset=ultrafast bitrate={int(bitrate_kbps)} key-int-max={max(1, int(round(fps)) * 2)} ! "
+        f"h264parse ! mp4mux faststart=true ! filesink location={path}"
+    )
+
+
+def open_h264_writer(path: str, fps: float, size, bitrate_kbps: int = 4000):
+    """(cv2.VideoWriter, codec 이름) 반환. 모두 실패하면 (None, None)."""
+    width, height = int(size[0]), int(size[1])
+    try:
+        writer = cv2.VideoWriter(_gst_h264_pipeline(path, fps, bitrate_kbps), cv2.CAP_GSTREAMER, 0, float(fps), (width, height))
+        if writer.isOpened():
+            return writer, 'h264(x264enc)'
+        writer.release()
+    except Exception:
+        pass
+    for fourcc, label in (('avc1', 'h264(avc1)'), ('mp4v', 'mpeg4(mp4v)')):
+        try:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), float(fps), (width, height))
+            if writer.isOpened():
+                return writer, label
+            writer.release()
+        except Exception:
+            pass
+    return None, None
+
+
+class BackgroundVideoWriter:
+    """제한 크기 프레임 큐 + 전용 writer 스레드.
+
+    writer = BackgroundVideoWriter('out.mp4', 20.0, (w, h))
+    if writer.open():
+        writer.write(frame)   # 논블로킹, 큐가 차면 드롭
+        writer.close()        # 남은 프레임을 모두 쓰고 파일을 닫음
+    """
+
+    def __init__(self, path: str, fps: float, size, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 bitrate_kbps: int = 4000, name: str = 'recording'):
+        self.path = path
+        self.fps = float(fps)
+        self.size = (int(size[0]), int(size[1]))
+        self.bitrate_kbps = int(bitrate_kbps)
+        self.name = name
+        self.codec = None
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._writer = None
+        self._thread = None
+        self._closed = False
+
+    def open(self) -> bool:
+        self._writer, self.codec = open_h264_writer(self.path, self.fps, self.size, self.bitrate_kbps)
+        if self._writer is None:
+            return False
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True)
+        self._thread.start()
+        return True
+
+    def is_open(self) -> bool:
+        return self._writer is not None and not self._closed and self.error is None
+
+    def write(self, frame) -> bool:
+        """프레임을 큐에 넣는다. 큐가 가득 찼거나 writer가 닫혔으면 드롭하고 False."""
+        if not self.is_open():
+            return False
+        if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+            frame = cv2.resize(frame, self.size)
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.FRAMES_DROPPED.inc(consumer=self.name)
+            return False
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        writer = self._writer
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                writer.write(frame)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+                print(f"[REC] 프레임 쓰기 실패: {e}")
+        try:
+            writer.release()
+        except Exception:
+            pass
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """남은 프레임을 모두 기록하고 파일을 닫는다 (해제는 writer 스레드가 수행). 시간 내에 끝나지 않으면 False."""
+        if self._closed:
+            return True
+        self._closed = True
+        if self._thread is None:
+            return True
+        deadline = time.time() + float(timeout)
+        while True:
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                if time.time() >= deadline:
+                    print(f"[REC] writer 큐 비우기 시간 초과: {self._queue.qsize()}프레임 남음")
+                    return False
+        self._thread.join(max(0.0, deadline - time.time()))
+        return not self._thread.is_alive()
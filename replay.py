@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+오프라인 재생 하네스: 녹화 영상(mp4) 또는 프레임 이미지 디렉터리를 camera_on과 동일한
+QR/옵티컬 플로우 판정 로직(motion_analytics)에 통과시켜 프레임별 판정, 세그먼트 경계, 처리 시간을 출력합니다.
+Picamera2/GPIO/GStreamer 없이 노트북이나 CI에서 실행할 수 있습니다.
+
+예)
+  python3 replay.py sample.mp4 --output summary.json --frames-out frames.jsonl
+  python3 replay.py frames_dir/ --fps 30 --sweep of_min_mag=0.5,1.0,2.0 --sweep of_min_moving_pts=4,8
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from motion_analytics import OF_DEFAULT_PARAMS, OpticalFlowMotionDetector, MotionSegmentTracker, QrScanner
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# CLI/스윕 파라미터 이름 → OpticalFlowMotionDetector 파라미터 이름
+PARAM_ALIASES = {
+    'of_min_mag': 'min_mag',
+    'of_fb_thresh': 'fb_thresh',
+    'of_min_moving_pts': 'min_moving_pts',
+    'of_idle_timeout': 'idle_timeout',
+    'of_target_width': 'target_width',
+    'of_redetect_interval': 'redetect_interval',
+    'of_max_corners': 'max_corners',
+    'of_quality_level': 'quality_level',
+    'of_interval_frames': 'interval_frames',
+}
+
+
+def parse_size(value: str):
+    if not value:
+        return None
+    w, h = str(value).lower().replace(' ', '').split('x', 1)
+    return int(w), int(h)
+
+
+def parse_roi(value: str):
+    if not value:
+        return None
+    parts = [int(float(v)) for v in str(value).replace(' ', '').split(',')]
+    if len(parts) != 4:
+        raise ValueError('ROI는 x,y,w,h 형식이어야 합니다')
+    return tuple(parts)
+
+
+def iter_frames(path: str, fps: float = None, resize=None, max_frames: int = None):
+    """(frame_idx, t_sec, frame) 생성. t_sec는 재생 시간 기준 가상 시계."""
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTS))
+        rate = float(fps or 30.0)
+        for idx, name in enumerate(names):
+            if max_frames is not None and idx >= max_frames:
+                break
+            frame = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            if resize is not None and (frame.shape[1], frame.shape[0]) != tuple(resize):
+                frame = cv2.resize(frame, tuple(resize), interpolation=cv2.INTER_AREA)
+            yield idx, idx / rate, frame
+        return
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f'영상을 열 수 없습니다: {path}')
+    try:
+        rate = float(fps or cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        idx = 0
+        while max_frames is None or idx < max_frames:
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                break
+            if resize is not None and (frame.shape[1], frame.shape[0]) != tuple(resize):
+                frame = cv2.resize(frame, tuple(resize), interpolation=cv2.INTER_AREA)
+            yield idx, idx / rate, frame
+            idx += 1
+    finally:
+        cap.release()
+
+
+def latency_stats(values_ms):
+    if not values_ms:
+        return {"count": 0}
+    arr = np.asarray(values_ms, dtype=np.float64)
+    return {
+        "count": int(arr.size),
+        "mean": round(float(arr.mean()), 3),
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "max": round(float(arr.max()), 3),
+    }
+
+
+def replay(path: str, params: dict = None, roi=None, fps: float = None, resize=None, qr: bool = False,
+           speed: float = 0.0, max_frames: int = None, frames_out=None) -> dict:
+    """영상 하나를 재생하며 모션/QR 판정을 수행하고 요약 dict 반환.
+
+    speed: 0이면 최대 속도, 1.0이면 실시간, 4.0이면 4배속으로 페이싱
+    frames_out: 프레임별 판정을 JSON Lines로 기록할 파일 객체 (선택)
+    """
+    params = dict(params or {})
+    detector = OpticalFlowMotionDetector(**params)
+    tracker = MotionSegmentTracker(detector.params["idle_timeout"])
+    scanner = QrScanner() if qr else None
+
+    segments = []
+    open_seg = None
+    qr_events = []
+    motion_ms, qr_ms = [], []
+    motion_frames = 0
+    frame_count = 0
+    last_t = 0.0
+    wall_start = time.perf_counter()
+    for idx, t, frame in iter_frames(path, fps, resize, max_frames):
+        frame_count += 1
+        last_t = t
+        if speed and speed > 0:
+            ahead = (t / speed) - (time.perf_counter() - wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
+        record = {"frame": idx, "t": round(t, 4)}
+        if scanner is not None:
+            q0 = time.perf_counter()
+            _all, accepted = scanner.scan(frame, t)
+            qr_ms.append((time.perf_counter() - q0) * 1000.0)
+            record["qr_ms"] = round(qr_ms[-1], 3)
+            if accepted:
+                record["qr"] = [r['data'] for r in accepted]
+                for r in accepted:
+                    qr_events.append({"frame": idx, "t": round(t, 4), "data": r['data']})
+        m0 = time.perf_counter()
+        motion = detector.update(frame, roi)
+        motion_ms.append((time.perf_counter() - m0) * 1000.0)
+        record["motion_ms"] = round(motion_ms[-1], 3)
+        record["motion"] = bool(motion)
+        record["moving_pts"] = int(detector.moving_count)
+        if motion:
+            motion_frames += 1
+        event = tracker.update(motion, t)
+        if event == 'open':
+            open_seg = {"start_frame": idx, "start_t": round(t, 4)}
+        elif event == 'close' and open_seg is not None:
+            open_seg.update({"end_frame": idx, "end_t": round(t, 4)})
+            segments.append(open_seg)
+            open_seg = None
+        if event:
+            record["segment"] = event
+        if frames_out is not None:
+            frames_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if open_seg is not None:
+        # 입력 종료 시 열린 세그먼트는 세션 종료와 동일하게 닫음
+        open_seg.update({"end_frame": frame_count - 1, "end_t": round(last_t, 4), "closed_by": "end_of_input"})
+        segments.append(open_seg)
+    wall_s = time.perf_counter() - wall_start
+    recorded_s = sum(max(0.0, s["end_t"] - s["start_t"]) for s in segments)
+    return {
+        "input": path,
+        "params": {k: (list(v) if isinstance(v, tuple) else v) for k, v in detector.params.items()},
+        "roi": list(roi) if roi else None,
+        "frames": frame_count,
+        "duration_s": round(last_t, 3),
+        "motion_frames": motion_frames,
+        "segment_count": len(segments),
+        "recorded_s": round(recorded_s, 3),
+        "segments": segments,
+        "qr_detections": qr_events,
+        "timing": {
+            "wall_s": round(wall_s, 3),
+            "fps": round(frame_count / wall_s, 2) if wall_s > 0 else None,
+            "realtime_factor": round(last_t / wall_s, 2) if wall_s > 0 else None,
+            "motion_ms": latency_stats(motion_ms),
+            "qr_ms": latency_stats(qr_ms),
+        },
+    }
+
+
+def _parse_value(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_sweeps(sweep_args):
+    """['of_min_mag=0.5,1.0', ...] → 파라미터 조합 dict 리스트."""
+    axes = []
+    for item in sweep_args or []:
+        key, _, values = item.partition('=')
+        key = PARAM_ALIASES.get(key.strip(), key.strip())
+        if key not in OF_DEFAULT_PARAMS:
+            raise ValueError(f'알 수 없는 파라미터: {key}')
+        axes.append([(key, _parse_value(v)) for v in values.split(',') if v.strip()])
+    if not axes:
+        return [{}]
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description='camera_on 분석 로직 오프라인 재생')
+    ap.add_argument('input', help='mp4 파일 또는 프레임 이미지 디렉터리')
+    ap.add_argument('--fps', type=float, default=None, help='프레임 레이트 (디렉터리 입력 기본 30)')
+    ap.add_argument('--resize', default=None, help='처리 해상도 WxH (camera_on의 frame 설정과 맞출 때)')
+    ap.add_argument('--roi', default=None, help='ROI x,y,w,h')
+    ap.add_argument('--qr', action='store_true', help='QR 인식도 수행')
+    ap.add_argument('--speed', type=float, default=0.0, help='페이싱 배속 (0=최대 속도)')
+    ap.add_argument('--max-frames', type=int, default=None)
+    for cli_name, key in PARAM_ALIASES.items():
+        ap.add_argument('--' + cli_name.replace('_', '-'), dest=key, type=float, default=None)
+    ap.add_argument('--sweep', action='append', default=[], help='파라미터 스윕 (예: of_min_mag=0.5,1.0,2.0)')
+    ap.add_argument('--frames-out', default=None, help='프레임별 판정 JSON Lines 출력 경로')
+    ap.add_argument('--output', default=None, help='요약 JSON 출력 경로 (기본: stdout)')
+    args = ap.parse_args(argv)
+
+    base = {}
+    for key in set(PARAM_ALIASES.values()):
+        val = getattr(args, key, None)
+        if val is not None:
+            base[key] = int(val) if isinstance(OF_DEFAULT_PARAMS[key], int) else val
+    roi = parse_roi(args.roi)
+    resize = parse_size(args.resize)
+
+    results = []
+    combos = parse_sweeps(args.sweep)
+    for i, combo in enumerate(combos):
+        params = dict(base)
+        params.update(combo)
+        frames_fp = None
+        if args.frames_out:
+            out_path = args.frames_out if len(combos) == 1 else f"{os.path.splitext(args.frames_out)[0]}_{i:03d}.jsonl"
+            frames_fp = open(out_path, 'w', encoding='utf-8')
+        try:
+            summary = replay(args.input, params, roi=roi, fps=args.fps, resize=resize, qr=args.qr,
+                             speed=args.speed, max_frames=args.max_frames, frames_out=frames_fp)
+        finally:
+            if frames_fp is not None:
+                frames_fp.close()
+        summary["sweep"] = combo
+        results.append(summary)
+        print(f"[REPLAY] {combo or 'default'}: frames={summary['frames']} motion={summary['motion_frames']} "
+              f"segments={summary['segment_count']} fps={summary['timing']['fps']}", file=sys.stderr)
+
+    payload = results[0] if len(results) == 1 else {"input": args.input, "runs": results}
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
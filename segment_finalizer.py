@@ -0,0 +1,224 @@
+"""
+세그먼트 백그라운드 마무리(finalize) 처리
+
+캡처 스레드는 닫을 세그먼트의 파이프라인을 넘기기만 하고 바로 다음 프레임으로 진행합니다.
+EOS 대기/NULL 전환/mp4 검증/세그먼트 인덱스 기록은 별도 스레드에서 시간 제한을 두고 수행합니다.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from mp4_utils import probe_mp4
+
+# EOS 드레인 대기 시간(초): 파일시스템이 멈춰도 카메라가 멈추지 않도록 제한
+FINALIZE_EOS_TIMEOUT_SEC = 10.0
+# set_state(NULL) 대기 시간(초)
+FINALIZE_NULL_TIMEOUT_SEC = 5.0
+# 기대 길이 대비 허용 오차(초)
+FINALIZE_DURATION_TOLERANCE_SEC = 3.0
+# 이보다 짧은 세그먼트는 사실상 빈 파일로 보고 거부(초)
+FINALIZE_MIN_DURATION_SEC = 0.1
+# 기대 길이의 이 비율보다 짧고 허용 오차보다도 많이 모자라면 거부
+FINALIZE_MIN_DURATION_RATIO = 0.5
+
+
+def _run_with_timeout(fn, timeout: float) -> bool:
+    """fn을 보조 스레드에서 실행하고 timeout 내에 끝나면 True."""
+    done = threading.Event()
+
+    def _target():
+        try:
+            fn()
+        except Exception:
+            pass
+        finally:
+            done.set()
+
+    threading.Thread(target=_target, daemon=True).start()
+    return done.wait(timeout)
+
+
+def verify_segment_file(path: str, expected_duration_s: float = None) -> dict:
+    """세그먼트 mp4를 검증하여 결과 dict 반환 (moov 존재, duration 범위).
+
+    duration은 FINALIZE_MIN_DURATION_SEC 이상이어야 하고, 기대 길이가 있으면 너무 길거나
+    (허용 오차 초과) 너무 짧으면(기대 길이의 절반 미만이면서 허용 오차보다 더 모자람) 거부한다.
+    조각 MP4는 끝이 잘려 있어도(전원 차단) 완전한 조각의 길이로 판정하므로 하한 비교는 하지 않는다.
+    """
+    result = {"verified": False, "reason": None, "duration_s": 0.0, "size": 0}
+    if not os.path.isfile(path):
+        result["reason"] = "missing"
+        return result
+    try:
+        info = probe_mp4(path)
+    except Exception as e:
+        result["reason"] = f"probe_error: {e}"
+        return result
+    result["size"] = info["size"]
+    result["duration_s"] = round(info["duration_s"], 3)
+    result["fragmented"] = info["fragmented"]
+    result["truncated"] = info["truncated"]
+    if not info["has_moov"]:
+        result["reason"] = "no_moov"
+        return result
+    if not info["has_mdat"] and not info["fragmented"]:
+        result["reason"] = "no_mdat"
+        return result
+    duration = info["duration_s"]
+    if duration < FINALIZE_MIN_DURATION_SEC:
+        result["reason"] = "zero_duration"
+        return result
+    if expected_duration_s is not None and expected_duration_s > 0:
+        if duration > expected_duration_s + FINALIZE_DURATION_TOLERANCE_SEC:
+            result["reason"] = "duration_too_long"
+            return result
+        if (not info["truncated"] and duration < expected_duration_s * FINALIZE_MIN_DURATION_RATIO
+                and duration < expected_duration_s - FINALIZE_DURATION_TOLERANCE_SEC):
+            result["reason"] = "duration_too_short"
+            return result
+    result["verified"] = True
+    return result
+
+
+class SegmentFinalizer:
+    """닫힌 세그먼트 파이프라인을 넘겨받아 순차적으로 마무리하는 백그라운드 작업자."""
+
+    def __init__(self, index_path: str = None, on_finalized=None,
+                 eos_timeout_sec: float = FINALIZE_EOS_TIMEOUT_SEC,
+                 null_timeout_sec: float = FINALIZE_NULL_TIMEOUT_SEC):
+        self.index_path = index_path
+        self.on_finalized = on_finalized
+        self.eos_timeout_sec = float(eos_timeout_sec)
+        self.null_timeout_sec = float(null_timeout_sec)
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._index_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='segment-finalizer', daemon=True)
+        self._thread.start()
+
+    def submit(self, pipeline, appsrc, info: dict) -> None:
+        """세그먼트 파이프라인 소유권을 넘겨받는다. 호출자는 이후 pipeline을 건드리지 않아야 한다."""
+        with self._pending_cond:
+            self._pending += 1
+        info["status"] = "finalizing"
+        self._queue.put((pipeline, appsrc, info))
+
+    def pending_count(self) -> int:
+        with self._pending_cond:
+            return self._pending
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """대기 중인 세그먼트가 모두 처리될 때까지 대기. 시간 초과 시 False."""
+        deadline = None if timeout is None else time.time() + float(timeout)
+        with self._pending_cond:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_cond.wait(remaining)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            pipeline, appsrc, info = self._queue.get()
+            try:
+                self._finalize(pipeline, appsrc, info)
+            except Exception as e:
+                info["status"] = "error"
+                info["reason"] = str(e)
+                print(f"[FINALIZE] 예외: {info.get('path')}, {e}")
+            finally:
+                with self._pending_cond:
+                    self._pending -= 1
+                    self._pending_cond.notify_all()
+
+    def _finalize(self, pipeline, appsrc, info: dict) -> None:
+        path = info.get("path")
+        t0 = time.time()
+        eos_ok = False
+        # 1) EOS 드레인 (시간 제한)
+        try:
+            if appsrc is not None:
+                appsrc.emit('end-of-stream')
+            bus = pipeline.get_bus()
+            msg = bus.timed_pop_filtered(int(self.eos_timeout_sec * Gst.SECOND),
+                                         Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if msg is not None and msg.type == Gst.MessageType.EOS:
+                eos_ok = True
+            elif msg is not None and msg.type == Gst.MessageType.ERROR:
+                err, _dbg = msg.parse_error()
+                print(f"[FINALIZE] 파이프라인 오류: {path}, {err}")
+            else:
+                print(f"[FINALIZE] EOS 대기 시간 초과({self.eos_timeout_sec:.0f}s): {path}")
+        except Exception as e:
+            print(f"[FINALIZE] EOS 처리 실패: {path}, {e}")
+        # 2) NULL 전환 (파일시스템 정지 시 무한 대기 방지)
+        null_ok = _run_with_timeout(lambda: pipeline.set_state(Gst.State.NULL), self.null_timeout_sec)
+        if not null_ok:
+            print(f"[FINALIZE] set_state(NULL) 시간 초과: {path} (파이프라인 포기)")
+        # 3) mp4 검증
+        expected = None
+        try:
+            if info.get("end_ns") is not None:
+                expected = (int(info["end_ns"]) - int(info.get("start_ns", 0))) / 1e9
+        except Exception:
+            expected = None
+        result = verify_segment_file(path, expected)
+        info["eos"] = bool(eos_ok)
+        info["verified"] = bool(result["verified"])
+        info["duration_s"] = result["duration_s"]
+        info["size"] = result["size"]
+        info["reason"] = result["reason"]
+        info["status"] = "ok" if result["verified"] else "invalid"
+        info["finalize_ms"] = int((time.time() - t0) * 1000)
+        if result["verified"]:
+            print(f"[FINALIZE] 완료: {path} ({result['duration_s']:.1f}s, {info['finalize_ms']}ms)")
+        else:
+            print(f"[FINALIZE] 검증 실패: {path} ({result['reason']})")
+        self._append_index(info)
+        if self.on_finalized is not None:
+            try:
+                self.on_finalized(info)
+            except Exception as e:
+                print(f"[FINALIZE] 콜백 실패: {e}")
+
+    def _append_index(self, info: dict) -> None:
+        """세그먼트 인덱스(JSON Lines)에 결과 한 줄 추가."""
+        if not self.index_path:
+            return
+        record = {k: v for k, v in info.items() if isinstance(v, (str, int, float, bool, type(None)))}
+        record["finalized_at"] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        try:
+            with self._index_lock:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[FINALIZE] 인덱스 기록 실패: {e}")
+
+
+def load_segment_index(index_path: str) -> dict:
+    """세그먼트 인덱스 파일을 읽어 path → 마지막 기록 dict로 반환."""
+    out = {}
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(rec, dict) and rec.get("path"):
+                    out[rec["path"]] = rec
+    except FileNotFoundError:
+        pass
+    return out
@@ -0,0 +1,322 @@
+"""
+녹화 디렉터리 용량 관리 (상한/하한 워터마크 + 보존 등급별 삭제)
+
+시작 시 디렉터리를 한 번만 훑어 파일별 크기를 인덱스에 올리고, 이후에는 writer들이 note_file()/note_removed()로
+알려주는 값으로 사용량 합계를 유지합니다. 세그먼트 오픈 같은 hot path에서는 디렉터리를 다시 훑지 않으며,
+파일 삭제는 전용 스레드에서만 수행합니다 (드리프트 보정용 재스캔도 같은 스레드에서 주기적으로).
+
+- 상한 워터마크를 넘으면 하한 워터마크 아래로 내려갈 때까지 삭제
+- 삭제 순서: 보존 기간 대비 경과 비율이 큰 것부터 → 같은 나이면 스케줄 영상이 모션 영상보다 먼저 삭제됨
+- 등급별 보존 기간이 지난 파일은 용량과 무관하게 삭제
+- 작성 중인 파일(*_merging.mp4, .part, 최근 수정 파일), 인덱스/작업 파일, protect(path)가 True인 파일은 삭제하지 않음
+- admit(): 새 파일을 열기 전 호출. 최소 여유 공간보다 적게 남으면 False (조용히 실패하지 않고 기록을 거부)
+
+워터마크 형식: '90%' → 파일시스템 사용률, '20G'/'500M'/바이트 수 → 이 디렉터리 사용량
+"""
+
+import os
+import re
+import threading
+import time
+
+import metrics
+from job_queue import lower_thread_priority
+
+DEFAULT_HIGH_WATERMARK = '90%'
+DEFAULT_LOW_WATERMARK = '80%'
+DEFAULT_MIN_FREE_BYTES = 256 * 1024 * 1024
+# 등급별 보존 기간(일)
+DEFAULT_RETENTION_DAYS = {'schedule': 7, 'segment': 7, 'manual': 30, 'motion': 30}
+# 최근 수정된 파일은 작성 중일 수 있으므로 삭제하지 않음(초)
+PROTECT_RECENT_SEC = 120
+CHECK_INTERVAL_SEC = 60
+RESCAN_INTERVAL_SEC = 3600
+
+# 녹화 파일에 딸린 사이드카 (<파일>.mp4<접미사>)
+SIDECAR_SUFFIXES = ('.timeline.json', '.meta.json', '.index.json', '.thumbs.jpg')
+
+_SEGMENT_RE = re.compile(r'_seg\d+_raw\.mp4$')
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_watermark(value):
+    """'90%' → ('percent', 0.9), '20G' → ('bytes', 21474836480)."""
+    text = str(value).strip().upper()
+    if text.endswith('%'):
+        return 'percent', min(1.0, max(0.0, float(text[:-1]) / 100.0))
+    m = re.fullmatch(r'([\d.]+)\s*([KMGT]?)I?B?', text)
+    if not m:
+        raise ValueError(f'잘못된 워터마크: {value}')
+    return 'bytes', int(float(m.group(1)) * _SIZE_UNITS[m.group(2)])
+
+
+def parse_retention(text: str) -> dict:
+    """'schedule=7,motion=30' → {'schedule': 7.0, 'motion': 30.0}."""
+    out = {}
+    for item in str(text or '').split(','):
+        if '=' not in item:
+            continue
+        name, days = item.split('=', 1)
+        try:
+            if float(days) > 0:
+                out[name.strip()] = float(days)
+        except ValueError:
+            pass
+    return out
+
+
+def classify(name: str):
+    """파일명 → 보존 등급. 삭제 대상이 아니면 None."""
+    if not name.endswith('.mp4') or name.endswith('_merging.mp4'):
+        return None
+    if name.startswith('recording_'):
+        return 'manual'
+    if '_merge_raw' in name:
+        return 'motion'
+    if _SEGMENT_RE.search(name):
+        return 'segment'
+    return 'schedule'
+
+
+class StorageManager:
+    """녹화 디렉터리 사용량 인덱스 + 백그라운드 삭제 스레드.
+
+    storage = StorageManager('/video', protect=lambda p: p in busy)
+    storage.start()
+    if storage.admit(expected_bytes):
+        ... 파일 기록 ...
+        storage.note_file(path, 'motion')
+    """
+
+    def __init__(self, root_dir: str, high=None, low=None, min_free_bytes: int = None,
+                 retention_days: dict = None, protect=None, segment_classes=None):
+        self.root_dir = root_dir
+        self.high = parse_watermark(high or os.getenv('STORAGE_HIGH_WATERMARK', DEFAULT_HIGH_WATERMARK))
+        self.low = parse_watermark(low or os.getenv('STORAGE_LOW_WATERMARK', DEFAULT_LOW_WATERMARK))
+        if self.high[0] != self.low[0]:
+            raise ValueError('상한/하한 워터마크 단위가 다릅니다')
+        self.min_free_bytes = int(min_free_bytes if min_free_bytes is not None
+                                  else parse_watermark(os.getenv('STORAGE_MIN_FREE', str(DEFAULT_MIN_FREE_BYTES)))[1])
+        self.retention_days = dict(DEFAULT_RETENTION_DAYS)
+        self.retention_days.update(retention_days or parse_retention(os.getenv('STORAGE_RETENTION_DAYS', '')))
+        self.protect = protect
+        # 파일명으로 구분되지 않는 세그먼트 등급 (재시작 후 스캔용): () → {파일명: 등급}
+        self.segment_classes = segment_classes
+        self._files = {}  # name -> [size, mtime, class]
+        self._used = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._last_scan = 0.0
+        os.makedirs(root_dir, exist_ok=True)
+        self.rescan()
+
+    # --- 사용량 인덱스 ---
+    def rescan(self) -> None:
+        """디렉터리 최상위 파일을 다시 훑어 인덱스를 재구성 (시작 시와 삭제 스레드에서만 호출)."""
+        files = {}
+        try:
+            with os.scandir(self.root_dir) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files[entry.name] = [st.st_size, st.st_mtime, classify(entry.name)]
+        except OSError as e:
+            print(f"[저장소] 디렉터리 스캔 실패: {self.root_dir}, {e}")
+            return
+        with self._lock:
+            # 스캔 전에 note_file로 등급이 지정된 파일은 그 등급 유지
+            unknown = []
+            for name, item in files.items():
+                old = self._files.get(name)
+                if old is not None and old[2] is not None and item[2] is not None:
+                    item[2] = old[2]
+                elif item[2] == 'segment':
+                    unknown.append(name)
+        if unknown and self.segment_classes is not None:
+            # 재시작 직후: 모션 세그먼트도 파일명으로는 'segment'이므로 기록된 등급으로 보정
+            try:
+                classes = self.segment_classes() or {}
+            except Exception as e:
+                print(f"[저장소] 세그먼트 등급 읽기 실패: {e}")
+                classes = {}
+            for name in unknown:
+                if classes.get(name):
+                    files[name][2] = classes[name]
+        with self._lock:
+            self._files = files
+            self._used = sum(item[0] for item in files.values())
+        self._last_scan = time.time()
+
+    def note_file(self, path: str, cls: str = None) -> None:
+        """파일이 생성/확장됨. cls를 주면 파일명 대신 그 등급을 사용 (모션/스케줄 세그먼트 구분 등)."""
+        name = self._name(path)
+        if name is None:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.note_removed(path)
+            return
+        with self._lock:
+            old = self._files.get(name)
+            if old is not None:
+                self._used -= old[0]
+            if cls is None:
+                cls = old[2] if old is not None and old[2] is not None else classify(name)
+            self._files[name] = [st.st_size, st.st_mtime, cls]
+            self._used += st.st_size
+
+    def note_removed(self, path: str) -> None:
+        name = self._name(path)
+        if name is None:
+            return
+        with self._lock:
+            old = self._files.pop(name, None)
+            if old is not None:
+                self._used -= old[0]
+
+    def _name(self, path: str):
+        """root_dir 최상위 파일이면 파일명, 아니면 None."""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.root_dir):
+            return None
+        return os.path.basename(path)
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return self._used
+
+    def disk_usage(self):
+        """(전체, 여유) 바이트 — statvfs 한 번, 디렉터리를 훑지 않음."""
+        st = os.statvfs(self.root_dir)
+        return st.f_blocks * st.f_frsize, st.f_bavail * st.f_frsize
+
+    def bytes_over(self, mark) -> int:
+        """워터마크까지 내려가려면 지워야 하는 바이트 수 (0이면 이미 아래)."""
+        unit, limit = mark
+        if unit == 'bytes':
+            return max(0, self.used_bytes() - limit)
+        total, free = self.disk_usage()
+        return max(0, int((total - free) - total * limit))
+
+    # --- 기록 허용 ---
+    def admit(self, expected_bytes: int = 0, kind: str = 'segment') -> bool:
+        """새 파일 기록 전 호출. 상한 초과 시 삭제 스레드를 깨우고, 최소 여유 공간이 없으면 False."""
+        try:
+            _, free = self.disk_usage()
+        except OSError:
+            return True
+        if free - int(expected_bytes) < self.min_free_bytes:
+            self._wake.set()
+            metrics.STORAGE_WRITES_REFUSED.inc(kind=kind)
+            print(f"[저장소] ⚠️ 여유 공간 부족으로 기록 거부 ({kind}): "
+                  f"여유 {free / 1024 / 1024:.0f}MB < 최소 {self.min_free_bytes / 1024 / 1024:.0f}MB")
+            return False
+        if self.high[0] == 'bytes' and self.used_bytes() + int(expected_bytes) > self.high[1]:
+            self._wake.set()
+        elif self.high[0] == 'percent':
+            total = self.disk_usage()[0]
+            if total and (total - free + int(expected_bytes)) > total * self.high[1]:
+                self._wake.set()
+        return True
+
+    # --- 삭제 ---
+    def _candidates(self, now: float) -> list:
+        """삭제 가능한 (경과 비율, 파일명, 크기, 등급) 목록, 비율 큰 순."""
+        with self._lock:
+            items = [(name, item[0], item[1], item[2]) for name, item in self._files.items()]
+        out = []
+        for name, size, mtime, cls in items:
+            if cls is None or now - mtime < PROTECT_RECENT_SEC:
+                continue
+            if self.protect is not None:
+                try:
+                    if self.protect(os.path.join(self.root_dir, name)):
+                        continue
+                except Exception:
+                    continue
+            days = self.retention_days.get(cls, DEFAULT_RETENTION_DAYS['schedule'])
+            out.append(((now - mtime) / (days * 86400.0), name, size, cls))
+        out.sort(reverse=True)
+        return out
+
+    def _evict(self, name: str, cls: str, reason: str) -> bool:
+        path = os.path.join(self.root_dir, name)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[저장소] 삭제 실패: {path}, {e}")
+            return False
+        self.note_removed(path)
+        # 사이드카(후처리 타임라인, 카탈로그 메타, 키프레임 인덱스/썸네일)도 함께 정리 (인덱스 대상이 아님)
+        for suffix in SIDECAR_SUFFIXES:
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+        metrics.STORAGE_EVICTED.inc(**{'class': cls, 'reason': reason})
+        print(f"[저장소] 삭제({reason}, {cls}): {name}")
+        return True
+
+    def enforce(self) -> int:
+        """보존 기간 초과 파일 삭제 후, 상한을 넘었으면 하한까지 삭제. 삭제한 바이트 수 반환."""
+        freed = 0
+        candidates = self._candidates(time.time())
+        remaining = []
+        for ratio, name, size, cls in candidates:
+            if ratio >= 1.0:
+                if self._evict(name, cls, 'retention'):
+                    freed += size
+            else:
+                remaining.append((ratio, name, size, cls))
+        try:
+            if self.bytes_over(self.high) <= 0:
+                return freed
+            need = self.bytes_over(self.low)
+        except OSError:
+            return freed
+        released = 0
+        for ratio, name, size, cls in remaining:
+            if released >= need:
+                break
+            if self._evict(name, cls, 'watermark'):
+                released += size
+        if released < need:
+            print(f"[저장소] ⚠️ 하한 워터마크까지 확보하지 못했습니다: {released / 1024 / 1024:.0f}MB / "
+                  f"{need / 1024 / 1024:.0f}MB (남은 파일은 보호 대상)")
+        return freed + released
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='storage-manager', daemon=True)
+        self._thread.start()
+        metrics.STORAGE_USED_BYTES.set_function(self.used_bytes)
+        metrics.STORAGE_FREE_BYTES.set_function(lambda: self.disk_usage()[1])
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        lower_thread_priority()
+        while not self._stopped:
+            try:
+                if time.time() - self._last_scan >= RESCAN_INTERVAL_SEC:
+                    self.rescan()
+                self.enforce()
+            except Exception as e:
+                print(f"[저장소] 용량 관리 실패: {e}")
+            self._wake.wait(CHECK_INTERVAL_SEC)
+            self._wake.clear()
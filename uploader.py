@@ -0,0 +1,390 @@
+"""
+이어 올리기 가능한 청크 업로드 (대역폭 제한 + 동시 업로드 수 제한 + sha256 확인 + 진행 저널)
+
+프로토콜 (HTTP/HTTPS, --serve의 로컬 대체 서버가 같은 동작을 구현):
+  HEAD {url}/{name}             → 200, Upload-Offset: 서버가 받은 바이트 수 (완료된 파일이면 X-Content-Sha256 포함)
+  PUT  {url}/{name}             → 본문 = 청크, Content-Range: bytes <시작>-<끝>/<전체>
+  POST {url}/{name} (multipart) → 필드 offset/total/sha256 + 파일 파트 chunk (PUT을 쓸 수 없는 서버용)
+  공통 헤더: X-Content-Sha256(파일 전체), X-Chunk-Sha256(이 청크)
+  응답: 308 + Upload-Offset(계속), 409 + Upload-Offset(오프셋 불일치, 그 위치부터 재전송),
+        201/200 + X-Content-Sha256(완료) → 로컬 sha256과 같아야 업로드 확정
+
+진행 상태는 <journal_dir>/<파일명>.json에 청크마다 기록되어 재부팅 후 이어서 올리며,
+실제 재개 위치는 항상 서버의 Upload-Offset을 따릅니다.
+대역폭은 모든 업로드가 공유하는 토큰 버킷으로 제한합니다 (RTSP 송출과 업링크를 나눠 쓰므로).
+
+예)
+  up = Uploader('http://server/videos', '/video/.uploads', max_kbps=2000)
+  up.upload_file('/video/video_20250101_merge_file.mp4')
+  python3 uploader.py --serve /srv/uploads --port 8099     # 로컬 대체 서버
+  python3 uploader.py http://127.0.0.1:8099/videos a.mp4    # 수동 업로드
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import metrics
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_KBPS = 2000
+DEFAULT_TIMEOUT_SEC = 60
+_READ_BLOCK = 64 * 1024
+
+
+class UploadError(Exception):
+    """업로드 실패. permanent=True면 재시도해도 성공할 수 없음 (인증 실패, 체크섬 불일치 반복 등)."""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class TokenBucket:
+    """바이트 단위 토큰 버킷. rate_bytes가 0이면 제한 없음."""
+
+    def __init__(self, rate_bytes: float, burst_bytes: float = None):
+        self.rate = float(rate_bytes)
+        self.burst = float(burst_bytes if burst_bytes is not None else max(_READ_BLOCK, rate_bytes))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        """n 바이트를 보낼 수 있을 때까지 대기."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= n or self._tokens >= self.burst:
+                    self._tokens -= n
+                    return
+                wait = (min(n, self.burst) - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _ThrottledReader:
+    """bytes를 토큰 버킷 속도로 내보내는 파일 객체 (requests가 Content-Length를 알 수 있도록 __len__ 제공)."""
+
+    def __init__(self, data: bytes, bucket: TokenBucket):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._bucket = bucket
+
+    def __len__(self):
+        return len(self._data) - self._pos
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0 or n > _READ_BLOCK:
+            n = _READ_BLOCK
+        out = self._data[self._pos:self._pos + n]
+        self._pos += len(out)
+        if out:
+            self._bucket.consume(len(out))
+            metrics.UPLOAD_BYTES.inc(len(out))
+        return out.tobytes()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def _multipart_body(fields: dict, filename: str, data: bytes):
+    """(본문, Content-Type) — 청크를 메모리에서 바로 multipart/form-data로 감싼다."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for k, v in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="chunk"; filename="{filename}"\r\n'
+                  'Content-Type: application/octet-stream\r\n\r\n').encode())
+    parts.append(data)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Uploader:
+    def __init__(self, base_url: str, journal_dir: str, max_kbps: float = DEFAULT_MAX_KBPS,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES, max_concurrent: int = 1, mode: str = 'put',
+                 timeout: float = DEFAULT_TIMEOUT_SEC, headers: dict = None):
+        if mode not in ('put', 'multipart'):
+            raise ValueError(f'알 수 없는 업로드 방식: {mode}')
+        self.base_url = base_url.rstrip('/')
+        self.journal_dir = journal_dir
+        self.chunk_bytes = max(_READ_BLOCK, int(chunk_bytes))
+        self.mode = mode
+        self.timeout = float(timeout)
+        self.headers = dict(headers or {})
+        self.bucket = TokenBucket(float(max_kbps) * 1000 / 8)
+        self._slots = threading.BoundedSemaphore(max(1, int(max_concurrent)))
+        self._session = None
+        os.makedirs(journal_dir, exist_ok=True)
+
+    # --- 저널 ---
+    def _journal_path(self, name: str) -> str:
+        return os.path.join(self.journal_dir, f'{name}.json')
+
+    def _load_journal(self, name: str) -> dict:
+        try:
+            with open(self._journal_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_journal(self, name: str, entry: dict) -> None:
+        entry["updated_at"] = time.time()
+        path = self._journal_path(name)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _drop_journal(self, name: str) -> None:
+        try:
+            os.remove(self._journal_path(name))
+        except FileNotFoundError:
+            pass
+
+    # --- HTTP ---
+    def _http(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def _check(self, resp, what: str) -> None:
+        if resp.status_code in (401, 403, 404, 405, 411, 413, 415):
+            raise UploadError(f'{what}: HTTP {resp.status_code} {resp.text[:200]}', permanent=True)
+        if resp.status_code >= 400 and resp.status_code != 409:
+            raise UploadError(f'{what}: HTTP {resp.status_code} {resp.text[:200]}')
+
+    def remote_offset(self, name: str):
+        """(서버가 받은 바이트 수, 완료 파일 sha256 또는 None)."""
+        resp = self._http().head(f'{self.base_url}/{name}', headers=self.headers, timeout=self.timeout,
+                                 allow_redirects=False)
+        if resp.status_code == 404:
+            return 0, None
+        self._check(resp, 'HEAD')
+        return int(resp.headers.get('Upload-Offset', 0)), resp.headers.get('X-Content-Sha256')
+
+    def _send_chunk(self, name: str, offset: int, data: bytes, total: int, sha256: str):
+        headers = dict(self.headers)
+        headers.update({'X-Content-Sha256': sha256, 'X-Chunk-Sha256': hashlib.sha256(data).hexdigest()})
+        url = f'{self.base_url}/{name}'
+        if self.mode == 'put':
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['Content-Range'] = f'bytes {offset}-{offset + len(data) - 1}/{total}'
+            body = data
+            method = self._http().put
+        else:
+            body, headers['Content-Type'] = _multipart_body(
+                {"offset": offset, "total": total, "sha256": sha256}, name, data)
+            method = self._http().post
+        resp = method(url, data=_ThrottledReader(body, self.bucket), headers=headers,
+                      timeout=self.timeout, allow_redirects=False)
+        self._check(resp, 'PUT' if self.mode == 'put' else 'POST')
+        return resp
+
+    # --- 업로드 ---
+    def upload_file(self, path: str, name: str = None) -> dict:
+        """파일 하나를 업로드하고 서버 sha256이 일치하면 결과 dict 반환. 실패 시 UploadError (저널 유지)."""
+        name = name or os.path.basename(path)
+        with self._slots:
+            try:
+                result = self._upload(path, name)
+            except UploadError:
+                metrics.UPLOADS.inc(status='failed')
+                raise
+            except Exception as e:
+                metrics.UPLOADS.inc(status='failed')
+                raise UploadError(f'{name}: {e}') from e
+        metrics.UPLOADS.inc(status='done')
+        return result
+
+    def _upload(self, path: str, name: str) -> dict:
+        st = os.stat(path)
+        total = st.st_size
+        entry = self._load_journal(name)
+        if entry.get("size") != total or entry.get("mtime") != st.st_mtime or not entry.get("sha256"):
+            entry = {"path": path, "url": f'{self.base_url}/{name}', "size": total, "mtime": st.st_mtime,
+                     "sha256": file_sha256(path), "offset": 0, "started_at": time.time()}
+            self._save_journal(name, entry)
+        sha256 = entry["sha256"]
+        if total == 0:
+            raise UploadError(f'{name}: 빈 파일', permanent=True)
+        t0 = time.time()
+        offset, remote_sha = self.remote_offset(name)
+        resumed_from = offset
+        if offset > 0:
+            print(f"[업로드] 이어 올리기: {name} {offset}/{total} bytes")
+        done_sha = remote_sha if offset >= total else None
+        stalled = 0
+        with open(path, 'rb') as f:
+            while done_sha is None:
+                if offset > total:
+                    raise UploadError(f'{name}: 서버 오프셋 {offset} > 파일 크기 {total}')
+                if offset == total:
+                    # 데이터는 다 보냈지만 완료 응답을 받지 못함 → 마지막 1바이트를 다시 보내 완료 응답을 받음
+                    offset -= 1
+                f.seek(offset)
+                data = f.read(min(self.chunk_bytes, total - offset))
+                resp = self._send_chunk(name, offset, data, total, sha256)
+                new_offset = int(resp.headers.get('Upload-Offset', offset + len(data)))
+                stalled = stalled + 1 if new_offset <= offset else 0
+                if stalled >= 3:
+                    raise UploadError(f'{name}: 서버 오프셋이 {new_offset}에서 진행되지 않음')
+                offset = new_offset
+                entry["offset"] = offset
+                self._save_journal(name, entry)
+                if resp.status_code in (200, 201):
+                    done_sha = resp.headers.get('X-Content-Sha256', '')
+        if not done_sha:
+            raise UploadError(f'{name}: 서버가 X-Content-Sha256을 반환하지 않아 확인할 수 없습니다', permanent=True)
+        if done_sha.lower() != sha256:
+            self._drop_journal(name)
+            raise UploadError(f'{name}: 체크섬 불일치 (로컬 {sha256[:12]}…, 서버 {done_sha[:12]}…)')
+        self._drop_journal(name)
+        elapsed = time.time() - t0
+        sent = total - resumed_from
+        print(f"[업로드] 완료: {name} ({total / 1024 / 1024:.1f}MB, {elapsed:.1f}s, "
+              f"{sent * 8 / 1000 / max(elapsed, 1e-3):.0f}kbps)")
+        return {"url": entry["url"], "size": total, "sha256": sha256, "resumed_from": resumed_from,
+                "elapsed_s": round(elapsed, 3)}
+
+
+# --- 로컬 대체 서버 (--serve) ---
+class _UploadHandler(BaseHTTPRequestHandler):
+    """업로드 프로토콜의 최소 서버 구현. 받은 청크는 <dir>/<name>.part에 이어 쓰고 완료 시 <dir>/<name>으로 이동."""
+
+    root_dir = '.'
+    _lock = threading.Lock()
+
+    def _paths(self):
+        name = os.path.basename(self.path.split('?', 1)[0].rstrip('/'))
+        if not name or name.startswith('.'):
+            return None, None
+        final = os.path.join(self.root_dir, name)
+        return final, final + '.part'
+
+    def _reply(self, code: int, headers: dict = None, body: bytes = b'') -> None:
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        final, part = self._paths()
+        if final is None:
+            return self._reply(400)
+        if os.path.isfile(final):
+            return self._reply(200, {'Upload-Offset': os.path.getsize(final), 'X-Content-Sha256': file_sha256(final)})
+        return self._reply(200, {'Upload-Offset': os.path.getsize(part) if os.path.isfile(part) else 0})
+
+    def _receive(self, offset: int, total: int, data: bytes, sha256: str):
+        final, part = self._paths()
+        if final is None:
+            return self._reply(400)
+        chunk_sha = self.headers.get('X-Chunk-Sha256')
+        if chunk_sha and hashlib.sha256(data).hexdigest() != chunk_sha.lower():
+            return self._reply(400, body=b'chunk checksum mismatch')
+        with self._lock:
+            if os.path.isfile(final) and offset + len(data) == total:
+                # 완료 후 재전송 (완료 응답 유실)
+                return self._reply(201, {'Upload-Offset': total, 'X-Content-Sha256': file_sha256(final)})
+            have = os.path.getsize(part) if os.path.isfile(part) else 0
+            if offset > have or offset + len(data) > total:
+                return self._reply(409, {'Upload-Offset': have})
+            with open(part, 'r+b' if have else 'wb') as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+            have = offset + len(data)
+            if have < total:
+                return self._reply(308, {'Upload-Offset': have})
+            digest = file_sha256(part)
+            if sha256 and digest != sha256.lower():
+                os.remove(part)
+                return self._reply(201, {'Upload-Offset': 0, 'X-Content-Sha256': digest})
+            os.replace(part, final)
+        print(f"[업로드 서버] 수신 완료: {final} ({total} bytes)")
+        return self._reply(201, {'Upload-Offset': total, 'X-Content-Sha256': digest})
+
+    def do_PUT(self):
+        try:
+            spec = self.headers.get('Content-Range', '').split(' ', 1)[1]
+            rng, total = spec.split('/')
+            offset = int(rng.split('-')[0])
+            total = int(total)
+        except Exception:
+            return self._reply(400, body=b'Content-Range required')
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return self._receive(offset, total, data, self.headers.get('X-Content-Sha256'))
+
+    def do_POST(self):
+        import email.parser
+        import email.policy
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + self.headers.get('Content-Type', '').encode() + b'\r\n\r\n' + body)
+        fields = {}
+        data = None
+        for part in msg.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'chunk':
+                data = part.get_payload(decode=True)
+            else:
+                fields[part.get_param('name', header='content-disposition')] = part.get_content().strip()
+        try:
+            return self._receive(int(fields["offset"]), int(fields["total"]), data or b'', fields.get("sha256"))
+        except (KeyError, ValueError):
+            return self._reply(400, body=b'offset/total/chunk required')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root_dir: str, port: int, host: str = '0.0.0.0') -> None:
+    os.makedirs(root_dir, exist_ok=True)
+    handler = type('UploadHandler', (_UploadHandler,), {'root_dir': root_dir})
+    server = ThreadingHTTPServer((host, int(port)), handler)
+    print(f"[업로드 서버] http://{host}:{port}/<파일명> → {root_dir}")
+    server.serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='청크 업로드 클라이언트 / 로컬 대체 서버')
+    ap.add_argument('url_or_dir', help='업로드 URL (클라이언트) 또는 저장 디렉터리 (--serve)')
+    ap.add_argument('files', nargs='*')
+    ap.add_argument('--serve', action='store_true', help='로컬 대체 업로드 서버 실행')
+    ap.add_argument('--port', type=int, default=8099)
+    ap.add_argument('--max-kbps', type=float, default=DEFAULT_MAX_KBPS, help='대역폭 제한 (0=제한 없음)')
+    ap.add_argument('--chunk-bytes', type=int, default=DEFAULT_CHUNK_BYTES)
+    ap.add_argument('--mode', choices=('put', 'multipart'), default='put')
+    ap.add_argument('--journal', default='.uploads')
+    args = ap.parse_args()
+    if args.serve:
+        serve(args.url_or_dir, args.port)
+        return
+    up = Uploader(args.url_or_dir, args.journal, max_kbps=args.max_kbps, chunk_bytes=args.chunk_bytes, mode=args.mode)
+    for path in args.files:
+        print(json.dumps(up.upload_file(path), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()